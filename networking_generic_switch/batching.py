@@ -12,7 +12,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import abc
 import atexit
+import collections
+from concurrent import futures
+import functools
+import itertools
 import json
 import threading
 import time
@@ -23,20 +28,40 @@ from etcd3gw import exceptions as etcd3gw_exc
 from etcd3gw.utils import _decode
 from etcd3gw.utils import _encode
 from etcd3gw.utils import _increment_last_byte
+from etcd3gw.utils import LOCK_PREFIX
 from oslo_log import log as logging
 from oslo_service import threadgroup
 from oslo_utils import netutils
 from oslo_utils import uuidutils
 import tenacity
 
+from networking_generic_switch.devices import utils as device_utils
 from networking_generic_switch import exceptions as exc
+from networking_generic_switch import locking as ngs_lock
+from networking_generic_switch import metrics
+from networking_generic_switch import utils as ngs_utils
 
 SHUTDOWN_TIMEOUT = 60
 RESULT_WATCH_TIMEOUT = 10
+# etcd rejects transactions with more than 128 operations by default
+# (--max-txn-ops). Each recorded result needs a put and a delete.
+MAX_TXN_OPS = 128
+# Watch workers also check for work periodically, in case an etcd watch event
+# is lost. See [ngs_coordination] batch_watch_poll_interval.
+WATCH_WORKER_POLL_INTERVAL = 300
+
+# Characters which end the prompt preceding the echo of a command.
+_PROMPT_TERMINATORS = '#>$%]'
 
 LOG = logging.getLogger(__name__)
 
 THREAD_POOL = threadgroup.ThreadGroup()
+WATCH_WORKERS = []
+RESULT_WATCHERS = []
+LEASE_MANAGERS = []
+# etcd URL to a list of the shared client and its reference count.
+_ETCD_CLIENTS = {}
+_ETCD_CLIENTS_LOCK = threading.Lock()
 
 
 class ShutdownTimeout(Exception):
@@ -52,6 +77,10 @@ def _wait_for_threads():
     and performing switch configuration operations which should not be
     interrupted.
     """
+    for worker in WATCH_WORKERS:
+        worker.stop(timeout=SHUTDOWN_TIMEOUT)
+    for watcher in RESULT_WATCHERS:
+        watcher.stop()
     active_threads = len(THREAD_POOL.threads)
     LOG.info("Waiting %d seconds for %d threads to complete",
              SHUTDOWN_TIMEOUT, active_threads)
@@ -61,6 +90,8 @@ def _wait_for_threads():
         LOG.error("Timed out waiting for threads to complete")
     else:
         LOG.info("Finished waiting for threads to complete")
+    for lease_manager in LEASE_MANAGERS:
+        lease_manager.stop()
 
 
 class SwitchQueueItem(object):
@@ -71,18 +102,334 @@ class SwitchQueueItem(object):
         self.create_revision = create_revision
 
 
-class SwitchQueue(object):
+class LeaseManager(object):
+    """Share etcd leases between the keys written for a switch.
+
+    Rather than creating a lease for every key, a lease is created at most
+    once every rotate_interval seconds and attached to all keys written in
+    that time. The current lease is kept alive in the background. Once it
+    has been replaced it is no longer refreshed, so keys that are never
+    consumed, for example because the process waiting for a result died,
+    still expire within ttl seconds of the lease being replaced.
+    """
+
+    def __init__(self, etcd_client, ttl, rotate_interval=None,
+                 revoke_on_stop=False):
+        self.client = etcd_client
+        self.ttl = ttl
+        self.rotate_interval = rotate_interval or ttl / 2
+        self.refresh_interval = ttl / 3
+        self.revoke_on_stop = revoke_on_stop
+        self._lease = None
+        self._created = None
+        self._leases = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def get_lease(self):
+        """Return a lease to attach to a new key."""
+        with self._lock:
+            now = time.monotonic()
+            if (self._lease is None
+                    or now - self._created >= self.rotate_interval):
+                self._lease = self.client.lease(ttl=self.ttl)
+                self._created = now
+                self._leases.append(self._lease)
+                # Forget leases which have expired by now.
+                self._leases = self._leases[-int(
+                    self.ttl // self.rotate_interval + 2):]
+                self._ensure_refreshing()
+            return self._lease
+
+    def stop(self, revoke=None):
+        """Stop refreshing leases, and revoke them if required.
+
+        Revoking a lease deletes all of the keys attached to it.
+
+        :param revoke: whether to revoke the leases. Defaults to
+            revoke_on_stop.
+        """
+        self._stopped.set()
+        with self._lock:
+            leases = self._leases
+            self._lease = None
+            self._leases = []
+        if revoke is None:
+            revoke = self.revoke_on_stop
+        if not revoke:
+            return
+        for lease in leases:
+            try:
+                lease.revoke()
+            except Exception as e:
+                LOG.debug("Failed to revoke lease %s: %s", lease.id, e)
+
+    def _ensure_refreshing(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._refresh_leases,
+                                        daemon=True, name="ngs-batch-lease")
+        self._thread.start()
+        LEASE_MANAGERS.append(self)
+
+    def _refresh_leases(self):
+        while not self._stopped.wait(self.refresh_interval):
+            self._refresh_lease()
+
+    def _refresh_lease(self):
+        with self._lock:
+            lease = self._lease
+        if lease is None:
+            return
+        try:
+            lease.refresh()
+        except Exception as e:
+            LOG.warning("Failed to refresh lease %s, a new lease will be "
+                        "created: %s", lease.id, e)
+            with self._lock:
+                if self._lease is lease:
+                    self._lease = None
+
+
+class ResultWatcher(object):
+    """Deliver batch results of a switch to waiting callers.
+
+    A single etcd watch on the output prefix of the switch is shared by all
+    callers in this process waiting for a result, rather than each caller
+    watching its own result key.
+    """
+
+    def __init__(self, switch_name, etcd_client):
+        self.switch_name = switch_name
+        self.client = etcd_client
+        self._waiters = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._cancel = None
+
+    def register(self, uuid):
+        """Start waiting for the result of a batch.
+
+        Must be called before the batch is added to the queue, so that the
+        result cannot be written before we are waiting for it.
+
+        :param uuid: the uuid of the batch
+        """
+        with self._lock:
+            self._ensure_watching()
+            self._waiters[uuid] = futures.Future()
+
+    def unregister(self, uuid):
+        with self._lock:
+            self._waiters.pop(uuid, None)
+
+    def get_future(self, uuid):
+        """Return the future for a registered batch, or None."""
+        with self._lock:
+            return self._waiters.get(uuid)
+
+    def stop(self):
+        with self._lock:
+            if self._cancel is not None:
+                self._cancel()
+            self._thread = None
+            self._cancel = None
+
+    def _ensure_watching(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        prefix = SwitchQueue.RESULT_PREFIX % self.switch_name
+        events, self._cancel = self.client.watch_prefix(
+            prefix, filters=['NODELETE'])
+        self._thread = threading.Thread(
+            target=self._consume, args=(events,), daemon=True,
+            name="ngs-batch-results-%s" % self.switch_name)
+        self._thread.start()
+        if self not in RESULT_WATCHERS:
+            RESULT_WATCHERS.append(self)
+
+    def _consume(self, events):
+        for event in events:
+            # etcd3gw decodes the base64 keys and values of events to bytes.
+            uuid = event['kv']['key'].decode('utf-8').rpartition('/')[2]
+            with self._lock:
+                future = self._waiters.get(uuid)
+            if future is None or future.done():
+                # Result for a caller in another process.
+                continue
+            try:
+                future.set_result(
+                    json.loads(event['kv']['value'].decode('utf-8')))
+            except Exception as e:
+                LOG.error("Failed to decode batch result for %s: %s",
+                          uuid, e)
+
+
+class BaseSwitchQueue(object, metaclass=abc.ABCMeta):
+    """Interface of the per switch queue of command batches.
+
+    Callers add batches of commands with add_batch and wait for their result
+    with wait_for_result. A worker holding the lock returned by
+    acquire_worker_lock or try_worker_lock executes the batches returned by
+    get_batches and calls record_results.
+
+    The lock objects returned implement acquire(), release(), refresh() and
+    is_acquired(), like etcd3gw locks.
+
+    :param switch_name: name of the switch
+    :param release: optional function releasing the backend of the queue,
+        called when the queue is closed
+    """
+
+    def __init__(self, switch_name, release=None):
+        self.switch_name = switch_name
+        self._release = release
+
+    def close(self):
+        """Release the resources held by the queue.
+
+        Callers already waiting for a result may still use the queue.
+        """
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    @abc.abstractmethod
+    def add_batch(self, cmds, op=None):
+        """Add a batch of commands to the queue.
+
+        :param cmds: an iterable of commands
+        :param op: optional operation dict describing the commands, used to
+            compact batches. See port_operation and friends.
+        :return: a SwitchQueueItem object
+        """
+
+    @abc.abstractmethod
+    def wait_for_result(self, item, timeout):
+        """Wait for the result of a command batch.
+
+        :param item: SwitchQueueItem object returned by add_batch
+        :param timeout: wait timeout in seconds
+        :return: output string generated by this command set
+        :raises: GenericSwitchBatchError if waiting times out or the command
+            batch was unsuccessful
+        """
+
+    @abc.abstractmethod
+    def get_batches(self, item=None):
+        """Return a list of the pending batch dicts, oldest first.
+
+        :param item: Optional SwitchQueueItem object. If provided, only batches
+            added up to and including this item are returned.
+        """
+
+    def record_result(self, batch):
+        """Record the result from executing given command set.
+
+        We assume that a lock is held before getting a fresh list
+        of batches, executing them, and then calling this record
+        results function, before finally dropping the lock.
+        """
+        self.record_results([batch])
+
+    @abc.abstractmethod
+    def record_results(self, batches):
+        """Record the results from executing several command sets.
+
+        The same locking requirements as record_result apply.
+
+        :param batches: a list of batch dicts with results or errors set.
+        """
+
+    @abc.abstractmethod
+    def acquire_worker_lock(self, item, acquire_timeout=300, lock_ttl=120,
+                            wait=None):
+        """Wait for lock needed to call record_result.
+
+        :param item: SwitchQueueItem object of the batch to wait for.
+        :returns: the acquired lock, or None if the batches up to and
+            including item have been executed by another worker.
+        """
+
+    @abc.abstractmethod
+    def try_worker_lock(self, lock_ttl=120):
+        """Try once to get the lock needed to call record_result.
+
+        :returns: the acquired lock, or None if another worker holds it.
+        """
+
+    @abc.abstractmethod
+    def has_batches(self):
+        """Return whether any batches are waiting to be executed."""
+
+    @abc.abstractmethod
+    def watch_for_work(self, callback):
+        """Call callback when there may be batches to execute.
+
+        :param callback: function to call without arguments when a batch is
+            added or the worker lock is released
+        :returns: a function that stops calling the callback
+        """
+
+    def _parse_result(self, result_dict):
+        LOG.debug("got result: %s", result_dict)
+        if "result" in result_dict:
+            return result_dict["result"]
+        else:
+            raise exc.GenericSwitchBatchError(
+                device=self.switch_name,
+                error=result_dict["error"])
+
+
+class SwitchQueue(BaseSwitchQueue):
+    """Queue of command batches for a switch, stored in etcd."""
+
     INPUT_PREFIX = "/ngs/batch/%s/input/"
     INPUT_ITEM_KEY = "/ngs/batch/%s/input/%s"
+    RESULT_PREFIX = "/ngs/batch/%s/output/"
     RESULT_ITEM_KEY = "/ngs/batch/%s/output/%s"
     EXEC_LOCK = "/ngs/batch/%s/execute_lock"
 
-    def __init__(self, switch_name, etcd_client):
-        self.switch_name = switch_name
+    def __init__(self, switch_name, etcd_client, shared_result_watch=False,
+                 shared_lease=False, release=None):
+        super(SwitchQueue, self).__init__(switch_name, release=release)
         self.client = etcd_client
         self.lease_ttl = 600
-
-    def add_batch(self, cmds):
+        self.result_watcher = None
+        if shared_result_watch:
+            self.result_watcher = ResultWatcher(switch_name, etcd_client)
+        self.input_leases = None
+        self.result_leases = None
+        if shared_lease:
+            # Inputs of this process can be dropped when it exits, since
+            # nobody will be waiting for their results. Results may be for
+            # other processes, so they are left to expire.
+            self.input_leases = LeaseManager(
+                etcd_client, self.lease_ttl, revoke_on_stop=True)
+            self.result_leases = LeaseManager(etcd_client, self.lease_ttl)
+
+    def close(self):
+        watcher, self.result_watcher = self.result_watcher, None
+        if watcher is not None:
+            watcher.stop()
+            _discard(RESULT_WATCHERS, watcher)
+        for lease_manager in (self.input_leases, self.result_leases):
+            if lease_manager is not None:
+                # Pending inputs are left to the worker of the device which
+                # replaces this one, and expire with their lease otherwise.
+                lease_manager.stop(revoke=False)
+                _discard(LEASE_MANAGERS, lease_manager)
+        self.input_leases = None
+        self.result_leases = None
+        super(SwitchQueue, self).close()
+
+    def _get_lease(self, lease_manager):
+        if lease_manager is not None:
+            return lease_manager.get_lease()
+        return self.client.lease(ttl=self.lease_ttl)
+
+    def add_batch(self, cmds, op=None):
         """Clients add batch, given key events.
 
         Each batch is given an uuid that is used to generate both
@@ -95,6 +442,8 @@ class SwitchQueue(object):
         to the workers, and start waiting for results.
 
         :param cmds: an iterable of commands
+        :param op: optional operation dict describing the commands, used to
+            compact batches. See port_operation and friends.
         :return: a SwitchQueueItem object
         """
 
@@ -108,8 +457,22 @@ class SwitchQueue(object):
             "result_key": result_key,
             "cmds": cmds,
         }
+        if op is not None:
+            batch["op"] = op
+        result_watcher = self.result_watcher
+        if result_watcher is not None:
+            result_watcher.register(uuid)
+        try:
+            return self._put_batch(batch)
+        except Exception:
+            if result_watcher is not None:
+                result_watcher.unregister(uuid)
+            raise
+
+    def _put_batch(self, batch):
+        input_key = batch["input_key"]
         value = json.dumps(batch, sort_keys=True).encode("utf-8")
-        lease = self.client.lease(ttl=self.lease_ttl)
+        lease = self._get_lease(self.input_leases)
         # Use a transaction rather than create() in order to extract the
         # create revision.
         base64_key = _encode(input_key)
@@ -144,7 +507,7 @@ class SwitchQueue(object):
         LOG.debug("written input key %s revision %s",
                   input_key, create_revision)
 
-        return SwitchQueueItem(uuid, create_revision)
+        return SwitchQueueItem(batch["uuid"], create_revision)
 
     def wait_for_result(self, item, timeout):
         """Wait for the result of a command batch.
@@ -156,6 +519,19 @@ class SwitchQueue(object):
             unsuccessful
         """
         result_key = self.RESULT_ITEM_KEY % (self.switch_name, item.uuid)
+        # The watcher is stopped when the queue is closed, after which the
+        # result is polled for.
+        result_watcher = self.result_watcher
+        if result_watcher is not None:
+            future = result_watcher.get_future(item.uuid)
+            if future is not None:
+                try:
+                    result_dict = self._wait_for_shared_result(
+                        future, result_key, timeout)
+                finally:
+                    result_watcher.unregister(item.uuid)
+                return self._parse_result(result_dict)
+
         deadline = time.monotonic() + timeout
         result_dict = None
         start_revision = item.create_revision
@@ -195,13 +571,32 @@ class SwitchQueue(object):
                     device=self.switch_name,
                     error="Timed out waiting for result key: %s" % result_key)
 
-        LOG.debug("got result: %s", result_dict)
-        if "result" in result_dict:
-            return result_dict["result"]
-        else:
-            raise exc.GenericSwitchBatchError(
-                device=self.switch_name,
-                error=result_dict["error"])
+        return self._parse_result(result_dict)
+
+    def _wait_for_shared_result(self, future, result_key, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                try:
+                    result_dict = future.result(
+                        timeout=min(RESULT_WATCH_TIMEOUT, remaining))
+                except futures.TimeoutError:
+                    pass
+                else:
+                    self.client.delete(result_key)
+                    LOG.debug("deleted result for: %s", result_key)
+                    return result_dict
+            # NOTE: The result can exist even if the watch event was missed,
+            # for example while the shared watch was being established.
+            result_dict = self._get_and_delete_result(result_key)
+            if result_dict is not None:
+                return result_dict
+            if remaining <= 0:
+                raise exc.GenericSwitchBatchError(
+                    device=self.switch_name,
+                    error="Timed out waiting for result key: %s" % result_key)
+            LOG.debug("Result key not ready yet: %s", result_key)
 
     def _get_and_delete_result(self, result_key):
         # Consume the result if it exists, otherwise return None.
@@ -262,42 +657,52 @@ class SwitchQueue(object):
             batches.append(batch)
         return batches
 
-    def record_result(self, batch):
-        """Record the result from executing given command set.
+    def record_results(self, batches):
+        """Record the results from executing several command sets.
 
-        We assume that a lock is held before getting a fresh list
-        of batches, executing them, and then calling this record
-        results function, before finally dropping the lock.
+        Results are written using as few etcd transactions as possible,
+        each one writing the result keys and deleting the input keys of
+        a group of batches.
+
+        The same locking requirements as record_result apply.
+
+        :param batches: a list of batch dicts with results or errors set.
         """
         # Write results and delete input keys so the next worker to hold the
         # lock knows not to execute these batches
-        lease = self.client.lease(ttl=self.lease_ttl)
-        result_value = json.dumps(batch, sort_keys=True).encode('utf-8')
-        txn = {
-            'compare': [],
-            'success': [
-                {
+        lease = self._get_lease(self.result_leases)
+        txn_size = MAX_TXN_OPS // 2
+        for i in range(0, len(batches), txn_size):
+            txn_batches = batches[i:i + txn_size]
+            success_ops = []
+            for batch in txn_batches:
+                result_value = json.dumps(
+                    batch, sort_keys=True).encode('utf-8')
+                success_ops.append({
                     'request_put': {
                         'key': _encode(batch['result_key']),
                         'value': _encode(result_value),
                         'lease': lease.id,
                     }
-                },
-                {
+                })
+                success_ops.append({
                     'request_delete_range': {
                         'key': _encode(batch['input_key']),
                     }
-                }
-            ],
-            'failure': []
-        }
-        result = self.client.transaction(txn)
-        success = result.get('succeeded', False)
-        if not success:
-            LOG.error("failed to report batch result for: %s",
-                      batch)
-        else:
-            LOG.debug("written result key: %s", batch['result_key'])
+                })
+            txn = {
+                'compare': [],
+                'success': success_ops,
+                'failure': []
+            }
+            result = self.client.transaction(txn)
+            success = result.get('succeeded', False)
+            if not success:
+                LOG.error("failed to report batch result for: %s",
+                          txn_batches)
+            else:
+                LOG.debug("written result keys: %s",
+                          [batch['result_key'] for batch in txn_batches])
 
     def acquire_worker_lock(self, item, acquire_timeout=300, lock_ttl=120,
                             wait=None):
@@ -337,35 +742,716 @@ class SwitchQueue(object):
 
         return _acquire_lock_with_retry()
 
+    def try_worker_lock(self, lock_ttl=120):
+        lock = self.client.lock(self.EXEC_LOCK % self.switch_name, lock_ttl)
+        if lock.acquire():
+            return lock
+        return None
+
+    def has_batches(self):
+        # Fetch at most one key, without its value.
+        input_prefix = self.INPUT_PREFIX % self.switch_name
+        range_end = _encode(_increment_last_byte(input_prefix))
+        return bool(self.client.get(input_prefix, range_end=range_end,
+                                    keys_only=True, limit=1))
+
+    def watch_for_work(self, callback):
+        """Watch for new batches and for the worker lock being released.
+
+        The callback is called without arguments for every batch that is
+        added to the queue of this switch by any process, and every time the
+        worker lock of this switch is released or expires.
+
+        :param callback: function to call when there may be work to do
+        :returns: a function that cancels the watches
+        """
+        input_prefix = self.INPUT_PREFIX % self.switch_name
+        lock_key = LOCK_PREFIX + self.EXEC_LOCK % self.switch_name
+        watches = [
+            self.client.watch_prefix(input_prefix, filters=['NODELETE']),
+            self.client.watch(lock_key, filters=['NOPUT']),
+        ]
+
+        def consume(events):
+            for event in events:
+                callback()
+
+        threads = []
+        for events, cancel in watches:
+            thread = threading.Thread(
+                target=consume, args=(events,), daemon=True,
+                name="ngs-batch-watch-%s" % self.switch_name)
+            thread.start()
+            threads.append(thread)
+
+        def cancel_all():
+            for events, cancel in watches:
+                cancel()
+
+        return cancel_all
+
+
+class _InProcessLock(object):
+    """Worker lock of an InProcessSwitchQueue."""
+
+    def __init__(self, switch_queue):
+        self.switch_queue = switch_queue
+        self._acquired = False
+
+    def acquire(self):
+        self._acquired = self.switch_queue._exec_lock.acquire(blocking=False)
+        return self._acquired
+
+    def release(self):
+        if not self._acquired:
+            return False
+        self._acquired = False
+        self.switch_queue._exec_lock.release()
+        self.switch_queue._notify()
+        return True
+
+    def refresh(self):
+        pass
+
+    def is_acquired(self):
+        return self._acquired
+
+
+class InProcessSwitchQueue(BaseSwitchQueue):
+    """Queue of command batches for a switch, held in memory.
+
+    Only batches added by this process are executed together, and the worker
+    lock only excludes workers in this process. This is suitable when a
+    single process manages the switch.
+    """
+
+    def __init__(self, switch_name, release=None):
+        super(InProcessSwitchQueue, self).__init__(switch_name,
+                                                   release=release)
+        self._cond = threading.Condition()
+        self._pending = collections.OrderedDict()
+        self._results = {}
+        self._revisions = itertools.count(1)
+        self._exec_lock = threading.Lock()
+        self._callbacks = []
+
+    def add_batch(self, cmds, op=None):
+        uuid = uuidutils.generate_uuid()
+        batch = {
+            "uuid": uuid,
+            "cmds": cmds,
+        }
+        if op is not None:
+            batch["op"] = op
+        with self._cond:
+            revision = next(self._revisions)
+            self._pending[uuid] = (revision, batch)
+        self._notify()
+        return SwitchQueueItem(uuid, revision)
+
+    def wait_for_result(self, item, timeout):
+        with self._cond:
+            found = self._cond.wait_for(lambda: item.uuid in self._results,
+                                        timeout)
+            if not found:
+                self._pending.pop(item.uuid, None)
+                raise exc.GenericSwitchBatchError(
+                    device=self.switch_name,
+                    error="Timed out waiting for result: %s" % item.uuid)
+            result_dict = self._results.pop(item.uuid)
+        return self._parse_result(result_dict)
+
+    def get_batches(self, item=None):
+        with self._cond:
+            # Return copies, so that pending batches are not modified until
+            # their results are recorded.
+            return [dict(batch) for revision, batch in self._pending.values()
+                    if item is None or revision <= item.create_revision]
+
+    def record_results(self, batches):
+        with self._cond:
+            for batch in batches:
+                # A batch is no longer pending once its waiter has timed out,
+                # so its result would never be removed.
+                if self._pending.pop(batch["uuid"], None) is not None:
+                    self._results[batch["uuid"]] = batch
+            self._cond.notify_all()
+
+    def acquire_worker_lock(self, item, acquire_timeout=300, lock_ttl=120,
+                            wait=None):
+        # Workers are woken up when the lock is released or results are
+        # recorded, so the wait argument is not used.
+        deadline = time.monotonic() + acquire_timeout
+        while True:
+            lock = self.try_worker_lock(lock_ttl)
+            if lock is not None:
+                return lock
+            with self._cond:
+                if not self.get_batches(item):
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise exc.GenericSwitchBatchError(
+                        device=self.switch_name,
+                        error="Timed out waiting for worker lock")
+                self._cond.wait(remaining)
+
+    def try_worker_lock(self, lock_ttl=120):
+        lock = self._make_lock()
+        if lock.acquire():
+            return lock
+        return None
+
+    def _make_lock(self):
+        return _InProcessLock(self)
+
+    def has_batches(self):
+        with self._cond:
+            return bool(self._pending)
+
+    def watch_for_work(self, callback):
+        with self._cond:
+            self._callbacks.append(callback)
+
+        def cancel():
+            with self._cond:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+        return cancel
+
+    def _notify(self):
+        with self._cond:
+            self._cond.notify_all()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+
+class _ToozLock(_InProcessLock):
+    """Worker lock of a ToozSwitchQueue.
+
+    Holds the in-process lock of the queue and a tooz lock for the switch,
+    so that only one process at a time configures the switch.
+    """
+
+    def __init__(self, switch_queue, tooz_lock):
+        super(_ToozLock, self).__init__(switch_queue)
+        self.tooz_lock = tooz_lock
+
+    def acquire(self):
+        if not super(_ToozLock, self).acquire():
+            return False
+        try:
+            if self.tooz_lock.acquire(blocking=False):
+                return True
+        except Exception as e:
+            LOG.warning("Failed to acquire tooz lock for %s: %s",
+                        self.switch_queue.switch_name, e)
+        super(_ToozLock, self).release()
+        return False
+
+    def release(self):
+        if not self._acquired:
+            return False
+        try:
+            self.tooz_lock.release()
+        finally:
+            super(_ToozLock, self).release()
+        return True
+
+    def is_acquired(self):
+        # The lifetime of the tooz lock is managed by the coordinator
+        # heartbeat.
+        return self._acquired and self.tooz_lock.is_still_owner()
+
+
+class ToozSwitchQueue(InProcessSwitchQueue):
+    """Queue of command batches held in memory, with a tooz worker lock.
+
+    Batches are queued and executed as with InProcessSwitchQueue, while a
+    tooz lock ensures that workers in different processes do not configure
+    the switch at the same time. Any tooz driver supporting locks may be
+    used, e.g. redis, memcached or file.
+    """
+
+    EXEC_LOCK = "ngs-batch-%s"
+
+    def __init__(self, switch_name, coordinator, release=None):
+        super(ToozSwitchQueue, self).__init__(switch_name, release=release)
+        self.coordinator = coordinator
+
+    def _make_lock(self):
+        name = (self.EXEC_LOCK % self.switch_name).encode()
+        return _ToozLock(self, self.coordinator.get_lock(name))
+
+    def acquire_worker_lock(self, item, acquire_timeout=300, lock_ttl=120,
+                            wait=None):
+        # Other processes do not notify us when they release the tooz lock,
+        # so retry periodically as well as when woken up.
+        if wait is None:
+            wait = tenacity.wait_random(min=1, max=3)
+
+        @tenacity.retry(
+            after=tenacity.after_log(LOG, logging.DEBUG),
+            retry=tenacity.retry_if_result(lambda x: x is False),
+            stop=tenacity.stop_after_delay(acquire_timeout),
+            wait=wait,
+        )
+        def _acquire_lock_with_retry():
+            lock = self.try_worker_lock(lock_ttl)
+            if lock is not None:
+                return lock
+            if not self.get_batches(item):
+                return None
+            return False
+
+        return _acquire_lock_with_retry()
+
+
+BACKENDS = ('etcd', 'tooz', 'memory')
+
+
+def get_switch_queue(switch_name, backend='etcd', backend_url=None,
+                     **kwargs):
+    """Create the queue of command batches for a switch.
+
+    :param switch_name: name of the switch
+    :param backend: one of BACKENDS
+    :param backend_url: URL of the etcd or tooz backend
+    :param kwargs: extra arguments for the etcd SwitchQueue
+    :returns: a BaseSwitchQueue object
+    """
+    if backend == 'memory':
+        return InProcessSwitchQueue(switch_name)
+    if backend == 'tooz':
+        coordinator = ngs_lock.get_coordinator(
+            backend_url,
+            ('ngs-batch-' + device_utils.get_hostname()).encode('ascii'),
+            start_heart=True)
+        release = ngs_utils.release_at_exit(coordinator.release)
+        return ToozSwitchQueue(switch_name, coordinator, release=release)
+    etcd_client = _get_etcd_client(backend_url)
+    release = ngs_utils.release_at_exit(
+        functools.partial(_release_etcd_client, backend_url))
+    return SwitchQueue(switch_name, etcd_client, release=release, **kwargs)
+
+
+def _discard(items, item):
+    try:
+        items.remove(item)
+    except ValueError:
+        pass
+
+
+def _get_etcd_client(etcd_url):
+    """Return a reference to the etcd client shared by this process.
+
+    The client and its HTTP connection pool are shared by the queues of all
+    switches using the same etcd URL. _release_etcd_client must be called
+    when the client is no longer needed.
+    """
+    with _ETCD_CLIENTS_LOCK:
+        entry = _ETCD_CLIENTS.get(etcd_url)
+        if entry is None:
+            entry = [_make_etcd_client(etcd_url), 0]
+            _ETCD_CLIENTS[etcd_url] = entry
+        entry[1] += 1
+        return entry[0]
+
+
+def _release_etcd_client(etcd_url):
+    """Release a reference, closing the client after the last."""
+    with _ETCD_CLIENTS_LOCK:
+        entry = _ETCD_CLIENTS.get(etcd_url)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del _ETCD_CLIENTS[etcd_url]
+    entry[0].session.close()
+
+
+def _make_etcd_client(etcd_url):
+    parsed_url = netutils.urlsplit(etcd_url)
+    host = parsed_url.hostname
+    port = parsed_url.port
+    protocol = 'https' if parsed_url.scheme.endswith(
+        'https') else 'http'
+    # Use the same parameter format as tooz etcd3gw driver.
+    params = parsed_url.params()
+    ca_cert = params.get('ca_cert')
+    cert_key = params.get('cert_key')
+    cert_cert = params.get('cert_cert')
+    api_version = params.get('api_version')
+    if api_version:
+        api_path = '/' + api_version + '/'
+    else:
+        api_path = DEFAULT_API_PATH
+    return etcd3gw.client(
+        host=host, port=port, protocol=protocol,
+        ca_cert=ca_cert, cert_key=cert_key, cert_cert=cert_cert,
+        api_path=api_path, timeout=30)
+
+
+def port_operation(action, port, segmentation_id, trunk_details=None,
+                   default_vlan=None, kind='port'):
+    """Describe a port plug or unplug operation for batch compaction.
+
+    :param action: 'plug' or 'unplug'
+    :param port: name of the switch port or bond
+    :param segmentation_id: VLAN identifier of the network
+    :param trunk_details: trunk information if port is a part of trunk
+    :param default_vlan: default VLAN identifier of the port, if any
+    :param kind: 'port' or 'bond'
+    :returns: an operation dict
+    """
+    vlans = [segmentation_id]
+    if default_vlan:
+        vlans.append(default_vlan)
+    if trunk_details:
+        vlans += [sub_port['segmentation_id']
+                  for sub_port in trunk_details.get('sub_ports', [])]
+    return _operation(kind, action,
+                      [port, segmentation_id, trunk_details, default_vlan],
+                      ports=[port], vlans=vlans)
+
+
+def network_operation(action, segmentation_id, network_id):
+    """Describe a network add or delete operation for batch compaction.
+
+    :param action: 'add' or 'delete'
+    :param segmentation_id: VLAN identifier of the network
+    :param network_id: UUID of the network
+    :returns: an operation dict
+    """
+    return _operation('network', action, [segmentation_id, network_id],
+                      vlans=[segmentation_id], exclusive=True)
+
+
+def trunk_operation(action, port, segmentation_ids):
+    """Describe a trunk subport add or remove operation for batch compaction.
+
+    :param action: 'add' or 'delete'
+    :param port: name of the switch port or bond
+    :param segmentation_ids: VLAN identifiers of the subports
+    :returns: an operation dict
+    """
+    return _operation('trunk', action, [port, sorted(segmentation_ids)],
+                      ports=[port], vlans=segmentation_ids)
+
+
+def _operation(kind, action, args, ports=(), vlans=(), exclusive=False):
+    return {
+        "kind": kind,
+        "action": action,
+        # Operations with equal keys and inverse actions cancel each other.
+        "key": json.dumps(args, sort_keys=True, default=str),
+        "ports": sorted(set(str(port) for port in ports)),
+        "vlans": sorted(set(str(vlan) for vlan in vlans)),
+        # Exclusive operations conflict with every operation on their VLANs.
+        "exclusive": exclusive,
+    }
+
+
+_INVERSE_ACTIONS = {
+    ('plug', 'unplug'),
+    ('unplug', 'plug'),
+    ('add', 'delete'),
+    ('delete', 'add'),
+}
+
+
+def _is_inverse(op1, op2):
+    return (op1['kind'] == op2['kind'] and op1['key'] == op2['key']
+            and (op1['action'], op2['action']) in _INVERSE_ACTIONS)
+
+
+def _conflicts(op1, op2):
+    if set(op1['ports']) & set(op2['ports']):
+        return True
+    if op1['exclusive'] or op2['exclusive']:
+        return bool(set(op1['vlans']) & set(op2['vlans']))
+    return False
+
+
+def compact_batches(batches):
+    """Cancel batches that are undone by later ones.
+
+    A batch is cancelled when a later batch has the inverse operation (e.g.
+    plugging and then unplugging the same port into the same VLAN), and no
+    batch between them that has not itself been cancelled touches the same
+    port or VLAN. Batches without an operation are treated as touching
+    everything. The later batch is still executed, since the switch may not
+    have been in the state preceding the earlier batch, for example when
+    retrying a failed request. The final state of the remaining batches is
+    the same as executing every batch in order.
+
+    :param batches: list of batch dicts, in execution order
+    :returns: a tuple of the list of batches to execute and the list of
+        cancelled batches, both in execution order
+    """
+    cancelled = set()
+    for later_index, later in enumerate(batches):
+        later_op = later.get('op')
+        if not later_op:
+            continue
+        for index in range(later_index - 1, -1, -1):
+            if index in cancelled:
+                continue
+            earlier_op = batches[index].get('op')
+            if not earlier_op:
+                break
+            if _is_inverse(earlier_op, later_op):
+                cancelled.add(index)
+                break
+            if _conflicts(earlier_op, later_op):
+                break
+    remaining = [batch for index, batch in enumerate(batches)
+                 if index not in cancelled]
+    compacted = [batch for index, batch in enumerate(batches)
+                 if index in cancelled]
+    return remaining, compacted
+
+
+def _is_command_echo(line, cmd):
+    """Return whether a line of output is the echo of a command.
+
+    The echo may be preceded by a prompt, but must otherwise be the whole
+    line, so that 'vlan 10' does not match 'vlan 100' or 'no vlan 10'.
+    """
+    line = line.rstrip()
+    cmd = cmd.strip()
+    if not line.endswith(cmd):
+        return False
+    prefix = line[:len(line) - len(cmd)].rstrip()
+    return not prefix or prefix[-1] in _PROMPT_TERMINATORS
+
+
+def _split_output(output, batches):
+    """Split the output of a coalesced config session between batches.
+
+    Devices echo each configuration line that they receive, so we walk the
+    lines of the output looking for the commands of every batch in the order
+    that they were sent, and split the output at the first command of each
+    batch.
+
+    :param output: output string of the coalesced config session
+    :param batches: list of batch dicts that were sent in the session
+    :returns: a list of output strings, one for each batch, or None if the
+        output could not be matched up with the commands.
+    """
+    expected = []
+    for batch in batches:
+        if not batch['cmds']:
+            return None
+        for index, cmd in enumerate(batch['cmds']):
+            if not isinstance(cmd, str) or not cmd.strip():
+                return None
+            expected.append((cmd, index == 0))
+    offsets = []
+    pos = 0
+    for line in output.splitlines(keepends=True):
+        if not expected:
+            break
+        cmd, first = expected[0]
+        if _is_command_echo(line, cmd):
+            if first:
+                # Start from the beginning of the line, to include the
+                # prompt preceding the command echo.
+                offsets.append(pos)
+            expected.pop(0)
+        pos += len(line)
+    if expected:
+        return None
+    offsets[0] = 0
+    offsets.append(len(output))
+    return [output[start:end] for start, end in zip(offsets, offsets[1:])]
+
+
+class WatchWorker(object):
+    """Long-lived batch worker for one switch, woken up by etcd events.
+
+    Rather than each request spawning a thread that polls for the worker
+    lock, a single worker per switch and process waits for a batch to be
+    added or for the worker lock to be released, and then tries to execute
+    all pending batches.
+    """
+
+    def __init__(self, switch_batch, device):
+        self.switch_batch = switch_batch
+        self.device = device
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._cancel_watches = None
+
+    def notify(self):
+        """Wake up the worker, starting it if required."""
+        self.start()
+        self._wake.set()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._cancel_watches = self.switch_batch.queue.watch_for_work(
+                self._wake.set)
+            self._thread = threading.Thread(
+                target=self._run, daemon=True,
+                name="ngs-batch-worker-%s" % self.switch_batch.switch_name)
+            self._thread.start()
+            WATCH_WORKERS.append(self)
+
+    def stop(self, timeout=None):
+        """Stop the worker after it finishes any batches in progress."""
+        self._stopped.set()
+        self._wake.set()
+        if self._cancel_watches is not None:
+            self._cancel_watches()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.switch_batch.watch_poll_interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            # Let other requests join the batch.
+            if self._stopped.wait(self.switch_batch.window.get_window()):
+                break
+            try:
+                self.switch_batch._execute_available_batches(self.device)
+            except Exception:
+                LOG.exception("Batch worker for %s failed",
+                              self.switch_batch.switch_name)
+
+
+class BatchWindow(object):
+    """Adaptive delay before executing the pending batches of one switch.
+
+    Waiting before executing batches lets other requests join the batch, but
+    delays every request. The window is sized from a moving average of the
+    interval between requests and of the time taken to send batches to the
+    switch. When requests arrive more often than batches can be sent, the
+    window grows to gather a few more requests, but never beyond half the
+    send time. Otherwise the minimum window is used.
+
+    :param switch_name: name of the switch, used for metrics
+    :param minimum: smallest window in seconds
+    :param maximum: largest window in seconds. If not greater than the
+        minimum, the window is fixed at the minimum.
+    """
+
+    SMOOTHING = 0.2
+    ARRIVALS_PER_WINDOW = 4
+
+    def __init__(self, switch_name, minimum=0.001, maximum=None):
+        self.switch_name = switch_name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.arrival_interval = None
+        self.send_duration = None
+        self._last_arrival = None
+        self._lock = threading.Lock()
+
+    @property
+    def adaptive(self):
+        return self.maximum is not None and self.maximum > self.minimum
+
+    def _average(self, current, sample):
+        if current is None:
+            return sample
+        return current + self.SMOOTHING * (sample - current)
+
+    def record_arrival(self):
+        """Record that a request has been added to the queue."""
+        if not self.adaptive:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self._last_arrival is not None:
+                # Long idle periods would otherwise take many requests to
+                # forget. Beyond this bound the minimum window is used
+                # anyway.
+                bound = max(self.maximum, self.send_duration or 0)
+                sample = min(now - self._last_arrival, bound)
+                self.arrival_interval = self._average(
+                    self.arrival_interval, sample)
+            self._last_arrival = now
+
+    def record_send(self, duration, num_batches):
+        """Record the execution of batches on the switch.
+
+        :param duration: time in seconds taken to send the batches
+        :param num_batches: number of batches sent
+        """
+        metrics.observe('batch_size', self.switch_name, num_batches,
+                        buckets=metrics.SIZE_BUCKETS)
+        metrics.observe('batch_send_duration', self.switch_name, duration)
+        if not self.adaptive:
+            return
+        with self._lock:
+            self.send_duration = self._average(self.send_duration, duration)
+
+    def get_window(self):
+        """Return the time in seconds to wait before executing batches."""
+        window = self.minimum
+        with self._lock:
+            interval = self.arrival_interval
+            duration = self.send_duration
+        if (self.adaptive and interval is not None and duration is not None
+                and interval < duration):
+            window = min(self.ARRIVALS_PER_WINDOW * interval, duration / 2)
+            window = max(self.minimum, min(self.maximum, window))
+        metrics.set_gauge('batch_window', self.switch_name, window)
+        return window
+
 
 class SwitchBatch(object):
-    def __init__(self, switch_name, etcd_url=None, switch_queue=None):
+    def __init__(self, switch_name, backend_url=None, switch_queue=None,
+                 coalesce=False, max_coalesce_commands=500, compact=False,
+                 watch_worker=False, shared_result_watch=False,
+                 shared_lease=False, backend='etcd', window_min=0.001,
+                 window_max=None,
+                 watch_poll_interval=WATCH_WORKER_POLL_INTERVAL):
         if switch_queue is None:
-            parsed_url = netutils.urlsplit(etcd_url)
-            host = parsed_url.hostname
-            port = parsed_url.port
-            protocol = 'https' if parsed_url.scheme.endswith(
-                'https') else 'http'
-            # Use the same parameter format as tooz etcd3gw driver.
-            params = parsed_url.params()
-            ca_cert = params.get('ca_cert')
-            cert_key = params.get('cert_key')
-            cert_cert = params.get('cert_cert')
-            api_version = params.get('api_version')
-            if api_version:
-                api_path = '/' + api_version + '/'
-            else:
-                api_path = DEFAULT_API_PATH
-            etcd_client = etcd3gw.client(
-                host=host, port=port, protocol=protocol,
-                ca_cert=ca_cert, cert_key=cert_key, cert_cert=cert_cert,
-                api_path=api_path, timeout=30)
-            self.queue = SwitchQueue(switch_name, etcd_client)
+            self.queue = get_switch_queue(
+                switch_name, backend=backend, backend_url=backend_url,
+                shared_result_watch=shared_result_watch,
+                shared_lease=shared_lease)
         else:
             self.queue = switch_queue
         self.switch_name = switch_name
-
-    def do_batch(self, device, cmd_set, timeout=300):
+        self.coalesce = coalesce
+        self.max_coalesce_commands = max_coalesce_commands
+        self.compact = compact
+        self.watch_worker = watch_worker
+        self.watch_poll_interval = watch_poll_interval
+        self.window = BatchWindow(switch_name, minimum=window_min,
+                                  maximum=window_max)
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._closed = False
+
+    def close(self):
+        """Stop the watch worker and release the queue.
+
+        Batches being executed are completed. Batches added later are
+        executed by a worker spawned for each request.
+        """
+        with self._worker_lock:
+            self._closed = True
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.stop(timeout=SHUTDOWN_TIMEOUT)
+            _discard(WATCH_WORKERS, worker)
+        self.queue.close()
+
+    def do_batch(self, device, cmd_set, timeout=300, op=None):
         """Batch up switch configuration commands to reduce overheads.
 
         We collect together the iterables in the cmd_set, and
@@ -373,22 +1459,28 @@ class SwitchBatch(object):
 
         :param device: a NetmikoSwitch device object
         :param cmd_set: an iterable of commands
+        :param op: optional operation dict describing the commands
         :return: output string generated by this command set
         """
 
         # request that the cmd_set by executed
         cmd_list = list(cmd_set)
-        item = self.queue.add_batch(cmd_list)
+        item = self.queue.add_batch(cmd_list, op=op)
+        self.window.record_arrival()
 
-        def do_work():
-            try:
-                self._execute_pending_batches(device, item)
-            except Exception as e:
-                LOG.error("failed to run execute batch: %s", e,
-                          exec_info=True)
-                raise
+        worker = self._get_worker(device) if self.watch_worker else None
+        if worker is not None:
+            worker.notify()
+        else:
+            def do_work():
+                try:
+                    self._execute_pending_batches(device, item)
+                except Exception as e:
+                    LOG.error("failed to run execute batch: %s", e,
+                              exec_info=True)
+                    raise
 
-        self._spawn(do_work)
+            self._spawn(do_work, self.window.get_window())
 
         # Wait for our result key
         # as the result might be done before the above task starts
@@ -396,11 +1488,17 @@ class SwitchBatch(object):
         LOG.debug("Got batch result: %s", output)
         return output
 
+    def _get_worker(self, device):
+        with self._worker_lock:
+            if self._worker is None and not self._closed:
+                self._worker = WatchWorker(self, device)
+            return self._worker
+
     @staticmethod
-    def _spawn(work_fn):
+    def _spawn(work_fn, delay=0.001):
         # Sleep to let possible other work to batch together
         # This works with both eventlet and native threading
-        threading.Event().wait(0.001)
+        threading.Event().wait(delay)
         # Run all pending tasks, which might be a no op
         # if pending tasks already ran
         THREAD_POOL.add_thread(work_fn)
@@ -436,6 +1534,27 @@ class SwitchBatch(object):
                 device=self.switch_name,
                 error="unable to get lock for: %s" % self.switch_name)
 
+        self._execute_locked(device, lock)
+
+    def _execute_available_batches(self, device):
+        """Execute all pending batches, unless another worker is doing so.
+
+        Called by the watch worker, which is woken up again when the lock is
+        released, so there is no need to wait for the lock here.
+
+        :param device: a NetmikoSwitch device object
+        """
+        if not self.queue.has_batches():
+            LOG.debug("Skipped execution for %s", self.switch_name)
+            return
+        lock = self.queue.try_worker_lock()
+        if lock is None:
+            LOG.debug("Another worker holds the lock for %s",
+                      self.switch_name)
+            return
+        self._execute_locked(device, lock)
+
+    def _execute_locked(self, device, lock):
         # be sure to drop the lock when we are done
         try:
             LOG.debug("got lock for %s", self.switch_name)
@@ -447,38 +1566,245 @@ class SwitchBatch(object):
                 LOG.debug("No batches to execute %s", self.switch_name)
                 return
 
+            if self.compact:
+                batches = self._compact_batches(batches, lock)
+                if not batches:
+                    return
+
             LOG.debug("Starting to execute %d batches", len(batches))
+            start = time.monotonic()
             self._send_commands(device, batches, lock)
+            self.window.record_send(time.monotonic() - start, len(batches))
         finally:
             lock.release()
 
         LOG.debug("end of lock for %s", self.switch_name)
 
+    def _compact_batches(self, batches, lock):
+        """Record results for cancelled batches and return the rest."""
+        batches, cancelled = compact_batches(batches)
+        if cancelled:
+            LOG.debug("Compacted away %(cancelled)d of %(total)d batches "
+                      "for %(switch)s",
+                      {'cancelled': len(cancelled),
+                       'total': len(cancelled) + len(batches),
+                       'switch': self.switch_name})
+            for batch in cancelled:
+                batch["result"] = ""
+            self._refresh_lock(lock)
+            self.queue.record_results(cancelled)
+        return batches
+
     def _send_commands(self, device, batches, lock):
+        if self.coalesce:
+            self._send_coalesced_commands(device, batches, lock)
+            return
         with device._get_connection() as net_connect:
             for batch in batches:
-                try:
-                    output = device.send_config_set(net_connect, batch['cmds'])
-                    batch["result"] = output
-                except Exception as e:
-                    batch["error"] = str(e)
-
-                # The switch configuration can take a long time, and may exceed
-                # the lock TTL. Periodically refresh our lease, and verify that
-                # we still own the lock before recording the results.
-                lock.refresh()
-                if not lock.is_acquired():
-                    raise exc.GenericSwitchBatchError(
-                        device=self.switch_name,
-                        error="Worker aborting - lock timed out")
-
+                self._send_batch(device, net_connect, batch)
+                self._refresh_lock(lock)
                 # Tell request watchers the result and
                 # tell workers which batches have now been executed
                 self.queue.record_result(batch)
+            self._save_after_send(device, net_connect, len(batches))
 
-            if device._get_save_configuration():
-                try:
-                    device.save_configuration(net_connect)
-                except Exception:
-                    LOG.exception("Failed to save configuration")
-                    # Probably not worth failing all batches for this.
+    def _save_after_send(self, device, net_connect, num_batches):
+        if device.save_scheduler is not None:
+            device.save_scheduler.record_change(num_batches)
+        elif device._get_save_configuration():
+            try:
+                device.save_configuration(net_connect)
+            except Exception:
+                LOG.exception("Failed to save configuration")
+                # Probably not worth failing all batches for this.
+
+    def save_configuration(self, device, acquire_timeout=300):
+        """Save the configuration of the switch between batches.
+
+        The worker lock is held while saving, so that the save does not run
+        concurrently with the execution of batches.
+
+        :param device: a NetmikoSwitch device object
+        :param acquire_timeout: time in seconds to wait for the worker lock
+        """
+        @tenacity.retry(
+            retry=tenacity.retry_if_result(lambda lock: lock is None),
+            stop=tenacity.stop_after_delay(acquire_timeout),
+            wait=tenacity.wait_random(min=0.1, max=1))
+        def _acquire_lock_with_retry():
+            return self.queue.try_worker_lock()
+
+        try:
+            lock = _acquire_lock_with_retry()
+        except tenacity.RetryError:
+            raise exc.GenericSwitchBatchError(
+                device=self.switch_name,
+                error="Timed out waiting for worker lock to save "
+                      "configuration")
+        try:
+            with device._get_connection() as net_connect:
+                device.save_configuration(net_connect)
+        finally:
+            lock.release()
+
+    def _send_batch(self, device, net_connect, batch):
+        try:
+            output = device.send_config_set(net_connect, batch['cmds'])
+            batch["result"] = output
+        except Exception as e:
+            batch["error"] = str(e)
+
+    def _refresh_lock(self, lock):
+        # The switch configuration can take a long time, and may exceed
+        # the lock TTL. Periodically refresh our lease, and verify that
+        # we still own the lock before recording the results.
+        lock.refresh()
+        if not lock.is_acquired():
+            raise exc.GenericSwitchBatchError(
+                device=self.switch_name,
+                error="Worker aborting - lock timed out")
+
+    def _chunk_batches(self, batches):
+        """Split batches into chunks of bounded command count.
+
+        Every chunk contains at least one batch, even if that batch on its
+        own exceeds max_coalesce_commands.
+        """
+        chunk = []
+        chunk_cmds = 0
+        for batch in batches:
+            num_cmds = len(batch['cmds'])
+            if chunk and chunk_cmds + num_cmds > self.max_coalesce_commands:
+                yield chunk
+                chunk = []
+                chunk_cmds = 0
+            chunk.append(batch)
+            chunk_cmds += num_cmds
+        if chunk:
+            yield chunk
+
+    def _send_coalesced_commands(self, device, batches, lock):
+        """Send the commands of many batches in few configuration sessions.
+
+        The output is split between the batches of a chunk, so that errors
+        reported by the device are detected by the right caller. If the
+        session fails, the connection is closed and each batch in the chunk
+        is executed separately on a new connection.
+        """
+        chunks = collections.deque(self._chunk_batches(batches))
+        failed_chunk = None
+        while True:
+            try:
+                with device._get_connection() as net_connect:
+                    if failed_chunk is not None:
+                        self._send_batches_separately(device, net_connect,
+                                                      failed_chunk, lock)
+                        failed_chunk = None
+                    while chunks:
+                        chunk = chunks.popleft()
+                        cmds = [cmd for batch in chunk
+                                for cmd in batch['cmds']]
+                        try:
+                            output = device.send_config_set(net_connect,
+                                                            cmds)
+                        except Exception as e:
+                            # It is not known which of the commands were
+                            # applied before the session failed, so retry
+                            # each batch separately.
+                            LOG.warning(
+                                "Coalesced execution of %(count)d batches "
+                                "failed for %(switch)s, executing batches "
+                                "one by one: %(error)s",
+                                {'count': len(chunk),
+                                 'switch': self.switch_name, 'error': e})
+                            failed_chunk = chunk
+                            raise _SessionFailed()
+                        self._record_coalesced_output(
+                            device, net_connect, chunk, output, lock)
+                    self._save_after_send(device, net_connect, len(batches))
+                return
+            except _SessionFailed:
+                # The connection has been closed, retry on a new one.
+                continue
+
+    def _send_batches_separately(self, device, net_connect, chunk, lock):
+        for batch in chunk:
+            self._refresh_lock(lock)
+            self._send_batch(device, net_connect, batch)
+        self._refresh_lock(lock)
+        self.queue.record_results(chunk)
+
+    def _record_coalesced_output(self, device, net_connect, chunk, output,
+                                 lock):
+        # All of the commands were sent. If the device reported an error,
+        # the output of each batch is checked by its caller, as when batches
+        # are sent one by one.
+        outputs = _split_output(output, chunk)
+        if outputs is None:
+            try:
+                device.check_output(output, 'coalesced batches')
+            except exc.GenericSwitchNetmikoConfigError:
+                # The error cannot be attributed to a batch, so send each
+                # batch again to find out which one fails.
+                LOG.warning("Unable to split coalesced output containing an "
+                            "error for %s, executing batches one by one",
+                            self.switch_name)
+                self._send_batches_separately(device, net_connect, chunk,
+                                              lock)
+                return
+            LOG.debug("Unable to split coalesced output for %s, returning "
+                      "all output to each batch", self.switch_name)
+            outputs = [output] * len(chunk)
+        for batch, batch_output in zip(chunk, outputs):
+            batch["result"] = batch_output
+        self._refresh_lock(lock)
+        self.queue.record_results(chunk)
+
+
+class _SessionFailed(Exception):
+    """Raised to close the connection of a failed coalesced session."""
+
+
+class NetconfSwitchBatch(SwitchBatch):
+    """Batches configuration of a NETCONF switch.
+
+    The configuration objects of all pending batches are merged into a single
+    ``<config>`` payload, which is sent with one edit-config and one commit.
+    The configuration objects are not serialisable, so only the memory and
+    tooz backends are supported.
+    """
+
+    def _send_commands(self, device, batches, lock):
+        """Send the configuration of many batches in few commits.
+
+        If the merged configuration fails, each batch in the chunk is sent
+        separately so that errors are reported to the right caller.
+        """
+        for chunk in self._chunk_batches(batches):
+            config = [obj for batch in chunk for obj in batch['cmds']]
+            try:
+                device._edit_config(config)
+            except Exception as e:
+                if len(chunk) == 1:
+                    chunk[0]["error"] = str(e)
+                else:
+                    LOG.warning("Merged configuration of %(count)d batches "
+                                "failed for %(switch)s, sending batches one "
+                                "by one: %(error)s",
+                                {'count': len(chunk),
+                                 'switch': self.switch_name, 'error': e})
+                    for batch in chunk:
+                        self._send_config(device, batch)
+            else:
+                for batch in chunk:
+                    batch["result"] = ""
+
+            self._refresh_lock(lock)
+            self.queue.record_results(chunk)
+
+    def _send_config(self, device, batch):
+        try:
+            device._edit_config(batch['cmds'])
+            batch["result"] = ""
+        except Exception as e:
+            batch["error"] = str(e)
@@ -0,0 +1,231 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Broker sharing SSH sessions to switches between processes.
+
+Each Neutron server worker process otherwise has its own connection pool
+for every switch. The broker is a local daemon which owns the sessions to
+all switches, and executes the commands configuring or querying them on
+behalf of the workers, sent over a UNIX socket. This limits a switch to
+ngs_max_connections sessions on the host, without requiring distributed
+locks.
+
+Requests and responses are JSON objects, one per line.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from networking_generic_switch import config  # noqa
+from networking_generic_switch import devices
+from networking_generic_switch import exceptions as exc
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+
+def _encode(message):
+    return json.dumps(message).encode('utf-8') + b'\n'
+
+
+def _decode(line):
+    return json.loads(line.decode('utf-8'))
+
+
+class BrokerClient(object):
+    """Client sending command sets to the broker.
+
+    :param socket_path: path of the UNIX socket of the broker
+    :param timeout: timeout in seconds for a request to complete
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def send_commands(self, device_name, cmd_set):
+        """Execute commands on a switch through the broker.
+
+        :param device_name: name of the switch in the configuration
+        :param cmd_set: an iterable of commands
+        :returns: output of the commands
+        :raises: GenericSwitchBrokerError if the broker could not be reached
+            or failed to execute the commands.
+        """
+        return self._request(
+            device_name, {'device': device_name, 'cmds': list(cmd_set)})
+
+    def send_show_commands(self, device_name, cmds):
+        """Execute commands querying a switch through the broker.
+
+        :param device_name: name of the switch in the configuration
+        :param cmds: an iterable of commands
+        :returns: list of the outputs of each command
+        :raises: GenericSwitchBrokerError if the broker could not be reached
+            or failed to execute the commands.
+        """
+        return self._request(
+            device_name, {'device': device_name, 'show': list(cmds)})
+
+    def _request(self, device_name, request):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(_encode(request))
+                with sock.makefile('rb') as rfile:
+                    response = _decode(rfile.readline())
+        except (OSError, ValueError) as e:
+            raise exc.GenericSwitchBrokerError(device=device_name, error=e)
+        if 'error' in response:
+            raise exc.GenericSwitchBrokerError(device=device_name,
+                                               error=response['error'])
+        return response['output']
+
+
+class Broker(object):
+    """Executes command sets on switches on behalf of other processes.
+
+    At most ngs_max_connections command sets are executed concurrently on
+    each switch.
+
+    :param switches: dict of device objects keyed by switch name
+    """
+
+    def __init__(self, switches):
+        self.switches = switches
+        self._semaphores = {
+            name: threading.BoundedSemaphore(
+                int(switch.ngs_config['ngs_max_connections']))
+            for name, switch in switches.items()
+        }
+
+    def execute(self, device_name, cmd_set):
+        """Execute commands on a switch.
+
+        :param device_name: name of the switch in the configuration
+        :param cmd_set: a list of commands
+        :returns: output of the commands
+        """
+        switch = self._get_switch(device_name)
+        with self._semaphores[device_name]:
+            return switch._execute_commands(cmd_set)
+
+    def show(self, device_name, cmds):
+        """Execute commands querying a switch.
+
+        :param device_name: name of the switch in the configuration
+        :param cmds: a list of commands
+        :returns: list of the outputs of each command
+        """
+        switch = self._get_switch(device_name)
+        with self._semaphores[device_name]:
+            return switch._execute_show_commands(cmds)
+
+    def _get_switch(self, device_name):
+        switch = self.switches.get(device_name)
+        if switch is None or not hasattr(switch, '_execute_commands'):
+            raise exc.GenericSwitchBrokerError(
+                device=device_name, error="unknown SSH switch")
+        return switch
+
+    def handle_request(self, request):
+        """Execute a request and return the response."""
+        device_name = request.get('device')
+        try:
+            if 'show' in request:
+                output = self.show(device_name, request['show'])
+            else:
+                output = self.execute(device_name, request['cmds'])
+        except Exception as e:
+            LOG.error("Broker failed to execute commands on %(device)s: "
+                      "%(error)s", {'device': device_name, 'error': e})
+            return {'error': str(e)}
+        return {'output': output}
+
+    def make_server(self, socket_path):
+        """Create a server listening on a UNIX socket.
+
+        Any existing file at socket_path is removed. The socket is only
+        accessible to the user running the broker.
+        """
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = _BrokerServer(socket_path, _BrokerRequestHandler,
+                               bind_and_activate=False)
+        server.broker = self
+        try:
+            # Create the socket without access for other users, rather than
+            # restricting it after binding, and only listen once it is.
+            old_umask = os.umask(0o177)
+            try:
+                server.server_bind()
+            finally:
+                os.umask(old_umask)
+            os.chmod(socket_path, 0o600)
+            server.server_activate()
+        except Exception:
+            server.server_close()
+            raise
+        return server
+
+
+class _BrokerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class _BrokerRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = _decode(line)
+            except ValueError as e:
+                response = {'error': "invalid request: %s" % e}
+            else:
+                response = self.server.broker.handle_request(request)
+            self.wfile.write(_encode(response))
+
+
+def main():
+    logging.register_options(CONF)
+    CONF(sys.argv[1:], project='networking-generic-switch')
+    logging.setup(CONF, 'networking-generic-switch-broker')
+    socket_path = CONF.ngs.broker_socket
+    if not socket_path:
+        LOG.error("[ngs] broker_socket must be set to run the broker")
+        return 1
+    # The switches of the broker must connect directly rather than through
+    # the broker.
+    CONF.set_override('broker_socket', None, group='ngs')
+    switches = devices.get_devices()
+    server = Broker(switches).make_server(socket_path)
+    LOG.info("Broker for %(count)d switches listening on %(path)s",
+             {'count': len(switches), 'path': socket_path})
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+    return 0
@@ -0,0 +1,150 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Circuit breaker for connections to a switch.
+
+Connecting to an unreachable switch blocks until the connection times out,
+possibly after several retries. After a number of consecutive connection
+failures the circuit breaker opens, and connection attempts fail at once
+until a cool-down period has passed. A single attempt is then let through
+to probe the switch: the circuit closes if it succeeds, and opens again if
+it fails.
+"""
+
+import threading
+import time
+
+from oslo_log import log as logging
+
+from networking_generic_switch import exceptions as exc
+from networking_generic_switch import metrics
+
+LOG = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Values of the circuit_breaker_state gauge.
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker(object):
+    """Circuit breaker for the connections to one switch.
+
+    :param switch_name: name of the switch, used for logging and metrics
+    :param failure_threshold: number of consecutive connection failures
+        which open the circuit
+    :param reset_timeout: time in seconds for which the circuit stays open
+        before a connection attempt is let through
+    """
+
+    def __init__(self, switch_name, failure_threshold, reset_timeout):
+        self.switch_name = switch_name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.last_error = None
+        self._state = CLOSED
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        metrics.set_gauge('circuit_breaker_state', switch_name,
+                          STATE_VALUES[CLOSED])
+
+    @property
+    def state(self):
+        """The current state: CLOSED, OPEN or HALF_OPEN."""
+        with self._lock:
+            if (self._state == OPEN and not self._probing
+                    and self._cooled_down()):
+                return HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """Check that a connection attempt may be made.
+
+        :raises: GenericSwitchCircuitOpen if the circuit is open, or if it
+            is half-open and another attempt is already probing the switch.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if self._probing or not self._cooled_down():
+                retry_after = max(
+                    0, self._opened_at + self.reset_timeout - time.monotonic())
+                raise exc.GenericSwitchCircuitOpen(
+                    device=self.switch_name, failures=self.failures,
+                    retry_after=int(retry_after), error=self.last_error)
+            LOG.info("Probing switch %s after %d consecutive connection "
+                     "failures", self.switch_name, self.failures)
+            self._probing = True
+            self._set_state(HALF_OPEN)
+
+    def record_success(self):
+        """Record a successful connection attempt."""
+        with self._lock:
+            if self._state != CLOSED:
+                LOG.info("Connection to switch %s restored, closing circuit",
+                         self.switch_name)
+            self.failures = 0
+            self.last_error = None
+            self._probing = False
+            self._set_state(CLOSED)
+
+    def record_failure(self, error):
+        """Record a failed connection attempt.
+
+        :param error: the exception raised by the attempt
+        """
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if self._probing or self.failures >= self.failure_threshold:
+                if self._state == CLOSED:
+                    LOG.warning("Opening circuit for switch %(switch)s after "
+                                "%(failures)d consecutive connection "
+                                "failures for %(timeout)s seconds: %(error)s",
+                                {'switch': self.switch_name,
+                                 'failures': self.failures,
+                                 'timeout': self.reset_timeout,
+                                 'error': error})
+                self._probing = False
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def call(self, func, *args, **kwargs):
+        """Call a function which connects to the switch.
+
+        :returns: the return value of func
+        :raises: GenericSwitchCircuitOpen if the circuit is open
+        """
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    def _cooled_down(self):
+        return time.monotonic() >= self._opened_at + self.reset_timeout
+
+    def _set_state(self, state):
+        if state == self._state:
+            return
+        self._state = state
+        metrics.set_gauge('circuit_breaker_state', self.switch_name,
+                          STATE_VALUES[state])
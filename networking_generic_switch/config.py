@@ -13,6 +13,7 @@
 #    under the License.
 
 import glob
+import hashlib
 import os
 
 from oslo_config import cfg
@@ -32,12 +33,130 @@ coordination_opts = [
                default=60,
                help='Timeout in seconds after which an attempt to grab a lock '
                     'is failed. Value of 0 is forever.'),
+    cfg.BoolOpt('fair_locking',
+                default=False,
+                help='Acquire the connection locks of a switch in the order '
+                     'requests arrive in each process, blocking on each '
+                     'lock in turn, rather than retrying at random '
+                     'intervals.'),
+    cfg.StrOpt('batch_backend',
+               default='etcd',
+               choices=[
+                   ('etcd', 'Queue batches in etcd, using the etcd3gw '
+                            'backend_url. Batches from all processes are '
+                            'executed together.'),
+                   ('tooz', 'Queue batches in memory, and use a tooz lock '
+                            'from backend_url to serialise switch '
+                            'configuration between processes.'),
+                   ('memory', 'Queue batches in memory, without any '
+                              'coordination between processes. Only '
+                              'suitable when a single process manages the '
+                              'switches.'),
+               ],
+               help='Backend used to queue requests for devices with '
+                    'ngs_batch_requests enabled.'),
+    cfg.IntOpt('batch_watch_poll_interval',
+               min=1,
+               default=300,
+               help='Interval in seconds at which batch workers of devices '
+                    'with ngs_batch_watch_worker enabled check the queue '
+                    'for work, in case an etcd watch event is lost. Workers '
+                    'are otherwise woken up by watch events.'),
 ]
 
 ngs_opts = [
     cfg.StrOpt('session_log_file',
                default=None,
                help='Netmiko session log file.'),
+    cfg.IntOpt('metrics_log_interval',
+               min=0,
+               default=0,
+               help='Interval in seconds at which per-switch metrics, such '
+                    'as the batching window and batch sizes, are logged. '
+                    'Value of 0 disables logging of metrics.'),
+    cfg.IntOpt('network_fanout_width',
+               min=1,
+               default=1,
+               help='Maximum number of switches on which a network is '
+                    'created or deleted concurrently.'),
+    cfg.IntOpt('physnet_vlans_cache_time',
+               min=0,
+               default=0,
+               help='Time in seconds for which the VLANs in use on each '
+                    'physical network are cached for devices converging '
+                    'trunk VLANs. The cache is updated as networks are '
+                    'created and deleted by this process, but changes made '
+                    'by other processes are only seen when it is refreshed. '
+                    'It is always refreshed before trunk VLANs are '
+                    'converged, so it mainly saves queries across the '
+                    'switches of a network. Value of 0 disables the cache.'),
+    cfg.BoolOpt('lazy_device_loading',
+                default=False,
+                help='Instantiate the driver of each device when the device '
+                     'is first used, rather than when the device inventory '
+                     'is loaded at startup. Errors in the configuration of '
+                     'a device are then only reported when it is first '
+                     'used.'),
+    cfg.IntOpt('device_warmup_width',
+               min=0,
+               default=0,
+               help='Maximum number of devices instantiated concurrently in '
+                    'the background once the device inventory has been '
+                    'loaded, when lazy_device_loading is enabled. Value of '
+                    '0 disables the warm-up, and each device is '
+                    'instantiated when it is first used.'),
+    cfg.IntOpt('inventory_reload_interval',
+               min=0,
+               default=0,
+               help='Interval in seconds at which the [genericswitch:*] '
+                    'sections of the configuration files are checked for '
+                    'changes. Added, changed and removed devices are '
+                    'applied without restarting neutron-server, and the '
+                    'connections of changed and removed devices are closed '
+                    'once operations in progress have finished with them. '
+                    'Value of 0 disables periodic reloading.'),
+    cfg.BoolOpt('inventory_reload_on_sighup',
+                default=False,
+                help='Reload the [genericswitch:*] sections of the '
+                     'configuration files when neutron-server reloads its '
+                     'configuration files on SIGHUP.'),
+    cfg.IntOpt('switch_state_cache_time',
+               min=0,
+               default=0,
+               help='Time in seconds for which the results of queries of '
+                    'the state of a switch, such as whether a VLAN has '
+                    'ports or is mapped to a VNI, are cached. Concurrent '
+                    'identical queries share a single query. The cache is '
+                    'updated as this process changes the switch, but '
+                    'changes made by other processes are only seen when '
+                    'the cached result expires. Value of 0 disables the '
+                    'cache.'),
+    cfg.IntOpt('security_group_fanout_width',
+               min=1,
+               default=1,
+               help='Maximum number of switches on which a security group '
+                    'is updated or deleted concurrently.'),
+    cfg.IntOpt('security_group_ports_cache_time',
+               min=0,
+               default=0,
+               help='Time in seconds after which the index of the switch '
+                    'ports bound to each security group is rebuilt from '
+                    'the database. The index is updated as ports are '
+                    'created, updated and deleted by this process, but '
+                    'changes made by other processes are only seen when it '
+                    'is rebuilt. Value of 0 disables the index, and all '
+                    'baremetal ports are read whenever a security group is '
+                    'bound or unbound.'),
+    cfg.StrOpt('broker_socket',
+               help='Path of the UNIX socket of the SSH broker. When set, '
+                    'commands for Netmiko devices without '
+                    'ngs_batch_requests are executed by the broker, which '
+                    'shares SSH sessions between processes. The broker is '
+                    'started with networking-generic-switch-broker.'),
+    cfg.IntOpt('broker_timeout',
+               min=1,
+               default=300,
+               help='Timeout in seconds for a request to the SSH broker.'),
 ]
 
 CONF.register_opts(coordination_opts, group='ngs_coordination')
@@ -54,26 +173,72 @@ def config_files():
             yield config_file
 
 
-def get_devices():
-    """Parse supplied config files and fetch defined compatible devices."""
+# Device sections parsed from each config file, keyed by file name. Each
+# value is a tuple of the modification time and size of the file, the hash
+# of its content, and the devices defined in the file.
+_PARSED_FILES = {}
 
-    device_tag = 'genericswitch:'
-    devices = {}
 
-    for filename in config_files():
+def _parse_devices(filename):
+    """Return the devices defined in a config file.
+
+    The devices are cached, and the file is only parsed again when its
+    content changes.
+
+    :param filename: the name of the config file.
+    :returns: a dict mapping device names to their configuration, or None
+        if the file cannot be read.
+    """
+    device_tag = 'genericswitch:'
+    try:
+        stat = os.stat(filename)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        cached = _PARSED_FILES.get(filename)
+        if cached is not None and cached[0] == stat_key:
+            return cached[2]
+        with open(filename, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if cached is not None and cached[1] == digest:
+            _PARSED_FILES[filename] = (stat_key, digest, cached[2])
+            return cached[2]
         LOG.debug(f'Searching for genericswitch config in: {filename}')
         sections = {}
         parser = cfg.ConfigParser(filename, sections)
-        try:
-            parser.parse()
-        except IOError:
+        parser.parse()
+    except IOError:
+        _PARSED_FILES.pop(filename, None)
+        return None
+    devices = {}
+    for parsed_item, parsed_value in sections.items():
+        if parsed_item.startswith(device_tag):
+            LOG.debug(f'Found genericswitch config: {parsed_item}')
+            dev_id = parsed_item.partition(device_tag)[2]
+            devices[dev_id] = {k: v[0] for k, v in parsed_value.items()}
+    _PARSED_FILES[filename] = (stat_key, digest, devices)
+    return devices
+
+
+def get_devices():
+    """Parse supplied config files and fetch defined compatible devices.
+
+    Config files are only parsed again when their content has changed since
+    the last call.
+
+    :returns: a dict mapping device names to a new copy of their
+        configuration.
+    """
+    devices = {}
+    filenames = list(config_files())
+
+    for filename in filenames:
+        file_devices = _parse_devices(filename)
+        if not file_devices:
             continue
-        for parsed_item, parsed_value in sections.items():
-            if parsed_item.startswith(device_tag):
-                LOG.debug(f'Found genericswitch config: {parsed_item}')
-                dev_id = parsed_item.partition(device_tag)[2]
-                device_cfg = {k: v[0] for k, v
-                              in parsed_value.items()}
-                devices[dev_id] = device_cfg
+        for dev_id, device_cfg in file_devices.items():
+            devices[dev_id] = dict(device_cfg)
+
+    # Forget files which have been removed from the config directories.
+    for filename in set(_PARSED_FILES) - set(filenames):
+        _PARSED_FILES.pop(filename, None)
 
     return devices
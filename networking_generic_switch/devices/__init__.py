@@ -13,6 +13,8 @@
 #    under the License.
 
 import abc
+import os
+import threading
 
 from neutron_lib.utils.helpers import parse_mappings
 from oslo_concurrency import lockutils
@@ -20,8 +22,11 @@ from oslo_log import log as logging
 from oslo_utils import strutils
 import stevedore
 
+from networking_generic_switch import circuit_breaker
 from networking_generic_switch import config as gsw_conf
+from networking_generic_switch.devices import utils as device_utils
 from networking_generic_switch import exceptions as gsw_exc
+from networking_generic_switch import utils as ngs_utils
 
 GENERIC_SWITCH_NAMESPACE = 'generic_switch.devices'
 LOG = logging.getLogger(__name__)
@@ -41,6 +46,14 @@ NGS_INTERNAL_OPTS = [
     {'name': 'ngs_ssh_connect_interval', 'default': 10},
     {'name': 'ngs_ssh_reuse_connection', 'default': False},
     {'name': 'ngs_max_connections', 'default': 1},
+    # Interval in seconds at which idle pooled SSH connections are checked
+    # in the background. 0 disables background pool maintenance.
+    {'name': 'ngs_ssh_keepalive_interval', 'default': 0},
+    # Minimum and maximum number of idle pooled SSH connections kept by
+    # background pool maintenance. The maximum defaults to
+    # ngs_max_connections.
+    {'name': 'ngs_ssh_pool_min_idle', 'default': 0},
+    {'name': 'ngs_ssh_pool_max_idle'},
     {'name': 'ngs_switchport_mode', 'default': 'access'},
     # If True, disable switch ports that are not in use.
     {'name': 'ngs_disable_inactive_ports', 'default': False},
@@ -51,8 +64,39 @@ NGS_INTERNAL_OPTS = [
     {'name': 'ngs_manage_vlans', 'default': True},
     # If False, ngs will skip saving configuration on devices
     {'name': 'ngs_save_configuration', 'default': True},
+    # Maximum time in seconds to defer saving the configuration after a
+    # change, coalescing the saves of changes made in the meantime. 0 saves
+    # after every change.
+    {'name': 'ngs_save_configuration_delay', 'default': 0},
+    # Number of deferred changes which trigger a save without waiting for
+    # ngs_save_configuration_delay. 0 means no limit.
+    {'name': 'ngs_save_configuration_max_changes', 'default': 0},
+    # Number of consecutive connection failures after which connections to
+    # the switch fail at once for ngs_circuit_breaker_reset_timeout
+    # seconds. 0 disables the circuit breaker.
+    {'name': 'ngs_circuit_breaker_threshold', 'default': 0},
+    {'name': 'ngs_circuit_breaker_reset_timeout', 'default': 60},
     # When true try to batch up in flight switch requests
     {'name': 'ngs_batch_requests', 'default': False},
+    # When true, send all pending batches in a single configuration session
+    {'name': 'ngs_batch_coalesce', 'default': False},
+    # Maximum number of commands sent in one coalesced configuration session
+    {'name': 'ngs_batch_coalesce_max_commands', 'default': 500},
+    # When true, drop batched requests whose effect is undone by later ones
+    {'name': 'ngs_batch_compact', 'default': False},
+    # When true, use a long-lived batch worker woken up by etcd watches
+    # rather than polling for the batch worker lock
+    {'name': 'ngs_batch_watch_worker', 'default': False},
+    # When true, share one etcd watch for batch results per switch
+    {'name': 'ngs_batch_shared_result_watch', 'default': False},
+    # When true, share etcd leases between batch keys rather than creating
+    # a lease per key
+    {'name': 'ngs_batch_shared_lease', 'default': False},
+    # Minimum and maximum time in seconds to wait for other requests to join
+    # a batch. The window adapts to the load when the maximum is greater
+    # than the minimum.
+    {'name': 'ngs_batch_window_min', 'default': 0.001},
+    {'name': 'ngs_batch_window_max', 'default': 0.001},
     # The following three are used in the Fake device driver.
     {'name': 'ngs_fake_sleep_min_s'},
     {'name': 'ngs_fake_sleep_max_s'},
@@ -81,21 +125,172 @@ NGS_INTERNAL_OPTS = [
     {'name': 'ngs_netconf_confirmed_commit', 'default': True},
     # Rollback timeout (seconds) for the tentative confirmed commit.
     {'name': 'ngs_netconf_confirmed_commit_timeout', 'default': 5},
+    # If True, keep NETCONF sessions open for reuse by later operations.
+    {'name': 'ngs_netconf_reuse_session', 'default': False},
+    # Maximum number of idle NETCONF sessions kept for reuse. Defaults to
+    # ngs_max_connections.
+    {'name': 'ngs_netconf_pool_size'},
 ]
 
 EM_SEMAPHORE = 'ngs_device_manager'
 DEVICES = {}
+REGISTRY = device_utils.DeviceRegistry({})
+# Configuration from which each device in DEVICES was created.
+DEVICE_CONFIGS = {}
+# Functions called with the new DeviceRegistry when devices are reloaded.
+_RELOAD_CALLBACKS = []
 
 
 @lockutils.synchronized(EM_SEMAPHORE)
 def get_devices():
-    global DEVICES
+    """Load configured devices.
+
+    :returns: a DeviceRegistry of all devices. The registry is immutable, and
+        is replaced by a new one when devices are added.
+    """
+    global REGISTRY
     gsw_devices = gsw_conf.get_devices()
+    new_devices = []
     for device_name, device_cfg in gsw_devices.items():
         if device_name in DEVICES:
             continue
-        DEVICES[device_name] = device_manager(device_cfg, device_name)
-    return DEVICES
+        DEVICES[device_name] = _load_device(device_cfg, device_name,
+                                            new_devices)
+    if REGISTRY._switches != DEVICES:
+        REGISTRY = device_utils.DeviceRegistry(DEVICES)
+    _start_warm_up(new_devices)
+    return REGISTRY
+
+
+def reload_devices():
+    """Reload configured devices, applying changes to their configuration.
+
+    Devices which have been added to the configuration are loaded, and
+    devices whose configuration has changed are replaced by new ones. The
+    registry returned by get_devices() is replaced atomically, and the
+    functions registered with register_reload_callback() are called with the
+    new registry. Replaced and removed devices are then closed. If a device
+    fails to load, the current device is kept.
+
+    :returns: a DeviceRegistry of all devices.
+    """
+    registry, changed, old_devices = _reload_devices()
+    if changed:
+        for callback in list(_RELOAD_CALLBACKS):
+            try:
+                callback(registry)
+            except Exception:
+                LOG.exception("Failed to apply reloaded devices")
+        for device in old_devices:
+            try:
+                device.close()
+            except Exception:
+                LOG.exception("Failed to close device %s",
+                              device.device_name)
+    return registry
+
+
+@lockutils.synchronized(EM_SEMAPHORE)
+def _reload_devices():
+    global REGISTRY
+    gsw_devices = gsw_conf.get_devices()
+    new_devices = []
+    old_devices = []
+    changed = False
+    for device_name in list(DEVICES):
+        if device_name not in gsw_devices:
+            LOG.info("Removing device %s", device_name)
+            old_devices.append(DEVICES.pop(device_name))
+            DEVICE_CONFIGS.pop(device_name, None)
+    for device_name, device_cfg in gsw_devices.items():
+        if (device_name in DEVICES
+                and DEVICE_CONFIGS.get(device_name) == device_cfg):
+            continue
+        try:
+            # A changed device is instantiated at once even if loading is
+            # lazy, so that an invalid configuration does not replace a
+            # working device.
+            device = _load_device(device_cfg, device_name, new_devices,
+                                  lazy=device_name not in DEVICES)
+        except Exception:
+            LOG.exception("Failed to load device %s, keeping its previous "
+                          "configuration", device_name)
+            continue
+        if device_name in DEVICES:
+            LOG.info("Replacing device %s", device_name)
+            old_devices.append(DEVICES[device_name])
+        else:
+            LOG.info("Adding device %s", device_name)
+        DEVICES[device_name] = device
+    if REGISTRY._switches != DEVICES:
+        REGISTRY = device_utils.DeviceRegistry(DEVICES)
+        changed = True
+    _start_warm_up(new_devices)
+    return REGISTRY, changed, old_devices
+
+
+def register_reload_callback(callback):
+    """Register a function to call when devices are reloaded.
+
+    :param callback: function called with the new DeviceRegistry.
+    """
+    if callback not in _RELOAD_CALLBACKS:
+        _RELOAD_CALLBACKS.append(callback)
+
+
+def _load_device(device_cfg, device_name, lazy_devices, lazy=True):
+    """Load a device, lazily if configured.
+
+    :param device_cfg: the configuration of the device.
+    :param device_name: the name of the device.
+    :param lazy_devices: a list to which a lazily loaded device is appended.
+    :param lazy: whether the device may be loaded lazily.
+    :returns: the device.
+    """
+    if lazy and gsw_conf.CONF.ngs.lazy_device_loading:
+        device = LazyDevice(device_cfg, device_name)
+        lazy_devices.append(device)
+    else:
+        # The driver removes the NGS options from its configuration.
+        device = device_manager(dict(device_cfg), device_name)
+    DEVICE_CONFIGS[device_name] = dict(device_cfg)
+    return device
+
+
+def _start_warm_up(lazy_devices):
+    width = gsw_conf.CONF.ngs.device_warmup_width
+    if lazy_devices and width:
+        threading.Thread(target=_warm_up, args=(lazy_devices, width),
+                         daemon=True, name="ngs-device-warmup").start()
+
+
+def _reset_after_fork():
+    # Drivers instantiated in the parent, for example by the warm-up, own
+    # threads and connections which do not survive a fork. Instantiate them
+    # again in the child, warming them up again if configured.
+    lazy_devices = [device for device in DEVICES.values()
+                    if isinstance(device, LazyDevice)]
+    for device in lazy_devices:
+        device._reset_after_fork()
+    _start_warm_up(lazy_devices)
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _warm_up(lazy_devices, width):
+    """Instantiate the drivers of lazily loaded devices.
+
+    :param lazy_devices: a list of LazyDevice objects.
+    :param width: maximum number of devices instantiated concurrently.
+    """
+    calls = [(device.device_name, device.get_device)
+             for device in lazy_devices]
+    for device_name, error in ngs_utils.call_on_switches(calls, width):
+        if error is not None:
+            LOG.error("Failed to instantiate device %(device)s: %(err)s",
+                      {'device': device_name, 'err': error})
+    LOG.debug("Instantiated %d devices", len(calls))
 
 
 def device_manager(device_cfg, device_name=""):
@@ -149,6 +344,21 @@ class GenericSwitchDevice(abc.ABC):
 
         self._validate_network_name_format()
 
+        self.circuit_breaker = None
+        threshold = int(self.ngs_config['ngs_circuit_breaker_threshold'])
+        if threshold > 0:
+            self.circuit_breaker = circuit_breaker.CircuitBreaker(
+                self.device_name, threshold, float(
+                    self.ngs_config['ngs_circuit_breaker_reset_timeout']))
+
+    def close(self):
+        """Release the resources held by the device.
+
+        Called when the device is removed from the inventory or replaced by a
+        reloaded one. Operations in progress may still use the device, and
+        must be allowed to complete.
+        """
+
     @property
     def support_trunk_on_ports(self):
         return False
@@ -238,6 +448,31 @@ class GenericSwitchDevice(abc.ABC):
         return strutils.bool_from_string(
             self.ngs_config['ngs_batch_requests'])
 
+    def _batch_coalesce(self):
+        """Return whether to coalesce batched requests into one session."""
+        return strutils.bool_from_string(
+            self.ngs_config['ngs_batch_coalesce'])
+
+    def _batch_compact(self):
+        """Return whether to compact batched requests."""
+        return strutils.bool_from_string(
+            self.ngs_config['ngs_batch_compact'])
+
+    def _batch_watch_worker(self):
+        """Return whether to use an event driven batch worker."""
+        return strutils.bool_from_string(
+            self.ngs_config['ngs_batch_watch_worker'])
+
+    def _batch_shared_result_watch(self):
+        """Return whether to share one etcd watch for batch results."""
+        return strutils.bool_from_string(
+            self.ngs_config['ngs_batch_shared_result_watch'])
+
+    def _batch_shared_lease(self):
+        """Return whether to share etcd leases between batch keys."""
+        return strutils.bool_from_string(
+            self.ngs_config['ngs_batch_shared_lease'])
+
     def _reuse_connection(self):
         """Return whether to reuse ssh connections."""
         return strutils.bool_from_string(
@@ -399,6 +634,23 @@ class GenericSwitchDevice(abc.ABC):
         """
         pass
 
+    def get_state_snapshot(self):
+        """Return a snapshot of the VLANs, ports and VNIs of the switch.
+
+        Used to answer vlan_has_ports() and vlan_has_vni() for many VLANs
+        with a single query of the switch, when [ngs]
+        switch_state_cache_time is set.
+
+        This is a read-only operation and should not acquire locks.
+
+        Implementations should query the switch directly, and raise an
+        exception on error.
+
+        :returns: A devices.utils.SwitchStateSnapshot, or None if the device
+            does not support snapshots.
+        """
+        return None
+
     @abc.abstractmethod
     def plug_port_to_network(self, port_id, segmentation_id,
                              trunk_details=None, default_vlan=None):
@@ -548,3 +800,88 @@ class GenericSwitchDevice(abc.ABC):
                          bound to this group
         """
         pass
+
+
+class LazyDevice(object):
+    """Proxy for a device whose driver is instantiated on first use.
+
+    The NGS options of the device are available without instantiating the
+    driver, so that a DeviceRegistry can be built from lazy devices. Any
+    other attribute is looked up on the driver, which is instantiated the
+    first time such an attribute is accessed. If instantiating the driver
+    fails, the error is raised to the caller, and the next access tries
+    again. A process forked after the driver was instantiated instantiates
+    its own.
+
+    :param device_cfg: the configuration of the device.
+    :param device_name: the name of the device.
+    """
+
+    def __init__(self, device_cfg, device_name=""):
+        self.device_name = device_name
+        self._device_cfg = dict(device_cfg)
+        self._device = None
+        self._lock = threading.Lock()
+        self._ngs_config = {}
+        for opt in NGS_INTERNAL_OPTS:
+            opt_name = opt['name']
+            if opt_name in device_cfg:
+                self._ngs_config[opt_name] = device_cfg[opt_name]
+            elif 'default' in opt:
+                self._ngs_config[opt_name] = opt['default']
+
+    @property
+    def ngs_config(self):
+        if self._device is not None:
+            return self._device.ngs_config
+        return self._ngs_config
+
+    get_physical_networks = GenericSwitchDevice.get_physical_networks
+
+    @property
+    def loaded(self):
+        """Whether the driver of the device has been instantiated."""
+        return self._device is not None
+
+    def get_device(self):
+        """Return the driver of the device, instantiating it if necessary.
+
+        :returns: a GenericSwitchDevice.
+        """
+        device = self._device
+        if device is not None:
+            return device
+        # The driver is not instantiated while holding the lock, so that a
+        # process forked meanwhile does not inherit a held lock.
+        LOG.debug("Instantiating device %s", self.device_name)
+        device = device_manager(dict(self._device_cfg), self.device_name)
+        with self._lock:
+            current = self._device
+            if current is None:
+                self._device = device
+                return device
+        # Another thread instantiated the driver first.
+        device.close()
+        return current
+
+    def _reset_after_fork(self):
+        # The driver of the parent is dropped rather than closed, as its
+        # connections are shared with the parent.
+        self._lock = threading.Lock()
+        self._device = None
+
+    def close(self):
+        """Close the driver of the device if it has been instantiated."""
+        if self._device is not None:
+            self._device.close()
+
+    def __getattr__(self, name):
+        # Only called for attributes which are not found on the proxy.
+        if name.startswith('__') or name in ('_device', '_lock',
+                                             '_device_cfg', '_ngs_config'):
+            raise AttributeError(name)
+        return getattr(self.get_device(), name)
+
+    def __repr__(self):
+        return '<LazyDevice %s%s>' % (self.device_name,
+                                      '' if self.loaded else ' (not loaded)')
@@ -11,6 +11,7 @@
 #    under the License.
 
 import atexit
+import queue
 from urllib.parse import parse_qs as urlparse_qs
 from urllib.parse import urlparse
 import uuid
@@ -25,14 +26,15 @@ from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import strutils
 import tenacity
-from tooz import coordination
 
+from networking_generic_switch import batching
 from networking_generic_switch import devices
 from networking_generic_switch.devices import utils as device_utils
 from networking_generic_switch import exceptions as exc
 from networking_generic_switch import locking as ngs_lock
 from networking_generic_switch.netconf_models import constants as ncconst
 from networking_generic_switch.netconf_models import utils as ncutils
+from networking_generic_switch import utils as ngs_utils
 
 LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
@@ -98,18 +100,69 @@ class NetconfSwitch(devices.GenericSwitchDevice):
             'timeout': CONF.ngs_coordination.acquire_timeout,
         }
         self.locker = None
-        if CONF.ngs_coordination.backend_url:
-            self.locker = coordination.get_coordinator(
+        self._release_locker = None
+        self.batch_configs = None
+        self._session_pool = None
+        self._closed = False
+        if strutils.bool_from_string(
+                self.ngs_config.get('ngs_netconf_reuse_session', False)):
+            pool_size = int(
+                self.ngs_config.get('ngs_netconf_pool_size')
+                or self.lock_kwargs['locks_pool_size'])
+            self._session_pool = queue.LifoQueue(maxsize=pool_size)
+            atexit.register(self._drain_sessions)
+        if self._batch_requests() and self._setup_batching():
+            pass
+        elif CONF.ngs_coordination.backend_url:
+            self.locker = ngs_lock.get_coordinator(
                 CONF.ngs_coordination.backend_url,
                 ('ngs-' + device_utils.get_hostname()).encode('ascii'))
-            self.locker.start()
-            atexit.register(self.locker.stop)
+            self._release_locker = ngs_utils.release_at_exit(
+                self.locker.release)
         else:
             LOG.warning(
                 "Switch %s: [ngs_coordination] backend_url is not "
                 "configured. The ngs_max_connections is ignored.",
                 self.lock_kwargs['locks_prefix'])
 
+    def _setup_batching(self):
+        """Set up batching of requests.
+
+        :returns: True if requests are batched, False if they are not.
+        """
+        backend = CONF.ngs_coordination.batch_backend
+        if backend not in ('memory', 'tooz'):
+            # Configuration objects cannot be serialised to etcd. Earlier
+            # releases ignored ngs_batch_requests for NETCONF devices, so do
+            # not refuse to start.
+            LOG.warning(
+                "Switch %(switch)s: ngs_batch_requests is ignored, as the "
+                "%(backend)s [ngs_coordination] batch_backend is not "
+                "supported for NETCONF devices. Use the memory or tooz "
+                "backend to batch requests.",
+                {'switch': self.lock_kwargs['locks_prefix'],
+                 'backend': backend})
+            return False
+        if backend == 'tooz' and not CONF.ngs_coordination.backend_url:
+            raise exc.GenericSwitchBatchError(
+                device=self.device_name,
+                error="ngs_batch_requests is true but [ngs_coordination] "
+                      "backend_url is not provided")
+        # NOTE: the batch worker lock serialises configuration of the
+        # switch, so the pool lock is not used.
+        self.batch_configs = batching.NetconfSwitchBatch(
+            self.lock_kwargs['locks_prefix'],
+            CONF.ngs_coordination.backend_url,
+            max_coalesce_commands=int(
+                self.ngs_config['ngs_batch_coalesce_max_commands']),
+            watch_worker=self._batch_watch_worker(),
+            backend=backend,
+            window_min=float(self.ngs_config['ngs_batch_window_min']),
+            window_max=float(self.ngs_config['ngs_batch_window_max']),
+            watch_poll_interval=(
+                CONF.ngs_coordination.batch_watch_poll_interval))
+        return True
+
     def _build_ncclient_args(self):
         """Build keyword arguments for ``ncclient.manager.connect``.
 
@@ -178,6 +231,112 @@ class NetconfSwitch(devices.GenericSwitchDevice):
 
         return capabilities
 
+    def _connect(self):
+        """Open a NETCONF session through the circuit breaker, if enabled.
+
+        :returns: A ``ncclient.manager.Manager`` session.
+        :raises: GenericSwitchCircuitOpen if the circuit breaker is open.
+        """
+        if self.circuit_breaker is not None:
+            return self.circuit_breaker.call(manager.connect,
+                                             **self._ncclient_args)
+        return manager.connect(**self._ncclient_args)
+
+    def _connect_session(self):
+        """Open a NETCONF session to be kept in the session pool.
+
+        :returns: 2-tuple of the ``ncclient.manager.Manager`` session and
+            the processed capabilities of the server.
+        :raises: GenericSwitchNetconfConnectError on SSH or authentication
+            failure.
+        """
+        try:
+            client = self._connect()
+        except (SSHError, AuthenticationError) as e:
+            raise exc.GenericSwitchNetconfConnectError(
+                device=self.device_name, error=e)
+        return client, self.process_capabilities(client.server_capabilities)
+
+    def _close_session(self, client):
+        try:
+            client.close_session()
+        except Exception:
+            LOG.debug('Failed to close NETCONF session to %s',
+                      self.device_name, exc_info=True)
+
+    def _get_pooled_session(self):
+        """Pop a connected session from the session pool, or return None."""
+        while True:
+            try:
+                client, capabilities = self._session_pool.get_nowait()
+            except queue.Empty:
+                return None
+            if client.connected:
+                return client, capabilities
+            self._close_session(client)
+
+    def _call_on_session(self, session, func, *args):
+        client, capabilities = session
+        try:
+            result = func(client, capabilities, *args)
+        except Exception:
+            # The state of the session is unknown, so do not reuse it.
+            self._close_session(client)
+            raise
+        if self._closed:
+            self._close_session(client)
+            return result
+        try:
+            self._session_pool.put_nowait(session)
+        except queue.Full:
+            self._close_session(client)
+        return result
+
+    def _call_with_pooled_session(self, func, *args):
+        """Call a function with a session from the session pool.
+
+        A new session is opened if there is no idle session in the pool.
+        If the device has closed an idle session, the call is retried once
+        with a new session.
+
+        :param func: Function called with the ``ncclient.manager.Manager``
+            session, the processed capabilities of the server, and args.
+        :returns: The return value of func.
+        """
+        session = self._get_pooled_session()
+        if session is not None:
+            try:
+                return self._call_on_session(session, func, *args)
+            except SessionCloseError:
+                LOG.info('NETCONF session to %s was closed, reconnecting',
+                         self.device_name)
+        return self._call_on_session(self._connect_session(), func, *args)
+
+    def _drain_sessions(self):
+        """Close all idle sessions in the session pool."""
+        if self._session_pool is None:
+            return
+        while True:
+            try:
+                client, _capabilities = self._session_pool.get_nowait()
+            except queue.Empty:
+                return
+            self._close_session(client)
+
+    def close(self):
+        """Close idle pooled sessions.
+
+        Sessions in use are closed when they are released rather than
+        returned to the pool. The batch worker is stopped, and the shared
+        coordinator is released.
+        """
+        self._closed = True
+        if self.batch_configs is not None:
+            self.batch_configs.close()
+        self._drain_sessions()
+        if self._release_locker is not None:
+            self._release_locker()
+
     def get_capabilities(self):
         """Connect to the device and return its processed capabilities.
 
@@ -185,10 +344,14 @@ class NetconfSwitch(devices.GenericSwitchDevice):
         :raises: GenericSwitchNetconfConnectError on SSH or authentication
             failure.
         """
+        if self._session_pool is not None:
+            return self._call_with_pooled_session(
+                lambda client, capabilities: capabilities)
+
         # https://github.com/ncclient/ncclient/issues/525
         _ignore_close_issue_525 = False
         try:
-            with manager.connect(**self._ncclient_args) as nc_client:
+            with self._connect() as nc_client:
                 server_capabilities = nc_client.server_capabilities
                 _ignore_close_issue_525 = True
         except SessionCloseError as e:
@@ -212,8 +375,17 @@ class NetconfSwitch(devices.GenericSwitchDevice):
 
         q_filter = ElementTree.tostring(
             query.to_xml_element()).decode('utf-8')
+        if self._session_pool is not None:
+            try:
+                return self._call_with_pooled_session(
+                    lambda client, capabilities: client.get(
+                        filter=('subtree', q_filter)).data_xml)
+            except RPCError:
+                LOG.error('Netconf XML: %s', q_filter)
+                raise
+
         try:
-            with manager.connect(**self._ncclient_args) as client:
+            with self._connect() as client:
                 reply = client.get(filter=('subtree', q_filter))
                 _ignore_close_issue_525 = True
         except SessionCloseError as e:
@@ -336,28 +508,52 @@ class NetconfSwitch(devices.GenericSwitchDevice):
     def send_config_to_device(self, config):
         """Edit configuration on the device.
 
+        If ``ngs_batch_requests`` is enabled, the configuration is merged
+        with that of concurrent requests and committed together.
+
         :param config: Configuration object or list of configuration objects.
             Each must implement ``to_xml_element()``.
         """
+        if not isinstance(config, list):
+            config = [config]
+
+        if self.batch_configs is not None:
+            self.batch_configs.do_batch(self, config)
+            return
+
+        with ngs_lock.PoolLock(self.locker, **self.lock_kwargs):
+            self._edit_config(config)
+
+    def _edit_config(self, config):
+        """Lock the datastore, edit-config and commit in one session.
+
+        :param config: List of configuration objects.
+        """
         # https://github.com/ncclient/ncclient/issues/525
         _ignore_close_issue_525 = False
 
-        if not isinstance(config, list):
-            config = [config]
+        if self._session_pool is not None:
+            self._call_with_pooled_session(self._configure, config)
+            return
 
         try:
-            with ngs_lock.PoolLock(self.locker, **self.lock_kwargs):
-                with manager.connect(**self._ncclient_args) as client:
-                    self.capabilities = self.process_capabilities(
-                        client.server_capabilities)
-                    target = self._get_datastore_target()
-                    if target:
-                        self._lock_and_configure(client, target, config)
-                        _ignore_close_issue_525 = True
+            with self._connect() as client:
+                self.capabilities = self.process_capabilities(
+                    client.server_capabilities)
+                target = self._get_datastore_target()
+                if target:
+                    self._lock_and_configure(client, target, config)
+                    _ignore_close_issue_525 = True
         except SessionCloseError as e:
             if not _ignore_close_issue_525:
                 raise e
 
+    def _configure(self, client, capabilities, config):
+        self.capabilities = capabilities
+        target = self._get_datastore_target()
+        if target:
+            self._lock_and_configure(client, target, config)
+
     @staticmethod
     def _get_lock_session_id(err_info):
         """Parse session-id from a lock-denied error [RFC6241].
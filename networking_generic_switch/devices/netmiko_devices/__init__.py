@@ -16,8 +16,11 @@ import atexit
 import contextlib
 import functools
 import hashlib
+import os
 import queue
+import threading
 import uuid
+import weakref
 
 import netmiko
 from neutron_lib import constants as const
@@ -27,14 +30,16 @@ from oslo_utils import strutils
 from paramiko import PKey as _pkey  # noqa - This is for a monkeypatch
 import paramiko  # noqa - Must load after the patch
 import tenacity
-from tooz import coordination
 
 from networking_generic_switch._i18n import _
 from networking_generic_switch import batching
+from networking_generic_switch import broker as ngs_broker
+from networking_generic_switch import circuit_breaker
 from networking_generic_switch import devices
 from networking_generic_switch.devices import utils as device_utils
 from networking_generic_switch import exceptions as exc
 from networking_generic_switch import locking as ngs_lock
+from networking_generic_switch import save_scheduler
 from networking_generic_switch import utils as ngs_utils
 
 # NOTE(TheJulia) monkey patch paramiko's get_fingerprint function
@@ -45,6 +50,17 @@ _pkey.get_fingerprint = lambda x: hashlib.sha256(x.asbytes()).digest()
 LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
 
+# Switches with a connection pool, to reset in processes forked from this one.
+_POOLED_SWITCHES = weakref.WeakSet()
+
+
+def _reset_pools_after_fork():
+    for switch in list(_POOLED_SWITCHES):
+        switch._reset_pool_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
 
 def check_output(operation):
     """Returns a decorator that checks the output of an operation.
@@ -69,6 +85,8 @@ def check_output(operation):
             except exc.GenericSwitchNetmikoConfigError:
                 # Raised if ERROR_MSG_PATTERNS catches an output error
                 self._drain_cached_connections()
+                # The ACLs on the switch are no longer known.
+                self._forget_security_groups()
                 raise
             return output
 
@@ -77,6 +95,60 @@ def check_output(operation):
     return decorator
 
 
+def batch_operation(describe):
+    """Returns a decorator that describes an operation for batching.
+
+    When requests are batched, the description is sent along with the
+    commands of the operation, and allows the batch worker to drop pairs of
+    operations that undo each other.
+
+    :param describe: function called with the arguments of the decorated
+        method, returning an operation dict (see batching.port_operation).
+    """
+    def decorator(func):
+        """The real decorator."""
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            """Wrapper that records the operation for the current thread."""
+            previous = getattr(self._batch_op_local, 'op', None)
+            self._batch_op_local.op = describe(self, *args, **kwargs)
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self._batch_op_local.op = previous
+
+        return wrapper
+
+    return decorator
+
+
+def _describe_network(action):
+    def describe(self, segmentation_id, network_id, physnet_vlans=None):
+        return batching.network_operation(action, segmentation_id,
+                                          network_id)
+    return describe
+
+
+def _describe_port(action, kind='port'):
+    def describe(self, port, segmentation_id, trunk_details=None,
+                 default_vlan=None):
+        return batching.port_operation(
+            action, port, segmentation_id, trunk_details=trunk_details,
+            default_vlan=default_vlan or self._get_port_default_vlan(),
+            kind=kind)
+    return describe
+
+
+def _describe_trunk(action):
+    def describe(self, binding_profile, port_id, subports,
+                 trunk_details=None):
+        return batching.trunk_operation(
+            action, port_id,
+            [sub_port['segmentation_id'] for sub_port in subports])
+    return describe
+
+
 class NetmikoSwitch(devices.GenericSwitchDevice):
 
     NETMIKO_DEVICE_TYPE = None
@@ -93,6 +165,8 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
 
     SHOW_VLAN_VNI = None
 
+    SHOW_SWITCH_STATE = None
+
     PLUG_PORT_TO_NETWORK = None
 
     DELETE_PORT = None
@@ -137,6 +211,10 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
 
     ADD_SECURITY_GROUP_RULE_EGRESS = None
 
+    REMOVE_SECURITY_GROUP_RULE_INGRESS = None
+
+    REMOVE_SECURITY_GROUP_RULE_EGRESS = None
+
     BIND_SECURITY_GROUP = None
 
     UNBIND_SECURITY_GROUP = None
@@ -147,6 +225,13 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
     Set to False for switches which support only a single port per rule.
     """
 
+    DEFER_SAVE_CONFIGURATION = True
+    """Whether saving the configuration may be deferred on this switch
+
+    Set to False for switches where save_configuration() is required to
+    apply the changes, rather than only to persist them.
+    """
+
     ERROR_MSG_PATTERNS = ()
     """Sequence of error message patterns.
 
@@ -226,10 +311,23 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
             'timeout': CONF.ngs_coordination.acquire_timeout}
 
         self.locker = None
+        self._release_locker = None
         self.batch_cmds = None
+        self.broker = None
+        self.save_scheduler = None
+        self._batch_op_local = threading.local()
         self._connection_pool = None
+        self._closed = False
+        self._pool_maintainer = None
+        self._pool_maintainer_stopped = threading.Event()
+        self._pool_maintainer_lock = threading.Lock()
+        # Security group ID to (revision number, rules) last applied to the
+        # switch, used to update ACLs incrementally.
+        self._applied_security_groups = {}
+        self._applied_security_groups_lock = threading.Lock()
         if self._batch_requests():
-            if not CONF.ngs_coordination.backend_url:
+            if (not CONF.ngs_coordination.backend_url
+                    and CONF.ngs_coordination.batch_backend != 'memory'):
                 error = ("ngs_batch_requests is true but [ngs_coordination] "
                          "backend_url is not provided")
                 LOG.error(
@@ -241,13 +339,30 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
             self.locker = None
             switch_name = self.lock_kwargs['locks_prefix']
             self.batch_cmds = batching.SwitchBatch(
-                switch_name, CONF.ngs_coordination.backend_url)
+                switch_name, CONF.ngs_coordination.backend_url,
+                coalesce=self._batch_coalesce(),
+                max_coalesce_commands=int(
+                    self.ngs_config['ngs_batch_coalesce_max_commands']),
+                compact=self._batch_compact(),
+                watch_worker=self._batch_watch_worker(),
+                shared_result_watch=self._batch_shared_result_watch(),
+                shared_lease=self._batch_shared_lease(),
+                backend=CONF.ngs_coordination.batch_backend,
+                window_min=float(self.ngs_config['ngs_batch_window_min']),
+                window_max=float(self.ngs_config['ngs_batch_window_max']),
+                watch_poll_interval=(
+                    CONF.ngs_coordination.batch_watch_poll_interval))
+        elif CONF.ngs.broker_socket:
+            # Sessions are owned by the broker, which limits them to
+            # ngs_max_connections across all processes.
+            self.broker = ngs_broker.BrokerClient(
+                CONF.ngs.broker_socket, timeout=CONF.ngs.broker_timeout)
         elif CONF.ngs_coordination.backend_url:
-            self.locker = coordination.get_coordinator(
+            self.locker = ngs_lock.get_coordinator(
                 CONF.ngs_coordination.backend_url,
                 ('ngs-' + device_utils.get_hostname()).encode('ascii'))
-            self.locker.start()
-            atexit.register(self.locker.stop)
+            self._release_locker = ngs_utils.release_at_exit(
+                self.locker.release)
         else:
             LOG.warning(
                 "Switch %s: [ngs_coordination] backend_url is not "
@@ -260,6 +375,28 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
             # Connections are returned to pool rather than closed;
             # register cleanup on exit
             atexit.register(self._drain_cached_connections)
+            # Registered after the drain, so that it runs before it.
+            atexit.register(self._stop_pool_maintainer)
+            _POOLED_SWITCHES.add(self)
+
+        save_delay = float(self.ngs_config['ngs_save_configuration_delay'])
+        # With a broker, the configuration is applied and saved by the
+        # broker, which defers saving with its own scheduler.
+        if (save_delay > 0 and self._get_save_configuration()
+                and self.broker is None):
+            if self.DEFER_SAVE_CONFIGURATION:
+                self.save_scheduler = save_scheduler.SaveScheduler(
+                    self.lock_kwargs['locks_prefix'],
+                    self._save_configuration_locked,
+                    save_delay, max_changes=int(self.ngs_config[
+                        'ngs_save_configuration_max_changes']))
+                # Registered after the locker, so that pending saves are
+                # flushed before it is stopped.
+                atexit.register(self.save_scheduler.stop)
+            else:
+                LOG.warning("Switch %s: saving the configuration cannot be "
+                            "deferred on this device type, ignoring "
+                            "ngs_save_configuration_delay", self.device_name)
 
     @property
     def support_trunk_on_ports(self):
@@ -309,6 +446,7 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
                 yield net_connect
             return
 
+        self._ensure_pool_maintainer()
         net_connect = (
             self._get_pooled_connection()
             or self._connect_with_retry()
@@ -324,6 +462,9 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
         else:
             # If the caller completes without an exception assume the
             # connection is still alive and put it back in the pool.
+            if self._closed:
+                net_connect.disconnect()
+                return
             try:
                 self._connection_pool.put_nowait(net_connect)
             except queue.Full:
@@ -349,6 +490,9 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
                 int(self.ngs_config['ngs_ssh_connect_interval'])),
         )
         def _create_connection():
+            if self.circuit_breaker is not None:
+                return self.circuit_breaker.call(netmiko.ConnectHandler,
+                                                 **self.config)
             return netmiko.ConnectHandler(**self.config)
 
         # First, create a connection.
@@ -361,6 +505,8 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
                       'device': device_utils.sanitise_config(self.config),
                       'error': e})
             raise exc.GenericSwitchNetmikoConnectError()
+        except exc.GenericSwitchCircuitOpen:
+            raise
         except Exception as e:
             LOG.error(
                 _("Unexpected exception during SSH connection "
@@ -369,6 +515,136 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
                       'error': e})
             raise exc.GenericSwitchNetmikoConnectError()
 
+    def _ensure_pool_maintainer(self):
+        """Start the pool maintainer on first use of the pool.
+
+        The maintainer is not started when the device is created, so that
+        no sessions are opened in neutron-server before it forks its
+        workers. Each process that uses the pool starts its own.
+        """
+        if self._pool_maintainer is not None or self._closed:
+            return
+        with self._pool_maintainer_lock:
+            if self._pool_maintainer is None and not self._closed:
+                self._start_pool_maintainer(
+                    int(self.ngs_config['ngs_max_connections']))
+
+    def _stop_pool_maintainer(self):
+        self._pool_maintainer_stopped.set()
+
+    def _reset_pool_after_fork(self):
+        """Forget the connection pool and maintainer of the parent.
+
+        Pooled connections share their sockets with the parent and their
+        transport threads did not survive the fork, so they are dropped
+        without being closed. The maintainer is started again on first
+        use.
+        """
+        self._pool_maintainer = None
+        self._pool_maintainer_stopped = threading.Event()
+        self._pool_maintainer_lock = threading.Lock()
+        if self._connection_pool is not None:
+            self._connection_pool = queue.LifoQueue(
+                maxsize=self._connection_pool.maxsize)
+
+    def _start_pool_maintainer(self, max_connections):
+        """Start a thread maintaining the connection pool, if configured."""
+        interval = int(self.ngs_config['ngs_ssh_keepalive_interval'])
+        if interval <= 0 or self.broker is not None:
+            # With a broker, sessions are owned by the broker.
+            return
+        min_idle = min(int(self.ngs_config['ngs_ssh_pool_min_idle']),
+                       max_connections)
+        max_idle = self.ngs_config.get('ngs_ssh_pool_max_idle')
+        max_idle = max_connections if max_idle is None else int(max_idle)
+        max_idle = max(min(max_idle, max_connections), min_idle)
+
+        stopped = self._pool_maintainer_stopped
+
+        def run():
+            while True:
+                try:
+                    self._maintain_connection_pool(min_idle, max_idle)
+                except Exception:
+                    LOG.exception("Failed to maintain SSH connection pool "
+                                  "for device: %s",
+                                  self.lock_kwargs['locks_prefix'])
+                if stopped.wait(interval):
+                    return
+
+        self._pool_maintainer = threading.Thread(
+            target=run, daemon=True,
+            name="ngs-pool-%s" % self.lock_kwargs['locks_prefix'])
+        self._pool_maintainer.start()
+
+    def _maintain_connection_pool(self, min_idle, max_idle):
+        """Check idle pooled connections and keep them within limits.
+
+        Idle connections are checked for liveness, which also serves as a
+        keepalive. Dead connections and those beyond max_idle are closed,
+        then new connections are opened until min_idle are idle.
+
+        :param min_idle: minimum number of idle connections
+        :param max_idle: maximum number of idle connections
+        """
+        idle = []
+        while True:
+            try:
+                idle.append(self._connection_pool.get_nowait())
+            except queue.Empty:
+                break
+
+        # The most recently used connections come first.
+        live = []
+        for net_connect in idle:
+            try:
+                alive = net_connect.is_alive()
+            except Exception:
+                alive = False
+            if alive and len(live) < max_idle:
+                live.append(net_connect)
+            else:
+                self._disconnect_quietly(net_connect)
+        for net_connect in reversed(live):
+            self._return_to_pool(net_connect)
+
+        if (self.circuit_breaker is not None
+                and self.circuit_breaker.state == circuit_breaker.OPEN):
+            # Connections fail at once until the circuit is half-open.
+            return
+        while (not self._pool_maintainer_stopped.is_set()
+               and self._connection_pool.qsize() < min_idle):
+            try:
+                net_connect = self._connect_with_retry()
+            except (exc.GenericSwitchNetmikoConnectError,
+                    exc.GenericSwitchCircuitOpen):
+                # Already logged, try again on the next cycle.
+                return
+            if not self._return_to_pool(net_connect):
+                return
+
+    def _return_to_pool(self, net_connect):
+        """Put a connection into the pool, or close it if the pool is full.
+
+        :returns: whether the connection was added to the pool
+        """
+        if self._closed:
+            self._disconnect_quietly(net_connect)
+            return False
+        try:
+            self._connection_pool.put_nowait(net_connect)
+        except queue.Full:
+            self._disconnect_quietly(net_connect)
+            return False
+        return True
+
+    def _disconnect_quietly(self, net_connect):
+        try:
+            net_connect.disconnect()
+        except Exception:
+            LOG.debug("Failed to close cached SSH connection",
+                      exc_info=True)
+
     def _drain_cached_connections(self):
         if not self._connection_pool:
             return
@@ -385,6 +661,23 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
                     exc_info=True,
                 )
 
+    def close(self):
+        """Close idle pooled connections and flush pending saves.
+
+        Connections in use are closed when they are released rather than
+        returned to the pool. The batch worker is stopped, and the shared
+        coordinator and etcd client are released.
+        """
+        self._closed = True
+        self._pool_maintainer_stopped.set()
+        if self.save_scheduler is not None:
+            self.save_scheduler.stop()
+        if self.batch_cmds is not None:
+            self.batch_cmds.close()
+        self._drain_cached_connections()
+        if self._release_locker is not None:
+            self._release_locker()
+
     def send_commands_to_device(self, cmd_set):
         if not cmd_set:
             LOG.debug("Nothing to execute")
@@ -392,8 +685,19 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
 
         # If configured, batch up requests to the switch
         if self.batch_cmds is not None:
-            return self.batch_cmds.do_batch(self, cmd_set)
+            return self.batch_cmds.do_batch(
+                self, cmd_set, op=getattr(self._batch_op_local, 'op', None))
+
+        if self.broker is not None:
+            return self.broker.send_commands(self.device_name, cmd_set)
 
+        return self._execute_commands(cmd_set)
+
+    def _execute_commands(self, cmd_set):
+        """Execute commands on the device over SSH.
+
+        Used directly by the SSH broker.
+        """
         try:
             return self._send_commands_to_device(cmd_set)
         except Exception as error:
@@ -407,12 +711,35 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
                 return self._send_commands_to_device(cmd_set)
             raise
 
+    def _send_show_commands(self, cmds):
+        """Run commands querying the device.
+
+        :param cmds: a list of commands
+        :returns: list of the outputs of each command
+        """
+        if self.broker is not None:
+            return self.broker.send_show_commands(self.device_name, cmds)
+        return self._execute_show_commands(cmds)
+
+    def _send_show_command(self, cmd):
+        """Run a command querying the device and return its output."""
+        return self._send_show_commands([cmd])[0]
+
+    def _execute_show_commands(self, cmds):
+        """Run commands querying the device over SSH, in a single session.
+
+        Used directly by the SSH broker.
+        """
+        with self._get_connection() as net_connect:
+            return [net_connect.send_command(cmd) for cmd in cmds]
+
     def _send_commands_to_device(self, cmd_set):
         try:
             with ngs_lock.PoolLock(self.locker, **self.lock_kwargs):
                 with self._get_connection() as net_connect:
                     output = self.send_config_set(net_connect, cmd_set)
-                    if self._get_save_configuration():
+                    if (self._get_save_configuration()
+                            and self.save_scheduler is None):
                         # Save configuration only if enabled in settings
                         # and when configuration is applied successfully.
                         self.save_configuration(net_connect)
@@ -428,10 +755,25 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
                       'error': e})
             raise exc.GenericSwitchNetmikoConnectError()
 
+        if self.save_scheduler is not None:
+            self.save_scheduler.record_change()
         LOG.debug(output)
         return output
 
+    def _save_configuration_locked(self):
+        """Save the configuration while holding the switch lock.
+
+        Used by the save scheduler to save deferred changes.
+        """
+        if self.batch_cmds is not None:
+            self.batch_cmds.save_configuration(self)
+            return
+        with ngs_lock.PoolLock(self.locker, **self.lock_kwargs):
+            with self._get_connection() as net_connect:
+                self.save_configuration(net_connect)
+
     @check_output('add network')
+    @batch_operation(_describe_network('add'))
     def add_network(self, segmentation_id, network_id, physnet_vlans=None):
         if physnet_vlans is not None:
             raise exc.GenericSwitchException(
@@ -458,6 +800,7 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
         return self.send_commands_to_device(cmds)
 
     @check_output('delete network')
+    @batch_operation(_describe_network('delete'))
     def del_network(self, segmentation_id, network_id, physnet_vlans=None):
         if physnet_vlans is not None:
             raise exc.GenericSwitchException(
@@ -537,9 +880,8 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
             segmentation_id=segmentation_id)
 
         try:
-            with self._get_connection() as net_connect:
-                output = net_connect.send_command(cmd[0])
-                return self._parse_vlan_ports(output, segmentation_id)
+            output = self._send_show_command(cmd[0])
+            return self._parse_vlan_ports(output, segmentation_id)
         except Exception as e:
             LOG.error("Failed to check VLAN %s ports on %s: %s",
                       segmentation_id, self.device_name, e)
@@ -581,9 +923,8 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
             vxlan_interface=getattr(self, 'vxlan_interface', 'Vxlan1'))
 
         try:
-            with self._get_connection() as net_connect:
-                output = net_connect.send_command(cmd[0])
-                return self._parse_vlan_vni(output, segmentation_id, vni)
+            output = self._send_show_command(cmd[0])
+            return self._parse_vlan_vni(output, segmentation_id, vni)
         except Exception as e:
             LOG.error("Failed to check VLAN %s VNI %s on %s: %s",
                       segmentation_id, vni, self.device_name, e)
@@ -604,7 +945,39 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
         # Default implementation: return False (assume not configured)
         return False
 
+    def get_state_snapshot(self):
+        """Return a snapshot of the VLANs, ports and VNIs of the switch.
+
+        Runs the SHOW_SWITCH_STATE commands in a single session, and parses
+        their output with _parse_state_snapshot().
+
+        :returns: A devices.utils.SwitchStateSnapshot, or None if
+            SHOW_SWITCH_STATE is not implemented.
+        """
+        if not self.SHOW_SWITCH_STATE:
+            return None
+
+        cmds = self._format_commands(self.SHOW_SWITCH_STATE,
+                                     **self._state_snapshot_params())
+        outputs = self._send_show_commands(cmds)
+        return self._parse_state_snapshot(outputs)
+
+    def _state_snapshot_params(self):
+        """Return the parameters of the SHOW_SWITCH_STATE commands."""
+        return {}
+
+    def _parse_state_snapshot(self, outputs):
+        """Parse the output of the SHOW_SWITCH_STATE commands.
+
+        Subclasses which define SHOW_SWITCH_STATE must override this.
+
+        :param outputs: list of the outputs of each command
+        :returns: A devices.utils.SwitchStateSnapshot
+        """
+        raise NotImplementedError()
+
     @check_output('plug port')
+    @batch_operation(_describe_port('plug'))
     def plug_port_to_network(self, port, segmentation_id, trunk_details=None,
                              default_vlan=None):
         cmds = []
@@ -634,6 +1007,7 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
         return self.send_commands_to_device(cmds)
 
     @check_output('unplug port')
+    @batch_operation(_describe_port('unplug'))
     def delete_port(self, port, segmentation_id, trunk_details=None,
                     default_vlan=None):
         cmds = self._format_commands(self.DELETE_PORT,
@@ -669,6 +1043,7 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
         return self.send_commands_to_device(cmds)
 
     @check_output('plug bond')
+    @batch_operation(_describe_port('plug', kind='bond'))
     def plug_bond_to_network(self, bond, segmentation_id, trunk_details=None,
                              default_vlan=None):
         # Fallback to regular plug port if no specialist PLUG_BOND_TO_NETWORK
@@ -703,6 +1078,7 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
         return self.send_commands_to_device(cmds)
 
     @check_output('unplug bond')
+    @batch_operation(_describe_port('unplug', kind='bond'))
     def unplug_bond_from_network(self, bond, segmentation_id,
                                  trunk_details=None, default_vlan=None):
         # Fallback to regular port delete if no specialist
@@ -770,6 +1146,7 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
                             " reboot", self.config['device_type'])
 
     @check_output('add trunk subports')
+    @batch_operation(_describe_trunk('add'))
     def add_subports_on_trunk(self, binding_profile, port_id, subports,
                               trunk_details=None):
         """Allow subports on trunk
@@ -795,6 +1172,7 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
         return self.send_commands_to_device(cmds)
 
     @check_output('delete trunk subports')
+    @batch_operation(_describe_trunk('delete'))
     def del_subports_on_trunk(self, binding_profile, port_id, subports,
                               trunk_details=None):
         """Remove subports from trunk
@@ -858,6 +1236,9 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
 
     def _security_group_rule_commands(self, sg_id, rule):
         rule = self._prepare_security_group_rule(sg_id, rule)
+        return self._add_rule_commands(rule)
+
+    def _add_rule_commands(self, rule):
         if rule['direction'] == 'ingress':
             cmd_template = self.ADD_SECURITY_GROUP_RULE_INGRESS
         else:
@@ -871,6 +1252,31 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
             cmd_template,
             **rule)
 
+    def _remove_rule_commands(self, rule):
+        if rule['direction'] == 'ingress':
+            cmd_template = self.REMOVE_SECURITY_GROUP_RULE_INGRESS
+        else:
+            cmd_template = self.REMOVE_SECURITY_GROUP_RULE_EGRESS
+        if not cmd_template:
+            return None
+        return self._format_commands(
+            cmd_template,
+            **rule)
+
+    def _security_group_rules(self, sg):
+        """Get the rules of a security group to apply to the switch.
+
+        :param sg: Security group object including rules
+        :returns: A dict of prepared rule dicts, keyed by a hashable form of
+                  the rule
+        """
+        rules = {}
+        for rule in sg.rules:
+            if self._validate_rule(rule):
+                rule = self._prepare_security_group_rule(sg.id, rule)
+                rules[tuple(sorted(rule.items()))] = rule
+        return rules
+
     def _validate_rule(self, rule):
         """Validate a security group rule.
 
@@ -900,8 +1306,10 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
             return False
         return True
 
-    def _security_group_commands(self, sg, delete_first=False):
+    def _security_group_commands(self, sg, delete_first=False, rules=None):
         names = self._get_acl_names(sg.id)
+        if rules is None:
+            rules = self._security_group_rules(sg)
         cmds = []
         if delete_first:
             cmds += self._format_commands(self.REMOVE_SECURITY_GROUP,
@@ -909,21 +1317,65 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
 
         cmds += self._format_commands(self.ADD_SECURITY_GROUP,
                                       **names)
-        for rule in sg.rules:
-            if self._validate_rule(rule):
-                cmds += self._security_group_rule_commands(sg.id, rule)
+        for rule in rules.values():
+            cmds += self._add_rule_commands(rule)
 
         cmds += self._format_commands(self.ADD_SECURITY_GROUP_COMPLETE)
         return cmds
 
+    def _security_group_diff_commands(self, sg, applied_rules, rules):
+        """Get the commands to change the rules of an existing ACL.
+
+        :param sg: Security group object including rules
+        :param applied_rules: Rules last applied to the switch, as returned
+                              by _security_group_rules
+        :param rules: Rules to apply, as returned by _security_group_rules
+        :returns: A list of commands, or None if a removed rule cannot be
+                  removed individually on this switch
+        """
+        cmds = []
+        for key, rule in applied_rules.items():
+            if key not in rules:
+                remove_cmds = self._remove_rule_commands(rule)
+                if remove_cmds is None:
+                    return None
+                cmds += remove_cmds
+        for key, rule in rules.items():
+            if key not in applied_rules:
+                cmds += self._add_rule_commands(rule)
+        if not cmds:
+            return []
+
+        names = self._get_acl_names(sg.id)
+        return (self._format_commands(self.ADD_SECURITY_GROUP, **names)
+                + cmds
+                + self._format_commands(self.ADD_SECURITY_GROUP_COMPLETE))
+
+    def _record_security_group(self, sg, rules):
+        with self._applied_security_groups_lock:
+            self._applied_security_groups[sg.id] = (
+                getattr(sg, 'revision_number', None), rules)
+
+    def _pop_security_group(self, sg_id):
+        with self._applied_security_groups_lock:
+            return self._applied_security_groups.pop(sg_id, None)
+
+    def _forget_security_groups(self):
+        with self._applied_security_groups_lock:
+            self._applied_security_groups.clear()
+
     @check_output('add security group')
     def add_security_group(self, sg):
         """Add a security group to a switch
 
         :param sg: Security group object including rules
         """
-        cmds = self._security_group_commands(sg)
-        return self.send_commands_to_device(cmds)
+        self._pop_security_group(sg.id)
+        rules = self._security_group_rules(sg)
+        cmds = self._security_group_commands(sg, rules=rules)
+        output = self.send_commands_to_device(cmds)
+        self._record_security_group(sg, rules)
+        return output
 
     @check_output('update security group')
     def update_security_group(self, sg):
@@ -933,10 +1385,25 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
         needs to update the switch state to accurately reflect
         the provided security group.
 
+        If the rules of the previous revision of the security group were
+        applied by this process, only the rules which have changed are added
+        and removed. Otherwise the ACL is recreated.
+
         :param sg: Security group object including rules
         """
-        cmds = self._security_group_commands(sg, delete_first=True)
-        return self.send_commands_to_device(cmds)
+        applied = self._pop_security_group(sg.id)
+        rules = self._security_group_rules(sg)
+        cmds = None
+        revision = getattr(sg, 'revision_number', None)
+        if (applied is not None and isinstance(applied[0], int)
+                and revision == applied[0] + 1):
+            cmds = self._security_group_diff_commands(sg, applied[1], rules)
+        if cmds is None:
+            cmds = self._security_group_commands(sg, delete_first=True,
+                                                 rules=rules)
+        output = self.send_commands_to_device(cmds)
+        self._record_security_group(sg, rules)
+        return output
 
     @check_output('delete security group')
     def del_security_group(self, sg_id):
@@ -944,6 +1411,7 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
 
         :param sg_id: Security group ID
         """
+        self._pop_security_group(sg_id)
         names = self._get_acl_names(sg_id)
         cmds = self._format_commands(self.REMOVE_SECURITY_GROUP,
                                      **names)
@@ -962,14 +1430,19 @@ class NetmikoSwitch(devices.GenericSwitchDevice):
                          bound to this group
         """
         names = self._get_acl_names(sg.id)
+        self._pop_security_group(sg.id)
         # Recreate the security group based on the passed object
         # before binding to an interface
-        cmds = self._security_group_commands(sg, delete_first=True)
+        rules = self._security_group_rules(sg)
+        cmds = self._security_group_commands(sg, delete_first=True,
+                                             rules=rules)
         # Bind to all ports provided by port_ids
         for port in port_ids:
             cmds += self._format_commands(self.BIND_SECURITY_GROUP,
                                           port=port, **names)
-        return self.send_commands_to_device(cmds)
+        output = self.send_commands_to_device(cmds)
+        self._record_security_group(sg, rules)
+        return output
 
     @check_output('unbind security group')
     def unbind_security_group(self, sg_id, port_id, port_ids):
@@ -442,9 +442,8 @@ class AristaEos(netmiko_devices.NetmikoSwitch):
             self.SHOW_VLAN_PORTS,
             segmentation_id=segmentation_id,
             vxlan_interface=self.vxlan_interface)
-        with self._get_connection() as net_connect:
-            output = net_connect.send_command(cmd[0])
-            return self._parse_vlan_ports(output, segmentation_id)
+        output = self._send_show_command(cmd[0])
+        return self._parse_vlan_ports(output, segmentation_id)
 
     def vlan_has_vni(self, segmentation_id: int, vni: int) -> bool:
         """Check if a VLAN already has a specific VNI mapping configured.
@@ -458,6 +457,5 @@ class AristaEos(netmiko_devices.NetmikoSwitch):
             segmentation_id=segmentation_id,
             vni=vni,
             vxlan_interface=self.vxlan_interface)
-        with self._get_connection() as net_connect:
-            output = net_connect.send_command(cmd[0])
-            return self._parse_vlan_vni(output, segmentation_id, vni)
+        output = self._send_show_command(cmd[0])
+        return self._parse_vlan_vni(output, segmentation_id, vni)
@@ -166,6 +166,10 @@ class CiscoNxOS(netmiko_devices.NetmikoSwitch):
         'permit {protocol} any {remote_ip_prefix} {filter}',
     )
 
+    REMOVE_SECURITY_GROUP_RULE_EGRESS = (
+        'no permit {protocol} any {remote_ip_prefix} {filter}',
+    )
+
     BIND_SECURITY_GROUP = (
         'interface {port}',
         'ip port access-group {security_group} in',
@@ -93,6 +93,9 @@ class Cumulus(netmiko_devices.NetmikoSwitch):
         'net commit',
     )
 
+    # Changes are only applied by the commit in save_configuration().
+    DEFER_SAVE_CONFIGURATION = False
+
     ERROR_MSG_PATTERNS = (
         # Its tempting to add this error message, but as only one
         # bridge-access is allowed, we ignore that error for now:
@@ -568,9 +571,8 @@ class CumulusNVUE(netmiko_devices.NetmikoSwitch):
         cmd = self._format_commands(
             self.SHOW_VLAN_PORTS,
             segmentation_id=segmentation_id)
-        with self._get_connection() as net_connect:
-            output = net_connect.send_command(cmd[0])
-            return self._parse_vlan_ports(output, segmentation_id)
+        output = self._send_show_command(cmd[0])
+        return self._parse_vlan_ports(output, segmentation_id)
 
     def vlan_has_vni(self, segmentation_id: int, vni: int) -> bool:
         """Check if a VLAN already has a specific VNI mapping configured.
@@ -583,9 +585,8 @@ class CumulusNVUE(netmiko_devices.NetmikoSwitch):
             self.SHOW_VLAN_VNI,
             segmentation_id=segmentation_id,
             vni=vni)
-        with self._get_connection() as net_connect:
-            output = net_connect.send_command(cmd[0])
-            return self._parse_vlan_vni(output, segmentation_id, vni)
+        output = self._send_show_command(cmd[0])
+        return self._parse_vlan_vni(output, segmentation_id, vni)
 
     def send_config_set(self, net_connect, cmd_set):
         """Send a set of configuration lines to the device.
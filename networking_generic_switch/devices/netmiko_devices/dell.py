@@ -155,6 +155,18 @@ class DellOS10(netmiko_devices.NetmikoSwitch):
         'exit',
     )
 
+    REMOVE_SECURITY_GROUP_RULE_INGRESS = (
+        'ip access-list {security_group_ingress}',
+        'no permit {protocol} {remote_ip_prefix} any {filter}',
+        'exit',
+    )
+
+    REMOVE_SECURITY_GROUP_RULE_EGRESS = (
+        'ip access-list {security_group_egress}',
+        'no permit {protocol} any {remote_ip_prefix} {filter}',
+        'exit',
+    )
+
     BIND_SECURITY_GROUP = (
         'interface {port}',
         'ip access-group {security_group_egress} in',
@@ -84,6 +84,8 @@ class Juniper(netmiko_devices.NetmikoSwitch):
 
     SHOW_VLANS = ('show vlans',)
 
+    SHOW_SWITCH_STATE = SHOW_VLANS
+
     PLUG_PORT_TO_NETWORK = (
         # Delete any existing VLAN associations - only one VLAN may be
         # associated with an access mode port.
@@ -134,6 +136,9 @@ class Juniper(netmiko_devices.NetmikoSwitch):
         'delete vlans {vlan_name} vrf-target',
     )
 
+    # Changes are only applied by the commit in save_configuration().
+    DEFER_SAVE_CONFIGURATION = False
+
     def __init__(self, device_cfg, *args, **kwargs):
         """Initialize Juniper Junos with EVPN configuration support.
 
@@ -282,16 +287,15 @@ class Juniper(netmiko_devices.NetmikoSwitch):
         :returns: VLAN name
         :raises: GenericSwitchNetmikoConfigError if VLAN not found
         """
-        with self._get_connection() as net_connect:
-            output = net_connect.send_command(self.SHOW_VLANS[0])
-            vlan_name = self._parse_vlan_name(output, segmentation_id)
-            if not vlan_name:
-                msg = _("VLAN %(vlan)s not found on device %(device)s") % {
-                    'vlan': segmentation_id,
-                    'device': device_utils.sanitise_config(self.config)}
-                LOG.error(msg)
-                raise exc.GenericSwitchNetmikoConfigError()
-            return vlan_name
+        output = self._send_show_command(self.SHOW_VLANS[0])
+        vlan_name = self._parse_vlan_name(output, segmentation_id)
+        if not vlan_name:
+            msg = _("VLAN %(vlan)s not found on device %(device)s") % {
+                'vlan': segmentation_id,
+                'device': device_utils.sanitise_config(self.config)}
+            LOG.error(msg)
+            raise exc.GenericSwitchNetmikoConfigError()
+        return vlan_name
 
     def _parse_vlan_name(self, output: str, segmentation_id: int):
         """Parse 'show vlans' output to find VLAN name by vlan-id.
@@ -338,31 +342,69 @@ class Juniper(netmiko_devices.NetmikoSwitch):
             vni, self.mcast_group_map, self.mcast_group_base,
             self.device_name)
 
-    def _parse_vlan_ports(self, output: str, segmentation_id: int) -> bool:
-        """Parse 'show vlans' output for ports.
+    def _parse_vlans(self, output: str):
+        """Parse 'show vlans' output into the ports and VNIs of each VLAN.
+
+        Used both to answer questions about a single VLAN and to build a
+        snapshot of all VLANs, so that they always agree.
 
         :param output: Command output from switch
-        :param segmentation_id: VLAN identifier being checked
-        :returns: True if VLAN has ports, False otherwise
+        :returns: A tuple of dicts mapping VLAN IDs to sets of port names
+            and to sets of VNIs.
         """
         # Junos output format:
         # Routing instance        VLAN name           Tag     Interfaces
+        # default-switch          default             1
         # default-switch          vlan100             100     xe-0/0/1.0*
-        lines = output.strip().split('\n')
-        for line in lines:
+        #                                                     xe-0/0/2.0
+        #   VNI: 5000
+        # default-switch          vlan200             200
+        vlan_ports = {}
+        vlan_vnis = {}
+        vlan_id = None
+        for line in output.strip().split('\n'):
             if not line.strip() or 'Routing instance' in line or \
                'VLAN name' in line:
                 continue
+            if 'VNI:' in line:
+                # VNI of the previous VLAN.
+                if vlan_id is not None:
+                    try:
+                        vlan_vnis[vlan_id].add(
+                            int(line.split('VNI:')[1].strip()))
+                    except (ValueError, IndexError):
+                        pass
+                continue
+            if line.startswith(' '):
+                # Further interfaces of the previous VLAN.
+                if vlan_id is not None:
+                    vlan_ports[vlan_id].update(
+                        self._parse_interface_name(interface)
+                        for interface in line.split())
+                continue
             parts = line.split()
+            vlan_id = None
+            # Need at least routing-instance, vlan-name, and tag
             if len(parts) >= 3:
                 try:
                     vlan_id = int(parts[2])
-                    if vlan_id == segmentation_id:
-                        # If there are 4+ parts, interfaces are listed
-                        return len(parts) >= 4
-                except (ValueError, IndexError):
+                except ValueError:
                     continue
-        return False
+                vlan_ports.setdefault(vlan_id, set()).update(
+                    self._parse_interface_name(interface)
+                    for interface in parts[3:])
+                vlan_vnis.setdefault(vlan_id, set())
+        return vlan_ports, vlan_vnis
+
+    def _parse_vlan_ports(self, output: str, segmentation_id: int) -> bool:
+        """Parse 'show vlans' output for ports.
+
+        :param output: Command output from switch
+        :param segmentation_id: VLAN identifier being checked
+        :returns: True if VLAN has ports, False otherwise
+        """
+        vlan_ports, _vlan_vnis = self._parse_vlans(output)
+        return bool(vlan_ports.get(segmentation_id))
 
     def _parse_vlan_vni(self, output: str, segmentation_id: int,
                         vni: int) -> bool:
@@ -373,38 +415,28 @@ class Juniper(netmiko_devices.NetmikoSwitch):
         :param vni: VNI to check for
         :returns: True if VLAN has this VNI, False otherwise
         """
-        # Junos extended output format for VXLAN-enabled VLANs:
-        # Routing instance        VLAN name           Tag     Interfaces
-        # default-switch          vlan100             100
-        #   VNI: 5000
-        lines = output.strip().split('\n')
-        found_vlan = False
-        for line in lines:
-            # Look for the VLAN line
-            if not found_vlan:
-                if not line.strip() or 'Routing instance' in line or \
-                   'VLAN name' in line:
-                    continue
-                parts = line.split()
-                if len(parts) >= 3:
-                    try:
-                        vlan_id = int(parts[2])
-                        if vlan_id == segmentation_id:
-                            found_vlan = True
-                    except (ValueError, IndexError):
-                        continue
-            else:
-                # Found the VLAN, now look for VNI on following lines
-                if 'VNI:' in line:
-                    try:
-                        vni_value = int(line.split('VNI:')[1].strip())
-                        return vni_value == vni
-                    except (ValueError, IndexError):
-                        return False
-                # If we hit another VLAN or non-indented line, stop looking
-                if line and not line.startswith(' '):
-                    return False
-        return False
+        _vlan_ports, vlan_vnis = self._parse_vlans(output)
+        return vni in vlan_vnis.get(segmentation_id, ())
+
+    def _parse_state_snapshot(self, outputs):
+        """Parse 'show vlans' output into a snapshot of all VLANs.
+
+        :param outputs: list containing the output of 'show vlans'
+        :returns: A devices.utils.SwitchStateSnapshot
+        """
+        return device_utils.SwitchStateSnapshot(*self._parse_vlans(outputs[0]))
+
+    @staticmethod
+    def _parse_interface_name(interface):
+        """Return the port name of an interface listed by 'show vlans'.
+
+        Strips the active marker and the logical unit, which is always 0 for
+        the ports configured by this driver.
+        """
+        interface = interface.rstrip('*')
+        if interface.endswith('.0'):
+            interface = interface[:-2]
+        return interface
 
     @netmiko_devices.check_output('plug vni')
     def plug_switch_to_network(self, vni: int, segmentation_id: int,
@@ -510,9 +542,8 @@ class Juniper(netmiko_devices.NetmikoSwitch):
         :param segmentation_id: VLAN identifier
         :returns: True if VLAN has ports, False otherwise
         """
-        with self._get_connection() as net_connect:
-            output = net_connect.send_command(self.SHOW_VLANS[0])
-            return self._parse_vlan_ports(output, segmentation_id)
+        output = self._send_show_command(self.SHOW_VLANS[0])
+        return self._parse_vlan_ports(output, segmentation_id)
 
     def vlan_has_vni(self, segmentation_id: int, vni: int) -> bool:
         """Check if a VLAN already has a specific VNI mapping configured.
@@ -521,6 +552,5 @@ class Juniper(netmiko_devices.NetmikoSwitch):
         :param vni: VNI to check for
         :returns: True if VLAN has this VNI, False otherwise
         """
-        with self._get_connection() as net_connect:
-            output = net_connect.send_command(self.SHOW_VLANS[0])
-            return self._parse_vlan_vni(output, segmentation_id, vni)
+        output = self._send_show_command(self.SHOW_VLANS[0])
+        return self._parse_vlan_vni(output, segmentation_id, vni)
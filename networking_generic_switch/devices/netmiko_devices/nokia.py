@@ -71,6 +71,12 @@ class NokiaSRL(netmiko_devices.NetmikoSwitch):
             LOG.debug('Nothing to execute')
             return
 
+        if self.broker is not None:
+            return self.broker.send_commands(self.device_name, cmd_set)
+
+        return self._execute_commands(cmd_set)
+
+    def _execute_commands(self, cmd_set):
         try:
             with ngs_lock.PoolLock(self.locker, **self.lock_kwargs):
                 with self._get_connection() as net_connect:
@@ -15,6 +15,7 @@
 import re
 
 from networking_generic_switch.devices import netmiko_devices
+from networking_generic_switch.devices import utils as device_utils
 
 # Internal ngs options will not be passed to driver.
 OVS_INTERNAL_OPTS = [
@@ -120,6 +121,8 @@ class OvsLinux(netmiko_devices.NetmikoSwitch):
         'ovs-vsctl get bridge {bridge_name} external_ids',
     )
 
+    SHOW_SWITCH_STATE = SHOW_PORTS + SHOW_BRIDGE_EXTERNAL_IDS
+
     def __init__(self, device_cfg, *args, **kwargs):
         # Do not expose OVS internal options to device config.
         ovs_cfg = {}
@@ -139,35 +142,61 @@ class OvsLinux(netmiko_devices.NetmikoSwitch):
         """
         return self.ngs_config.get('ngs_ovs_bridge', 'genericswitch')
 
-    def _parse_vlan_ports(self, output: str, segmentation_id: int) -> bool:
-        """Parse 'ovs-vsctl list port' output for ports with VLAN tag.
+    def _parse_port_vlans(self, output: str):
+        """Parse 'ovs-vsctl list port' output into the ports of each VLAN.
+
+        A port is a member of the VLAN of its tag and of the VLANs in its
+        trunks. Used both to answer questions about a single VLAN and to
+        build a snapshot of all VLANs, so that they always agree.
 
         :param output: Command output from OVS
-        :param segmentation_id: VLAN identifier being checked
-        :returns: True if any port has this VLAN tag, False otherwise
+        :returns: A dict mapping VLAN IDs to sets of port names.
         """
-        # OVS output format:
+        # OVS prints one record per port, separated by blank lines:
         # _uuid               : 12345678-1234-1234-1234-123456789abc
         # name                : "eth0"
         # tag                 : 100
-        # trunks              : []
-        lines = output.strip().split('\n')
-        for line in lines:
-            # Look for tag line with our segmentation_id
-            if line.startswith('tag'):
-                try:
-                    # Format: "tag                 : 100" or "tag : []"
-                    parts = line.split(':')
-                    if len(parts) >= 2:
-                        value = parts[1].strip()
-                        # Skip empty tags (shown as [] or empty)
-                        if value and value != '[]':
-                            tag_id = int(value)
-                            if tag_id == segmentation_id:
-                                return True
-                except (ValueError, IndexError):
-                    continue
-        return False
+        # trunks              : [200, 300]
+        vlan_ports = {}
+        for record in re.split(r'\n\s*\n', output.strip()):
+            fields = {}
+            for line in record.split('\n'):
+                key, sep, value = line.partition(':')
+                if sep:
+                    fields[key.strip()] = value.strip()
+            name = (fields.get('name', '').strip('"')
+                    or fields.get('_uuid', ''))
+            # Empty tags and trunks are shown as [].
+            vlans = re.findall(r'\d+', fields.get('tag', ''))
+            vlans += re.findall(r'\d+', fields.get('trunks', ''))
+            for vlan in vlans:
+                vlan_ports.setdefault(int(vlan), set()).add(name)
+        return vlan_ports
+
+    def _parse_vni_map(self, output: str):
+        """Parse 'ovs-vsctl get bridge external_ids' output into VNIs.
+
+        :param output: Command output from OVS
+        :returns: A dict mapping VLAN IDs to sets of VNIs.
+        """
+        # OVS external_ids output format:
+        # {key1=value1, key2=value2, "vni-5000"="100"}
+        # Handles both quoted and unquoted formats across OVS versions
+        vlan_vnis = {}
+        pattern = r'["\']?vni-(\d+)["\']?\s*=\s*["\']?(\d+)["\']?'
+        for vni, vlan in re.findall(pattern, output):
+            vlan_vnis.setdefault(int(vlan), set()).add(int(vni))
+        return vlan_vnis
+
+    def _parse_vlan_ports(self, output: str, segmentation_id: int) -> bool:
+        """Parse 'ovs-vsctl list port' output for ports in a VLAN.
+
+        :param output: Command output from OVS
+        :param segmentation_id: VLAN identifier being checked
+        :returns: True if any port has this VLAN tag or trunks this VLAN,
+            False otherwise
+        """
+        return bool(self._parse_port_vlans(output).get(segmentation_id))
 
     def _parse_vlan_vni(self, output: str, segmentation_id: int,
                         vni: int) -> bool:
@@ -178,15 +207,21 @@ class OvsLinux(netmiko_devices.NetmikoSwitch):
         :param vni: VNI to check for
         :returns: True if VNI maps to this VLAN, False otherwise
         """
-        # OVS external_ids output format:
-        # {key1=value1, key2=value2, "vni-5000"="100"}
-        # Look for vni-<vni>=<segmentation_id> in the output
-        # Handles both quoted and unquoted formats across OVS versions
-        pattern = rf'["\']?vni-{vni}["\']?\s*=\s*["\']?(\d+)["\']?'
-        match = re.search(pattern, output)
-        if match:
-            return int(match.group(1)) == segmentation_id
-        return False
+        return vni in self._parse_vni_map(output).get(segmentation_id, ())
+
+    def _state_snapshot_params(self):
+        return {'bridge_name': self._get_bridge_name()}
+
+    def _parse_state_snapshot(self, outputs):
+        """Parse port list and bridge external_ids into a snapshot.
+
+        :param outputs: list containing the output of 'ovs-vsctl list port'
+            and 'ovs-vsctl get bridge external_ids'
+        :returns: A devices.utils.SwitchStateSnapshot
+        """
+        return device_utils.SwitchStateSnapshot(
+            self._parse_port_vlans(outputs[0]),
+            self._parse_vni_map(outputs[1]))
 
     @netmiko_devices.check_output('plug vni')
     def plug_switch_to_network(self, vni: int, segmentation_id: int,
@@ -236,9 +271,8 @@ class OvsLinux(netmiko_devices.NetmikoSwitch):
         :param segmentation_id: VLAN identifier
         :returns: True if any port has this tag, False otherwise
         """
-        with self._get_connection() as net_connect:
-            output = net_connect.send_command(self.SHOW_PORTS[0])
-            return self._parse_vlan_ports(output, segmentation_id)
+        output = self._send_show_command(self.SHOW_PORTS[0])
+        return self._parse_vlan_ports(output, segmentation_id)
 
     def vlan_has_vni(self, segmentation_id: int, vni: int) -> bool:
         """Check if VNI mapping exists in bridge external_ids.
@@ -251,6 +285,5 @@ class OvsLinux(netmiko_devices.NetmikoSwitch):
         cmd = self._format_commands(
             self.SHOW_BRIDGE_EXTERNAL_IDS,
             bridge_name=bridge_name)
-        with self._get_connection() as net_connect:
-            output = net_connect.send_command(cmd[0])
-            return self._parse_vlan_vni(output, segmentation_id, vni)
+        output = self._send_show_command(cmd[0])
+        return self._parse_vlan_vni(output, segmentation_id, vni)
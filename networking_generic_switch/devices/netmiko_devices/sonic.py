@@ -676,9 +676,8 @@ class Sonic(netmiko_devices.NetmikoSwitch):
         cmd = self._format_commands(
             self.SHOW_VLAN_PORTS,
             segmentation_id=segmentation_id)
-        with self._get_connection() as net_connect:
-            output = net_connect.send_command(cmd[0])
-            return self._parse_vlan_ports(output, segmentation_id)
+        output = self._send_show_command(cmd[0])
+        return self._parse_vlan_ports(output, segmentation_id)
 
     def vlan_has_vni(self, segmentation_id: int, vni: int) -> bool:
         """Check if a VLAN already has a specific VNI mapping configured.
@@ -691,9 +690,8 @@ class Sonic(netmiko_devices.NetmikoSwitch):
             self.SHOW_VLAN_VNI,
             segmentation_id=segmentation_id,
             vni=vni)
-        with self._get_connection() as net_connect:
-            output = net_connect.send_command(cmd[0])
-            return self._parse_vlan_vni(output, segmentation_id, vni)
+        output = self._send_show_command(cmd[0])
+        return self._parse_vlan_vni(output, segmentation_id, vni)
 
     @netmiko_devices.check_output('add trunk subports')
     def add_subports_on_trunk(self, binding_profile, port_id, subports):
@@ -12,6 +12,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections.abc
 from dataclasses import dataclass
 import ipaddress
 from typing import Optional
@@ -43,6 +44,115 @@ class VxlanMulticastConfig:
     mcast_group_map: dict
 
 
+class DeviceRegistry(collections.abc.Mapping):
+    """Immutable mapping of switch names to devices, with lookup indexes.
+
+    The indexes are built once, so that looking up a switch by MAC address
+    or physical network does not scan the whole inventory. A new registry
+    should be built when the inventory changes.
+
+    :param switches: a mapping of switch names to device objects.
+    """
+
+    def __init__(self, switches):
+        self._switches = dict(switches)
+        self._by_mac = {}
+        physnets = {}
+        for name, switch in self._switches.items():
+            mac_address = switch.ngs_config.get('ngs_mac_address')
+            if mac_address:
+                # The first switch wins, as with a scan of the inventory.
+                self._by_mac.setdefault(mac_address.lower(), switch)
+            physnets[name] = frozenset(switch.get_physical_networks())
+        # NOTE(mgoddard): If the switch has no physical networks then
+        # follow the old behaviour of mapping all networks to it.
+        self._any_physnet = tuple(
+            (name, switch) for name, switch in self._switches.items()
+            if not physnets[name])
+        self._by_physnet = {
+            physnet: tuple(
+                (name, switch) for name, switch in self._switches.items()
+                if not physnets[name] or physnet in physnets[name])
+            for physnet in set().union(*physnets.values())
+        }
+
+    def __getitem__(self, switch_info):
+        return self._switches[switch_info]
+
+    def __iter__(self):
+        return iter(self._switches)
+
+    def __len__(self):
+        return len(self._switches)
+
+    def get_by_mac(self, mac_address):
+        """Return the switch with a MAC address, or None."""
+        return self._by_mac.get(mac_address.lower())
+
+    def get_by_physnet(self, physnet):
+        """Return the switches on a physical network.
+
+        :param physnet: Physical network to filter by.
+        :returns: A tuple of 2-tuples containing the name of the switch and
+            the switch device object, in inventory order.
+        """
+        return self._by_physnet.get(physnet, self._any_physnet)
+
+
+class SwitchStateSnapshot(object):
+    """Immutable snapshot of the VLANs, ports and VNIs of a switch.
+
+    Built from the output of one or more show commands run in a single
+    session, so that questions about many VLANs can be answered without
+    querying the switch for each of them.
+
+    :param vlan_ports: a mapping of VLAN IDs to iterables of the names of
+        the ports which are members of the VLAN, access or trunk.
+    :param vlan_vnis: a mapping of VLAN IDs to iterables of the VNIs mapped
+        to the VLAN.
+    """
+
+    def __init__(self, vlan_ports=None, vlan_vnis=None):
+        self._ports = {int(vlan): frozenset(ports)
+                       for vlan, ports in (vlan_ports or {}).items()}
+        self._vnis = {int(vlan): frozenset(int(vni) for vni in vnis)
+                      for vlan, vnis in (vlan_vnis or {}).items()}
+
+    def __eq__(self, other):
+        if not isinstance(other, SwitchStateSnapshot):
+            return NotImplemented
+        return (self._ports, self._vnis) == (other._ports, other._vnis)
+
+    def __repr__(self):
+        return 'SwitchStateSnapshot(%r, %r)' % (self._ports, self._vnis)
+
+    @property
+    def vlans(self):
+        """The IDs of the VLANs in the snapshot."""
+        return frozenset(self._ports) | frozenset(self._vnis)
+
+    def vlan_has_ports(self, segmentation_id):
+        """Return whether a VLAN has any ports."""
+        return bool(self._ports.get(segmentation_id))
+
+    def vlan_has_vni(self, segmentation_id, vni):
+        """Return whether a VNI is mapped to a VLAN."""
+        return vni in self._vnis.get(segmentation_id, ())
+
+    def port_in_vlan(self, port, segmentation_id):
+        """Return whether a port is a member of a VLAN."""
+        return port in self._ports.get(segmentation_id, ())
+
+    def vlans_without_ports(self, segmentation_ids):
+        """Return the VLANs which have no ports.
+
+        :param segmentation_ids: an iterable of VLAN IDs.
+        :returns: a set of the VLAN IDs which have no ports.
+        """
+        return {segmentation_id for segmentation_id in segmentation_ids
+                if not self.vlan_has_ports(segmentation_id)}
+
+
 def get_switch_device(switches, switch_info=None,
                       ngs_mac_address=None):
     """Return switch device by specified identifier.
@@ -51,12 +161,17 @@ def get_switch_device(switches, switch_info=None,
     passed identifiers. ngs_mac_address takes precedence over switch_info,
     if didn't match any address based on mac fallback to switch_info.
 
+    :param switches: a DeviceRegistry, or a dict of switch devices.
     :param switch_info: hostname of the switch or any other switch identifier.
     :param ngs_mac_address: Normalized mac address of the switch.
     :returns: switch device matches by specified identifier or None.
     """
 
-    if ngs_mac_address:
+    if ngs_mac_address and isinstance(switches, DeviceRegistry):
+        switch = switches.get_by_mac(ngs_mac_address)
+        if switch is not None:
+            return switch
+    elif ngs_mac_address:
         for sw_info, switch in switches.items():
             mac_address = switch.ngs_config.get('ngs_mac_address')
             if mac_address and mac_address.lower() == ngs_mac_address.lower():
@@ -62,6 +62,16 @@ class GenericSwitchBatchError(GenericSwitchException):
     message = _("Batching error: %(device)s, error: %(error)s")
 
 
+class GenericSwitchBrokerError(GenericSwitchException):
+    message = _("SSH broker error: %(device)s, error: %(error)s")
+
+
+class GenericSwitchCircuitOpen(GenericSwitchException):
+    message = _("Not connecting to switch %(device)s after %(failures)s "
+                "consecutive connection failures, retrying in "
+                "%(retry_after)s seconds. Last error: %(error)s")
+
+
 class GenericSwitchNotSupported(GenericSwitchException):
     message = _("Requested feature %(feature)s is not supported by "
                 "networking-generic-switch on the %(switch)s. %(error)s")
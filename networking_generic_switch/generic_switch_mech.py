@@ -12,7 +12,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import sys
+import functools
 
 from neutron.db import provisioning_blocks
 from neutron.db import segments_db
@@ -22,14 +22,19 @@ from neutron_lib.callbacks import resources
 from neutron_lib import constants as const
 from neutron_lib.plugins import directory
 from neutron_lib.plugins.ml2 import api
+from oslo_config import cfg
 from oslo_log import log as logging
 
 from networking_generic_switch import devices
 from networking_generic_switch.devices import utils as device_utils
 from networking_generic_switch import exceptions as ngs_exc
+from networking_generic_switch import inventory
+from networking_generic_switch import state_cache
 from networking_generic_switch import trunk_driver
 from networking_generic_switch import utils as ngs_utils
+from networking_generic_switch import vlan_cache
 
+CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
 GENERIC_SWITCH_ENTITY = 'GENERICSWITCH'
@@ -37,6 +42,9 @@ GENERIC_SWITCH_ENTITY = 'GENERICSWITCH'
 
 class GenericSwitchDriver(api.MechanismDriver):
 
+    physnet_vlan_cache = None
+    switch_state_cache = None
+
     @property
     def connectivity(self):
         return portbindings.CONNECTIVITY_L2
@@ -57,9 +65,26 @@ class GenericSwitchDriver(api.MechanismDriver):
         LOG.info('Devices %s have been loaded', self.switches.keys())
         if not self.switches:
             LOG.error('No devices have been loaded')
+        devices.register_reload_callback(self._devices_reloaded)
+        inventory.setup()
 
         self.trunk_driver = trunk_driver.GenericSwitchTrunkDriver.create(self)
 
+        if CONF.ngs.physnet_vlans_cache_time:
+            self.physnet_vlan_cache = vlan_cache.PhysnetVlanCache(
+                CONF.ngs.physnet_vlans_cache_time)
+            self.physnet_vlan_cache.subscribe()
+
+        if CONF.ngs.switch_state_cache_time:
+            self.switch_state_cache = state_cache.SwitchStateCache(
+                CONF.ngs.switch_state_cache_time)
+
+    def _devices_reloaded(self, switches):
+        LOG.info('Devices %s have been reloaded', switches.keys())
+        self.switches = switches
+        if self.switch_state_cache is not None:
+            self.switch_state_cache.invalidate()
+
     def create_network_precommit(self, context):
         """Allocate resources for a new network.
 
@@ -94,31 +119,28 @@ class GenericSwitchDriver(api.MechanismDriver):
         if provider_type != 'vlan' or not segmentation_id:
             return
 
+        if self.physnet_vlan_cache is not None:
+            self.physnet_vlan_cache.add(physnet, segmentation_id)
+
         # Create vlan on all switches from this driver
-        physnet_vlans_cache = {}
-        for switch_name, switch in self._get_devices_by_physnet(physnet):
-            physnet_vlans = None
-            if switch.trunk_vlans_converge and switch.get_trunk_ports():
-                switch_physnets = frozenset(switch.get_physical_networks())
-                if switch_physnets not in physnet_vlans_cache:
-                    physnet_vlans_cache[switch_physnets] = (
-                        self._get_physnet_vlans(context._plugin_context,
-                                                list(switch_physnets)))
-                physnet_vlans = physnet_vlans_cache[switch_physnets]
-            try:
-                switch.add_network(segmentation_id, network_id,
-                                   physnet_vlans=physnet_vlans)
-            except Exception as e:
+        calls = self._network_calls(context, physnet, 'add_network',
+                                    segmentation_id, network_id)
+        errors = []
+        for switch_name, error in self._call_on_switches(
+                calls, stop_on_error=True):
+            if error is not None:
                 LOG.error("Failed to create network %(net_id)s "
                           "on device: %(switch)s, reason: %(exc)s",
                           {'net_id': network_id,
                            'switch': switch_name,
-                           'exc': e})
-                raise
+                           'exc': error})
+                errors.append(error)
             else:
                 LOG.info('Network %(net_id)s has been added on device '
                          '%(device)s', {'net_id': network['id'],
                                         'device': switch_name})
+        if errors:
+            raise errors[0]
 
     def update_network_precommit(self, context):
         """Update resources of a network.
@@ -195,34 +217,30 @@ class GenericSwitchDriver(api.MechanismDriver):
         # NOTE(TheJulia): For L2VNI cases, VNI-to-VLAN mappings should
         # have been cleaned up during port deletion via
         # _unplug_port_from_segment(). This deletes the VLAN itself.
-        exc_info = None
-        physnet_vlans_cache = {}
-        for switch_name, switch in self._get_devices_by_physnet(physnet):
-            physnet_vlans = None
-            if switch.trunk_vlans_converge and switch.get_trunk_ports():
-                switch_physnets = frozenset(switch.get_physical_networks())
-                if switch_physnets not in physnet_vlans_cache:
-                    physnet_vlans_cache[switch_physnets] = (
-                        self._get_physnet_vlans(context._plugin_context,
-                                                list(switch_physnets)))
-                physnet_vlans = physnet_vlans_cache[switch_physnets]
-            try:
-                switch.del_network(segmentation_id, network['id'],
-                                   physnet_vlans=physnet_vlans)
-            except Exception as e:
+        if self.physnet_vlan_cache is not None:
+            self.physnet_vlan_cache.remove(physnet, segmentation_id)
+
+        calls = self._network_calls(context, physnet, 'del_network',
+                                    segmentation_id, network['id'])
+        errors = []
+        for switch_name, error in self._call_on_switches(calls):
+            if self.switch_state_cache is not None:
+                # Deleting the VLAN may remove its ports and VNI mapping.
+                self.switch_state_cache.invalidate(switch_name)
+            if error is not None:
                 LOG.error("Failed to delete network %(net_id)s "
                           "on device: %(switch)s, reason: %(exc)s",
                           {'net_id': network['id'],
                            'switch': switch_name,
-                           'exc': e})
+                           'exc': error})
                 # Save any exceptions for later reraise.
-                exc_info = sys.exc_info()
+                errors.append(error)
             else:
                 LOG.info('Network %(net_id)s has been deleted on device '
                          '%(device)s', {'net_id': network['id'],
                                         'device': switch_name})
-        if exc_info:
-            raise exc_info[1]
+        if errors:
+            raise errors[-1]
 
     def create_subnet_precommit(self, context):
         """Allocate resources for a new subnet.
@@ -437,6 +455,8 @@ class GenericSwitchDriver(api.MechanismDriver):
                             error="Trunks are not supported on ports.")
                     switch.plug_port_to_network(port_id, segmentation_id,
                                                 **plug_kwargs)
+                self._record_switch_state(switch, ('ports', segmentation_id),
+                                          True)
                 LOG.info("Successfully plugged port %(port_id)s in segment "
                          "%(segment_id)s on device %(device)s",
                          {'port_id': port['id'], 'device': switch_info,
@@ -687,7 +707,7 @@ class GenericSwitchDriver(api.MechanismDriver):
             else:
                 # Check if VNI is already configured on this VLAN
                 # (idempotency check)
-                if not switch.vlan_has_vni(segmentation_id, vni):
+                if not self._vlan_has_vni(switch, segmentation_id, vni):
                     # Extract physnet for per-physnet mcast-group resolution
                     physnet = segment.get(api.PHYSICAL_NETWORK)
                     LOG.debug("Putting fabric vni %(vni)s on vlan "
@@ -699,6 +719,8 @@ class GenericSwitchDriver(api.MechanismDriver):
                                'physnet': physnet})
                     switch.plug_switch_to_network(vni, segmentation_id,
                                                   physnet=physnet)
+                    self._record_switch_state(
+                        switch, ('vni', segmentation_id, vni), True)
                 else:
                     LOG.debug("VNI %(vni)s already configured on vlan "
                               "%(segmentation_id)s on "
@@ -707,6 +729,75 @@ class GenericSwitchDriver(api.MechanismDriver):
                                'segmentation_id': segmentation_id,
                                'switch_info': switch_info})
 
+    def _vlan_has_vni(self, switch, segmentation_id, vni):
+        """Return whether a VNI is mapped to a VLAN on a switch.
+
+        The result is cached if [ngs] switch_state_cache_time is set.
+        """
+        if self.switch_state_cache is None:
+            return switch.vlan_has_vni(segmentation_id, vni)
+
+        def query():
+            snapshot = self._get_state_snapshot(switch)
+            if snapshot is None:
+                return switch.vlan_has_vni(segmentation_id, vni)
+            return snapshot.vlan_has_vni(segmentation_id, vni)
+
+        return self.switch_state_cache.get(
+            switch.device_name, ('vni', segmentation_id, vni), query)
+
+    def _vlan_has_ports(self, switch, segmentation_id):
+        """Return whether a VLAN has ports on a switch.
+
+        The result is cached if [ngs] switch_state_cache_time is set.
+        """
+        if self.switch_state_cache is None:
+            return switch.vlan_has_ports(segmentation_id)
+
+        def query():
+            snapshot = self._get_state_snapshot(switch)
+            if snapshot is None:
+                return switch.vlan_has_ports(segmentation_id)
+            return snapshot.vlan_has_ports(segmentation_id)
+
+        return self.switch_state_cache.get(
+            switch.device_name, ('ports', segmentation_id), query)
+
+    def _get_state_snapshot(self, switch):
+        """Return a cached snapshot of the state of a switch, or None.
+
+        A single snapshot answers the state queries for all VLANs of the
+        switch until it expires or the switch is changed. None is returned
+        if the switch does not support snapshots or the query fails, in
+        which case the caller should query the switch for the VLAN.
+        """
+        try:
+            return self.switch_state_cache.get(
+                switch.device_name, 'snapshot', switch.get_state_snapshot)
+        except Exception as e:
+            LOG.warning("Failed to get a snapshot of the state of switch "
+                        "%(switch)s: %(error)s",
+                        {'switch': switch.device_name, 'error': e})
+            return None
+
+    def _record_switch_state(self, switch, key, value):
+        """Update the cached state of a switch after changing it."""
+        if self.switch_state_cache is not None:
+            # The recorded result outlives a cached snapshot of the switch,
+            # which may still answer other queries. A snapshot in progress
+            # may not see the change, and must not be cached.
+            self.switch_state_cache.cancel(switch.device_name, 'snapshot')
+            self.switch_state_cache.set(switch.device_name, key, value)
+
+    def _port_removed(self, switch, segmentation_id):
+        """Update the cached state of a switch after removing a port."""
+        if self.switch_state_cache is not None:
+            self.switch_state_cache.invalidate(switch.device_name, 'snapshot')
+            # Other ports may remain on the VLAN, but a VLAN without ports
+            # still has none.
+            self.switch_state_cache.invalidate(
+                switch.device_name, ('ports', segmentation_id), value=True)
+
     def _get_subport_l2vni_info(self, subport_obj, segmentation_id):
         """Extract and validate VNI and segment info from subport.
 
@@ -763,7 +854,7 @@ class GenericSwitchDriver(api.MechanismDriver):
             return
 
         # Check if VNI is already configured on this VLAN (idempotency check)
-        if switch.vlan_has_vni(segmentation_id, vni):
+        if self._vlan_has_vni(switch, segmentation_id, vni):
             LOG.debug("VNI %(vni)s already configured on VLAN %(vlan)s on "
                       "%(switch_info)s for subport %(port_id)s, skipping",
                       {'vni': vni, 'vlan': segmentation_id,
@@ -780,6 +871,7 @@ class GenericSwitchDriver(api.MechanismDriver):
                    'physnet': physnet})
         switch.plug_switch_to_network(vni, segmentation_id,
                                       physnet=physnet)
+        self._record_switch_state(switch, ('vni', segmentation_id, vni), True)
 
     def _cleanup_l2vni_for_subport(self, context, subport_obj, segmentation_id,
                                    switch, switch_info):
@@ -917,7 +1009,7 @@ class GenericSwitchDriver(api.MechanismDriver):
 
         # Phase 2: Segment exists (or check skipped) - check if this switch
         # has ports using it
-        if switch.vlan_has_ports(segmentation_id):
+        if self._vlan_has_ports(switch, segmentation_id):
             LOG.debug("VLAN %(vlan)s still has ports on %(switch_info)s, "
                       "keeping VNI %(vni)s mapping",
                       {'vlan': segmentation_id, 'switch_info': switch_info,
@@ -949,6 +1041,8 @@ class GenericSwitchDriver(api.MechanismDriver):
         try:
             switch.unplug_switch_from_network(vni, segmentation_id,
                                               physnet=physnet)
+            self._record_switch_state(switch, ('vni', segmentation_id, vni),
+                                      False)
         except ngs_exc.GenericSwitchNetmikoConnectError:
             LOG.error("Failed to remove VNI %(vni)s from VLAN %(vlan)s on "
                       "%(switch)s due to connectivity issue. Verify switch is "
@@ -1125,6 +1219,7 @@ class GenericSwitchDriver(api.MechanismDriver):
                 else:
                     switch.delete_port(port_id, segmentation_id)
             except Exception as e:
+                self._port_removed(switch, segmentation_id)
                 LOG.error("Failed to unplug port %(port_id)s "
                           "on device: %(switch)s from network %(net_id)s "
                           "reason: %(exc)s",
@@ -1132,6 +1227,7 @@ class GenericSwitchDriver(api.MechanismDriver):
                            'net_id': segment['network_id'],
                            'switch': switch_info, 'exc': e})
                 raise e
+            self._port_removed(switch, segmentation_id)
             LOG.info('Port %(port_id)s has been unplugged from network '
                      '%(net_id)s on device %(device)s',
                      {'port_id': port['id'], 'net_id': segment['network_id'],
@@ -1142,14 +1238,20 @@ class GenericSwitchDriver(api.MechanismDriver):
                 context.plugin_context, vxlan_segment, segment, switch,
                 segmentation_id, switch_info)
 
-    def _get_physnet_vlans(self, plugin_context, physnets):
+    def _get_physnet_vlans(self, plugin_context, physnets, refresh=False):
         """Query all VLAN segmentation IDs across the given physnets.
 
         :param plugin_context: Neutron admin context for DB access.
         :param physnets: List of physical network names, or empty list
             for all physnets (no-physnet-configured case).
+        :param refresh: Whether to refresh the VLAN cache, if enabled, from
+            the database.
         :returns: Set of segmentation IDs.
         """
+        if self.physnet_vlan_cache is not None:
+            return self.physnet_vlan_cache.get_vlans(plugin_context, physnets,
+                                                     refresh=refresh)
+
         kwargs = {}
         if physnets:
             kwargs['physical_network'] = physnets
@@ -1159,6 +1261,59 @@ class GenericSwitchDriver(api.MechanismDriver):
 
         return {s.segmentation_id for s in segments}
 
+    def _network_calls(self, context, physnet, method, segmentation_id,
+                       network_id):
+        """Prepare calls to add or delete a network on switches.
+
+        :param context: NetworkContext instance.
+        :param physnet: Physical network of the network.
+        :param method: Name of the switch method to call, add_network or
+            del_network.
+        :param segmentation_id: VLAN ID of the network.
+        :param network_id: ID of the network.
+        :returns: a list of 2-tuples containing the name of the switch and a
+            function to call.
+        """
+        # NOTE: The database is only queried here, from the calling thread.
+        calls = []
+        physnet_vlans_cache = {}
+        # VLANs missing from physnet_vlans are pruned from the trunk ports,
+        # so the VLAN cache is refreshed once per call, in case other
+        # processes have added VLANs.
+        refresh = True
+        for switch_name, switch in self._get_devices_by_physnet(physnet):
+            physnet_vlans = None
+            if switch.trunk_vlans_converge and switch.get_trunk_ports():
+                switch_physnets = frozenset(switch.get_physical_networks())
+                if switch_physnets not in physnet_vlans_cache:
+                    physnet_vlans_cache[switch_physnets] = (
+                        self._get_physnet_vlans(context._plugin_context,
+                                                list(switch_physnets),
+                                                refresh=refresh))
+                    refresh = False
+                physnet_vlans = physnet_vlans_cache[switch_physnets]
+            calls.append((switch_name, functools.partial(
+                getattr(switch, method), segmentation_id, network_id,
+                physnet_vlans=physnet_vlans)))
+        return calls
+
+    def _call_on_switches(self, calls, stop_on_error=False):
+        """Make a call for each of a number of switches.
+
+        Up to [ngs] network_fanout_width calls are made concurrently.
+
+        :param calls: A list of 2-tuples containing the name of a switch and
+            a function to call.
+        :param stop_on_error: Whether to skip calls which have not started
+            once a call has failed.
+        :returns: A list of 2-tuples containing the name of the switch and
+            the exception raised by the call, or None, for each call made,
+            in the order of calls.
+        """
+        return ngs_utils.call_on_switches(
+            calls, CONF.ngs.network_fanout_width,
+            stop_on_error=stop_on_error)
+
     def _get_devices_by_physnet(self, physnet):
         """Generator yielding switches on a particular physical network.
 
@@ -1166,6 +1321,9 @@ class GenericSwitchDriver(api.MechanismDriver):
         :returns: Yields 2-tuples containing the name of the switch and the
             switch device object.
         """
+        if isinstance(self.switches, device_utils.DeviceRegistry):
+            yield from self.switches.get_by_physnet(physnet)
+            return
         for switch_name, switch in self.switches.items():
             physnets = switch.get_physical_networks()
             # NOTE(mgoddard): If the switch has no physical networks then
@@ -1209,6 +1367,9 @@ class GenericSwitchDriver(api.MechanismDriver):
             switch.add_subports_on_trunk(
                 binding_profile, port_id, subports,
                 trunk_details=port.get('trunk_details'))
+            for subport in subports:
+                self._record_switch_state(
+                    switch, ('ports', subport['segmentation_id']), True)
 
         core_plugin = directory.get_plugin()
 
@@ -1252,9 +1413,13 @@ class GenericSwitchDriver(api.MechanismDriver):
                 self.switches, switch_info=switch_info,
                 ngs_mac_address=switch_id)
 
-            switch.del_subports_on_trunk(
-                binding_profile, port_id, subports,
-                trunk_details=port.get('trunk_details'))
+            try:
+                switch.del_subports_on_trunk(
+                    binding_profile, port_id, subports,
+                    trunk_details=port.get('trunk_details'))
+            finally:
+                for subport in subports:
+                    self._port_removed(switch, subport['segmentation_id'])
 
         for subport in subports:
             self.cleanup_l2vni_for_subport(context, port, subport)
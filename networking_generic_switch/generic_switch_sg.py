@@ -12,6 +12,7 @@
 #    under the License.
 
 import collections
+import functools
 
 from neutron.objects import ports as ports_obj
 from neutron.objects import securitygroup as sg_obj
@@ -26,6 +27,7 @@ from oslo_log import log as logging
 from networking_generic_switch import devices
 from networking_generic_switch.devices import utils as device_utils
 from networking_generic_switch import exceptions as exc
+from networking_generic_switch import sg_port_index
 from networking_generic_switch import utils as ngs_utils
 
 
@@ -41,19 +43,21 @@ class GenericSwitchSecurityGroupHandler(service_base.ServicePluginBase):
     hardware appropriately.
     """
 
+    sg_port_index = None
+
     def __init__(self):
         super(GenericSwitchSecurityGroupHandler, self).__init__()
-        self.switches = {}
         self.subscribe()
-        # filter the list of switches to only those that haven't explicitly
-        # disabled port security
-        for switch_info, switch in devices.get_devices().items():
-            if switch.ngs_config.get('ngs_security_groups_enabled', True):
-                self.switches[switch_info] = switch
+        if CONF.ngs.security_group_ports_cache_time:
+            self.sg_port_index = sg_port_index.SecurityGroupPortIndex(
+                CONF.ngs.security_group_ports_cache_time)
+            self.sg_port_index.subscribe()
+        self.switches = self._filter_switches(devices.get_devices())
 
         LOG.info('Devices %s have been loaded', self.switches.keys())
         if not self.switches:
             LOG.error('No devices have been loaded')
+        devices.register_reload_callback(self._devices_reloaded)
 
         # TODO(stevebaker) A periodic worker can be implemented to ensure
         # switch state is in sync with security group state. It would be
@@ -68,52 +72,98 @@ class GenericSwitchSecurityGroupHandler(service_base.ServicePluginBase):
         return "generic_switch_security_group"
 
     def create_security_group(self, resource, event, trigger, payload):
-        sg_id = payload.resource_id
-        sg = sg_obj.SecurityGroup.get_object(payload.context, id=sg_id)
-        for switch_name, switch in self.switches.items():
-            try:
-                switch.add_security_group(sg)
-            except Exception as e:
-                LOG.error("Failed to create security group %(sg_id)s "
-                          "on device: %(switch)s, reason: %(exc)s",
-                          {'sg_id': sg_id, 'switch': switch_name, 'exc': e})
-                raise
-            else:
-                LOG.info('Security group %(sg_id)s has been added on device '
-                         '%(device)s',
-                         {'sg_id': sg_id, 'device': switch_name})
+        # NOTE: A new security group is not bound to any port. It is created
+        # on a switch by bind_security_group when first bound to a port on
+        # that switch.
+        LOG.debug('Security group %(sg_id)s will be added to devices when '
+                  'it is bound to a port', {'sg_id': payload.resource_id})
 
     def update_security_group_rules(self, resource, event, trigger, payload):
         sgr = payload.latest_state
         sg_id = sgr['security_group_id']
         sg = sg_obj.SecurityGroup.get_object(payload.context, id=sg_id)
-        for switch_name, switch in self.switches.items():
-            try:
-                switch.update_security_group(sg)
-            except Exception as e:
+        calls = [
+            (switch_name, functools.partial(switch.update_security_group, sg))
+            for switch_name, switch in self._security_group_switches(
+                payload.context, sg_id)
+        ]
+        results = ngs_utils.call_on_switches(
+            calls, CONF.ngs.security_group_fanout_width, stop_on_error=True)
+        for switch_name, e in results:
+            if e is not None:
                 LOG.error("Failed to add rule to security group %(sg_id)s "
                           "on device: %(switch)s, reason: %(exc)s",
                           {'sg_id': sg_id, 'switch': switch_name, 'exc': e})
-                raise
             else:
                 LOG.info('Rule has been added to security group %(sg_id)s '
                          'on device %(device)s',
                          {'sg_id': sg_id, 'device': switch_name})
+        self._raise_first_error(results)
 
     def delete_security_group(self, resource, event, trigger, payload):
         sg_id = payload.resource_id
-        for switch_name, switch in self.switches.items():
-            try:
-                switch.del_security_group(sg_id)
-            except Exception as e:
+        # NOTE: The security group is no longer bound to any port, but may
+        # have been created on any switch by an earlier binding.
+        calls = [
+            (switch_name, functools.partial(switch.del_security_group, sg_id))
+            for switch_name, switch in self.switches.items()
+        ]
+        results = ngs_utils.call_on_switches(
+            calls, CONF.ngs.security_group_fanout_width)
+        for switch_name, e in results:
+            if e is not None:
                 LOG.error("Failed to delete security group %(sg_id)s "
                           "on device: %(switch)s, reason: %(exc)s",
                           {'sg_id': sg_id, 'switch': switch_name, 'exc': e})
-                raise
             else:
                 LOG.info('Security group %(sg_id)s has been deleted from '
                          '%(device)s',
                          {'sg_id': sg_id, 'device': switch_name})
+        self._raise_first_error(results)
+
+    @staticmethod
+    def _raise_first_error(results):
+        for switch_name, e in results:
+            if e is not None:
+                raise e
+
+    def _security_group_switches(self, context, sg_id):
+        """Find the switches with ports bound to a security group.
+
+        :param context: Database context
+        :param sg_id: Security group ID
+        :returns: A list of 2-tuples containing the name of the switch and
+                  the switch device object.
+        """
+        if self.sg_port_index is not None:
+            links = self.sg_port_index.get_security_group_links(
+                context, sg_id)
+        else:
+            links = set()
+            ports = ports_obj.Port.get_ports_by_vnic_type_and_host(
+                context, portbindings.VNIC_BAREMETAL)
+            for port in ports:
+                if not port.bindings:
+                    continue
+                if sg_id not in (port.security_group_ids or ()):
+                    continue
+                for binding in port.bindings:
+                    for link in binding.profile.get(
+                            'local_link_information', []):
+                        if link.get('port_id'):
+                            links.add((link.get('switch_info'),
+                                       link.get('switch_id')))
+
+        found = set()
+        for switch_info, switch_id in links:
+            switch = device_utils.get_switch_device(
+                self.switches, switch_info=switch_info,
+                ngs_mac_address=switch_id)
+            if switch is not None:
+                found.add(id(switch))
+        return [(switch_name, switch)
+                for switch_name, switch in self.switches.items()
+                if id(switch) in found]
 
     @staticmethod
     def _valid_baremetal_port(port):
@@ -165,6 +215,10 @@ class GenericSwitchSecurityGroupHandler(service_base.ServicePluginBase):
         :returns: A dict with key security group ID and value set of
                   port names bound to that group
         """
+        if self.sg_port_index is not None:
+            return self.sg_port_index.get_security_group_ports(
+                context, switch_info, switch_id)
+
         # iterate all baremetal ports and collect port names and security
         # group IDs related to this switch
         sg_ports = collections.defaultdict(set)
@@ -270,6 +324,20 @@ class GenericSwitchSecurityGroupHandler(service_base.ServicePluginBase):
                      {'sg_id': sg_id, 'port_id': port_id,
                       'sg_ports': ', '.join(sg_ports)})
 
+    @staticmethod
+    def _filter_switches(switches):
+        # filter the list of switches to only those that haven't explicitly
+        # disabled port security
+        return device_utils.DeviceRegistry({
+            switch_info: switch
+            for switch_info, switch in switches.items()
+            if switch.ngs_config.get('ngs_security_groups_enabled', True)
+        })
+
+    def _devices_reloaded(self, switches):
+        self.switches = self._filter_switches(switches)
+        LOG.info('Devices %s have been reloaded', self.switches.keys())
+
     def subscribe(self):
         # Subscribe to the events related to security groups and rules.
 
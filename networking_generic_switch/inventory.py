@@ -0,0 +1,101 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Reloading of the device inventory.
+
+Changes to the [genericswitch:*] sections of the configuration files are
+applied without restarting neutron-server, either periodically or when
+neutron-server reloads its configuration files on SIGHUP. See
+devices.reload_devices().
+"""
+
+import atexit
+import os
+import threading
+
+from oslo_log import log as logging
+
+from networking_generic_switch import config as gsw_conf
+from networking_generic_switch import devices
+
+LOG = logging.getLogger(__name__)
+
+_WATCHER = None
+
+
+def reload():
+    """Reload the device inventory, logging any error."""
+    try:
+        devices.reload_devices()
+    except Exception:
+        LOG.exception("Failed to reload the device inventory")
+
+
+def _mutate_hook(conf, fresh):
+    reload()
+
+
+def setup():
+    """Reload the device inventory as configured.
+
+    Called when the mechanism driver is initialised.
+    """
+    global _WATCHER
+    if gsw_conf.CONF.ngs.inventory_reload_on_sighup:
+        gsw_conf.CONF.register_mutate_hook(_mutate_hook)
+    interval = gsw_conf.CONF.ngs.inventory_reload_interval
+    if interval and _WATCHER is None:
+        _WATCHER = InventoryWatcher(interval)
+        _WATCHER.start()
+        atexit.register(_WATCHER.stop)
+
+
+def _restart_after_fork():
+    # Threads do not survive a fork, so restart the watcher in API workers
+    # forked after the driver was initialised.
+    if _WATCHER is not None:
+        _WATCHER.start()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+class InventoryWatcher(object):
+    """Periodically reloads the device inventory in a background thread.
+
+    :param interval: time in seconds between reloads
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="ngs-inventory")
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, waiting for a reload to finish."""
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            reload()
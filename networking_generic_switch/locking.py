@@ -12,13 +12,148 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import contextlib
 import itertools
+import threading
+import time
 
+from oslo_config import cfg
 from oslo_log import log as logging
 import tenacity
 from tooz import coordination
 
+from networking_generic_switch import metrics
+
 LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+# Time in seconds to block on one lock of a pool before trying the next
+SLOT_WAIT = 1
+
+
+class _TicketQueue(object):
+    """FIFO queue of the threads of a process waiting for a pool of locks."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiters = collections.deque()
+
+    @contextlib.contextmanager
+    def turn(self, deadline=None):
+        """Wait until all earlier waiters have had their turn.
+
+        :param deadline: time.monotonic() value after which to stop waiting,
+            or None to wait forever.
+        :raises: LockAcquireFailed if the deadline is reached.
+        """
+        ticket = object()
+        with self._cond:
+            self._waiters.append(ticket)
+            try:
+                while self._waiters[0] is not ticket:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise coordination.LockAcquireFailed(
+                                "Timed out waiting for earlier requests")
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()
+                raise
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()
+
+
+_TICKET_QUEUES = {}
+_TICKET_QUEUES_LOCK = threading.Lock()
+
+
+def _get_ticket_queue(locks_prefix):
+    with _TICKET_QUEUES_LOCK:
+        if locks_prefix not in _TICKET_QUEUES:
+            _TICKET_QUEUES[locks_prefix] = _TicketQueue()
+        return _TICKET_QUEUES[locks_prefix]
+
+
+_COORDINATORS = {}
+_COORDINATORS_LOCK = threading.Lock()
+
+
+class SharedCoordinator(object):
+    """A tooz coordinator shared by all switches of a process.
+
+    The coordinator is started when a lock is first requested, and stopped
+    when the last reference to it is released.
+
+    :param backend_url: URL of the tooz backend
+    :param member_id: member ID of the coordinator
+    :param start_heart: whether to start the coordinator heartbeat thread
+    """
+
+    def __init__(self, backend_url, member_id, start_heart=False):
+        self.backend_url = backend_url
+        self.member_id = member_id
+        self.start_heart = start_heart
+        self.refs = 0
+        self._coordinator = None
+        self._lock = threading.Lock()
+
+    def get_lock(self, name):
+        """Return a tooz lock, starting the coordinator if required."""
+        return self._get_coordinator().get_lock(name)
+
+    def _get_coordinator(self):
+        with self._lock:
+            if self._coordinator is None:
+                coordinator = coordination.get_coordinator(
+                    self.backend_url, self.member_id)
+                coordinator.start(start_heart=self.start_heart)
+                self._coordinator = coordinator
+            return self._coordinator
+
+    def release(self):
+        """Release a reference, stopping the coordinator after the last."""
+        with _COORDINATORS_LOCK:
+            self.refs -= 1
+            if self.refs > 0:
+                return
+            key = (self.backend_url, self.member_id)
+            if _COORDINATORS.get(key) is self:
+                del _COORDINATORS[key]
+        with self._lock:
+            coordinator = self._coordinator
+            self._coordinator = None
+        if coordinator is not None:
+            coordinator.stop()
+
+
+def get_coordinator(backend_url, member_id, start_heart=False):
+    """Return a reference to the coordinator shared by this process.
+
+    The caller must call release() on the coordinator when it no longer
+    needs it.
+
+    :param backend_url: URL of the tooz backend
+    :param member_id: member ID of the coordinator
+    :param start_heart: whether to start the coordinator heartbeat thread
+    :returns: a SharedCoordinator object
+    """
+    key = (backend_url, member_id)
+    with _COORDINATORS_LOCK:
+        shared = _COORDINATORS.get(key)
+        if shared is None:
+            shared = SharedCoordinator(backend_url, member_id,
+                                       start_heart=start_heart)
+            _COORDINATORS[key] = shared
+        shared.refs += 1
+        return shared
 
 
 class PoolLock(object):
@@ -28,16 +163,24 @@ class PoolLock(object):
     from a predefined set of names, with configurable set size (lock pool),
     and keep attempting for until given timeout is reached.
 
+    In fair mode, threads of a process take turns in the order they
+    arrived, and block on each lock of the pool in turn rather than polling
+    at random intervals. If fair is None, [ngs_coordination] fair_locking
+    is used.
+
     """
 
     def __init__(self, coordinator, locks_pool_size=1, locks_prefix='ngs-',
-                 timeout=0):
+                 timeout=0, fair=None):
         self.coordinator = coordinator
         self.locks_prefix = locks_prefix
         self.lock_names = ("{}{}".format(locks_prefix, i)
                            for i in range(locks_pool_size))
         self.locks_pool_size = locks_pool_size
         self.timeout = timeout
+        if fair is None:
+            fair = CONF.ngs_coordination.fair_locking
+        self.fair = fair
 
     def __enter__(self):
         self.lock = False
@@ -45,6 +188,55 @@ class PoolLock(object):
             return self
 
         LOG.debug("Trying to acquire lock for %s", self.locks_prefix)
+        start = time.monotonic()
+        if self.fair:
+            acquire = self._acquire_fair
+        else:
+            acquire = self._acquire_random
+        try:
+            self.lock = acquire()
+        except Exception:
+            msg = ("Failed to acquire any of %s locks for %s "
+                   "for a netmiko action in %s seconds. "
+                   "Try increasing acquire_timeout." % (
+                       self.locks_pool_size, self.locks_prefix,
+                       self.timeout))
+            LOG.error(msg, exc_info=True)
+            raise
+        self._acquired_at = time.monotonic()
+        metrics.observe('lock_wait_time', self.locks_prefix,
+                        self._acquired_at - start)
+        return self
+
+    def _acquire_fair(self):
+        deadline = None
+        if self.timeout:
+            deadline = time.monotonic() + self.timeout
+        names = itertools.cycle(self.lock_names)
+
+        with _get_ticket_queue(self.locks_prefix).turn(deadline):
+            # Take any free lock without waiting.
+            for _ in range(self.locks_pool_size):
+                lock = self.coordinator.get_lock(next(names).encode())
+                if lock.acquire(blocking=False):
+                    return lock
+
+            while True:
+                blocking = True
+                if deadline is not None:
+                    blocking = deadline - time.monotonic()
+                    if blocking <= 0:
+                        raise coordination.LockAcquireFailed(
+                            "Failed to acquire any lock for %s" %
+                            self.locks_prefix)
+                if self.locks_pool_size > 1:
+                    blocking = (SLOT_WAIT if blocking is True
+                                else min(SLOT_WAIT, blocking))
+                lock = self.coordinator.get_lock(next(names).encode())
+                if lock.acquire(blocking=blocking):
+                    return lock
+
+    def _acquire_random(self):
         names = itertools.cycle(self.lock_names)
         retry_kwargs = {'wait': tenacity.wait_random(min=0, max=1),
                         'reraise': True}
@@ -64,18 +256,10 @@ class PoolLock(object):
                     "Failed to acquire lock %s" % name)
             return lock
 
-        try:
-            self.lock = grab_lock_from_pool()
-        except Exception:
-            msg = ("Failed to acquire any of %s locks for %s "
-                   "for a netmiko action in %s seconds. "
-                   "Try increasing acquire_timeout." % (
-                       self.locks_pool_size, self.locks_prefix,
-                       self.timeout))
-            LOG.error(msg, exc_info=True)
-            raise
-        return self
+        return grab_lock_from_pool()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.lock:
             self.lock.release()
+            metrics.observe('lock_hold_time', self.locks_prefix,
+                            time.monotonic() - self._acquired_at)
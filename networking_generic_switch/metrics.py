@@ -0,0 +1,156 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""In-process metrics for switch operations.
+
+Metrics are kept per switch in memory, and may be fetched with get_metrics()
+or logged periodically by setting [ngs] metrics_log_interval.
+"""
+
+import bisect
+import os
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from networking_generic_switch import config  # noqa
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+TIME_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 300)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_LOCK = threading.Lock()
+_GAUGES = {}
+_HISTOGRAMS = {}
+_LOGGER_THREAD = None
+
+
+class Histogram(object):
+    """Distribution of observed values.
+
+    :param buckets: sorted upper bounds of the histogram buckets. Values
+        greater than the last bound are counted in an overflow bucket.
+    """
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def to_dict(self):
+        buckets = {str(bound): count
+                   for bound, count in zip(self.buckets, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'buckets': buckets,
+        }
+
+
+def set_gauge(name, switch, value):
+    """Set the current value of a gauge for a switch.
+
+    :param name: name of the metric
+    :param switch: name of the switch
+    :param value: the current value
+    """
+    with _LOCK:
+        _GAUGES.setdefault(name, {})[switch] = value
+    _ensure_logging()
+
+
+def observe(name, switch, value, buckets=TIME_BUCKETS):
+    """Add a value to a histogram for a switch.
+
+    :param name: name of the metric
+    :param switch: name of the switch
+    :param value: the observed value
+    :param buckets: bucket bounds used if the histogram does not exist yet
+    """
+    with _LOCK:
+        histograms = _HISTOGRAMS.setdefault(name, {})
+        if switch not in histograms:
+            histograms[switch] = Histogram(buckets)
+        histograms[switch].observe(value)
+    _ensure_logging()
+
+
+def get_metrics():
+    """Return a snapshot of all metrics.
+
+    :returns: a dict with 'gauges' and 'histograms' keys, each mapping
+        metric names to dicts keyed by switch name.
+    """
+    with _LOCK:
+        return {
+            'gauges': {name: dict(values)
+                       for name, values in _GAUGES.items()},
+            'histograms': {name: {switch: histogram.to_dict()
+                                  for switch, histogram in values.items()}
+                           for name, values in _HISTOGRAMS.items()},
+        }
+
+
+def reset():
+    """Forget all metrics."""
+    with _LOCK:
+        _GAUGES.clear()
+        _HISTOGRAMS.clear()
+
+
+def _ensure_logging():
+    global _LOGGER_THREAD
+    interval = CONF.ngs.metrics_log_interval
+    if not interval or _LOGGER_THREAD is not None:
+        return
+    with _LOCK:
+        if _LOGGER_THREAD is not None:
+            return
+        _LOGGER_THREAD = threading.Thread(
+            target=_log_metrics, args=(interval,), daemon=True,
+            name="ngs-metrics")
+        _LOGGER_THREAD.start()
+
+
+def _restart_after_fork():
+    # Threads do not survive a fork, so start the logger again in API
+    # workers forked after metrics were first recorded, for example by the
+    # circuit breakers of devices created before forking.
+    global _LOCK, _LOGGER_THREAD
+    _LOCK = threading.Lock()
+    if _LOGGER_THREAD is not None:
+        _LOGGER_THREAD = None
+        _ensure_logging()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _log_metrics(interval):
+    while not threading.Event().wait(interval):
+        LOG.info("Generic switch metrics: %s", get_metrics())
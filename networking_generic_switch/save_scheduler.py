@@ -0,0 +1,179 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Deferred saving of switch configuration.
+
+Saving the configuration of some switches takes several seconds, often
+longer than the change itself. Rather than saving after every change, a
+SaveScheduler coalesces the saves of a switch, and saves in the background
+once the oldest unsaved change is a few seconds old, or once enough changes
+are pending. Pending saves are flushed at exit.
+"""
+
+import atexit
+import threading
+import time
+
+from oslo_log import log as logging
+
+from networking_generic_switch import metrics
+
+LOG = logging.getLogger(__name__)
+
+SCHEDULERS = []
+
+
+@atexit.register
+def _flush_all():
+    """Save the configuration of all switches with pending changes."""
+    for scheduler in list(SCHEDULERS):
+        scheduler.stop()
+
+
+def get_pending_saves():
+    """Return the number of unsaved changes of each switch.
+
+    :returns: a dict mapping switch names to the number of changes which
+        have not been saved yet.
+    """
+    return {scheduler.switch_name: scheduler.pending
+            for scheduler in list(SCHEDULERS)}
+
+
+class SaveScheduler(object):
+    """Coalesces configuration saves of one switch.
+
+    :param switch_name: name of the switch, used for logging and metrics
+    :param save: function without arguments which saves the configuration.
+        It is responsible for holding the switch lock.
+    :param delay: maximum time in seconds between a change and the save
+    :param max_changes: number of pending changes which trigger a save
+        without waiting for the delay. 0 means no limit.
+    """
+
+    def __init__(self, switch_name, save, delay, max_changes=0):
+        self.switch_name = switch_name
+        self._save = save
+        self.delay = delay
+        self.max_changes = max_changes
+        self._pending = 0
+        self._deadline = None
+        self._failed = False
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._save_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def pending(self):
+        """Number of changes which have not been saved yet."""
+        with self._cond:
+            return self._pending
+
+    def record_change(self, count=1):
+        """Record changes to the configuration which need saving.
+
+        :param count: number of changes made
+        """
+        with self._cond:
+            self._add_pending(count)
+            stopped = self._stopped
+            if not stopped:
+                self._ensure_thread()
+                self._cond.notify()
+        if stopped:
+            # There is no worker to save the configuration any more.
+            self.flush()
+
+    def flush(self):
+        """Save the configuration now if there are pending changes."""
+        with self._save_lock:
+            with self._cond:
+                count = self._take_pending()
+            if count:
+                self._run_save(count)
+
+    def stop(self):
+        """Stop the background worker and save any pending changes."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+        if self in SCHEDULERS:
+            SCHEDULERS.remove(self)
+
+    def _add_pending(self, count):
+        if not self._pending:
+            self._deadline = time.monotonic() + self.delay
+        self._pending += count
+        metrics.set_gauge('pending_saves', self.switch_name, self._pending)
+
+    def _take_pending(self):
+        count = self._pending
+        self._pending = 0
+        self._deadline = None
+        metrics.set_gauge('pending_saves', self.switch_name, 0)
+        return count
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, daemon=True,
+            name="ngs-save-%s" % self.switch_name)
+        self._thread.start()
+        SCHEDULERS.append(self)
+
+    def _is_due(self):
+        if not self._pending:
+            return False
+        if (self.max_changes and self._pending >= self.max_changes
+                and not self._failed):
+            return True
+        return time.monotonic() >= self._deadline
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and not self._is_due():
+                    timeout = None
+                    if self._pending:
+                        timeout = max(0, self._deadline - time.monotonic())
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+            self.flush()
+
+    def _run_save(self, count):
+        LOG.debug("Saving configuration of %(switch)s after %(count)d "
+                  "changes", {'switch': self.switch_name, 'count': count})
+        start = time.monotonic()
+        try:
+            self._save()
+        except Exception:
+            LOG.exception("Failed to save configuration of %s, retrying in "
+                          "%s seconds", self.switch_name, self.delay)
+            with self._cond:
+                # Wait for the delay before retrying, even if there are
+                # max_changes pending changes.
+                self._failed = True
+                self._add_pending(count)
+            return
+        with self._cond:
+            self._failed = False
+        metrics.observe('save_duration', self.switch_name,
+                        time.monotonic() - start)
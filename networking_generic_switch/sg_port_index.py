@@ -0,0 +1,189 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+import time
+
+from neutron.objects import ports as ports_obj
+from neutron_lib.api.definitions import portbindings
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import priority_group
+from neutron_lib.callbacks import registry
+from neutron_lib.callbacks import resources
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# Update the index before the security group handler reads it.
+PRIORITY = priority_group.PRIORITY_DEFAULT - 1
+
+
+def _link_entries(local_link_information):
+    """Return the (kind, switch, port name) entries of a port's links."""
+    entries = set()
+    for link in local_link_information or []:
+        port_name = link.get('port_id')
+        if not port_name:
+            continue
+        if link.get('switch_info'):
+            entries.add(('switch_info', link['switch_info'], port_name))
+        if link.get('switch_id'):
+            entries.add(('switch_id', link['switch_id'], port_name))
+    return entries
+
+
+class SecurityGroupPortIndex(object):
+    """Index of the switch ports bound to each security group.
+
+    Switch ports are indexed by the switch_info and switch_id of the local
+    link information of baremetal ports. The index is built from all
+    baremetal ports in the database, and rebuilt once it is older than
+    refresh_interval seconds. In between, it is updated as ports are
+    created, updated and deleted in this process. Changes made by other
+    processes are only seen after the next rebuild.
+
+    :param refresh_interval: Maximum age of the index in seconds.
+    """
+
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        # Neutron port ID to (link entries, security group IDs).
+        self._ports = {}
+        # (kind, switch) to {security group ID: Counter of port names}.
+        self._index = {}
+        self._expires = None
+
+    def subscribe(self):
+        """Update the index when ports are created, updated or deleted."""
+        for event in (events.AFTER_CREATE, events.AFTER_UPDATE):
+            registry.subscribe(self._port_updated, resources.PORT, event,
+                               priority=PRIORITY)
+        registry.subscribe(self._port_deleted, resources.PORT,
+                           events.AFTER_DELETE, priority=PRIORITY)
+
+    def get_security_group_ports(self, context, switch_info, switch_id):
+        """Find all security groups and ports related to a switch.
+
+        :param context: Database context
+        :param switch_info: Local link information switch_info
+        :param switch_id: Local link information switch_id
+        :returns: A dict with key security group ID and value set of
+                  port names bound to that group
+        """
+        sg_ports = collections.defaultdict(set)
+        with self._lock:
+            if self._expires is None or time.monotonic() >= self._expires:
+                self._rebuild(context)
+            for key in (('switch_info', switch_info),
+                        ('switch_id', switch_id)):
+                if not key[1]:
+                    continue
+                for sg_id, port_names in self._index.get(key, {}).items():
+                    sg_ports[sg_id].update(port_names)
+        return dict(sg_ports)
+
+    def get_security_group_links(self, context, sg_id):
+        """Find the switches with ports bound to a security group.
+
+        :param context: Database context
+        :param sg_id: Security group ID
+        :returns: A set of 2-tuples containing the local link information
+                  switch_info and switch_id of each switch. One of the two
+                  is None.
+        """
+        links = set()
+        with self._lock:
+            if self._expires is None or time.monotonic() >= self._expires:
+                self._rebuild(context)
+            for (kind, switch), sg_ports in self._index.items():
+                if sg_id not in sg_ports:
+                    continue
+                if kind == 'switch_info':
+                    links.add((switch, None))
+                else:
+                    links.add((None, switch))
+        return links
+
+    def _rebuild(self, context):
+        self._ports = {}
+        self._index = {}
+        ports = ports_obj.Port.get_ports_by_vnic_type_and_host(
+            context, portbindings.VNIC_BAREMETAL)
+        for port in ports:
+            entries = set()
+            for binding in port.bindings or []:
+                entries |= _link_entries(
+                    binding.profile.get('local_link_information'))
+            self._set_port(port.id, entries, port.security_group_ids)
+        self._expires = time.monotonic() + self.refresh_interval
+        LOG.debug("Rebuilt security group index of %d ports",
+                  len(self._ports))
+
+    def _set_port(self, port_id, entries, sg_ids):
+        old_entries, old_sg_ids = self._ports.pop(port_id, ((), ()))
+        for kind, switch, port_name in old_entries:
+            sg_ports = self._index[(kind, switch)]
+            for sg_id in old_sg_ids:
+                sg_ports[sg_id][port_name] -= 1
+                if sg_ports[sg_id][port_name] <= 0:
+                    del sg_ports[sg_id][port_name]
+                if not sg_ports[sg_id]:
+                    del sg_ports[sg_id]
+            if not sg_ports:
+                del self._index[(kind, switch)]
+
+        if not entries or not sg_ids:
+            return
+        self._ports[port_id] = (frozenset(entries), frozenset(sg_ids))
+        for kind, switch, port_name in entries:
+            sg_ports = self._index.setdefault((kind, switch), {})
+            for sg_id in sg_ids:
+                sg_ports.setdefault(sg_id, collections.Counter())[
+                    port_name] += 1
+
+    def update_port(self, port):
+        """Record the current state of a port.
+
+        :param port: Port dict
+        """
+        entries = set()
+        if port.get(portbindings.VNIC_TYPE) == portbindings.VNIC_BAREMETAL:
+            profile = port.get(portbindings.PROFILE) or {}
+            entries = _link_entries(profile.get('local_link_information'))
+        with self._lock:
+            if self._expires is not None:
+                self._set_port(port['id'], entries,
+                               port.get('security_groups') or [])
+
+    def remove_port(self, port_id):
+        """Record that a port has been deleted.
+
+        :param port_id: Port ID
+        """
+        with self._lock:
+            if self._expires is not None:
+                self._set_port(port_id, (), ())
+
+    def invalidate(self):
+        """Rebuild the index from the database on the next lookup."""
+        with self._lock:
+            self._expires = None
+
+    def _port_updated(self, resource, event, trigger, payload):
+        self.update_port(payload.latest_state)
+
+    def _port_deleted(self, resource, event, trigger, payload):
+        self.remove_port(payload.latest_state['id'])
@@ -0,0 +1,161 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+
+class _Query(object):
+    """A query of the state of a switch which is in progress."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Set by changes to the switch while the query is in progress, to
+        # discard its result.
+        self.stale = False
+
+
+class SwitchStateCache(object):
+    """Cache of the results of read-only queries of the state of switches.
+
+    Results are kept for ttl seconds. Concurrent lookups of the same key of
+    a switch share a single query. Changes made to a switch by this process
+    should be recorded with set() or invalidate(), so that the cache is not
+    left stale. Changes made by other processes are only seen once the
+    cached result has expired. Expired results are dropped from time to
+    time as new results are stored.
+
+    :param ttl: Maximum age of a cached result in seconds.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Switch name to a dict of key to a tuple of the result and its
+        # expiry time.
+        self._results = {}
+        # (switch name, key) to the _Query in progress.
+        self._queries = {}
+        # Time after which expired results are next dropped.
+        self._next_prune = 0
+
+    def get(self, switch_name, key, query):
+        """Return the cached result of a query, or run the query.
+
+        :param switch_name: Name of the switch.
+        :param key: Hashable key identifying the query.
+        :param query: Function without arguments which queries the switch.
+        :returns: The result of the query.
+        """
+        cache_key = (switch_name, key)
+        with self._lock:
+            cached = self._results.get(switch_name, {}).get(key)
+            if cached is not None and time.monotonic() < cached[1]:
+                return cached[0]
+            pending = self._queries.get(cache_key)
+            leader = pending is None
+            if leader:
+                pending = _Query()
+                self._queries[cache_key] = pending
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+        try:
+            pending.result = query()
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._queries[cache_key]
+                if pending.error is None and not pending.stale:
+                    self._store(switch_name, key, pending.result)
+            pending.done.set()
+        return pending.result
+
+    def set(self, switch_name, key, value):
+        """Record the result of a query after changing a switch.
+
+        :param switch_name: Name of the switch.
+        :param key: Hashable key identifying the query.
+        :param value: The result the query would now return.
+        """
+        with self._lock:
+            self._cancel(switch_name, key)
+            self._store(switch_name, key, value)
+
+    def invalidate(self, switch_name=None, key=None, value=None):
+        """Discard cached results.
+
+        :param switch_name: Name of the switch, or None for all switches.
+        :param key: Key of the query, or None for all queries of the switch.
+        :param value: If not None, only discard the result if it is equal to
+            value.
+        """
+        with self._lock:
+            if switch_name is None:
+                switch_names = list(self._results)
+            else:
+                switch_names = [switch_name]
+            for name in switch_names:
+                results = self._results.get(name, {})
+                keys = list(results) if key is None else [key]
+                for k in keys:
+                    if value is not None and (
+                            k not in results or results[k][0] != value):
+                        continue
+                    results.pop(k, None)
+            self._cancel(switch_name, key)
+
+    def cancel(self, switch_name=None, key=None):
+        """Discard the results of queries in progress when they complete.
+
+        Cached results are kept. Used after a change to a switch which does
+        not invalidate a cached result, but which a query in progress may
+        not have seen.
+
+        :param switch_name: Name of the switch, or None for all switches.
+        :param key: Key of the query, or None for all queries of the switch.
+        """
+        with self._lock:
+            self._cancel(switch_name, key)
+
+    def _cancel(self, switch_name, key):
+        # Queries in progress may have started before the change.
+        for (name, k), pending in self._queries.items():
+            if ((switch_name is None or name == switch_name)
+                    and (key is None or k == key)):
+                pending.stale = True
+
+    def _store(self, switch_name, key, value):
+        now = time.monotonic()
+        if now >= self._next_prune:
+            self._prune(now)
+        self._results.setdefault(switch_name, {})[key] = (
+            value, now + self.ttl)
+
+    def _prune(self, now):
+        # Results of keys which are not queried again, such as those of
+        # deleted VLANs, would otherwise be kept forever.
+        for switch_name, results in list(self._results.items()):
+            for key in [k for k, (_, expiry) in results.items()
+                        if expiry <= now]:
+                del results[key]
+            if not results:
+                del self._results[switch_name]
+        self._next_prune = now + self.ttl
@@ -69,6 +69,78 @@ class TestDevices(unittest.TestCase):
         self.assertEqual(expected, result)
 
 
+class TestDeviceRegistry(TestDevices):
+    """Run the lookup tests against a registry rather than a dict."""
+
+    def setUp(self):
+        super(TestDeviceRegistry, self).setUp()
+        self.devices = device_utils.DeviceRegistry(self.devices)
+
+    def test_mapping(self):
+        self.assertEqual(['A', 'B'], list(self.devices))
+        self.assertEqual(2, len(self.devices))
+        self.assertIn('A', self.devices)
+        self.assertIsNone(self.devices.get('C'))
+
+    def test_get_by_mac(self):
+        self.assertEqual(self.devices['B'],
+                         self.devices.get_by_mac('AA:bb:CC:dd:EE:ff'))
+        self.assertIsNone(self.devices.get_by_mac('11:22:33:44:55:66'))
+
+    def test_get_by_physnet(self):
+        switches = {
+            'A': devices.device_manager({
+                "device_type": 'netmiko_ovs_linux',
+                "ngs_physical_networks": 'physnet1, physnet2'}),
+            'B': devices.device_manager({"device_type": 'netmiko_ovs_linux'}),
+            'C': devices.device_manager({
+                "device_type": 'netmiko_ovs_linux',
+                "ngs_physical_networks": 'physnet2'}),
+        }
+        registry = device_utils.DeviceRegistry(switches)
+
+        self.assertEqual(
+            (('A', switches['A']), ('B', switches['B'])),
+            registry.get_by_physnet('physnet1'))
+        self.assertEqual(
+            (('A', switches['A']), ('B', switches['B']),
+             ('C', switches['C'])),
+            registry.get_by_physnet('physnet2'))
+        self.assertEqual((('B', switches['B']),),
+                         registry.get_by_physnet('physnet3'))
+
+
+class TestSwitchStateSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot = device_utils.SwitchStateSnapshot(
+            vlan_ports={100: ['Ethernet1', 'Ethernet2'], 200: []},
+            vlan_vnis={100: [5000], 300: [6000]})
+
+    def test_vlans(self):
+        self.assertEqual({100, 200, 300}, self.snapshot.vlans)
+
+    def test_vlan_has_ports(self):
+        self.assertTrue(self.snapshot.vlan_has_ports(100))
+        self.assertFalse(self.snapshot.vlan_has_ports(200))
+        self.assertFalse(self.snapshot.vlan_has_ports(400))
+
+    def test_vlan_has_vni(self):
+        self.assertTrue(self.snapshot.vlan_has_vni(100, 5000))
+        self.assertFalse(self.snapshot.vlan_has_vni(100, 6000))
+        self.assertFalse(self.snapshot.vlan_has_vni(200, 5000))
+
+    def test_port_in_vlan(self):
+        self.assertTrue(self.snapshot.port_in_vlan('Ethernet1', 100))
+        self.assertFalse(self.snapshot.port_in_vlan('Ethernet3', 100))
+        self.assertFalse(self.snapshot.port_in_vlan('Ethernet1', 200))
+
+    def test_vlans_without_ports(self):
+        self.assertEqual({200, 300, 400},
+                         self.snapshot.vlans_without_ports(
+                             [100, 200, 300, 400]))
+
+
 class TestVxlanMulticastConfig(unittest.TestCase):
     """Test VXLAN multicast configuration parsing."""
 
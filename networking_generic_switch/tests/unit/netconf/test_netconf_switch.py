@@ -18,10 +18,12 @@ import fixtures
 from ncclient import manager
 from ncclient.operations.rpc import RPCError
 from ncclient.transport.errors import AuthenticationError
+from ncclient.transport.errors import SessionCloseError
 from ncclient.transport.errors import SSHError
 from oslo_config import fixture as config_fixture
 from tooz import coordination
 
+from networking_generic_switch import batching
 from networking_generic_switch.devices.netconf_devices import netconf_switch
 from networking_generic_switch.devices import utils as device_utils
 from networking_generic_switch import exceptions as exc
@@ -471,6 +473,191 @@ class TestSendConfigToDevice(unittest.TestCase):
             [fake_a, fake_b])
 
 
+@mock.patch.object(manager, 'connect', autospec=True)
+class TestSessionPool(unittest.TestCase):
+
+    def _make_client(self, caps=(':candidate',)):
+        client = mock.Mock(connected=True)
+        client.server_capabilities = {
+            ncconst.IANA_NETCONF_CAPABILITIES[cap] for cap in caps}
+        return client
+
+    def _make_config(self):
+        config = mock.Mock()
+        config.to_xml_element.return_value = ElementTree.Element('fake')
+        return config
+
+    def test_pool_disabled_by_default(self, mock_manager):
+        switch = _make_switch()
+        self.assertIsNone(switch._session_pool)
+
+    def test_pool_size(self, mock_manager):
+        switch = _make_switch({'ngs_netconf_reuse_session': 'true',
+                               'ngs_max_connections': 2})
+        self.assertEqual(2, switch._session_pool.maxsize)
+        switch = _make_switch({'ngs_netconf_reuse_session': 'true',
+                               'ngs_netconf_pool_size': '3'})
+        self.assertEqual(3, switch._session_pool.maxsize)
+
+    @mock.patch.object(netconf_switch.NetconfSwitch,
+                       '_lock_and_configure', autospec=True)
+    def test_send_config_reuses_session(self, mock_lock_config,
+                                        mock_manager):
+        switch = _make_switch({'ngs_netconf_reuse_session': True})
+        client = self._make_client()
+        mock_manager.return_value = client
+        config = self._make_config()
+
+        with mock.patch.object(
+                switch, 'process_capabilities',
+                wraps=switch.process_capabilities) as mock_process:
+            switch.send_config_to_device(config)
+            switch.send_config_to_device(config)
+            self.assertEqual({':candidate'}, switch.get_capabilities())
+
+        mock_manager.assert_called_once_with(**switch._ncclient_args)
+        mock_process.assert_called_once_with(client.server_capabilities)
+        mock_lock_config.assert_has_calls([
+            mock.call(switch, client, ncconst.CANDIDATE, [config]),
+            mock.call(switch, client, ncconst.CANDIDATE, [config]),
+        ])
+        client.close_session.assert_not_called()
+
+        switch._drain_sessions()
+        client.close_session.assert_called_once_with()
+
+    @mock.patch.object(netconf_switch.NetconfSwitch,
+                       '_lock_and_configure', autospec=True)
+    def test_send_config_disconnected_session(self, mock_lock_config,
+                                              mock_manager):
+        switch = _make_switch({'ngs_netconf_reuse_session': True})
+        client1 = self._make_client()
+        client2 = self._make_client()
+        mock_manager.side_effect = [client1, client2]
+        config = self._make_config()
+
+        switch.send_config_to_device(config)
+        client1.connected = False
+        switch.send_config_to_device(config)
+
+        client1.close_session.assert_called_once_with()
+        mock_lock_config.assert_called_with(
+            switch, client2, ncconst.CANDIDATE, [config])
+
+    @mock.patch.object(netconf_switch.NetconfSwitch,
+                       '_lock_and_configure', autospec=True)
+    def test_send_config_session_closed(self, mock_lock_config,
+                                        mock_manager):
+        switch = _make_switch({'ngs_netconf_reuse_session': True})
+        client1 = self._make_client()
+        client2 = self._make_client()
+        mock_manager.side_effect = [client1, client2]
+        config = self._make_config()
+        switch.send_config_to_device(config)
+
+        mock_lock_config.side_effect = [SessionCloseError('closed'), None]
+        switch.send_config_to_device(config)
+
+        client1.close_session.assert_called_once_with()
+        mock_lock_config.assert_called_with(
+            switch, client2, ncconst.CANDIDATE, [config])
+        self.assertEqual(client2, switch._session_pool.get_nowait()[0])
+
+    @mock.patch.object(netconf_switch.NetconfSwitch,
+                       '_lock_and_configure', autospec=True)
+    def test_send_config_error_closes_session(self, mock_lock_config,
+                                              mock_manager):
+        switch = _make_switch({'ngs_netconf_reuse_session': True})
+        client = self._make_client()
+        mock_manager.return_value = client
+        mock_lock_config.side_effect = exc.GenericSwitchNetconfLockDenied()
+
+        self.assertRaises(exc.GenericSwitchNetconfLockDenied,
+                          switch.send_config_to_device, self._make_config())
+
+        client.close_session.assert_called_once_with()
+        self.assertTrue(switch._session_pool.empty())
+
+    def test_pool_full_closes_session(self, mock_manager):
+        switch = _make_switch({'ngs_netconf_reuse_session': True})
+        client1 = self._make_client()
+        client2 = self._make_client()
+        switch._session_pool.put_nowait((client1, set()))
+
+        switch._call_on_session((client2, set()), mock.Mock())
+
+        client2.close_session.assert_called_once_with()
+        client1.close_session.assert_not_called()
+
+    def test_close(self, mock_manager):
+        switch = _make_switch({'ngs_netconf_reuse_session': True,
+                               'ngs_max_connections': 2})
+        idle_client = self._make_client()
+        busy_client = self._make_client()
+        switch._session_pool.put_nowait((idle_client, set()))
+
+        switch.close()
+        idle_client.close_session.assert_called_once_with()
+
+        # A session in use is closed once released.
+        switch._call_on_session((busy_client, set()), mock.Mock())
+        busy_client.close_session.assert_called_once_with()
+        self.assertTrue(switch._session_pool.empty())
+
+    def test_connect_error(self, mock_manager):
+        switch = _make_switch({'ngs_netconf_reuse_session': True})
+        mock_manager.side_effect = SSHError('fail')
+        self.assertRaises(
+            exc.GenericSwitchNetconfConnectError, switch.get_capabilities)
+
+    def test_get_from_device(self, mock_manager):
+        switch = _make_switch({'ngs_netconf_reuse_session': True})
+        client = self._make_client()
+        mock_manager.return_value = client
+        query = interfaces.Interfaces()
+        query.add('foo1/1')
+
+        result = switch.get_from_device(query)
+        switch.get_from_device(query)
+
+        self.assertEqual(client.get.return_value.data_xml, result)
+        mock_manager.assert_called_once_with(**switch._ncclient_args)
+        self.assertEqual(2, client.get.call_count)
+
+
+@mock.patch.object(manager, 'connect', autospec=True)
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_circuit_breaker_disabled_by_default(self, mock_manager):
+        switch = _make_switch()
+        self.assertIsNone(switch.circuit_breaker)
+
+    def test_circuit_opens(self, mock_manager):
+        switch = _make_switch({'ngs_circuit_breaker_threshold': '1'})
+        mock_manager.side_effect = SSHError('fail')
+
+        self.assertRaises(SSHError, switch.send_config_to_device,
+                          mock.Mock())
+        self.assertRaises(exc.GenericSwitchCircuitOpen,
+                          switch.send_config_to_device, mock.Mock())
+        self.assertRaises(exc.GenericSwitchCircuitOpen,
+                          switch.get_capabilities)
+
+        mock_manager.assert_called_once_with(**switch._ncclient_args)
+
+    def test_circuit_opens_session_pool(self, mock_manager):
+        switch = _make_switch({'ngs_circuit_breaker_threshold': '1',
+                               'ngs_netconf_reuse_session': True})
+        mock_manager.side_effect = SSHError('fail')
+
+        self.assertRaises(exc.GenericSwitchNetconfConnectError,
+                          switch.get_capabilities)
+        self.assertRaises(exc.GenericSwitchCircuitOpen,
+                          switch.get_capabilities)
+
+        mock_manager.assert_called_once_with(**switch._ncclient_args)
+
+
 class TestGetLockSessionId(unittest.TestCase):
 
     def test_parse_session_id_zero(self):
@@ -910,10 +1097,15 @@ class TestNetconfSwitchCoordination(fixtures.TestWithFixtures):
         mock_get_coord.return_value = coord
         mock_hostname.return_value = 'viking'
         switch = _make_switch({'ngs_max_connections': 2})
-        self.assertEqual(coord, switch.locker)
+        self.addCleanup(switch.locker.release)
+        self.assertIsInstance(switch.locker, ngs_lock.SharedCoordinator)
+        mock_get_coord.assert_not_called()
+
+        switch.locker.get_lock(b'lock')
+
         mock_get_coord.assert_called_once_with(
             'etcd3://localhost', b'ngs-viking')
-        coord.start.assert_called_once()
+        coord.start.assert_called_once_with(start_heart=False)
 
     @mock.patch.object(device_utils, 'get_hostname', autospec=True)
     @mock.patch.object(ngs_lock, 'PoolLock', autospec=True)
@@ -928,6 +1120,7 @@ class TestNetconfSwitchCoordination(fixtures.TestWithFixtures):
         mock_get_coord.return_value = coord
         mock_hostname.return_value = 'viking'
         switch = _make_switch({'ngs_max_connections': 2})
+        self.addCleanup(switch.locker.release)
 
         mock_ncclient = mock.Mock()
         fake_caps = {ncconst.IANA_NETCONF_CAPABILITIES[':candidate']}
@@ -940,7 +1133,7 @@ class TestNetconfSwitchCoordination(fixtures.TestWithFixtures):
             switch.send_config_to_device(mock.Mock())
 
         mock_pool_lock.assert_called_once_with(
-            coord, locks_pool_size=2,
+            switch.locker, locks_pool_size=2,
             locks_prefix='switch.example.com',
             timeout=120)
 
@@ -956,3 +1149,51 @@ class TestNetconfSwitchCoordination(fixtures.TestWithFixtures):
             "Switch %s: [ngs_coordination] backend_url is not "
             "configured. The ngs_max_connections is ignored.",
             'switch.example.com')
+
+
+class TestNetconfSwitchBatching(fixtures.TestWithFixtures):
+
+    def setUp(self):
+        super().setUp()
+        self.cfg = self.useFixture(config_fixture.Config())
+        self.cfg.config(batch_backend='memory', group='ngs_coordination')
+
+    def test_batching_disabled_by_default(self):
+        switch = _make_switch()
+        self.assertIsNone(switch.batch_configs)
+
+    @mock.patch.object(netconf_switch.LOG, 'warning', autospec=True)
+    @mock.patch.object(device_utils, 'get_hostname', autospec=True)
+    @mock.patch.object(coordination, 'get_coordinator', autospec=True)
+    def test_batching_etcd_backend_ignored(self, mock_get_coord,
+                                           mock_hostname, mock_warning):
+        mock_hostname.return_value = 'viking'
+        self.cfg.config(batch_backend='etcd', backend_url='etcd3://localhost',
+                        group='ngs_coordination')
+        switch = _make_switch({'ngs_batch_requests': True})
+        self.addCleanup(switch.locker.release)
+
+        # Requests are not batched, and are serialised by the pool lock.
+        self.assertIsNone(switch.batch_configs)
+        self.assertIsInstance(switch.locker, ngs_lock.SharedCoordinator)
+        self.assertEqual(1, mock_warning.call_count)
+
+    def test_batching_tooz_backend_requires_url(self):
+        self.cfg.config(batch_backend='tooz', group='ngs_coordination')
+        self.assertRaises(exc.GenericSwitchBatchError, _make_switch,
+                          {'ngs_batch_requests': True})
+
+    @mock.patch.object(batching.NetconfSwitchBatch, 'do_batch',
+                       autospec=True)
+    @mock.patch.object(ngs_lock, 'PoolLock', autospec=True)
+    def test_send_config_batched(self, mock_pool_lock, mock_do_batch):
+        switch = _make_switch({'ngs_batch_requests': True})
+        self.assertIsInstance(switch.batch_configs,
+                              batching.NetconfSwitchBatch)
+        config = mock.Mock()
+
+        switch.send_config_to_device(config)
+
+        mock_do_batch.assert_called_once_with(
+            switch.batch_configs, switch, [config])
+        mock_pool_lock.assert_not_called()
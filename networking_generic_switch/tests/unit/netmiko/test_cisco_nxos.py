@@ -371,6 +371,40 @@ class TestNetmikoCiscoNxOS(test_netmiko_base.NetmikoSwitchTestBase):
         m_check.assert_called_once_with(self.switch, 'fake output',
                                         'add security group')
 
+    @mock.patch('networking_generic_switch.devices.netmiko_devices.'
+                'NetmikoSwitch.send_commands_to_device',
+                return_value='fake output', autospec=True)
+    @mock.patch('networking_generic_switch.devices.netmiko_devices.'
+                'NetmikoSwitch.check_output', autospec=True)
+    def test_update_security_group(self, m_check, m_sctd):
+        rule1 = mock.Mock(
+            ethertype='IPv4',
+            protocol='tcp',
+            direction='egress',
+            remote_ip_prefix='0.0.0.0/0',
+            normalized_cidr='0.0.0.0/0',
+            port_range_min='22',
+            port_range_max='23'
+        )
+        rule2 = mock.Mock(
+            ethertype='IPv4',
+            protocol='tcp',
+            direction='egress',
+            remote_ip_prefix='0.0.0.0/0',
+            normalized_cidr='0.0.0.0/0',
+            port_range_min='80',
+            port_range_max='80'
+        )
+        self.switch.add_security_group(
+            mock.Mock(id='1234', revision_number=1, rules=[rule1]))
+        sg = mock.Mock(id='1234', revision_number=2, rules=[rule2])
+        self.switch.update_security_group(sg)
+        m_sctd.assert_called_with(self.switch, [
+            'ip access-list ngs-in-1234',
+            'no permit tcp any 0.0.0.0/0 range 22 23',
+            'permit tcp any 0.0.0.0/0 eq 80',
+            'exit'])
+
     @mock.patch('networking_generic_switch.devices.netmiko_devices.'
                 'NetmikoSwitch.send_commands_to_device',
                 return_value="", autospec=True)
@@ -475,6 +475,71 @@ default-switch          vlan200             200
         result = self.switch._parse_vlan_vni(output, 100, 5000)
         self.assertFalse(result)
 
+    def test__parse_state_snapshot(self):
+        output = '''Routing instance        VLAN name           Tag     \
+Interfaces
+default-switch          default             1
+default-switch          vlan100             100     xe-0/0/1.0*
+                                                    xe-0/0/2.0
+  VNI: 5000
+default-switch          vlan200             200
+  VNI: 6000'''
+        snapshot = self.switch._parse_state_snapshot([output])
+        self.assertEqual({1, 100, 200}, snapshot.vlans)
+        self.assertTrue(snapshot.vlan_has_ports(100))
+        self.assertFalse(snapshot.vlan_has_ports(200))
+        self.assertTrue(snapshot.port_in_vlan('xe-0/0/1', 100))
+        self.assertTrue(snapshot.port_in_vlan('xe-0/0/2', 100))
+        self.assertTrue(snapshot.vlan_has_vni(100, 5000))
+        self.assertTrue(snapshot.vlan_has_vni(200, 6000))
+        self.assertFalse(snapshot.vlan_has_vni(1, 5000))
+
+    def test__parse_vlan_ports_continuation_line(self):
+        output = '''Routing instance        VLAN name           Tag     \
+Interfaces
+default-switch          vlan100             100
+                                                    xe-0/0/2.0
+default-switch          vlan200             200'''
+        self.assertTrue(self.switch._parse_vlan_ports(output, 100))
+        self.assertFalse(self.switch._parse_vlan_ports(output, 200))
+
+    def test__parse_state_snapshot_agrees(self):
+        output = '''Routing instance        VLAN name           Tag     \
+Interfaces
+default-switch          default             1
+default-switch          vlan100             100
+                                                    xe-0/0/1.0*
+                                                    xe-0/0/2.0
+  VNI: 5000
+default-switch          vlan200             200
+VNI: 6000
+default-switch          vlan300             300     xe-0/0/3.0'''
+        snapshot = self.switch._parse_state_snapshot([output])
+        for vlan in (1, 100, 200, 300, 400):
+            self.assertEqual(
+                self.switch._parse_vlan_ports(output, vlan),
+                snapshot.vlan_has_ports(vlan))
+            for vni in (5000, 6000):
+                self.assertEqual(
+                    self.switch._parse_vlan_vni(output, vlan, vni),
+                    snapshot.vlan_has_vni(vlan, vni))
+        self.assertTrue(snapshot.vlan_has_ports(100))
+        self.assertTrue(snapshot.vlan_has_vni(200, 6000))
+
+    @mock.patch('networking_generic_switch.devices.netmiko_devices.'
+                'NetmikoSwitch._get_connection', autospec=True)
+    def test_get_state_snapshot(self, mock_conn):
+        mock_net_connect = mock.MagicMock()
+        mock_net_connect.send_command.return_value = (
+            'default-switch          vlan100             100     '
+            'xe-0/0/1.0*')
+        mock_conn.return_value.__enter__.return_value = mock_net_connect
+
+        snapshot = self.switch.get_state_snapshot()
+
+        self.assertTrue(snapshot.port_in_vlan('xe-0/0/1', 100))
+        mock_net_connect.send_command.assert_called_once_with('show vlans')
+
     # EVPN configuration tests
     def test_init_default_evpn_config(self):
         """Test __init__ with default (disabled) EVPN VNI config."""
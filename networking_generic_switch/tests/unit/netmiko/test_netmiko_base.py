@@ -24,9 +24,11 @@ import tenacity
 from tooz import coordination
 
 from networking_generic_switch import batching
+from networking_generic_switch import circuit_breaker
 from networking_generic_switch.devices import netmiko_devices
 from networking_generic_switch.devices import utils
 from networking_generic_switch import exceptions as exc
+from networking_generic_switch import save_scheduler
 
 
 class NetmikoSwitchTestBase(fixtures.TestWithFixtures):
@@ -133,6 +135,87 @@ class TestNetmikoSwitch(NetmikoSwitchTestBase):
         self.cfg.config(backend_url='url', group='ngs_coordination')
         self._make_switch_device({'ngs_batch_requests': True})
 
+    def test_batch_memory_backend(self):
+        self.cfg.config(batch_backend='memory', group='ngs_coordination')
+        switch = self._make_switch_device({'ngs_batch_requests': True})
+        self.assertIsInstance(switch.batch_cmds.queue,
+                              batching.InProcessSwitchQueue)
+
+    @mock.patch.object(netmiko_devices.NetmikoSwitch, '_get_connection',
+                       autospec=True)
+    def test_get_state_snapshot_not_implemented(self, m_get_connection):
+        switch = self._make_switch_device()
+        self.assertIsNone(switch.get_state_snapshot())
+        m_get_connection.assert_not_called()
+
+    @mock.patch.object(netmiko_devices.ngs_lock, 'get_coordinator',
+                       autospec=True)
+    def test_broker(self, m_get_coordinator):
+        self.cfg.config(backend_url='url', group='ngs_coordination')
+        self.cfg.config(broker_socket='/run/ngs.sock', group='ngs')
+        switch = self._make_switch_device()
+
+        self.assertIsNone(switch.locker)
+        self.assertEqual('/run/ngs.sock', switch.broker.socket_path)
+        self.assertEqual(300, switch.broker.timeout)
+        m_get_coordinator.assert_not_called()
+
+    def test_broker_send_commands(self):
+        self.cfg.config(broker_socket='/run/ngs.sock', group='ngs')
+        switch = self._make_switch_device()
+        switch.device_name = 'sw1'
+        switch.broker = mock.Mock()
+        switch.broker.send_commands.return_value = 'output'
+
+        self.assertEqual('output', switch.send_commands_to_device(['cmd1']))
+
+        switch.broker.send_commands.assert_called_once_with('sw1', ['cmd1'])
+
+    @mock.patch.object(netmiko_devices.NetmikoSwitch, '_get_connection',
+                       autospec=True)
+    def test_broker_send_show_commands(self, m_get_connection):
+        self.cfg.config(broker_socket='/run/ngs.sock', group='ngs')
+        switch = self._make_switch_device()
+        switch.device_name = 'sw1'
+        switch.broker = mock.Mock()
+        switch.broker.send_show_commands.return_value = ['out1', 'out2']
+
+        self.assertEqual(['out1', 'out2'],
+                         switch._send_show_commands(['show 1', 'show 2']))
+
+        switch.broker.send_show_commands.assert_called_once_with(
+            'sw1', ['show 1', 'show 2'])
+        m_get_connection.assert_not_called()
+
+    @mock.patch.object(netmiko_devices.NetmikoSwitch, '_get_connection',
+                       autospec=True)
+    def test_send_show_commands(self, m_get_connection):
+        switch = self._make_switch_device()
+        net_connect = m_get_connection.return_value.__enter__.return_value
+        net_connect.send_command.side_effect = ['out1', 'out2']
+
+        self.assertEqual(['out1', 'out2'],
+                         switch._send_show_commands(['show 1', 'show 2']))
+
+        m_get_connection.assert_called_once_with(switch)
+        net_connect.send_command.assert_has_calls(
+            [mock.call('show 1'), mock.call('show 2')])
+
+    def test_broker_no_save_scheduler(self):
+        self.cfg.config(broker_socket='/run/ngs.sock', group='ngs')
+        switch = self._make_switch_device({
+            'ngs_save_configuration_delay': '5'})
+
+        self.assertIsNone(switch.save_scheduler)
+
+    def test_broker_ignored_when_batching(self):
+        self.cfg.config(backend_url='url', group='ngs_coordination')
+        self.cfg.config(broker_socket='/run/ngs.sock', group='ngs')
+        switch = self._make_switch_device({'ngs_batch_requests': True})
+
+        self.assertIsNone(switch.broker)
+        self.assertIsNotNone(switch.batch_cmds)
+
     def test_batch_missing_backend_url(self):
         self.assertRaisesRegex(
             Exception, "switch configuration operation failed",
@@ -182,6 +265,23 @@ class TestNetmikoSwitch(NetmikoSwitchTestBase):
         first_connection.disconnect.assert_called_once_with()
         second_connection.disconnect.assert_not_called()
 
+    def test_batch_passes_operation(self):
+        self.cfg.config(backend_url='url', group='ngs_coordination')
+        switch = self._make_switch_device({
+            'ngs_batch_requests': True,
+            'ngs_batch_compact': True,
+        })
+        self.assertTrue(switch.batch_cmds.compact)
+        switch.batch_cmds = mock.Mock()
+        switch.batch_cmds.do_batch.return_value = ''
+
+        switch.plug_port_to_network(2222, 22)
+
+        switch.batch_cmds.do_batch.assert_called_once_with(
+            switch, mock.ANY,
+            op=batching.port_operation('plug', 2222, 22))
+        self.assertIsNone(getattr(switch._batch_op_local, 'op', None))
+
     @mock.patch('networking_generic_switch.devices.netmiko_devices.'
                 'NetmikoSwitch.send_commands_to_device',
                 return_value='fake output', autospec=True)
@@ -630,6 +730,121 @@ class TestNetmikoSwitch(NetmikoSwitchTestBase):
         m_sctd.assert_not_called()
         m_check.assert_not_called()
 
+    def _make_sg_rule(self, direction, port):
+        return mock.Mock(
+            ethertype='IPv4',
+            protocol='tcp',
+            direction=direction,
+            remote_ip_prefix='0.0.0.0/0',
+            normalized_cidr='0.0.0.0/0',
+            port_range_min=port,
+            port_range_max=port
+        )
+
+    def _make_sg_switch(self):
+        switch = self._make_switch_device()
+        switch.REMOVE_SECURITY_GROUP_RULE_INGRESS = (
+            "remove ingress rule {protocol} "
+            "source {remote_ip_prefix} "
+            "port {port_range_min} to {port_range_max}",
+        )
+        switch.REMOVE_SECURITY_GROUP_RULE_EGRESS = (
+            "remove egress rule {protocol} "
+            "source {remote_ip_prefix} "
+            "port {port_range_min} to {port_range_max}",
+        )
+        return switch
+
+    @mock.patch('networking_generic_switch.devices.netmiko_devices.'
+                'NetmikoSwitch.send_commands_to_device',
+                return_value='fake output', autospec=True)
+    @mock.patch('networking_generic_switch.devices.netmiko_devices.'
+                'NetmikoSwitch.check_output', autospec=True)
+    def test_update_security_group_incremental(self, m_check, m_sctd):
+        rule1 = self._make_sg_rule('ingress', '22')
+        rule2 = self._make_sg_rule('egress', '80')
+        rule3 = self._make_sg_rule('ingress', '443')
+        sg = mock.Mock(id='1234', revision_number=1, rules=[rule1, rule2])
+        switch = self._make_sg_switch()
+        switch.add_security_group(sg)
+
+        # Rule added and rule removed
+        sg = mock.Mock(id='1234', revision_number=2, rules=[rule1, rule3])
+        switch.update_security_group(sg)
+        m_sctd.assert_called_with(switch, [
+            'add security group ngs-1234',
+            'remove egress rule tcp source 0.0.0.0/0 port 80 to 80',
+            'add ingress rule tcp source 0.0.0.0/0 port 443 to 443',
+            'add security group complete'])
+        m_check.assert_called_with(switch, 'fake output',
+                                   'update security group')
+
+        # No rule changes
+        m_sctd.reset_mock()
+        sg = mock.Mock(id='1234', revision_number=3, rules=[rule3, rule1])
+        switch.update_security_group(sg)
+        m_sctd.assert_called_once_with(switch, [])
+
+    @mock.patch('networking_generic_switch.devices.netmiko_devices.'
+                'NetmikoSwitch.send_commands_to_device',
+                return_value='fake output', autospec=True)
+    @mock.patch('networking_generic_switch.devices.netmiko_devices.'
+                'NetmikoSwitch.check_output', autospec=True)
+    def test_update_security_group_rebuild(self, m_check, m_sctd):
+        rule1 = self._make_sg_rule('ingress', '22')
+        rule2 = self._make_sg_rule('egress', '80')
+        full_cmds = [
+            'remove security group ngs-1234',
+            'add security group ngs-1234',
+            'add ingress rule tcp source 0.0.0.0/0 port 22 to 22',
+            'add security group complete']
+        switch = self._make_sg_switch()
+
+        # Not previously applied
+        sg = mock.Mock(id='1234', revision_number=2, rules=[rule1])
+        switch.update_security_group(sg)
+        m_sctd.assert_called_with(switch, full_cmds)
+
+        # Missed a revision
+        sg = mock.Mock(id='1234', revision_number=4, rules=[rule1])
+        switch.update_security_group(sg)
+        m_sctd.assert_called_with(switch, full_cmds)
+
+        # Rule removal not supported
+        switch.add_security_group(
+            mock.Mock(id='1234', revision_number=5, rules=[rule1, rule2]))
+        switch.REMOVE_SECURITY_GROUP_RULE_EGRESS = None
+        sg = mock.Mock(id='1234', revision_number=6, rules=[rule1])
+        switch.update_security_group(sg)
+        m_sctd.assert_called_with(switch, full_cmds)
+
+        # Deleted
+        switch.del_security_group('1234')
+        sg = mock.Mock(id='1234', revision_number=7, rules=[rule1])
+        switch.update_security_group(sg)
+        m_sctd.assert_called_with(switch, full_cmds)
+
+    @mock.patch('networking_generic_switch.devices.netmiko_devices.'
+                'NetmikoSwitch.send_commands_to_device',
+                return_value='fake output', autospec=True)
+    def test_update_security_group_rebuild_after_error(self, m_sctd):
+        rule1 = self._make_sg_rule('ingress', '22')
+        switch = self._make_sg_switch()
+        switch.ERROR_MSG_PATTERNS = (re.compile('fake output'),)
+        sg = mock.Mock(id='1234', revision_number=1, rules=[])
+
+        self.assertRaises(exc.GenericSwitchNetmikoConfigError,
+                          switch.add_security_group, sg)
+
+        switch.ERROR_MSG_PATTERNS = ()
+        sg = mock.Mock(id='1234', revision_number=2, rules=[rule1])
+        switch.update_security_group(sg)
+        m_sctd.assert_called_with(switch, [
+            'remove security group ngs-1234',
+            'add security group ngs-1234',
+            'add ingress rule tcp source 0.0.0.0/0 port 22 to 22',
+            'add security group complete'])
+
     @mock.patch('networking_generic_switch.devices.netmiko_devices.'
                 'NetmikoSwitch.send_commands_to_device',
                 return_value='fake output', autospec=True)
@@ -776,6 +991,31 @@ class TestNetmikoSwitch(NetmikoSwitchTestBase):
         m_stop.assert_called_once_with(1)
         m_wait.assert_called_once_with(1)
 
+    @mock.patch.object(netmiko_devices.tenacity, 'wait_fixed',
+                       return_value=tenacity.wait_fixed(0.01), autospec=True)
+    @mock.patch.object(netmiko_devices.tenacity, 'stop_after_delay',
+                       return_value=tenacity.stop_after_delay(1),
+                       autospec=True)
+    @mock.patch.object(netmiko, 'ConnectHandler', autospec=True)
+    def test__get_connection_circuit_breaker(self, m_conn_handler,
+                                             m_stop, m_wait):
+        switch = self._make_switch_device(
+            {'ngs_circuit_breaker_threshold': '2',
+             'ngs_circuit_breaker_reset_timeout': '60'})
+        m_conn_handler.side_effect = paramiko.SSHException
+
+        def get_connection():
+            with switch._get_connection():
+                self.fail()
+
+        # The retries stop once the circuit opens.
+        self.assertRaises(exc.GenericSwitchCircuitOpen, get_connection)
+        self.assertEqual(2, m_conn_handler.call_count)
+        self.assertEqual('open', switch.circuit_breaker.state)
+
+        self.assertRaises(exc.GenericSwitchCircuitOpen, get_connection)
+        self.assertEqual(2, m_conn_handler.call_count)
+
     @mock.patch.object(netmiko_devices.tenacity, 'wait_fixed',
                        return_value=tenacity.wait_fixed(0.01), autospec=True)
     @mock.patch.object(netmiko_devices.tenacity, 'stop_after_delay',
@@ -871,6 +1111,244 @@ class TestNetmikoSwitch(NetmikoSwitchTestBase):
         conn2.disconnect.assert_called_once_with()
         self.assertTrue(switch._connection_pool.empty())
 
+    @mock.patch.object(netmiko, 'ConnectHandler', autospec=True)
+    def test_close(self, m_conn_handler):
+        switch = self._make_switch_device({
+            'ngs_ssh_reuse_connection': True,
+            'ngs_max_connections': 2,
+        })
+        idle_conn = mock.MagicMock(netmiko.base_connection.BaseConnection)
+        busy_conn = mock.MagicMock(netmiko.base_connection.BaseConnection)
+        switch._connection_pool.put_nowait(idle_conn)
+        m_conn_handler.return_value = busy_conn
+
+        with switch._get_connection() as conn:
+            self.assertEqual(idle_conn, conn)
+            switch.close()
+            self.assertTrue(switch._pool_maintainer_stopped.is_set())
+            idle_conn.disconnect.assert_not_called()
+
+        # The connection in use is closed once released.
+        idle_conn.disconnect.assert_called_once_with()
+        self.assertTrue(switch._connection_pool.empty())
+        self.assertFalse(switch._return_to_pool(busy_conn))
+        busy_conn.disconnect.assert_called_once_with()
+
+    def test_close_stops_batch_worker(self):
+        self.cfg.config(batch_backend='memory', group='ngs_coordination')
+        switch = self._make_switch_device({'ngs_batch_requests': True,
+                                           'ngs_batch_watch_worker': True})
+        worker = switch.batch_cmds._get_worker(switch)
+        worker.start()
+        self.assertIn(worker, batching.WATCH_WORKERS)
+
+        switch.close()
+
+        self.assertFalse(worker._thread.is_alive())
+        self.assertNotIn(worker, batching.WATCH_WORKERS)
+        self.assertFalse(switch.batch_cmds.queue._callbacks)
+        # Later batches do not start a new worker.
+        self.assertIsNone(switch.batch_cmds._get_worker(switch))
+
+    @mock.patch.object(netmiko_devices.device_utils, 'get_hostname',
+                       autospec=True, return_value='host1')
+    @mock.patch.object(netmiko_devices.ngs_lock, 'get_coordinator',
+                       autospec=True)
+    def test_close_releases_locker(self, m_get_coordinator, m_hostname):
+        self.cfg.config(backend_url='url', group='ngs_coordination')
+        switch = self._make_switch_device()
+
+        switch.close()
+        switch.close()
+
+        m_get_coordinator.return_value.release.assert_called_once_with()
+
+    @mock.patch.object(save_scheduler.SaveScheduler, 'stop', autospec=True)
+    def test_close_flushes_saves(self, mock_stop):
+        switch = self._make_switch_device({
+            'ngs_save_configuration_delay': '5'})
+        switch.close()
+        mock_stop.assert_called_once_with(switch.save_scheduler)
+
+    @mock.patch.object(netmiko_devices.threading, 'Thread', autospec=True)
+    def test_pool_maintainer_disabled(self, m_thread):
+        switch = self._make_switch_device({
+            'ngs_ssh_reuse_connection': True,
+        })
+
+        self.assertIsNone(switch._pool_maintainer)
+        m_thread.assert_not_called()
+
+    @mock.patch.object(netmiko_devices.NetmikoSwitch,
+                       '_maintain_connection_pool', autospec=True)
+    @mock.patch.object(netmiko_devices.threading, 'Thread', autospec=True)
+    def test_pool_maintainer(self, m_thread, m_maintain):
+        switch = self._make_switch_device({
+            'ngs_ssh_reuse_connection': True,
+            'ngs_max_connections': 3,
+            'ngs_ssh_keepalive_interval': '30',
+            'ngs_ssh_pool_min_idle': '5',
+        })
+        # No sessions are opened until the pool is first used.
+        m_thread.assert_not_called()
+
+        switch._ensure_pool_maintainer()
+        switch._ensure_pool_maintainer()
+
+        m_thread.assert_called_once_with(
+            target=mock.ANY, daemon=True, name='ngs-pool-host')
+        m_thread.return_value.start.assert_called_once_with()
+        switch._pool_maintainer_stopped.set()
+        m_thread.call_args[1]['target']()
+        # min_idle and max_idle are limited by ngs_max_connections
+        m_maintain.assert_called_once_with(switch, 3, 3)
+
+    @mock.patch.object(netmiko_devices.NetmikoSwitch,
+                       '_maintain_connection_pool', autospec=True)
+    @mock.patch.object(netmiko_devices.threading, 'Thread', autospec=True)
+    def test_pool_maintainer_max_idle(self, m_thread, m_maintain):
+        switch = self._make_switch_device({
+            'ngs_ssh_reuse_connection': True,
+            'ngs_max_connections': 3,
+            'ngs_ssh_keepalive_interval': '30',
+            'ngs_ssh_pool_min_idle': '1',
+            'ngs_ssh_pool_max_idle': '2',
+        })
+
+        switch._ensure_pool_maintainer()
+        switch._pool_maintainer_stopped.set()
+        m_thread.call_args[1]['target']()
+        m_maintain.assert_called_once_with(switch, 1, 2)
+
+    @mock.patch.object(netmiko_devices.threading, 'Thread', autospec=True)
+    @mock.patch.object(netmiko, 'ConnectHandler', autospec=True)
+    def test_pool_maintainer_started_on_connection(self, m_conn_handler,
+                                                   m_thread):
+        switch = self._make_switch_device({
+            'ngs_ssh_reuse_connection': True,
+            'ngs_ssh_keepalive_interval': '30',
+        })
+        m_thread.assert_not_called()
+
+        with switch._get_connection():
+            pass
+
+        m_thread.assert_called_once_with(
+            target=mock.ANY, daemon=True, name='ngs-pool-host')
+        m_thread.return_value.start.assert_called_once_with()
+
+    @mock.patch.object(netmiko_devices.threading, 'Thread', autospec=True)
+    def test_pool_maintainer_not_started_when_closed(self, m_thread):
+        switch = self._make_switch_device({
+            'ngs_ssh_reuse_connection': True,
+            'ngs_ssh_keepalive_interval': '30',
+        })
+        switch.close()
+        switch._ensure_pool_maintainer()
+        m_thread.assert_not_called()
+
+    @mock.patch.object(netmiko_devices.threading, 'Thread', autospec=True)
+    def test_reset_pools_after_fork(self, m_thread):
+        switch = self._make_switch_device({
+            'ngs_ssh_reuse_connection': True,
+            'ngs_max_connections': 2,
+            'ngs_ssh_keepalive_interval': '30',
+        })
+        switch._ensure_pool_maintainer()
+        parent_stopped = switch._pool_maintainer_stopped
+        inherited_conn = mock.MagicMock(
+            netmiko.base_connection.BaseConnection)
+        switch._connection_pool.put_nowait(inherited_conn)
+
+        netmiko_devices._reset_pools_after_fork()
+
+        # Inherited connections share their sockets with the parent, so
+        # they are dropped without being closed.
+        self.assertTrue(switch._connection_pool.empty())
+        self.assertEqual(2, switch._connection_pool.maxsize)
+        inherited_conn.disconnect.assert_not_called()
+        self.assertIsNot(parent_stopped, switch._pool_maintainer_stopped)
+        self.assertIsNone(switch._pool_maintainer)
+
+        # The child starts its own maintainer on first use.
+        switch._ensure_pool_maintainer()
+        self.assertEqual(2, m_thread.call_count)
+
+    @mock.patch.object(netmiko, 'ConnectHandler', autospec=True)
+    def test__maintain_connection_pool(self, m_conn_handler):
+        switch = self._make_switch_device({
+            'ngs_ssh_reuse_connection': True,
+            'ngs_max_connections': 4,
+        })
+        old_conn = mock.MagicMock(netmiko.base_connection.BaseConnection)
+        dead_conn = mock.MagicMock(netmiko.base_connection.BaseConnection)
+        dead_conn.is_alive.return_value = False
+        recent_conn = mock.MagicMock(netmiko.base_connection.BaseConnection)
+        new_conn = mock.MagicMock(netmiko.base_connection.BaseConnection)
+        m_conn_handler.return_value = new_conn
+        switch._connection_pool.put_nowait(old_conn)
+        switch._connection_pool.put_nowait(dead_conn)
+        switch._connection_pool.put_nowait(recent_conn)
+
+        switch._maintain_connection_pool(min_idle=2, max_idle=1)
+
+        # The dead connection and connections over max_idle are closed,
+        # then new connections are opened up to min_idle.
+        dead_conn.disconnect.assert_called_once_with()
+        old_conn.disconnect.assert_called_once_with()
+        recent_conn.disconnect.assert_not_called()
+        self.assertEqual(1, m_conn_handler.call_count)
+        self.assertEqual(new_conn, switch._connection_pool.get_nowait())
+        self.assertEqual(recent_conn, switch._connection_pool.get_nowait())
+        self.assertTrue(switch._connection_pool.empty())
+
+    @mock.patch.object(netmiko, 'ConnectHandler', autospec=True)
+    def test__maintain_connection_pool_connect_failure(self, m_conn_handler):
+        switch = self._make_switch_device({
+            'ngs_ssh_reuse_connection': True,
+            'ngs_max_connections': 2,
+        })
+        m_conn_handler.side_effect = Exception("boom")
+
+        switch._maintain_connection_pool(min_idle=2, max_idle=2)
+
+        self.assertEqual(1, m_conn_handler.call_count)
+        self.assertTrue(switch._connection_pool.empty())
+
+    @mock.patch.object(netmiko, 'ConnectHandler', autospec=True)
+    def test__maintain_connection_pool_circuit_open(self, m_conn_handler):
+        switch = self._make_switch_device({
+            'ngs_ssh_reuse_connection': True,
+            'ngs_max_connections': 2,
+            'ngs_circuit_breaker_threshold': 1,
+        })
+        m_conn_handler.side_effect = Exception("boom")
+
+        # The first connection failure opens the circuit.
+        switch._maintain_connection_pool(min_idle=2, max_idle=2)
+        switch._maintain_connection_pool(min_idle=2, max_idle=2)
+
+        self.assertEqual(1, m_conn_handler.call_count)
+        self.assertTrue(switch._connection_pool.empty())
+
+    @mock.patch.object(netmiko, 'ConnectHandler', autospec=True)
+    def test__maintain_connection_pool_circuit_open_race(self,
+                                                         m_conn_handler):
+        switch = self._make_switch_device({
+            'ngs_ssh_reuse_connection': True,
+            'ngs_max_connections': 2,
+        })
+        switch.circuit_breaker = mock.Mock(state=circuit_breaker.CLOSED)
+        # The circuit opens after the state is checked.
+        switch.circuit_breaker.call.side_effect = (
+            exc.GenericSwitchCircuitOpen(device='foo', failures=1,
+                                         retry_after=60, error='boom'))
+
+        switch._maintain_connection_pool(min_idle=2, max_idle=2)
+
+        self.assertEqual(1, switch.circuit_breaker.call.call_count)
+        self.assertTrue(switch._connection_pool.empty())
+
     @mock.patch.object(netmiko_devices.NetmikoSwitch, '_get_connection',
                        autospec=True)
     def test_send_commands_to_device_empty(self, gc_mock):
@@ -1025,6 +1503,59 @@ class TestNetmikoSwitch(NetmikoSwitchTestBase):
         self.assertEqual('fake output', result)
         save_mock.assert_not_called()
 
+    @mock.patch.object(netmiko_devices.NetmikoSwitch, '_get_connection',
+                       autospec=True)
+    @mock.patch.object(netmiko_devices.NetmikoSwitch, 'send_config_set',
+                       autospec=True)
+    @mock.patch.object(netmiko_devices.NetmikoSwitch, 'save_configuration',
+                       autospec=True)
+    def test_send_commands_to_device_deferred_save(self, save_mock,
+                                                   send_mock, gc_mock):
+        switch = self._make_switch_device(
+            extra_cfg={'ngs_save_configuration_delay': '60',
+                       'ngs_save_configuration_max_changes': '10'})
+        self.assertEqual(60, switch.save_scheduler.delay)
+        self.assertEqual(10, switch.save_scheduler.max_changes)
+        connect_mock = mock.MagicMock(netmiko.base_connection.BaseConnection)
+        gc_mock.return_value.__enter__.return_value = connect_mock
+        send_mock.return_value = 'fake output'
+
+        switch.send_commands_to_device(['spam ham aaaa'])
+        switch.send_commands_to_device(['spam ham bbbb'])
+
+        save_mock.assert_not_called()
+        self.assertEqual(2, switch.save_scheduler.pending)
+
+        switch.save_scheduler.stop()
+
+        save_mock.assert_called_once_with(switch, connect_mock)
+        self.assertEqual(0, switch.save_scheduler.pending)
+
+    def test_deferred_save_disabled_without_save_config(self):
+        switch = self._make_switch_device(
+            extra_cfg={'ngs_save_configuration_delay': '60',
+                       'ngs_save_configuration': False})
+        self.assertIsNone(switch.save_scheduler)
+
+    @mock.patch.object(netmiko_devices.NetmikoSwitch,
+                       'DEFER_SAVE_CONFIGURATION', new=False)
+    def test_deferred_save_not_supported(self):
+        switch = self._make_switch_device(
+            extra_cfg={'ngs_save_configuration_delay': '60'})
+        self.assertIsNone(switch.save_scheduler)
+
+    @mock.patch.object(netmiko_devices.batching.SwitchBatch,
+                       'save_configuration', autospec=True)
+    def test_save_configuration_locked_batched(self, save_mock):
+        self.cfg.config(batch_backend='memory', group='ngs_coordination')
+        switch = self._make_switch_device(
+            extra_cfg={'ngs_batch_requests': True,
+                       'ngs_save_configuration_delay': '60'})
+
+        switch._save_configuration_locked()
+
+        save_mock.assert_called_once_with(switch.batch_cmds, switch)
+
     @mock.patch.object(netmiko_devices.NetmikoSwitch,
                        '_drain_cached_connections', autospec=True)
     @mock.patch.object(netmiko_devices.NetmikoSwitch,
@@ -1158,9 +1689,13 @@ class TestNetmikoSwitch(NetmikoSwitchTestBase):
         mock_hostname.return_value = 'viking'
         switch = self._make_switch_device(
             extra_cfg={'ngs_max_connections': 2})
-        self.assertEqual(coord, switch.locker)
-        get_coord_mock.assert_called_once_with('mysql://localhost',
-                                               'ngs-viking'.encode('ascii'))
+        self.addCleanup(switch.locker.release)
+        self.assertIsInstance(switch.locker,
+                              netmiko_devices.ngs_lock.SharedCoordinator)
+        self.assertEqual('mysql://localhost', switch.locker.backend_url)
+        self.assertEqual(b'ngs-viking', switch.locker.member_id)
+        # The coordinator is started on first use.
+        get_coord_mock.assert_not_called()
 
         connect_mock = mock.MagicMock(SAVE_CONFIGURATION=None)
         connect_mock.__enter__.return_value = connect_mock
@@ -1168,7 +1703,7 @@ class TestNetmikoSwitch(NetmikoSwitchTestBase):
         lock_mock.return_value.__enter__.return_value = lock_mock
         switch.send_commands_to_device(['spam ham'])
 
-        lock_mock.assert_called_once_with(coord, locks_pool_size=2,
+        lock_mock.assert_called_once_with(switch.locker, locks_pool_size=2,
                                           locks_prefix='host',
                                           timeout=120)
         lock_mock.return_value.__exit__.assert_called_once()
@@ -70,6 +70,36 @@ class TestNetmikoNokiaSRL(test_netmiko_base.NetmikoSwitchTestBase):
             ['set interface 3333 subinterface 33 type bridged',
              'set network-instance mac-vrf-33 interface 3333.33'])
 
+    @mock.patch.object(nokia.NokiaSRL, '_execute_commands', autospec=True)
+    def test_send_commands_to_device_broker(self, mock_execute):
+        self.switch.device_name = 'sw1'
+        self.switch.broker = mock.Mock()
+        self.switch.broker.send_commands.return_value = 'output'
+
+        self.assertEqual('output',
+                         self.switch.send_commands_to_device(['cmd1']))
+
+        self.switch.broker.send_commands.assert_called_once_with(
+            'sw1', ['cmd1'])
+        mock_execute.assert_not_called()
+
+    @mock.patch.object(nokia.NokiaSRL, 'save_configuration', autospec=True)
+    @mock.patch.object(nokia.NokiaSRL, 'commit', autospec=True)
+    @mock.patch.object(nokia.NokiaSRL, 'send_config_set', autospec=True)
+    @mock.patch.object(nokia.NokiaSRL, '_get_connection', autospec=True)
+    def test_send_commands_to_device(self, mock_conn, mock_send, mock_commit,
+                                     mock_save):
+        net_connect = mock_conn.return_value.__enter__.return_value
+        mock_send.return_value = 'output'
+        mock_commit.return_value = ' committed'
+
+        self.assertEqual('output committed',
+                         self.switch.send_commands_to_device(['cmd1']))
+
+        mock_send.assert_called_once_with(self.switch, net_connect, ['cmd1'])
+        mock_commit.assert_called_once_with(self.switch, net_connect)
+        mock_save.assert_called_once_with(self.switch, net_connect)
+
     @mock.patch('networking_generic_switch.devices.netmiko_devices.nokia.'
                 'NokiaSRL.send_commands_to_device', autospec=True)
     def test_delete_port(self, mock_exec):
@@ -318,6 +318,78 @@ trunks              : []'''
         result = self.switch._parse_vlan_vni(output, 100, 5000)
         self.assertFalse(result)
 
+    def test__parse_state_snapshot(self):
+        ports = '''_uuid               : 12345678-1234-1234-1234-123456789abc
+name                : "eth0"
+tag                 : 100
+trunks              : []
+
+_uuid               : 87654321-4321-4321-4321-cba987654321
+name                : "eth1"
+tag                 : []
+trunks              : [100, 200]'''
+        external_ids = '{key1=value1, "vni-5000"="100", vni-6000=300}'
+        snapshot = self.switch._parse_state_snapshot([ports, external_ids])
+        self.assertTrue(snapshot.port_in_vlan('eth0', 100))
+        self.assertTrue(snapshot.port_in_vlan('eth1', 100))
+        self.assertTrue(snapshot.port_in_vlan('eth1', 200))
+        self.assertFalse(snapshot.port_in_vlan('eth0', 200))
+        self.assertFalse(snapshot.vlan_has_ports(300))
+        self.assertTrue(snapshot.vlan_has_vni(100, 5000))
+        self.assertTrue(snapshot.vlan_has_vni(300, 6000))
+        self.assertFalse(snapshot.vlan_has_vni(200, 5000))
+
+    def test__parse_vlan_ports_trunk(self):
+        output = '''_uuid               : 12345678-1234-1234-1234-123456789abc
+name                : "eth0"
+tag                 : []
+trunks              : [100, 200]'''
+        self.assertTrue(self.switch._parse_vlan_ports(output, 100))
+        self.assertTrue(self.switch._parse_vlan_ports(output, 200))
+        self.assertFalse(self.switch._parse_vlan_ports(output, 300))
+
+    def test__parse_state_snapshot_agrees(self):
+        ports = '''_uuid               : 12345678-1234-1234-1234-123456789abc
+name                : "eth0"
+tag                 : 100
+trunks              : []
+
+_uuid               : 87654321-4321-4321-4321-cba987654321
+name                : "eth1"
+tag                 : []
+trunks              : [200, 300]
+
+_uuid               : 11111111-2222-3333-4444-555555555555
+name                : "eth2"
+tag                 : []
+trunks              : []'''
+        external_ids = '{key1=value1, "vni-5000"="100", vni-6000=400}'
+        snapshot = self.switch._parse_state_snapshot([ports, external_ids])
+        for vlan in (100, 200, 300, 400, 500):
+            self.assertEqual(
+                self.switch._parse_vlan_ports(ports, vlan),
+                snapshot.vlan_has_ports(vlan))
+            for vni in (5000, 6000):
+                self.assertEqual(
+                    self.switch._parse_vlan_vni(external_ids, vlan, vni),
+                    snapshot.vlan_has_vni(vlan, vni))
+
+    @mock.patch('networking_generic_switch.devices.netmiko_devices.'
+                'NetmikoSwitch._get_connection', autospec=True)
+    def test_get_state_snapshot(self, mock_conn):
+        mock_net_connect = mock.MagicMock()
+        mock_net_connect.send_command.side_effect = [
+            'name : "eth0"\ntag : 100', '{"vni-5000"="100"}']
+        mock_conn.return_value.__enter__.return_value = mock_net_connect
+
+        snapshot = self.switch.get_state_snapshot()
+
+        self.assertTrue(snapshot.port_in_vlan('eth0', 100))
+        self.assertTrue(snapshot.vlan_has_vni(100, 5000))
+        mock_net_connect.send_command.assert_has_calls([
+            mock.call('ovs-vsctl list port'),
+            mock.call('ovs-vsctl get bridge genericswitch external_ids')])
+
     def test__parse_vlan_vni_not_found(self):
         output = '''{key1=value1, key2=value2}'''
         result = self.switch._parse_vlan_vni(output, 100, 5000)
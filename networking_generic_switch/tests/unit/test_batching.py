@@ -12,6 +12,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
 from unittest import mock
 
 from etcd3gw.exceptions import Etcd3Exception
@@ -25,6 +26,7 @@ import tenacity
 
 from networking_generic_switch import batching
 from networking_generic_switch import exceptions as exc
+from networking_generic_switch import metrics
 
 
 class SwitchQueueTest(fixtures.TestWithFixtures):
@@ -78,6 +80,27 @@ class SwitchQueueTest(fixtures.TestWithFixtures):
         }
         self.client.transaction.assert_called_once_with(expected_txn)
 
+    @mock.patch.object(uuidutils, "generate_uuid", autospec=True)
+    def test_add_batch_with_op(self, mock_uuid):
+        mock_uuid.return_value = "uuid"
+        self.client.transaction.return_value = {
+            "succeeded": True,
+            "responses": [{
+                "response_put": {
+                    "header": {
+                        "revision": 42
+                    }
+                }
+            }]
+        }
+        op = batching.network_operation('add', 22, 'net')
+
+        self.queue.add_batch(["cmd1"], op=op)
+
+        txn = self.client.transaction.call_args[0][0]
+        value = txn['success'][0]['request_put']['value']
+        self.assertIn(b'"op": {', base64.b64decode(value))
+
     @mock.patch.object(uuidutils, "generate_uuid", autospec=True)
     def test_add_batch_failure(self, mock_uuid):
         mock_uuid.return_value = "uuid"
@@ -154,6 +177,90 @@ class SwitchQueueTest(fixtures.TestWithFixtures):
                                    mock.call(self.queue, result_key)])
         self.assertEqual(2, mock_get.call_count)
 
+    @mock.patch.object(uuidutils, "generate_uuid", autospec=True)
+    def test_add_batch_shared_result_watch(self, mock_uuid):
+        mock_uuid.return_value = "uuid"
+        self.queue.result_watcher = mock.Mock()
+        self.client.transaction.return_value = {
+            "succeeded": True,
+            "responses": [{
+                "response_put": {
+                    "header": {
+                        "revision": 42
+                    }
+                }
+            }]
+        }
+
+        item = self.queue.add_batch(["cmd1", "cmd2"])
+
+        self.assertEqual("uuid", item.uuid)
+        self.queue.result_watcher.register.assert_called_once_with("uuid")
+        self.assertEqual(0, self.queue.result_watcher.unregister.call_count)
+
+    @mock.patch.object(uuidutils, "generate_uuid", autospec=True)
+    def test_add_batch_shared_result_watch_failure(self, mock_uuid):
+        mock_uuid.return_value = "uuid"
+        self.queue.result_watcher = mock.Mock()
+        self.client.transaction.return_value = {"succeeded": False}
+
+        self.assertRaises(exc.GenericSwitchBatchError,
+                          self.queue.add_batch, ["cmd1", "cmd2"])
+
+        self.queue.result_watcher.unregister.assert_called_once_with("uuid")
+
+    @mock.patch.object(batching.SwitchQueue, "_get_and_delete_result",
+                       autospec=True)
+    def test_wait_for_result_shared(self, mock_get):
+        self.queue.result_watcher = batching.ResultWatcher(
+            self.switch_name, self.client)
+        self.client.watch_prefix.return_value = (iter([]), mock.Mock())
+        self.queue.result_watcher.register("uuid")
+        self.queue.result_watcher.get_future("uuid").set_result(
+            {"result": "output"})
+        item = batching.SwitchQueueItem("uuid", 42)
+
+        result = self.queue.wait_for_result(item, 43)
+
+        self.assertEqual("output", result)
+        self.assertEqual(0, mock_get.call_count)
+        self.assertEqual(0, self.client.watch_once.call_count)
+        self.client.delete.assert_called_once_with(
+            "/ngs/batch/switch1/output/uuid")
+        self.assertIsNone(self.queue.result_watcher.get_future("uuid"))
+
+    @mock.patch.object(batching, "RESULT_WATCH_TIMEOUT", 0.01)
+    @mock.patch.object(batching.SwitchQueue, "_get_and_delete_result",
+                       autospec=True)
+    def test_wait_for_result_shared_missed_event(self, mock_get):
+        self.queue.result_watcher = batching.ResultWatcher(
+            self.switch_name, self.client)
+        self.client.watch_prefix.return_value = (iter([]), mock.Mock())
+        self.queue.result_watcher.register("uuid")
+        mock_get.side_effect = [None, {"error": "bang"}]
+        item = batching.SwitchQueueItem("uuid", 42)
+
+        self.assertRaises(exc.GenericSwitchBatchError,
+                          self.queue.wait_for_result, item, 43)
+
+        self.assertEqual(2, mock_get.call_count)
+        self.assertEqual(0, self.client.delete.call_count)
+
+    @mock.patch.object(batching.SwitchQueue, "_get_and_delete_result",
+                       autospec=True)
+    def test_wait_for_result_shared_timeout(self, mock_get):
+        self.queue.result_watcher = batching.ResultWatcher(
+            self.switch_name, self.client)
+        self.client.watch_prefix.return_value = (iter([]), mock.Mock())
+        self.queue.result_watcher.register("uuid")
+        mock_get.return_value = None
+        item = batching.SwitchQueueItem("uuid", 42)
+
+        self.assertRaises(exc.GenericSwitchBatchError,
+                          self.queue.wait_for_result, item, 0.01)
+
+        self.assertIsNone(self.queue.result_watcher.get_future("uuid"))
+
     def test_get_and_delete_result(self):
         self.client.transaction.return_value = {
             "succeeded": True,
@@ -222,6 +329,22 @@ class SwitchQueueTest(fixtures.TestWithFixtures):
             sort_order='ascend', sort_target='create',
             max_create_revision=None)
 
+    def test_has_batches(self):
+        self.client.get.return_value = [(b'', {})]
+
+        self.assertTrue(self.queue.has_batches())
+
+        input_prefix = '/ngs/batch/switch1/input/'
+        self.client.get.assert_called_once_with(
+            input_prefix,
+            range_end=_encode(_increment_last_byte(input_prefix)),
+            keys_only=True, limit=1)
+
+    def test_has_batches_empty(self):
+        self.client.get.return_value = []
+
+        self.assertFalse(self.queue.has_batches())
+
     def test_get_batches_with_item(self):
         self.client.get.return_value = [
             (b'{"foo": "bar"}', {}),
@@ -274,6 +397,79 @@ class SwitchQueueTest(fixtures.TestWithFixtures):
         }
         self.client.transaction.assert_called_once_with(expected_txn)
 
+    def test_record_results(self):
+        self.client.transaction.return_value = {"succeeded": True}
+        batches = [
+            {"result_key": "result1", "input_key": "input1",
+             "result": "asdf"},
+            {"result_key": "result2", "input_key": "input2",
+             "error": "bang"},
+        ]
+
+        self.queue.record_results(batches)
+
+        self.client.lease.assert_called_once_with(ttl=600)
+        expected_txn = {
+            'compare': [],
+            'success': [
+                {
+                    'request_put': {
+                        'key': _encode("result1"),
+                        'value': mock.ANY,
+                        'lease': mock.ANY,
+                    }
+                },
+                {
+                    'request_delete_range': {
+                        'key': _encode("input1"),
+                    }
+                },
+                {
+                    'request_put': {
+                        'key': _encode("result2"),
+                        'value': mock.ANY,
+                        'lease': mock.ANY,
+                    }
+                },
+                {
+                    'request_delete_range': {
+                        'key': _encode("input2"),
+                    }
+                }
+            ],
+            'failure': []
+        }
+        self.client.transaction.assert_called_once_with(expected_txn)
+
+    def test_record_results_many(self):
+        self.client.transaction.return_value = {"succeeded": True}
+        batches = [{"result_key": "result%d" % i, "input_key": "input%d" % i,
+                    "result": "asdf"} for i in range(100)]
+
+        self.queue.record_results(batches)
+
+        self.client.lease.assert_called_once_with(ttl=600)
+        self.assertEqual(2, self.client.transaction.call_count)
+        txns = [c[0][0] for c in self.client.transaction.call_args_list]
+        self.assertEqual(batching.MAX_TXN_OPS, len(txns[0]['success']))
+        self.assertEqual(200 - batching.MAX_TXN_OPS,
+                         len(txns[1]['success']))
+
+    def test_record_results_shared_lease(self):
+        self.queue = batching.SwitchQueue(self.switch_name, self.client,
+                                          shared_lease=True)
+        self.addCleanup(self.queue.input_leases.stop)
+        self.addCleanup(self.queue.result_leases.stop)
+        self.client.transaction.return_value = {"succeeded": True}
+        batch = {"result_key": "result1", "input_key": "input1",
+                 "result": "asdf"}
+
+        self.queue.record_result(batch)
+        self.queue.record_result(batch)
+
+        self.client.lease.assert_called_once_with(ttl=600)
+        self.assertEqual(2, self.client.transaction.call_count)
+
     def test_record_result_failure(self):
         self.client.transaction.return_value = {"succeeded": False}
         batch = {"result_key": "result1", "input_key": "input1",
@@ -328,6 +524,41 @@ class SwitchQueueTest(fixtures.TestWithFixtures):
         self.assertEqual(2, mock_get.call_count)
         self.assertEqual(3, lock.acquire.call_count)
 
+    def test_try_worker_lock(self):
+        lock = mock.MagicMock()
+        lock.acquire.return_value = True
+        self.client.lock.return_value = lock
+
+        result = self.queue.try_worker_lock()
+
+        self.assertEqual(lock, result)
+        self.client.lock.assert_called_once_with(
+            "/ngs/batch/switch1/execute_lock", 120)
+
+    def test_try_worker_lock_held(self):
+        lock = mock.MagicMock()
+        lock.acquire.return_value = False
+        self.client.lock.return_value = lock
+
+        self.assertIsNone(self.queue.try_worker_lock())
+
+    def test_watch_for_work(self):
+        cancel_input = mock.Mock()
+        cancel_lock = mock.Mock()
+        self.client.watch_prefix.return_value = (iter(["put"]), cancel_input)
+        self.client.watch.return_value = (iter(["delete"]), cancel_lock)
+        callback = mock.Mock()
+
+        cancel = self.queue.watch_for_work(callback)
+        cancel()
+
+        self.client.watch_prefix.assert_called_once_with(
+            "/ngs/batch/switch1/input/", filters=['NODELETE'])
+        self.client.watch.assert_called_once_with(
+            "/locks//ngs/batch/switch1/execute_lock", filters=['NOPUT'])
+        cancel_input.assert_called_once_with()
+        cancel_lock.assert_called_once_with()
+
 
 class SwitchBatchTest(fixtures.TestWithFixtures):
     def setUp(self):
@@ -347,10 +578,89 @@ class SwitchBatchTest(fixtures.TestWithFixtures):
         result = self.batch.do_batch("device", ["cmd1"])
 
         self.assertEqual("output", result)
-        self.assertEqual(1, mock_spawn.call_count)
-        self.queue.add_batch.assert_called_once_with(["cmd1"])
+        mock_spawn.assert_called_once_with(mock.ANY, 0.001)
+        self.queue.add_batch.assert_called_once_with(["cmd1"], op=None)
         self.queue.wait_for_result.assert_called_once_with("item", 300)
 
+    @mock.patch.object(batching.SwitchBatch, "_spawn", autospec=True)
+    def test_do_batch_with_op(self, mock_spawn):
+        self.queue.add_batch.return_value = "item"
+        self.queue.wait_for_result.return_value = "output"
+        op = batching.network_operation('add', 22, 'net')
+
+        result = self.batch.do_batch("device", ["cmd1"], op=op)
+
+        self.assertEqual("output", result)
+        self.queue.add_batch.assert_called_once_with(["cmd1"], op=op)
+
+    @mock.patch.object(batching, "WatchWorker", autospec=True)
+    @mock.patch.object(batching.SwitchBatch, "_spawn", autospec=True)
+    def test_close(self, mock_spawn, mock_worker):
+        self.batch.watch_worker = True
+        worker = self.batch._get_worker("device")
+        batching.WATCH_WORKERS.append(worker)
+
+        self.batch.close()
+
+        worker.stop.assert_called_once_with(
+            timeout=batching.SHUTDOWN_TIMEOUT)
+        self.assertNotIn(worker, batching.WATCH_WORKERS)
+        self.queue.close.assert_called_once_with()
+
+        # Batches added later are executed by a spawned worker.
+        self.queue.add_batch.return_value = "item"
+        self.queue.wait_for_result.return_value = "output"
+        self.assertEqual("output", self.batch.do_batch("device", ["cmd1"]))
+        mock_spawn.assert_called_once_with(mock.ANY, 0.001)
+        self.assertEqual(1, mock_worker.call_count)
+
+    @mock.patch.object(batching, "WatchWorker", autospec=True)
+    @mock.patch.object(batching.SwitchBatch, "_spawn", autospec=True)
+    def test_do_batch_watch_worker(self, mock_spawn, mock_worker):
+        self.batch.watch_worker = True
+        self.queue.add_batch.return_value = "item"
+        self.queue.wait_for_result.return_value = "output"
+
+        result = self.batch.do_batch("device", ["cmd1"])
+        self.batch.do_batch("device", ["cmd2"])
+
+        self.assertEqual("output", result)
+        self.assertEqual(0, mock_spawn.call_count)
+        mock_worker.assert_called_once_with(self.batch, "device")
+        self.assertEqual(2, mock_worker.return_value.notify.call_count)
+
+    @mock.patch.object(batching.SwitchBatch, "_send_commands", autospec=True)
+    def test_execute_available_batches(self, mock_send):
+        batches = [{"cmds": ["cmd1"]}]
+        self.queue.has_batches.return_value = True
+        self.queue.get_batches.return_value = batches
+        lock = mock.MagicMock()
+        self.queue.try_worker_lock.return_value = lock
+
+        self.batch._execute_available_batches("device")
+
+        mock_send.assert_called_once_with(self.batch, "device", batches, lock)
+        lock.release.assert_called_once_with()
+
+    @mock.patch.object(batching.SwitchBatch, "_send_commands", autospec=True)
+    def test_execute_available_batches_no_work(self, mock_send):
+        self.queue.has_batches.return_value = False
+
+        self.batch._execute_available_batches("device")
+
+        self.assertEqual(0, self.queue.try_worker_lock.call_count)
+        self.assertEqual(0, mock_send.call_count)
+
+    @mock.patch.object(batching.SwitchBatch, "_send_commands", autospec=True)
+    def test_execute_available_batches_locked(self, mock_send):
+        self.queue.has_batches.return_value = True
+        self.queue.try_worker_lock.return_value = None
+
+        self.batch._execute_available_batches("device")
+
+        self.assertEqual(0, self.queue.get_batches.call_count)
+        self.assertEqual(0, mock_send.call_count)
+
     def test_execute_pending_batches_skip(self):
         self.queue.get_batches.return_value = []
 
@@ -386,7 +696,7 @@ class SwitchBatchTest(fixtures.TestWithFixtures):
             {"cmds": ["cmd3", "cmd4"]},
         ]
         self.queue.get_batches.return_value = batches
-        device = mock.MagicMock()
+        device = mock.MagicMock(save_scheduler=None)
         lock = mock.MagicMock()
         self.queue.acquire_worker_lock.return_value = lock
 
@@ -396,6 +706,52 @@ class SwitchBatchTest(fixtures.TestWithFixtures):
         self.queue.acquire_worker_lock.assert_called_once_with("item")
         lock.release.assert_called_once_with()
 
+    @mock.patch.object(batching.SwitchBatch, "_send_commands", autospec=True)
+    def test_execute_pending_batches_compact(self, mock_send):
+        self.batch.compact = True
+        plug = batching.port_operation('plug', 'port1', 22)
+        unplug = batching.port_operation('unplug', 'port1', 22)
+        batches = [
+            {"cmds": ["plug1"], "op": plug},
+            {"cmds": ["unplug1"], "op": unplug},
+            {"cmds": ["plug2"], "op": plug},
+        ]
+        self.queue.get_batches.return_value = batches
+        device = mock.MagicMock(save_scheduler=None)
+        lock = mock.MagicMock()
+        self.queue.acquire_worker_lock.return_value = lock
+
+        self.batch._execute_pending_batches(device, "item")
+
+        self.queue.record_results.assert_called_once_with([
+            {"cmds": ["plug1"], "op": plug, "result": ""},
+            {"cmds": ["unplug1"], "op": unplug, "result": ""},
+        ])
+        mock_send.assert_called_once_with(
+            self.batch, device, [{"cmds": ["plug2"], "op": plug}], lock)
+        lock.release.assert_called_once_with()
+
+    @mock.patch.object(batching.SwitchBatch, "_send_commands", autospec=True)
+    def test_execute_pending_batches_compact_pair(self, mock_send):
+        self.batch.compact = True
+        batches = [
+            {"cmds": ["add"],
+             "op": batching.network_operation('add', 22, 'net')},
+            {"cmds": ["del"],
+             "op": batching.network_operation('delete', 22, 'net')},
+        ]
+        self.queue.get_batches.return_value = batches
+        lock = mock.MagicMock()
+        self.queue.acquire_worker_lock.return_value = lock
+
+        self.batch._execute_pending_batches("device", "item")
+
+        # Only the earlier batch is cancelled, the later one is sent.
+        self.queue.record_results.assert_called_once_with([batches[0]])
+        mock_send.assert_called_once_with(
+            self.batch, "device", [batches[1]], lock)
+        lock.release.assert_called_once_with()
+
     @mock.patch.object(batching.SwitchBatch, "_send_commands", autospec=True)
     def test_execute_pending_batches_failure(self, mock_send):
         batches = [
@@ -403,7 +759,7 @@ class SwitchBatchTest(fixtures.TestWithFixtures):
             {"cmds": ["cmd3", "cmd4"]},
         ]
         self.queue.get_batches.return_value = batches
-        device = mock.MagicMock()
+        device = mock.MagicMock(save_scheduler=None)
         lock = mock.MagicMock()
         self.queue.acquire_worker_lock.return_value = lock
         mock_send.side_effect = exc.GenericSwitchBatchError
@@ -415,7 +771,7 @@ class SwitchBatchTest(fixtures.TestWithFixtures):
         lock.release.assert_called_once_with()
 
     def test_send_commands_one_batch(self):
-        device = mock.MagicMock()
+        device = mock.MagicMock(save_scheduler=None)
         device.send_config_set.return_value = "output"
         batches = [
             {"cmds": ["cmd1", "cmd2"]},
@@ -433,8 +789,43 @@ class SwitchBatchTest(fixtures.TestWithFixtures):
             {"cmds": ["cmd1", "cmd2"], "result": "output"})
         device.save_configuration.assert_called_once_with(connection)
 
-    def test_send_commands_two_batches(self):
+    def test_send_commands_deferred_save(self):
+        device = mock.MagicMock()
+        device.send_config_set.side_effect = ["output1", "output2"]
+        batches = [
+            {"cmds": ["cmd1"]},
+            {"cmds": ["cmd2"]},
+        ]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        device.save_scheduler.record_change.assert_called_once_with(2)
+        device.save_configuration.assert_not_called()
+
+    def test_save_configuration(self):
+        device = mock.MagicMock()
+        lock = mock.MagicMock()
+        self.queue.try_worker_lock.side_effect = [None, lock]
+
+        self.batch.save_configuration(device)
+
+        connection = device._get_connection.return_value.__enter__.return_value
+        device.save_configuration.assert_called_once_with(connection)
+        lock.release.assert_called_once_with()
+
+    def test_save_configuration_lock_timeout(self):
         device = mock.MagicMock()
+        self.queue.try_worker_lock.return_value = None
+
+        self.assertRaises(exc.GenericSwitchBatchError,
+                          self.batch.save_configuration, device,
+                          acquire_timeout=0)
+
+        device.save_configuration.assert_not_called()
+
+    def test_send_commands_two_batches(self):
+        device = mock.MagicMock(save_scheduler=None)
         device.send_config_set.side_effect = ["output1", "output2"]
         batches = [
             {"cmds": ["cmd1", "cmd2"]},
@@ -461,7 +852,7 @@ class SwitchBatchTest(fixtures.TestWithFixtures):
         self.assertEqual(1, device.save_configuration.call_count)
 
     def test_send_commands_failure(self):
-        device = mock.MagicMock()
+        device = mock.MagicMock(save_scheduler=None)
         device.send_config_set.side_effect = Exception("Bang")
         batches = [
             {"cmds": ["cmd1", "cmd2"]},
@@ -480,7 +871,7 @@ class SwitchBatchTest(fixtures.TestWithFixtures):
         device.save_configuration.assert_called_once_with(connection)
 
     def test_send_commands_lock_timeout(self):
-        device = mock.MagicMock()
+        device = mock.MagicMock(save_scheduler=None)
         device.send_config_set.side_effect = Exception("Bang")
         batches = [
             {"cmds": ["cmd1", "cmd2"]},
@@ -496,3 +887,979 @@ class SwitchBatchTest(fixtures.TestWithFixtures):
             connection, ["cmd1", "cmd2"])
         self.assertEqual(0, self.queue.record_result.call_count)
         self.assertEqual(0, device.save_configuration.call_count)
+
+    def test_send_commands_coalesced(self):
+        self.batch.coalesce = True
+        device = mock.MagicMock(save_scheduler=None)
+        device.send_config_set.return_value = (
+            "config\n(config)# cmd1\n(config)# cmd2\n"
+            "(config)# cmd3\n(config)# cmd4\n(config)# end")
+        batches = [
+            {"cmds": ["cmd1", "cmd2"]},
+            {"cmds": ["cmd3", "cmd4"]},
+        ]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        connection = device._get_connection.return_value.__enter__.return_value
+        device.send_config_set.assert_called_once_with(
+            connection, ["cmd1", "cmd2", "cmd3", "cmd4"])
+        lock.refresh.assert_called_once_with()
+        lock.is_acquired.assert_called_once_with()
+        self.queue.record_results.assert_called_once_with([
+            {"cmds": ["cmd1", "cmd2"],
+             "result": "config\n(config)# cmd1\n(config)# cmd2\n"},
+            {"cmds": ["cmd3", "cmd4"],
+             "result": "(config)# cmd3\n(config)# cmd4\n(config)# end"},
+        ])
+        self.assertEqual(0, self.queue.record_result.call_count)
+        device.save_configuration.assert_called_once_with(connection)
+
+    def test_send_commands_coalesced_unsplittable_output(self):
+        self.batch.coalesce = True
+        device = mock.MagicMock(save_scheduler=None)
+        device.send_config_set.return_value = "output"
+        batches = [
+            {"cmds": ["cmd1", "cmd2"]},
+            {"cmds": ["cmd3", "cmd4"]},
+        ]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        self.assertEqual(1, device.send_config_set.call_count)
+        self.queue.record_results.assert_called_once_with([
+            {"cmds": ["cmd1", "cmd2"], "result": "output"},
+            {"cmds": ["cmd3", "cmd4"], "result": "output"},
+        ])
+
+    def test_send_commands_coalesced_unsplittable_output_error(self):
+        self.batch.coalesce = True
+        device = mock.MagicMock(save_scheduler=None)
+        device.send_config_set.side_effect = [
+            "% Invalid input", "output1", "% Invalid input"]
+        device.check_output.side_effect = exc.GenericSwitchNetmikoConfigError
+        batches = [
+            {"cmds": ["cmd1", "cmd2"]},
+            {"cmds": ["cmd3", "cmd4"]},
+        ]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        # The error cannot be attributed, so each batch is sent again and
+        # only the failing batch sees the error.
+        connection = device._get_connection.return_value.__enter__.return_value
+        device.send_config_set.assert_has_calls([
+            mock.call(connection, ["cmd1", "cmd2", "cmd3", "cmd4"]),
+            mock.call(connection, ["cmd1", "cmd2"]),
+            mock.call(connection, ["cmd3", "cmd4"]),
+        ])
+        device.check_output.assert_called_once_with(
+            "% Invalid input", 'coalesced batches')
+        self.queue.record_results.assert_called_once_with([
+            {"cmds": ["cmd1", "cmd2"], "result": "output1"},
+            {"cmds": ["cmd3", "cmd4"], "result": "% Invalid input"},
+        ])
+
+    def test_send_commands_coalesced_failure(self):
+        self.batch.coalesce = True
+        device = mock.MagicMock(save_scheduler=None)
+        connections = [mock.MagicMock(), mock.MagicMock()]
+        device._get_connection.side_effect = connections
+        device.send_config_set.side_effect = [
+            Exception("Bang"), "output1", Exception("Bang2")]
+        batches = [
+            {"cmds": ["cmd1", "cmd2"]},
+            {"cmds": ["cmd3", "cmd4"]},
+        ]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        failed = connections[0].__enter__.return_value
+        connection = connections[1].__enter__.return_value
+        device.send_config_set.assert_has_calls([
+            mock.call(failed, ["cmd1", "cmd2", "cmd3", "cmd4"]),
+            mock.call(connection, ["cmd1", "cmd2"]),
+            mock.call(connection, ["cmd3", "cmd4"]),
+        ])
+        # The failed connection is closed rather than reused.
+        connections[0].__exit__.assert_called_once_with(
+            batching._SessionFailed, mock.ANY, mock.ANY)
+        # The lock is refreshed before each batch and before recording.
+        self.assertEqual(3, lock.refresh.call_count)
+        self.queue.record_results.assert_called_once_with([
+            {"cmds": ["cmd1", "cmd2"], "result": "output1"},
+            {"cmds": ["cmd3", "cmd4"], "error": "Bang2"},
+        ])
+        device.save_configuration.assert_called_once_with(connection)
+
+    def test_send_commands_coalesced_failure_chunks(self):
+        self.batch.coalesce = True
+        self.batch.max_coalesce_commands = 1
+        device = mock.MagicMock(save_scheduler=None)
+        connections = [mock.MagicMock(), mock.MagicMock()]
+        device._get_connection.side_effect = connections
+        device.send_config_set.side_effect = [
+            Exception("Bang"), "output1", "output2"]
+        batches = [
+            {"cmds": ["cmd1"]},
+            {"cmds": ["cmd2"]},
+        ]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        # Later chunks are sent on the new connection.
+        connection = connections[1].__enter__.return_value
+        device.send_config_set.assert_has_calls([
+            mock.call(connections[0].__enter__.return_value, ["cmd1"]),
+            mock.call(connection, ["cmd1"]),
+            mock.call(connection, ["cmd2"]),
+        ])
+        self.queue.record_results.assert_has_calls([
+            mock.call([{"cmds": ["cmd1"], "result": "output1"}]),
+            mock.call([{"cmds": ["cmd2"], "result": "output2"}]),
+        ])
+
+    def test_send_commands_coalesced_failure_lock_timeout(self):
+        self.batch.coalesce = True
+        device = mock.MagicMock(save_scheduler=None)
+        device.send_config_set.side_effect = [Exception("Bang"), "output1"]
+        batches = [
+            {"cmds": ["cmd1"]},
+            {"cmds": ["cmd2"]},
+        ]
+        lock = mock.MagicMock()
+        lock.is_acquired.side_effect = [True, False]
+
+        self.assertRaises(exc.GenericSwitchBatchError,
+                          self.batch._send_commands, device, batches, lock)
+
+        # The second batch is not sent once the lock is lost.
+        self.assertEqual(2, device.send_config_set.call_count)
+        self.assertEqual(0, self.queue.record_results.call_count)
+
+    def test_send_commands_coalesced_check_output_failure(self):
+        self.batch.coalesce = True
+        device = mock.MagicMock(save_scheduler=None)
+        device.send_config_set.return_value = (
+            "(config)# cmd1\n(config)# cmd2\n% Invalid input\n(config)# end")
+        device.check_output.side_effect = exc.GenericSwitchNetmikoConfigError
+        batches = [
+            {"cmds": ["cmd1"]},
+            {"cmds": ["cmd2"]},
+        ]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        # The commands which were applied are not sent again. Errors in the
+        # output of individual batches are detected by callers.
+        device.send_config_set.assert_called_once_with(
+            device._get_connection.return_value.__enter__.return_value,
+            ["cmd1", "cmd2"])
+        self.queue.record_results.assert_called_once_with([
+            {"cmds": ["cmd1"], "result": "(config)# cmd1\n"},
+            {"cmds": ["cmd2"],
+             "result": "(config)# cmd2\n% Invalid input\n(config)# end"},
+        ])
+
+    def test_send_commands_coalesced_chunks(self):
+        self.batch.coalesce = True
+        self.batch.max_coalesce_commands = 3
+        device = mock.MagicMock(save_scheduler=None)
+        device.send_config_set.side_effect = ["output1", "output2"]
+        batches = [
+            {"cmds": ["cmd1", "cmd2"]},
+            {"cmds": ["cmd3"]},
+            {"cmds": ["cmd4", "cmd5"]},
+        ]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        connection = device._get_connection.return_value.__enter__.return_value
+        device.send_config_set.assert_has_calls([
+            mock.call(connection, ["cmd1", "cmd2", "cmd3"]),
+            mock.call(connection, ["cmd4", "cmd5"]),
+        ])
+        self.assertEqual(2, lock.refresh.call_count)
+        self.queue.record_results.assert_has_calls([
+            mock.call([{"cmds": ["cmd1", "cmd2"], "result": "output1"},
+                       {"cmds": ["cmd3"], "result": "output1"}]),
+            mock.call([{"cmds": ["cmd4", "cmd5"], "result": "output2"}]),
+        ])
+        device.save_configuration.assert_called_once_with(connection)
+
+    def test_send_commands_coalesced_lock_timeout(self):
+        self.batch.coalesce = True
+        device = mock.MagicMock(save_scheduler=None)
+        device.send_config_set.return_value = "output"
+        batches = [
+            {"cmds": ["cmd1", "cmd2"]},
+        ]
+        lock = mock.MagicMock()
+        lock.is_acquired.return_value = False
+
+        self.assertRaises(exc.GenericSwitchBatchError,
+                          self.batch._send_commands, device, batches, lock)
+
+        self.assertEqual(0, self.queue.record_results.call_count)
+        self.assertEqual(0, device.save_configuration.call_count)
+
+
+class NetconfSwitchBatchTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(NetconfSwitchBatchTest, self).setUp()
+        self.queue = mock.Mock()
+        self.batch = batching.NetconfSwitchBatch(
+            "switch1", switch_queue=self.queue)
+
+    def test_send_commands_merged(self):
+        device = mock.Mock()
+        batches = [
+            {"cmds": ["conf1", "conf2"]},
+            {"cmds": ["conf3"]},
+        ]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        device._edit_config.assert_called_once_with(
+            ["conf1", "conf2", "conf3"])
+        self.queue.record_results.assert_called_once_with([
+            {"cmds": ["conf1", "conf2"], "result": ""},
+            {"cmds": ["conf3"], "result": ""},
+        ])
+
+    def test_send_commands_merged_failure(self):
+        device = mock.Mock()
+        device._edit_config.side_effect = [
+            Exception("Bang"), None, Exception("Bang2")]
+        batches = [
+            {"cmds": ["conf1"]},
+            {"cmds": ["conf2"]},
+        ]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        device._edit_config.assert_has_calls([
+            mock.call(["conf1", "conf2"]),
+            mock.call(["conf1"]),
+            mock.call(["conf2"]),
+        ])
+        self.queue.record_results.assert_called_once_with([
+            {"cmds": ["conf1"], "result": ""},
+            {"cmds": ["conf2"], "error": "Bang2"},
+        ])
+
+    def test_send_commands_single_failure(self):
+        device = mock.Mock()
+        device._edit_config.side_effect = Exception("Bang")
+        batches = [{"cmds": ["conf1"]}]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        device._edit_config.assert_called_once_with(["conf1"])
+        self.queue.record_results.assert_called_once_with([
+            {"cmds": ["conf1"], "error": "Bang"},
+        ])
+
+    def test_send_commands_chunks(self):
+        self.batch.max_coalesce_commands = 2
+        device = mock.Mock()
+        batches = [
+            {"cmds": ["conf1", "conf2"]},
+            {"cmds": ["conf3"]},
+        ]
+        lock = mock.MagicMock()
+
+        self.batch._send_commands(device, batches, lock)
+
+        device._edit_config.assert_has_calls([
+            mock.call(["conf1", "conf2"]),
+            mock.call(["conf3"]),
+        ])
+        self.assertEqual(2, self.queue.record_results.call_count)
+
+
+class LeaseManagerTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(LeaseManagerTest, self).setUp()
+        self.client = mock.Mock()
+        self.manager = batching.LeaseManager(self.client, 600)
+        self.addCleanup(self.manager.stop)
+        self.addCleanup(self._remove_manager)
+
+    def _remove_manager(self):
+        if self.manager in batching.LEASE_MANAGERS:
+            batching.LEASE_MANAGERS.remove(self.manager)
+
+    def test_get_lease(self):
+        lease1 = self.manager.get_lease()
+        lease2 = self.manager.get_lease()
+
+        self.assertEqual(lease1, lease2)
+        self.client.lease.assert_called_once_with(ttl=600)
+        self.assertIn(self.manager, batching.LEASE_MANAGERS)
+
+    @mock.patch.object(batching.time, "monotonic", autospec=True)
+    def test_get_lease_rotate(self, mock_time):
+        self.client.lease.side_effect = ["lease1", "lease2"]
+        mock_time.side_effect = [0, 299, 300]
+
+        self.assertEqual("lease1", self.manager.get_lease())
+        self.assertEqual("lease1", self.manager.get_lease())
+        self.assertEqual("lease2", self.manager.get_lease())
+
+    def test_refresh_lease(self):
+        lease = self.manager.get_lease()
+
+        self.manager._refresh_lease()
+
+        lease.refresh.assert_called_once_with()
+        self.assertEqual(lease, self.manager.get_lease())
+
+    def test_refresh_lease_failure(self):
+        self.client.lease.side_effect = [mock.Mock(), mock.Mock()]
+        lease = self.manager.get_lease()
+        lease.refresh.side_effect = Etcd3Exception
+
+        self.manager._refresh_lease()
+
+        self.assertNotEqual(lease, self.manager.get_lease())
+        self.assertEqual(2, self.client.lease.call_count)
+
+    def test_stop(self):
+        lease = self.manager.get_lease()
+
+        self.manager.stop()
+
+        self.assertEqual(0, lease.revoke.call_count)
+        self.assertTrue(self.manager._stopped.is_set())
+
+    def test_stop_revoke(self):
+        self.manager.revoke_on_stop = True
+        lease = self.manager.get_lease()
+
+        self.manager.stop()
+
+        lease.revoke.assert_called_once_with()
+
+
+class ResultWatcherTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(ResultWatcherTest, self).setUp()
+        self.client = mock.Mock()
+        self.cancel = mock.Mock()
+        self.watcher = batching.ResultWatcher("switch1", self.client)
+        self.addCleanup(self.watcher.stop)
+
+    def test_register(self):
+        self.client.watch_prefix.return_value = (iter([]), self.cancel)
+
+        self.watcher.register("uuid1")
+        self.watcher._thread.join(5)
+        self.watcher.register("uuid2")
+
+        # The watch is restarted if it has stopped.
+        self.assertEqual(2, self.client.watch_prefix.call_count)
+        self.client.watch_prefix.assert_called_with(
+            "/ngs/batch/switch1/output/", filters=['NODELETE'])
+        self.assertIsNotNone(self.watcher.get_future("uuid1"))
+        self.watcher.unregister("uuid1")
+        self.assertIsNone(self.watcher.get_future("uuid1"))
+        self.assertIn(self.watcher, batching.RESULT_WATCHERS)
+        batching.RESULT_WATCHERS.remove(self.watcher)
+
+    def test_consume(self):
+        self.client.watch_prefix.return_value = (iter([]), self.cancel)
+        self.watcher.register("uuid1")
+        # etcd3gw passes the keys and values of events as bytes.
+        events = [
+            {"kv": {"key": b"/ngs/batch/switch1/output/other",
+                    "value": b'{"result": "other"}'}},
+            {"kv": {"key": b"/ngs/batch/switch1/output/uuid1",
+                    "value": b'{"result": "output"}'}},
+        ]
+
+        self.watcher._consume(iter(events))
+
+        self.assertEqual({"result": "output"},
+                         self.watcher.get_future("uuid1").result(0))
+        batching.RESULT_WATCHERS.remove(self.watcher)
+
+    def test_consume_invalid_value(self):
+        self.client.watch_prefix.return_value = (iter([]), self.cancel)
+        self.watcher.register("uuid1")
+        self.watcher.register("uuid2")
+        events = [
+            {"kv": {"key": b"/ngs/batch/switch1/output/uuid1",
+                    "value": b'not json'}},
+            {"kv": {"key": b"/ngs/batch/switch1/output/uuid2",
+                    "value": b'{"result": "output"}'}},
+        ]
+
+        self.watcher._consume(iter(events))
+
+        # The caller reads the result itself once it times out.
+        self.assertFalse(self.watcher.get_future("uuid1").done())
+        self.assertEqual({"result": "output"},
+                         self.watcher.get_future("uuid2").result(0))
+        batching.RESULT_WATCHERS.remove(self.watcher)
+
+    def test_stop(self):
+        self.client.watch_prefix.return_value = (iter([]), self.cancel)
+        self.watcher.register("uuid1")
+
+        self.watcher.stop()
+
+        self.cancel.assert_called_once_with()
+        batching.RESULT_WATCHERS.remove(self.watcher)
+
+
+class WatchWorkerTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(WatchWorkerTest, self).setUp()
+        self.switch_batch = mock.Mock()
+        self.switch_batch.switch_name = "switch1"
+        self.switch_batch.window.get_window.return_value = 0
+        self.switch_batch.watch_poll_interval = 10
+        self.cancel = self.switch_batch.queue.watch_for_work.return_value
+        self.worker = batching.WatchWorker(self.switch_batch, "device")
+        self.addCleanup(self.worker.stop, 1)
+
+    def test_notify(self):
+        executed = batching.threading.Event()
+        self.switch_batch._execute_available_batches.side_effect = (
+            lambda device: executed.set())
+
+        self.worker.notify()
+
+        self.assertTrue(executed.wait(5))
+        self.switch_batch._execute_available_batches.assert_called_with(
+            "device")
+        self.switch_batch.queue.watch_for_work.assert_called_once_with(
+            self.worker._wake.set)
+        self.assertIn(self.worker, batching.WATCH_WORKERS)
+
+    def test_stop(self):
+        self.worker.start()
+        self.worker.start()
+
+        self.worker.stop(5)
+
+        self.assertFalse(self.worker._thread.is_alive())
+        self.switch_batch.queue.watch_for_work.assert_called_once_with(
+            self.worker._wake.set)
+        self.cancel.assert_called_once_with()
+        batching.WATCH_WORKERS.remove(self.worker)
+
+    def test_poll(self):
+        self.switch_batch.watch_poll_interval = 0.01
+        executed = batching.threading.Event()
+        self.switch_batch._execute_available_batches.side_effect = (
+            lambda device: executed.set())
+
+        # Without a watch event, the worker checks for work periodically.
+        self.worker.start()
+
+        self.assertTrue(executed.wait(5))
+        batching.WATCH_WORKERS.remove(self.worker)
+
+
+class BatchWindowTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(BatchWindowTest, self).setUp()
+        self.cfg = self.useFixture(config_fixture.Config())
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.window = batching.BatchWindow("switch1", minimum=0.001,
+                                           maximum=0.5)
+
+    def test_fixed(self):
+        window = batching.BatchWindow("switch1", minimum=0.002)
+        window.record_arrival()
+        window.record_arrival()
+        window.record_send(1, 2)
+
+        self.assertFalse(window.adaptive)
+        self.assertEqual(0.002, window.get_window())
+        self.assertIsNone(window.arrival_interval)
+        self.assertIsNone(window.send_duration)
+
+    def test_no_samples(self):
+        self.assertTrue(self.window.adaptive)
+        self.assertEqual(0.001, self.window.get_window())
+
+    def test_frequent_arrivals(self):
+        self.window.arrival_interval = 0.05
+        self.window.send_duration = 2
+
+        self.assertEqual(0.2, self.window.get_window())
+        self.assertEqual({"switch1": 0.2},
+                         metrics.get_metrics()["gauges"]["batch_window"])
+
+    def test_limited_by_send_duration(self):
+        self.window.arrival_interval = 0.05
+        self.window.send_duration = 0.1
+
+        self.assertEqual(0.05, self.window.get_window())
+
+    def test_limited_by_maximum(self):
+        self.window.arrival_interval = 0.2
+        self.window.send_duration = 5
+
+        self.assertEqual(0.5, self.window.get_window())
+
+    def test_sparse_arrivals(self):
+        self.window.arrival_interval = 3
+        self.window.send_duration = 2
+
+        self.assertEqual(0.001, self.window.get_window())
+
+    @mock.patch.object(batching.time, "monotonic", autospec=True)
+    def test_record_arrival(self, mock_time):
+        mock_time.side_effect = [10, 10.1, 10.2, 3610]
+
+        self.window.record_arrival()
+        self.assertIsNone(self.window.arrival_interval)
+        self.window.record_arrival()
+        self.assertAlmostEqual(0.1, self.window.arrival_interval)
+        self.window.record_arrival()
+        self.assertAlmostEqual(0.1, self.window.arrival_interval)
+        # Idle time is bounded by the maximum window.
+        self.window.record_arrival()
+        self.assertAlmostEqual(0.18, self.window.arrival_interval)
+
+    def test_record_send(self):
+        self.window.record_send(1, 3)
+        self.window.record_send(2, 1)
+
+        self.assertAlmostEqual(1.2, self.window.send_duration)
+        histograms = metrics.get_metrics()["histograms"]
+        self.assertEqual(2, histograms["batch_size"]["switch1"]["count"])
+        self.assertEqual(4, histograms["batch_size"]["switch1"]["sum"])
+        self.assertEqual(
+            3, histograms["batch_send_duration"]["switch1"]["sum"])
+
+
+class CompactBatchesTest(fixtures.TestWithFixtures):
+    def _batch(self, op):
+        return {"cmds": ["cmd"], "op": op}
+
+    def test_compact_plug_unplug(self):
+        plug = self._batch(batching.port_operation('plug', 'p1', 22))
+        unplug = self._batch(batching.port_operation('unplug', 'p1', 22))
+        other = self._batch(batching.port_operation('plug', 'p2', 22))
+
+        remaining, cancelled = batching.compact_batches(
+            [plug, other, unplug])
+
+        self.assertEqual([other, unplug], remaining)
+        self.assertEqual([plug], cancelled)
+
+    def test_compact_unplug_plug(self):
+        # A retry after a failed unplug, while the port is still plugged.
+        # The plug must still be sent.
+        unplug = self._batch(batching.port_operation('unplug', 'p1', 22))
+        plug = self._batch(batching.port_operation('plug', 'p1', 22))
+
+        remaining, cancelled = batching.compact_batches([unplug, plug])
+
+        self.assertEqual([plug], remaining)
+        self.assertEqual([unplug], cancelled)
+
+    def test_compact_replug(self):
+        plug1 = self._batch(batching.port_operation('plug', 'p1', 22))
+        unplug = self._batch(batching.port_operation('unplug', 'p1', 22))
+        plug2 = self._batch(batching.port_operation('plug', 'p1', 22))
+
+        remaining, cancelled = batching.compact_batches(
+            [plug1, unplug, plug2])
+
+        self.assertEqual([plug2], remaining)
+        self.assertEqual([plug1, unplug], cancelled)
+
+    def test_compact_unplug_replug_unplug(self):
+        unplug1 = self._batch(batching.port_operation('unplug', 'p1', 22))
+        plug = self._batch(batching.port_operation('plug', 'p1', 22))
+        unplug2 = self._batch(batching.port_operation('unplug', 'p1', 22))
+
+        remaining, cancelled = batching.compact_batches(
+            [unplug1, plug, unplug2])
+
+        self.assertEqual([unplug2], remaining)
+        self.assertEqual([unplug1, plug], cancelled)
+
+    def test_compact_different_args(self):
+        plug = self._batch(batching.port_operation('plug', 'p1', 22))
+        unplug = self._batch(batching.port_operation('unplug', 'p1', 23))
+
+        remaining, cancelled = batching.compact_batches([plug, unplug])
+
+        self.assertEqual([plug, unplug], remaining)
+        self.assertEqual([], cancelled)
+
+    def test_compact_port_and_bond(self):
+        plug = self._batch(batching.port_operation('plug', 'p1', 22))
+        unplug = self._batch(batching.port_operation('unplug', 'p1', 22,
+                                                     kind='bond'))
+
+        remaining, cancelled = batching.compact_batches([plug, unplug])
+
+        self.assertEqual([plug, unplug], remaining)
+
+    def test_compact_blocked_by_port_conflict(self):
+        plug = self._batch(batching.port_operation('plug', 'p1', 22))
+        trunk = self._batch(batching.trunk_operation('add', 'p1', [23]))
+        unplug = self._batch(batching.port_operation('unplug', 'p1', 22))
+
+        remaining, cancelled = batching.compact_batches(
+            [plug, trunk, unplug])
+
+        self.assertEqual([plug, trunk, unplug], remaining)
+        self.assertEqual([], cancelled)
+
+    def test_compact_blocked_by_network_conflict(self):
+        plug = self._batch(batching.port_operation('plug', 'p1', 22))
+        delete = self._batch(batching.network_operation('delete', 22, 'n'))
+        unplug = self._batch(batching.port_operation('unplug', 'p1', 22))
+
+        remaining, cancelled = batching.compact_batches(
+            [plug, delete, unplug])
+
+        self.assertEqual([plug, delete, unplug], remaining)
+
+    def test_compact_blocked_by_unknown_op(self):
+        plug = self._batch(batching.port_operation('plug', 'p1', 22))
+        unknown = {"cmds": ["cmd"]}
+        unplug = self._batch(batching.port_operation('unplug', 'p1', 22))
+
+        remaining, cancelled = batching.compact_batches(
+            [plug, unknown, unplug])
+
+        self.assertEqual([plug, unknown, unplug], remaining)
+
+    def test_compact_network(self):
+        add = self._batch(batching.network_operation('add', 22, 'n'))
+        delete = self._batch(batching.network_operation('delete', 22, 'n'))
+        add2 = self._batch(batching.network_operation('add', 23, 'n2'))
+
+        remaining, cancelled = batching.compact_batches([add, add2, delete])
+
+        self.assertEqual([add2, delete], remaining)
+        self.assertEqual([add], cancelled)
+
+
+class SplitOutputTest(fixtures.TestWithFixtures):
+    def test_split_output(self):
+        output = "conf t\nsw# a\nsw# b\nsw# a\nsw# c\nsw# end"
+        batches = [{"cmds": ["a", "b"]}, {"cmds": ["a", "c"]}]
+
+        result = batching._split_output(output, batches)
+
+        self.assertEqual(["conf t\nsw# a\nsw# b\n",
+                          "sw# a\nsw# c\nsw# end"], result)
+
+    def test_split_output_missing_command(self):
+        output = "sw# a\nsw# b"
+        batches = [{"cmds": ["a"]}, {"cmds": ["c"]}]
+
+        self.assertIsNone(batching._split_output(output, batches))
+
+    def test_split_output_whole_lines(self):
+        output = ("sw(config)# vlan 100\nsw(config-vlan)# no vlan 10\n"
+                  "sw(config)# vlan 10\nsw(config)# end")
+        batches = [{"cmds": ["vlan 100", "no vlan 10"]},
+                   {"cmds": ["vlan 10"]}]
+
+        result = batching._split_output(output, batches)
+
+        self.assertEqual(["sw(config)# vlan 100\n"
+                          "sw(config-vlan)# no vlan 10\n",
+                          "sw(config)# vlan 10\nsw(config)# end"], result)
+
+    def test_split_output_prefix_of_other_command(self):
+        output = "sw# vlan 100\nsw# vlan 200"
+        batches = [{"cmds": ["vlan 10"]}, {"cmds": ["vlan 200"]}]
+
+        self.assertIsNone(batching._split_output(output, batches))
+
+    def test_split_output_nested_commands(self):
+        output = "sw# a"
+        batches = [{"cmds": [["a"]]}]
+
+        self.assertIsNone(batching._split_output(output, batches))
+
+
+class InProcessSwitchQueueTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(InProcessSwitchQueueTest, self).setUp()
+        self.queue = batching.InProcessSwitchQueue("switch1")
+
+    def test_add_batch(self):
+        item1 = self.queue.add_batch(["cmd1"])
+        item2 = self.queue.add_batch(["cmd2"], op={"kind": "port"})
+
+        self.assertEqual(1, item1.create_revision)
+        self.assertEqual(2, item2.create_revision)
+        self.assertTrue(self.queue.has_batches())
+        self.assertEqual([
+            {"uuid": item1.uuid, "cmds": ["cmd1"]},
+            {"uuid": item2.uuid, "cmds": ["cmd2"], "op": {"kind": "port"}},
+        ], self.queue.get_batches())
+        self.assertEqual([{"uuid": item1.uuid, "cmds": ["cmd1"]}],
+                         self.queue.get_batches(item1))
+
+    def test_record_results(self):
+        item = self.queue.add_batch(["cmd1"])
+        batch = self.queue.get_batches()[0]
+        batch["result"] = "output"
+
+        self.queue.record_results([batch])
+
+        self.assertFalse(self.queue.has_batches())
+        self.assertEqual("output", self.queue.wait_for_result(item, 1))
+
+    def test_wait_for_result_error(self):
+        item = self.queue.add_batch(["cmd1"])
+        batch = self.queue.get_batches()[0]
+        batch["error"] = "bang"
+        self.queue.record_result(batch)
+
+        self.assertRaises(exc.GenericSwitchBatchError,
+                          self.queue.wait_for_result, item, 1)
+
+    def test_wait_for_result_timeout(self):
+        item = self.queue.add_batch(["cmd1"])
+
+        self.assertRaises(exc.GenericSwitchBatchError,
+                          self.queue.wait_for_result, item, 0.01)
+
+        self.assertFalse(self.queue.has_batches())
+
+    def test_record_results_after_timeout(self):
+        item = self.queue.add_batch(["cmd1"])
+        batch = self.queue.get_batches()[0]
+        batch["result"] = "output"
+        self.assertRaises(exc.GenericSwitchBatchError,
+                          self.queue.wait_for_result, item, 0.01)
+
+        self.queue.record_results([batch])
+
+        self.assertEqual({}, self.queue._results)
+
+    def test_worker_lock(self):
+        item = self.queue.add_batch(["cmd1"])
+
+        lock = self.queue.acquire_worker_lock(item)
+
+        self.assertTrue(lock.is_acquired())
+        self.assertIsNone(self.queue.try_worker_lock())
+        self.assertRaises(exc.GenericSwitchBatchError,
+                          self.queue.acquire_worker_lock, item,
+                          acquire_timeout=0.01)
+        self.assertTrue(lock.release())
+        self.assertFalse(lock.is_acquired())
+        self.assertFalse(lock.release())
+        lock2 = self.queue.try_worker_lock()
+        self.assertTrue(lock2.is_acquired())
+        lock2.release()
+
+    def test_acquire_worker_lock_no_work(self):
+        item = self.queue.add_batch(["cmd1"])
+        lock = self.queue.try_worker_lock()
+        batch = self.queue.get_batches()[0]
+        batch["result"] = "output"
+
+        timer = batching.threading.Timer(
+            0.01, self.queue.record_results, args=([batch],))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        self.assertIsNone(self.queue.acquire_worker_lock(item))
+        lock.release()
+
+    def test_watch_for_work(self):
+        callback = mock.Mock()
+        cancel = self.queue.watch_for_work(callback)
+
+        self.queue.add_batch(["cmd1"])
+        self.queue.try_worker_lock().release()
+        cancel()
+        self.queue.add_batch(["cmd2"])
+
+        self.assertEqual(2, callback.call_count)
+
+    @mock.patch.object(batching.SwitchBatch, "_spawn", autospec=True)
+    def test_do_batch(self, mock_spawn):
+        mock_spawn.side_effect = (
+            lambda work_fn, delay:
+                batching.threading.Thread(target=work_fn).start())
+        switch_batch = batching.SwitchBatch("switch1", switch_queue=self.queue,
+                                            coalesce=True)
+        device = mock.MagicMock(save_scheduler=None)
+        device.send_config_set.side_effect = lambda conn, cmds: " ".join(cmds)
+
+        result = switch_batch.do_batch(device, ["cmd1", "cmd2"])
+
+        self.assertEqual("cmd1 cmd2", result)
+        self.assertFalse(self.queue.has_batches())
+
+    def test_do_batch_watch_worker(self):
+        switch_batch = batching.SwitchBatch("switch1", switch_queue=self.queue,
+                                            watch_worker=True)
+        device = mock.MagicMock(save_scheduler=None)
+        device.send_config_set.side_effect = lambda conn, cmds: " ".join(cmds)
+
+        result = switch_batch.do_batch(device, ["cmd1", "cmd2"])
+
+        self.assertEqual("cmd1 cmd2", result)
+        switch_batch._worker.stop(5)
+        batching.WATCH_WORKERS.remove(switch_batch._worker)
+
+
+class ToozSwitchQueueTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(ToozSwitchQueueTest, self).setUp()
+        self.coordinator = mock.Mock()
+        self.tooz_lock = self.coordinator.get_lock.return_value
+        self.queue = batching.ToozSwitchQueue("switch1", self.coordinator)
+
+    def test_try_worker_lock(self):
+        self.tooz_lock.acquire.return_value = True
+        self.tooz_lock.is_still_owner.return_value = True
+
+        lock = self.queue.try_worker_lock()
+
+        self.coordinator.get_lock.assert_called_once_with(b"ngs-batch-switch1")
+        self.tooz_lock.acquire.assert_called_once_with(blocking=False)
+        self.assertTrue(lock.is_acquired())
+        self.tooz_lock.is_still_owner.return_value = False
+        self.assertFalse(lock.is_acquired())
+        lock.release()
+        self.tooz_lock.release.assert_called_once_with()
+        # The in-process lock is released too.
+        self.assertIsNotNone(self.queue.try_worker_lock())
+
+    def test_try_worker_lock_held_by_other_process(self):
+        self.tooz_lock.acquire.return_value = False
+
+        self.assertIsNone(self.queue.try_worker_lock())
+
+        # The in-process lock is not kept.
+        self.tooz_lock.acquire.return_value = True
+        self.assertIsNotNone(self.queue.try_worker_lock())
+
+    def test_acquire_worker_lock(self):
+        self.tooz_lock.acquire.side_effect = [False, True]
+        item = self.queue.add_batch(["cmd1"])
+
+        lock = self.queue.acquire_worker_lock(
+            item, wait=tenacity.wait_none())
+
+        self.assertTrue(lock._acquired)
+        self.assertEqual(2, self.tooz_lock.acquire.call_count)
+
+    def test_acquire_worker_lock_timeout(self):
+        self.tooz_lock.acquire.return_value = False
+        item = self.queue.add_batch(["cmd1"])
+
+        self.assertRaises(
+            tenacity.RetryError, self.queue.acquire_worker_lock,
+            item, wait=tenacity.wait_none(), acquire_timeout=0.01)
+
+
+class GetSwitchQueueTest(fixtures.TestWithFixtures):
+    def test_memory(self):
+        queue = batching.get_switch_queue("switch1", backend='memory')
+
+        self.assertIsInstance(queue, batching.InProcessSwitchQueue)
+
+    @mock.patch.object(batching.device_utils, "get_hostname", autospec=True,
+                       return_value="host1")
+    @mock.patch.object(batching.ngs_lock, "get_coordinator",
+                       autospec=True)
+    def test_tooz(self, mock_get, mock_hostname):
+        queue = batching.get_switch_queue("switch1", backend='tooz',
+                                          backend_url='redis://host')
+
+        self.assertIsInstance(queue, batching.ToozSwitchQueue)
+        mock_get.assert_called_once_with('redis://host', b'ngs-batch-host1',
+                                         start_heart=True)
+        self.assertEqual(mock_get.return_value, queue.coordinator)
+
+    @mock.patch.object(batching.device_utils, "get_hostname", autospec=True,
+                       return_value="host1")
+    @mock.patch.object(batching.ngs_lock, "get_coordinator",
+                       autospec=True)
+    def test_tooz_close(self, mock_get, mock_hostname):
+        queue = batching.get_switch_queue("switch1", backend='tooz',
+                                          backend_url='redis://host')
+
+        queue.close()
+        queue.close()
+
+        mock_get.return_value.release.assert_called_once_with()
+
+    @mock.patch.object(batching.etcd3gw, "client", autospec=True)
+    def test_etcd_close(self, mock_client):
+        url = 'etcd3+http://host:2379'
+        queue = batching.get_switch_queue(
+            "switch1", backend_url=url, shared_result_watch=True,
+            shared_lease=True)
+        mock_client.return_value.watch_prefix.return_value = (
+            iter([]), mock.Mock())
+        queue.result_watcher.register('uuid')
+        result_watcher = queue.result_watcher
+        cancel = result_watcher._cancel
+        lease = queue.input_leases.get_lease()
+        input_leases = queue.input_leases
+
+        queue.close()
+        queue.close()
+
+        cancel.assert_called_once_with()
+        self.assertIsNone(queue.result_watcher)
+        self.assertNotIn(result_watcher, batching.RESULT_WATCHERS)
+        self.assertIsNone(queue.input_leases)
+        self.assertIsNone(queue.result_leases)
+        self.assertNotIn(input_leases, batching.LEASE_MANAGERS)
+        # Pending inputs are left for the worker of the new device.
+        lease.revoke.assert_not_called()
+        mock_client.return_value.session.close.assert_called_once_with()
+        self.assertNotIn(url, batching._ETCD_CLIENTS)
+
+    @mock.patch.object(batching.etcd3gw, "client", autospec=True)
+    def test_etcd(self, mock_client):
+        url = 'etcd3+https://host:2379?api_version=v3'
+        queue = batching.get_switch_queue(
+            "switch1", backend_url=url, shared_lease=True)
+        self.addCleanup(queue.close)
+
+        self.assertIsInstance(queue, batching.SwitchQueue)
+        self.assertIsNotNone(queue.input_leases)
+        mock_client.assert_called_once_with(
+            host='host', port=2379, protocol='https', ca_cert=None,
+            cert_key=None, cert_cert=None, api_path='/v3/', timeout=30)
+
+    @mock.patch.object(batching.etcd3gw, "client", autospec=True)
+    def test_etcd_shared_client(self, mock_client):
+        url = 'etcd3+http://host:2379'
+        queue1 = batching.get_switch_queue("switch1", backend_url=url)
+        queue2 = batching.get_switch_queue("switch2", backend_url=url)
+
+        self.assertIs(queue1.client, queue2.client)
+        mock_client.assert_called_once()
+
+        batching._release_etcd_client(url)
+        mock_client.return_value.session.close.assert_not_called()
+        batching._release_etcd_client(url)
+        mock_client.return_value.session.close.assert_called_once_with()
+        self.assertNotIn(url, batching._ETCD_CLIENTS)
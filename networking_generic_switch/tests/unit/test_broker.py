@@ -0,0 +1,172 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import stat
+import threading
+from unittest import mock
+
+import fixtures
+from oslo_config import fixture as config_fixture
+
+from networking_generic_switch import broker
+from networking_generic_switch import exceptions as exc
+
+
+class BrokerTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(BrokerTest, self).setUp()
+        self.cfg = self.useFixture(config_fixture.Config())
+        self.switch = mock.Mock()
+        self.switch.ngs_config = {'ngs_max_connections': '2'}
+        self.switch._execute_commands.return_value = "output"
+        self.broker = broker.Broker({'sw1': self.switch})
+
+    def _serve(self):
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        socket_path = os.path.join(tempdir, 'broker.sock')
+        server = self.broker.make_server(socket_path)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return socket_path
+
+    def test_execute(self):
+        self.assertEqual("output", self.broker.execute('sw1', ['cmd1']))
+        self.switch._execute_commands.assert_called_once_with(['cmd1'])
+
+    def test_show(self):
+        self.switch._execute_show_commands.return_value = ['out1']
+
+        self.assertEqual(['out1'], self.broker.show('sw1', ['show 1']))
+
+        self.switch._execute_show_commands.assert_called_once_with(
+            ['show 1'])
+        self.switch._execute_commands.assert_not_called()
+
+    def test_show_unknown_switch(self):
+        self.assertRaises(exc.GenericSwitchBrokerError,
+                          self.broker.show, 'sw2', ['show 1'])
+
+    def test_execute_unknown_switch(self):
+        self.assertRaises(exc.GenericSwitchBrokerError,
+                          self.broker.execute, 'sw2', ['cmd1'])
+
+    def test_execute_limits_concurrency(self):
+        self.assertEqual(2, self.broker._semaphores['sw1']._initial_value)
+
+    def test_handle_request(self):
+        self.assertEqual(
+            {'output': 'output'},
+            self.broker.handle_request({'device': 'sw1', 'cmds': ['cmd1']}))
+
+    def test_handle_request_show(self):
+        self.switch._execute_show_commands.return_value = ['out1']
+
+        self.assertEqual(
+            {'output': ['out1']},
+            self.broker.handle_request({'device': 'sw1',
+                                        'show': ['show 1']}))
+
+    def test_handle_request_error(self):
+        self.switch._execute_commands.side_effect = (
+            exc.GenericSwitchNetmikoConnectError())
+
+        response = self.broker.handle_request(
+            {'device': 'sw1', 'cmds': ['cmd1']})
+
+        self.assertIn('Failed to connect', response['error'])
+
+    def test_client(self):
+        socket_path = self._serve()
+        self.assertEqual(0o600, os.stat(socket_path).st_mode & 0o777)
+        client = broker.BrokerClient(socket_path, timeout=5)
+
+        self.assertEqual("output", client.send_commands('sw1', ('cmd1',)))
+
+        self.switch._execute_commands.assert_called_once_with(['cmd1'])
+
+    def test_client_show(self):
+        socket_path = self._serve()
+        client = broker.BrokerClient(socket_path, timeout=5)
+        self.switch._execute_show_commands.return_value = ['out1', 'out2']
+
+        self.assertEqual(['out1', 'out2'],
+                         client.send_show_commands('sw1',
+                                                   ('show 1', 'show 2')))
+
+        self.switch._execute_show_commands.assert_called_once_with(
+            ['show 1', 'show 2'])
+
+    def test_client_error(self):
+        socket_path = self._serve()
+        client = broker.BrokerClient(socket_path, timeout=5)
+
+        self.assertRaisesRegex(exc.GenericSwitchBrokerError,
+                               'unknown SSH switch',
+                               client.send_commands, 'sw2', ['cmd1'])
+
+    def test_client_no_broker(self):
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        client = broker.BrokerClient(os.path.join(tempdir, 'missing.sock'))
+
+        self.assertRaises(exc.GenericSwitchBrokerError,
+                          client.send_commands, 'sw1', ['cmd1'])
+
+    def test_make_server_removes_stale_socket(self):
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        socket_path = os.path.join(tempdir, 'broker.sock')
+        open(socket_path, 'w').close()
+
+        server = self.broker.make_server(socket_path)
+        server.server_close()
+
+        self.assertIs(self.broker, server.broker)
+
+    @mock.patch.object(broker.os, 'chmod', autospec=True)
+    def test_make_server_private_socket(self, mock_chmod):
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        socket_path = os.path.join(tempdir, 'broker.sock')
+        old_umask = os.umask(0o022)
+        self.addCleanup(os.umask, old_umask)
+
+        server = self.broker.make_server(socket_path)
+        server.server_close()
+
+        # The socket is created without access for other users.
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(socket_path).st_mode))
+        self.assertEqual(0o022, os.umask(0o022))
+        mock_chmod.assert_called_once_with(socket_path, 0o600)
+
+    @mock.patch.object(broker.devices, 'get_devices', autospec=True)
+    def test_main_requires_socket(self, mock_get_devices):
+        with mock.patch.object(broker.sys, 'argv', ['broker']):
+            self.assertEqual(1, broker.main())
+        mock_get_devices.assert_not_called()
+
+    @mock.patch.object(broker, 'Broker', autospec=True)
+    @mock.patch.object(broker.devices, 'get_devices', autospec=True)
+    def test_main_socket_removed(self, mock_get_devices, mock_broker):
+        tempdir = self.useFixture(fixtures.TempDir()).path
+        socket_path = os.path.join(tempdir, 'broker.sock')
+        self.cfg.config(broker_socket=socket_path, group='ngs')
+        server = mock_broker.return_value.make_server.return_value
+        # The socket has already been removed when the server stops.
+        server.serve_forever.side_effect = KeyboardInterrupt
+
+        with mock.patch.object(broker.sys, 'argv', ['broker']):
+            self.assertRaises(KeyboardInterrupt, broker.main)
+
+        server.server_close.assert_called_once_with()
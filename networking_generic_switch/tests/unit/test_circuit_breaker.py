@@ -0,0 +1,102 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+import fixtures
+
+from networking_generic_switch import circuit_breaker
+from networking_generic_switch import exceptions as exc
+from networking_generic_switch import metrics
+
+
+@mock.patch.object(circuit_breaker.time, 'monotonic', autospec=True,
+                   return_value=100)
+class CircuitBreakerTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(CircuitBreakerTest, self).setUp()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.breaker = circuit_breaker.CircuitBreaker("switch1", 2, 30)
+        self.func = mock.Mock(side_effect=ValueError("Bang"))
+
+    def _state_gauge(self):
+        return metrics.get_metrics()['gauges']['circuit_breaker_state'][
+            'switch1']
+
+    def _open(self):
+        for _ in range(2):
+            self.assertRaises(ValueError, self.breaker.call, self.func)
+
+    def test_closed(self, mock_monotonic):
+        self.func.side_effect = None
+
+        self.assertEqual(self.func.return_value,
+                         self.breaker.call(self.func, 1, a=2))
+
+        self.func.assert_called_once_with(1, a=2)
+        self.assertEqual(circuit_breaker.CLOSED, self.breaker.state)
+        self.assertEqual(0, self._state_gauge())
+
+    def test_success_resets_failures(self, mock_monotonic):
+        self.func.side_effect = [ValueError("Bang"), None, ValueError("Bang")]
+
+        for _ in range(3):
+            try:
+                self.breaker.call(self.func)
+            except ValueError:
+                pass
+
+        self.assertEqual(circuit_breaker.CLOSED, self.breaker.state)
+        self.assertEqual(1, self.breaker.failures)
+
+    def test_open(self, mock_monotonic):
+        self._open()
+
+        self.assertEqual(circuit_breaker.OPEN, self.breaker.state)
+        self.assertEqual(2, self._state_gauge())
+        mock_monotonic.return_value = 129
+        self.assertRaises(exc.GenericSwitchCircuitOpen, self.breaker.call,
+                          self.func)
+        self.assertEqual(2, self.func.call_count)
+
+    def test_half_open_probe_success(self, mock_monotonic):
+        self._open()
+        mock_monotonic.return_value = 130
+        self.assertEqual(circuit_breaker.HALF_OPEN, self.breaker.state)
+
+        self.breaker.before_call()
+        # Only one probe at a time.
+        self.assertRaises(exc.GenericSwitchCircuitOpen,
+                          self.breaker.before_call)
+        self.assertEqual(1, self._state_gauge())
+        self.breaker.record_success()
+
+        self.assertEqual(circuit_breaker.CLOSED, self.breaker.state)
+        self.assertEqual(0, self.breaker.failures)
+        self.breaker.before_call()
+
+    def test_half_open_probe_failure(self, mock_monotonic):
+        self._open()
+        mock_monotonic.return_value = 130
+
+        self.assertRaises(ValueError, self.breaker.call, self.func)
+
+        self.assertEqual(circuit_breaker.OPEN, self.breaker.state)
+        self.assertEqual(3, self.func.call_count)
+        mock_monotonic.return_value = 159
+        self.assertRaises(exc.GenericSwitchCircuitOpen,
+                          self.breaker.before_call)
+        mock_monotonic.return_value = 160
+        self.breaker.before_call()
@@ -15,6 +15,7 @@
 import os
 import shutil
 import tempfile
+from unittest import mock
 
 import fixtures
 from oslo_config import fixture as config_fixture
@@ -62,6 +63,9 @@ class TestConfig(fixtures.TestWithFixtures):
         with open(config_file_baz, 'w') as f:
             f.write(fake_config_baz)
 
+        self.config_file_bar = config_file_bar
+        self.useFixture(fixtures.MockPatchObject(config, '_PARSED_FILES', {}))
+
         self.cfg = self.useFixture(config_fixture.Config())
         self.cfg.conf(args=[f"--config-file={config_file_foo}",
                             f"--config-dir={config_dir}"])
@@ -75,3 +79,50 @@ class TestConfig(fixtures.TestWithFixtures):
                          device_list['bar'])
         self.assertEqual({"device_type": "baz_device", "truffle": "brandy"},
                          device_list['baz'])
+
+    def test_get_devices_cached(self):
+        device_list = config.get_devices()
+        # The caller may modify the configuration of devices.
+        device_list['foo'].pop('spam')
+
+        with mock.patch.object(config.cfg, 'ConfigParser',
+                               autospec=True) as mock_parser:
+            device_list = config.get_devices()
+
+        mock_parser.assert_not_called()
+        self.assertEqual({"device_type": "foo_device", "spam": "eggs"},
+                         device_list['foo'])
+
+    def test_get_devices_file_touched(self):
+        config.get_devices()
+        stat = os.stat(self.config_file_bar)
+        os.utime(self.config_file_bar,
+                 ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        with mock.patch.object(config.cfg, 'ConfigParser',
+                               autospec=True) as mock_parser:
+            device_list = config.get_devices()
+
+        mock_parser.assert_not_called()
+        self.assertEqual(set(device_list), set(['foo', 'bar', 'baz']))
+
+    def test_get_devices_file_changed(self):
+        config.get_devices()
+        with open(self.config_file_bar, 'w') as f:
+            f.write(fake_config_bar.replace('vikings', 'spam'))
+
+        device_list = config.get_devices()
+
+        self.assertEqual({"device_type": "bar_device", "ham": "spam"},
+                         device_list['bar'])
+        self.assertEqual({"device_type": "foo_device", "spam": "eggs"},
+                         device_list['foo'])
+
+    def test_get_devices_file_removed(self):
+        config.get_devices()
+        os.remove(self.config_file_bar)
+
+        device_list = config.get_devices()
+
+        self.assertEqual(set(device_list), set(['foo', 'baz']))
+        self.assertNotIn(self.config_file_bar, config._PARSED_FILES)
@@ -17,7 +17,11 @@ import unittest
 from unittest import mock
 
 
+from networking_generic_switch import config as gsw_conf
 from networking_generic_switch import devices
+from networking_generic_switch.devices import netmiko_devices
+from networking_generic_switch.devices.netmiko_devices import ovs
+from networking_generic_switch.devices import utils as device_utils
 from networking_generic_switch import exceptions as exc
 
 
@@ -103,6 +107,353 @@ class TestGenericSwitchDevice(unittest.TestCase):
         mock_delete.assert_called_once_with(device, 22, 33)
 
 
+class TestGetDevices(unittest.TestCase):
+
+    def setUp(self):
+        super(TestGetDevices, self).setUp()
+        devices.DEVICES.clear()
+        self.addCleanup(devices.DEVICES.clear)
+
+    @mock.patch('networking_generic_switch.config.get_devices',
+                autospec=True)
+    def test_get_devices(self, mock_get_devices):
+        mock_get_devices.return_value = {
+            'A': {'device_type': 'netmiko_ovs_linux',
+                  'ngs_mac_address': 'aa:bb:cc:dd:ee:ff'},
+        }
+
+        registry = devices.get_devices()
+
+        self.assertIsInstance(registry, device_utils.DeviceRegistry)
+        self.assertEqual(['A'], list(registry))
+        self.assertEqual(registry['A'],
+                         registry.get_by_mac('aa:bb:cc:dd:ee:ff'))
+        # The registry is only rebuilt when the inventory changes.
+        self.assertIs(registry, devices.get_devices())
+
+        mock_get_devices.return_value['B'] = {
+            'device_type': 'netmiko_ovs_linux'}
+        new_registry = devices.get_devices()
+
+        self.assertIsNot(registry, new_registry)
+        self.assertEqual(['A', 'B'], list(new_registry))
+        self.assertIs(registry['A'], new_registry['A'])
+        self.assertEqual(['A'], list(registry))
+
+    def _set_lazy(self, warmup_width=0):
+        gsw_conf.CONF.set_override('lazy_device_loading', True, group='ngs')
+        self.addCleanup(gsw_conf.CONF.clear_override, 'lazy_device_loading',
+                        group='ngs')
+        gsw_conf.CONF.set_override('device_warmup_width', warmup_width,
+                                   group='ngs')
+        self.addCleanup(gsw_conf.CONF.clear_override, 'device_warmup_width',
+                        group='ngs')
+
+    @mock.patch.object(devices, 'device_manager', autospec=True)
+    @mock.patch('networking_generic_switch.config.get_devices',
+                autospec=True)
+    def test_get_devices_lazy(self, mock_get_devices, mock_manager):
+        self._set_lazy()
+        mock_get_devices.return_value = {
+            'A': {'device_type': 'netmiko_ovs_linux',
+                  'ngs_mac_address': 'aa:bb:cc:dd:ee:ff',
+                  'ngs_physical_networks': 'physnet1'},
+            'B': {'device_type': 'netmiko_ovs_linux'},
+        }
+
+        registry = devices.get_devices()
+
+        self.assertEqual(['A', 'B'], list(registry))
+        self.assertIsInstance(registry['A'], devices.LazyDevice)
+        self.assertIs(registry['A'],
+                      registry.get_by_mac('aa:bb:cc:dd:ee:ff'))
+        self.assertEqual(['A', 'B'], [
+            name for name, _ in registry.get_by_physnet('physnet1')])
+        self.assertEqual(['B'], [
+            name for name, _ in registry.get_by_physnet('physnet2')])
+        mock_manager.assert_not_called()
+
+        registry['A'].add_network(22, 'net')
+
+        mock_manager.assert_called_once_with(
+            {'device_type': 'netmiko_ovs_linux',
+             'ngs_mac_address': 'aa:bb:cc:dd:ee:ff',
+             'ngs_physical_networks': 'physnet1'}, 'A')
+        mock_manager.return_value.add_network.assert_called_once_with(
+            22, 'net')
+        self.assertTrue(registry['A'].loaded)
+        self.assertFalse(registry['B'].loaded)
+
+    @mock.patch.object(devices, 'device_manager', autospec=True)
+    @mock.patch('networking_generic_switch.config.get_devices',
+                autospec=True)
+    def test_get_devices_lazy_warm_up(self, mock_get_devices, mock_manager):
+        self._set_lazy(warmup_width=4)
+        mock_get_devices.return_value = {
+            name: {'device_type': 'netmiko_ovs_linux'}
+            for name in ('A', 'B', 'C')}
+
+        with mock.patch.object(devices.threading, 'Thread',
+                               autospec=True) as mock_thread:
+            registry = devices.get_devices()
+
+        mock_thread.assert_called_once_with(
+            target=devices._warm_up, args=(list(registry.values()), 4),
+            daemon=True, name='ngs-device-warmup')
+        mock_thread.return_value.start.assert_called_once_with()
+        mock_manager.assert_not_called()
+
+        devices._warm_up(list(registry.values()), 4)
+
+        self.assertEqual(3, mock_manager.call_count)
+        self.assertTrue(all(device.loaded for device in registry.values()))
+
+    @mock.patch.object(devices, 'LOG', autospec=True)
+    @mock.patch.object(devices, 'device_manager', autospec=True)
+    def test_warm_up_failure(self, mock_manager, mock_log):
+        mock_manager.side_effect = [ValueError('boom'), mock.Mock()]
+        lazy_devices = [
+            devices.LazyDevice({'device_type': 'netmiko_ovs_linux'}, name)
+            for name in ('A', 'B')]
+
+        devices._warm_up(lazy_devices, 1)
+
+        self.assertFalse(lazy_devices[0].loaded)
+        self.assertTrue(lazy_devices[1].loaded)
+        self.assertEqual(1, mock_log.error.call_count)
+
+
+class TestReloadDevices(unittest.TestCase):
+
+    def setUp(self):
+        super(TestReloadDevices, self).setUp()
+        devices.DEVICES.clear()
+        devices.DEVICE_CONFIGS.clear()
+        self.addCleanup(devices.DEVICES.clear)
+        self.addCleanup(devices.DEVICE_CONFIGS.clear)
+        patcher = mock.patch.object(devices, '_RELOAD_CALLBACKS', [])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('networking_generic_switch.config.get_devices',
+                             autospec=True)
+        self.mock_get_devices = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_get_devices.return_value = {
+            'A': {'device_type': 'netmiko_ovs_linux', 'ip': '10.0.0.1'},
+            'B': {'device_type': 'netmiko_ovs_linux', 'ip': '10.0.0.2'},
+        }
+        self.registry = devices.get_devices()
+        self.callback = mock.Mock()
+        devices.register_reload_callback(self.callback)
+
+    def test_reload_unchanged(self):
+        registry = devices.reload_devices()
+
+        self.assertIs(self.registry, registry)
+        self.assertIs(registry, devices.get_devices())
+        self.callback.assert_not_called()
+
+    @mock.patch.object(netmiko_devices.NetmikoSwitch, 'close', autospec=True)
+    def test_reload(self, mock_close):
+        self.mock_get_devices.return_value = {
+            'A': {'device_type': 'netmiko_ovs_linux', 'ip': '10.0.0.1'},
+            'B': {'device_type': 'netmiko_ovs_linux', 'ip': '10.0.0.20'},
+            'C': {'device_type': 'netmiko_ovs_linux', 'ip': '10.0.0.3'},
+        }
+
+        registry = devices.reload_devices()
+
+        self.assertEqual(['A', 'B', 'C'], list(registry))
+        self.assertIs(self.registry['A'], registry['A'])
+        self.assertIsNot(self.registry['B'], registry['B'])
+        self.assertEqual('10.0.0.20', registry['B'].config['ip'])
+        self.assertIs(registry, devices.get_devices())
+        self.callback.assert_called_once_with(registry)
+        mock_close.assert_called_once_with(self.registry['B'])
+        # The previous registry is left untouched.
+        self.assertEqual('10.0.0.2', self.registry['B'].config['ip'])
+
+    @mock.patch.object(netmiko_devices.NetmikoSwitch, 'close', autospec=True)
+    def test_reload_removed(self, mock_close):
+        del self.mock_get_devices.return_value['A']
+
+        registry = devices.reload_devices()
+
+        self.assertEqual(['B'], list(registry))
+        self.assertEqual(['B'], list(devices.DEVICE_CONFIGS))
+        self.callback.assert_called_once_with(registry)
+        mock_close.assert_called_once_with(self.registry['A'])
+
+    @mock.patch.object(netmiko_devices.NetmikoSwitch, 'close', autospec=True)
+    @mock.patch.object(devices, 'device_manager', autospec=True)
+    def test_reload_load_failure(self, mock_manager, mock_close):
+        mock_manager.side_effect = exc.GenericSwitchEntrypointLoadError(
+            ep='ep', err='err')
+        self.mock_get_devices.return_value['B']['ip'] = '10.0.0.20'
+
+        registry = devices.reload_devices()
+
+        self.assertIs(self.registry, registry)
+        self.callback.assert_not_called()
+        mock_close.assert_not_called()
+
+        # The load is retried by the next reload.
+        mock_manager.side_effect = None
+        registry = devices.reload_devices()
+
+        self.assertIs(mock_manager.return_value, registry['B'])
+        mock_close.assert_called_once_with(self.registry['B'])
+
+    @mock.patch.object(netmiko_devices.NetmikoSwitch, 'close', autospec=True)
+    def test_reload_lazy_load_failure(self, mock_close):
+        gsw_conf.CONF.set_override('lazy_device_loading', True, group='ngs')
+        self.addCleanup(gsw_conf.CONF.clear_override, 'lazy_device_loading',
+                        group='ngs')
+        self.mock_get_devices.return_value['B']['device_type'] = 'bogus'
+        self.mock_get_devices.return_value['C'] = {
+            'device_type': 'netmiko_ovs_linux', 'ip': '10.0.0.3'}
+
+        registry = devices.reload_devices()
+
+        # The invalid configuration does not replace the working device,
+        # and new devices are still loaded lazily.
+        self.assertIs(self.registry['B'], registry['B'])
+        self.assertIsInstance(registry['C'], devices.LazyDevice)
+        self.callback.assert_called_once_with(registry)
+        mock_close.assert_not_called()
+
+        self.mock_get_devices.return_value['B']['device_type'] = (
+            'netmiko_ovs_linux')
+        self.mock_get_devices.return_value['B']['ip'] = '10.0.0.20'
+        registry = devices.reload_devices()
+
+        # A changed device is instantiated at once.
+        self.assertIsInstance(registry['B'], ovs.OvsLinux)
+        self.assertEqual('10.0.0.20', registry['B'].config['ip'])
+        mock_close.assert_called_once_with(self.registry['B'])
+
+    @mock.patch.object(netmiko_devices.NetmikoSwitch, 'close', autospec=True)
+    def test_reload_callback_failure(self, mock_close):
+        self.callback.side_effect = ValueError('boom')
+        del self.mock_get_devices.return_value['A']
+
+        registry = devices.reload_devices()
+
+        self.assertEqual(['B'], list(registry))
+        mock_close.assert_called_once_with(self.registry['A'])
+
+
+class TestLazyDevice(unittest.TestCase):
+
+    def test_ngs_config(self):
+        device_cfg = {'device_type': 'netmiko_ovs_linux',
+                      'ngs_physical_networks': 'physnet1, physnet2',
+                      'ngs_max_connections': '2'}
+        device = devices.LazyDevice(device_cfg, 'A')
+
+        self.assertEqual('2', device.ngs_config['ngs_max_connections'])
+        self.assertEqual('{network_id}',
+                         device.ngs_config['ngs_network_name_format'])
+        self.assertEqual(['physnet1', 'physnet2'],
+                         device.get_physical_networks())
+        self.assertFalse(device.loaded)
+        # The configuration is left untouched.
+        self.assertIn('ngs_max_connections', device_cfg)
+
+    def test_get_device(self):
+        device = devices.LazyDevice({'device_type': 'netmiko_ovs_linux',
+                                     'ngs_max_connections': '2'}, 'A')
+
+        driver = device.get_device()
+
+        self.assertIsInstance(driver, devices.GenericSwitchDevice)
+        self.assertIs(driver, device.get_device())
+        self.assertTrue(device.loaded)
+        self.assertEqual('A', driver.device_name)
+        self.assertEqual({'device_type': 'ovs_linux'}, driver.config)
+        self.assertIs(driver.ngs_config, device.ngs_config)
+        self.assertEqual(driver.config, device.config)
+        self.assertTrue(hasattr(device, '_execute_commands'))
+
+    @mock.patch.object(devices, 'device_manager', autospec=True)
+    def test_close(self, mock_manager):
+        device = devices.LazyDevice({'device_type': 'netmiko_ovs_linux'}, 'A')
+
+        device.close()
+        mock_manager.assert_not_called()
+
+        device.get_device()
+        device.close()
+        mock_manager.return_value.close.assert_called_once_with()
+
+    @mock.patch.object(devices, 'device_manager', autospec=True)
+    def test_get_device_not_locked(self, mock_manager):
+        device = devices.LazyDevice({'device_type': 'netmiko_ovs_linux'}, 'A')
+
+        def instantiate(device_cfg, device_name):
+            self.assertFalse(device._lock.locked())
+            return mock.sentinel.driver
+
+        mock_manager.side_effect = instantiate
+
+        self.assertIs(mock.sentinel.driver, device.get_device())
+
+    @mock.patch.object(devices, 'device_manager', autospec=True)
+    def test_get_device_concurrent(self, mock_manager):
+        device = devices.LazyDevice({'device_type': 'netmiko_ovs_linux'}, 'A')
+        winner = mock.Mock()
+        loser = mock.Mock()
+
+        def instantiate(device_cfg, device_name):
+            # Another thread instantiates the driver meanwhile.
+            device._device = winner
+            return loser
+
+        mock_manager.side_effect = instantiate
+
+        self.assertIs(winner, device.get_device())
+        loser.close.assert_called_once_with()
+        winner.close.assert_not_called()
+
+    @mock.patch.object(devices, '_start_warm_up', autospec=True)
+    @mock.patch.object(devices, 'device_manager', autospec=True)
+    def test_reset_after_fork(self, mock_manager, mock_warm_up):
+        devices.DEVICES.clear()
+        self.addCleanup(devices.DEVICES.clear)
+        loaded = devices.LazyDevice({'device_type': 'netmiko_ovs_linux'}, 'A')
+        unloaded = devices.LazyDevice({'device_type': 'netmiko_ovs_linux'},
+                                      'B')
+        devices.DEVICES.update({'A': loaded, 'B': unloaded,
+                                'C': mock.sentinel.eager})
+        parent_driver = loaded.get_device()
+        # The fork happens while another thread holds the lock.
+        loaded._lock.acquire()
+        mock_manager.reset_mock()
+
+        devices._reset_after_fork()
+
+        self.assertFalse(loaded.loaded)
+        self.assertFalse(loaded._lock.locked())
+        parent_driver.close.assert_not_called()
+        mock_warm_up.assert_called_once_with([loaded, unloaded])
+        # The child instantiates its own driver.
+        self.assertIs(mock_manager.return_value, loaded.get_device())
+        mock_manager.assert_called_once_with(
+            {'device_type': 'netmiko_ovs_linux'}, 'A')
+
+    @mock.patch.object(devices, 'device_manager', autospec=True)
+    def test_get_device_failure(self, mock_manager):
+        mock_manager.side_effect = [
+            exc.GenericSwitchEntrypointLoadError(ep='ep', err='err'),
+            mock.sentinel.driver]
+        device = devices.LazyDevice({'device_type': 'bad'}, 'A')
+
+        self.assertRaises(exc.GenericSwitchEntrypointLoadError,
+                          getattr, device, 'add_network')
+        self.assertFalse(device.loaded)
+        self.assertIs(mock.sentinel.driver, device.get_device())
+
+
 class TestDeviceManager(unittest.TestCase):
 
     def test_driver_load(self):
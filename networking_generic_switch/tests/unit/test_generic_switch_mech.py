@@ -13,6 +13,7 @@
 #    under the License.
 
 
+import threading
 import unittest
 from unittest import mock
 
@@ -40,6 +41,7 @@ class TestGenericSwitchDriver(unittest.TestCase):
         self.switch_mock.config = {'device_type': 'bar', 'spam': 'ham',
                                    'ip': 'ip'}
         self.switch_mock.get_physical_networks.return_value = []
+        self.switch_mock.get_state_snapshot.return_value = None
         self.switch_mock.trunk_vlans_converge = False
         self.ctxt = mock.MagicMock()
         self.db = mock.MagicMock()
@@ -93,6 +95,8 @@ class TestGenericSwitchDriver(unittest.TestCase):
         self.assertEqual(self.switch_mock.add_network.call_count, 1)
 
     def test_create_network_postcommit_with_different_physnet(self, m_list):
+        # The physical networks of switches are indexed on initialisation.
+        self.switch_mock.get_physical_networks.return_value = ['physnet2']
         driver = gsm.GenericSwitchDriver()
         driver.initialize()
         mock_context = mock.create_autospec(driver_context.NetworkContext)
@@ -100,7 +104,6 @@ class TestGenericSwitchDriver(unittest.TestCase):
                                 'provider:network_type': 'vlan',
                                 'provider:segmentation_id': 22,
                                 'provider:physical_network': 'physnet1'}
-        self.switch_mock.get_physical_networks.return_value = ['physnet2']
 
         driver.create_network_postcommit(mock_context)
         self.assertFalse(self.switch_mock.add_network.called)
@@ -148,6 +151,113 @@ class TestGenericSwitchDriver(unittest.TestCase):
         self.assertEqual(1, m_log.error.call_count)
         self.assertIn('Failed to create network', m_log.error.call_args[0][0])
 
+    def _set_fanout_width(self, width):
+        gsm.CONF.set_override('network_fanout_width', width, group='ngs')
+        self.addCleanup(gsm.CONF.clear_override, 'network_fanout_width',
+                        group='ngs')
+
+    def test_create_network_postcommit_fanout(self, m_list):
+        self._set_fanout_width(4)
+        m_list.return_value = {
+            name: {'device_type': 'bar', 'spam': 'ham', 'ip': 'ip'}
+            for name in ('foo', 'bar', 'baz')
+        }
+        driver = gsm.GenericSwitchDriver()
+        driver.initialize()
+        mock_context = mock.create_autospec(driver_context.NetworkContext)
+        mock_context.current = {'id': 22,
+                                'provider:network_type': 'vlan',
+                                'provider:segmentation_id': 22,
+                                'provider:physical_network': 'physnet1'}
+
+        driver.create_network_postcommit(mock_context)
+
+        self.switch_mock.add_network.assert_has_calls(
+            [mock.call(22, 22, physnet_vlans=None)] * 3)
+
+    @mock.patch('networking_generic_switch.generic_switch_mech.LOG',
+                autospec=True)
+    def test_create_network_postcommit_fanout_failure(self, m_log, m_list):
+        self._set_fanout_width(2)
+        m_list.return_value = {
+            'foo': {'device_type': 'bar', 'spam': 'ham', 'ip': 'ip'},
+            'bar': {'device_type': 'bar', 'spam': 'ham', 'ip': 'ip'},
+        }
+        driver = gsm.GenericSwitchDriver()
+        driver.initialize()
+        self.switch_mock.add_network.side_effect = [ValueError('boom'), None]
+        mock_context = mock.create_autospec(driver_context.NetworkContext)
+        mock_context.current = {'id': 22,
+                                'provider:network_type': 'vlan',
+                                'provider:segmentation_id': 22,
+                                'provider:physical_network': 'physnet1'}
+
+        self.assertRaisesRegex(ValueError, "boom",
+                               driver.create_network_postcommit, mock_context)
+        self.assertEqual(1, m_log.error.call_count)
+        self.assertIn('Failed to create network', m_log.error.call_args[0][0])
+
+    @mock.patch('networking_generic_switch.generic_switch_mech.LOG',
+                autospec=True)
+    def test_delete_network_postcommit_fanout_failure(self, m_log, m_list):
+        self._set_fanout_width(2)
+        m_list.return_value = {
+            'foo': {'device_type': 'bar', 'spam': 'ham', 'ip': 'ip'},
+            'bar': {'device_type': 'bar', 'spam': 'ham', 'ip': 'ip'},
+        }
+        driver = gsm.GenericSwitchDriver()
+        driver.initialize()
+        self.switch_mock.del_network.side_effect = ValueError('boom')
+        mock_context = mock.create_autospec(driver_context.NetworkContext)
+        mock_context.current = {'id': 22,
+                                'provider:network_type': 'vlan',
+                                'provider:segmentation_id': 22,
+                                'provider:physical_network': 'physnet1'}
+
+        self.assertRaisesRegex(ValueError, "boom",
+                               driver.delete_network_postcommit, mock_context)
+        self.assertEqual(2, self.switch_mock.del_network.call_count)
+        self.assertEqual(2, m_log.error.call_count)
+
+    def test__call_on_switches_stop_on_error(self, m_list):
+        self._set_fanout_width(2)
+        driver = gsm.GenericSwitchDriver()
+        started = threading.Event()
+        release = threading.Event()
+
+        def fail():
+            started.wait(5)
+            raise ValueError('boom')
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        calls = [('sw1', fail), ('sw2', block), ('sw3', mock.Mock())]
+        timer = threading.Timer(0.1, release.set)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        results = driver._call_on_switches(calls, stop_on_error=True)
+
+        self.assertEqual(['sw1', 'sw2'], [name for name, _ in results])
+        self.assertIsInstance(results[0][1], ValueError)
+        self.assertIsNone(results[1][1])
+        calls[2][1].assert_not_called()
+
+    def test__call_on_switches_sequential(self, m_list):
+        driver = gsm.GenericSwitchDriver()
+        calls = [('sw1', mock.Mock(side_effect=ValueError('boom'))),
+                 ('sw2', mock.Mock())]
+
+        results = driver._call_on_switches(calls)
+
+        self.assertEqual(['sw1', 'sw2'], [name for name, _ in results])
+        self.assertIsInstance(results[0][1], ValueError)
+        self.assertIsNone(results[1][1])
+        self.assertEqual([('sw1', results[0][1])],
+                         driver._call_on_switches(calls, stop_on_error=True))
+
     def test_delete_network_postcommit(self, m_list):
         driver = gsm.GenericSwitchDriver()
         driver.initialize()
@@ -192,6 +302,8 @@ class TestGenericSwitchDriver(unittest.TestCase):
         self.assertEqual(self.switch_mock.del_network.call_count, 1)
 
     def test_delete_network_postcommit_with_different_physnet(self, m_list):
+        # The physical networks of switches are indexed on initialisation.
+        self.switch_mock.get_physical_networks.return_value = ['physnet2']
         driver = gsm.GenericSwitchDriver()
         driver.initialize()
         mock_context = mock.create_autospec(driver_context.NetworkContext)
@@ -199,7 +311,6 @@ class TestGenericSwitchDriver(unittest.TestCase):
                                 'provider:network_type': 'vlan',
                                 'provider:segmentation_id': 22,
                                 'provider:physical_network': 'physnet1'}
-        self.switch_mock.get_physical_networks.return_value = ['physnet2']
 
         driver.delete_network_postcommit(mock_context)
         self.assertFalse(self.switch_mock.del_network.called)
@@ -364,6 +475,71 @@ class TestGenericSwitchDriver(unittest.TestCase):
                          + switch_b.add_network.call_count)
         mock_network_obj.NetworkSegment.get_objects.assert_called_once()
 
+    @mock.patch.object(gsm.inventory, 'setup', autospec=True)
+    def test_devices_reloaded(self, mock_setup, m_list):
+        with mock.patch.object(devices, '_RELOAD_CALLBACKS', []):
+            driver = gsm.GenericSwitchDriver()
+            driver.initialize()
+            self.assertEqual([driver._devices_reloaded],
+                             devices._RELOAD_CALLBACKS)
+        mock_setup.assert_called_once_with()
+
+        registry = device_utils.DeviceRegistry({})
+        driver._devices_reloaded(registry)
+        self.assertIs(registry, driver.switches)
+
+    @mock.patch.object(gsm.vlan_cache, 'network_obj', autospec=True)
+    def test_create_network_postcommit_converge_vlan_cache(
+            self, mock_network_obj, m_list):
+        gsm.CONF.set_override('physnet_vlans_cache_time', 60, group='ngs')
+        self.addCleanup(gsm.CONF.clear_override, 'physnet_vlans_cache_time',
+                        group='ngs')
+        m_list.return_value = {
+            'foo': {'device_type': 'bar', 'spam': 'ham', 'ip': 'ip'},
+        }
+        switch = mock.Mock()
+        switch.trunk_vlans_converge = True
+        switch.get_trunk_ports.return_value = ['port1']
+        switch.get_physical_networks.return_value = ['physnet1']
+        with mock.patch.object(gsm.vlan_cache.registry, 'subscribe',
+                               autospec=True):
+            driver = gsm.GenericSwitchDriver()
+            driver.initialize()
+        driver.switches = {'foo': switch}
+        segments = [
+            mock.Mock(physical_network='physnet1', segmentation_id=22),
+            mock.Mock(physical_network='physnet1', segmentation_id=100),
+            mock.Mock(physical_network='physnet2', segmentation_id=200),
+        ]
+        mock_network_obj.NetworkSegment.get_objects.side_effect = [
+            segments,
+            # VLAN 300 was added by another neutron-server worker.
+            segments + [
+                mock.Mock(physical_network='physnet1', segmentation_id=23),
+                mock.Mock(physical_network='physnet1', segmentation_id=300)],
+        ]
+        mock_context = mock.create_autospec(driver_context.NetworkContext)
+        mock_context._plugin_context = mock.sentinel.plugin_context
+
+        for segmentation_id in (22, 23):
+            mock_context.current = {
+                'id': segmentation_id,
+                'provider:network_type': 'vlan',
+                'provider:segmentation_id': segmentation_id,
+                'provider:physical_network': 'physnet1'}
+            driver.create_network_postcommit(mock_context)
+
+        # The cache is refreshed before trunk VLANs are converged, so that
+        # VLANs added by other processes are not pruned.
+        switch.add_network.assert_has_calls([
+            mock.call(22, 22, physnet_vlans={22, 100}),
+            mock.call(23, 23, physnet_vlans={22, 23, 100, 300}),
+        ])
+        mock_network_obj.NetworkSegment.get_objects.assert_has_calls([
+            mock.call(mock.sentinel.plugin_context, network_type='vlan'),
+            mock.call(mock.sentinel.plugin_context, network_type='vlan'),
+        ])
+
     @mock.patch('networking_generic_switch.generic_switch_mech.network_obj',
                 autospec=True)
     def test_create_network_postcommit_converge_no_trunk_ports(
@@ -1946,6 +2122,137 @@ class TestGenericSwitchDriver(unittest.TestCase):
         self.switch_mock.vlan_has_vni.assert_called_once_with(100, 5000)
         self.switch_mock.plug_switch_to_network.assert_not_called()
 
+    def _l2vni_port_context(self):
+        mock_context = mock.create_autospec(driver_context.PortContext)
+        mock_context._plugin_context = mock.MagicMock()
+        mock_context.current = {
+            'binding:profile': {
+                'local_link_information': [
+                    {'switch_info': 'foo', 'port_id': 2222}
+                ]
+            },
+            'binding:vnic_type': 'baremetal',
+            'id': '123',
+            'binding:vif_type': 'other',
+            'status': 'DOWN'
+        }
+        mock_context.original = {
+            'binding:profile': {},
+            'binding:vnic_type': 'baremetal',
+            'id': '123',
+            'binding:vif_type': 'unbound'
+        }
+        mock_context.bottom_bound_segment = {
+            'segmentation_id': 100,
+            'network_type': 'vlan',
+            'physical_network': 'physnet1',
+            'network_id': 'aaaa-bbbb-ccc'
+        }
+        mock_context.top_bound_segment = {
+            'segmentation_id': 5000,
+            'network_type': 'vxlan',
+            'network_id': 'aaaa-bbbb-ccc'
+        }
+        return mock_context
+
+    def _set_switch_state_cache_time(self, cache_time):
+        gsm.CONF.set_override('switch_state_cache_time', cache_time,
+                              group='ngs')
+        self.addCleanup(gsm.CONF.clear_override, 'switch_state_cache_time',
+                        group='ngs')
+
+    @mock.patch.object(provisioning_blocks, 'provisioning_complete',
+                       autospec=True)
+    def test_update_port_postcommit_l2vni_plug_cached(self, m_pc, m_list):
+        self._set_switch_state_cache_time(60)
+        driver = gsm.GenericSwitchDriver()
+        driver.initialize()
+        self.switch_mock.device_name = 'foo'
+        self.switch_mock.PLUG_SWITCH_TO_NETWORK = ['mock', 'commands']
+        self.switch_mock.vlan_has_vni.return_value = False
+
+        driver.update_port_postcommit(self._l2vni_port_context())
+        driver.update_port_postcommit(self._l2vni_port_context())
+
+        # The mapping made by the first binding is used by the second.
+        self.switch_mock.vlan_has_vni.assert_called_once_with(100, 5000)
+        self.switch_mock.plug_switch_to_network.assert_called_once_with(
+            5000, 100, physnet='physnet1')
+        self.assertEqual(2, self.switch_mock.plug_port_to_network.call_count)
+
+    @mock.patch('networking_generic_switch.generic_switch_mech.segments_db',
+                autospec=True)
+    def test_delete_port_postcommit_l2vni_cached(self, mock_segments_db,
+                                                 m_list):
+        self._set_switch_state_cache_time(60)
+        driver = gsm.GenericSwitchDriver()
+        driver.initialize()
+        self.switch_mock.device_name = 'foo'
+        mock_segments_db.get_network_segments.return_value = [{
+            'network_type': 'vlan',
+            'segmentation_id': 100,
+            'physical_network': 'physnet1',
+            'network_id': 'aaaa-bbbb-ccc'
+        }]
+        self.switch_mock.vlan_has_ports.return_value = True
+
+        driver.delete_port_postcommit(self._l2vni_port_context())
+        # Removing a port may have removed the last one.
+        self.switch_mock.vlan_has_ports.return_value = False
+        driver.delete_port_postcommit(self._l2vni_port_context())
+        # A VLAN without ports has none after removing another.
+        driver.delete_port_postcommit(self._l2vni_port_context())
+
+        self.assertEqual(2, self.switch_mock.vlan_has_ports.call_count)
+        self.assertEqual(
+            2, self.switch_mock.unplug_switch_from_network.call_count)
+        self.assertFalse(driver.switch_state_cache.get(
+            'foo', ('vni', 100, 5000), self.switch_mock.vlan_has_vni))
+        self.switch_mock.vlan_has_vni.assert_not_called()
+
+    @mock.patch.object(provisioning_blocks, 'provisioning_complete',
+                       autospec=True)
+    def test_update_port_postcommit_l2vni_plug_snapshot(self, m_pc, m_list):
+        self._set_switch_state_cache_time(60)
+        driver = gsm.GenericSwitchDriver()
+        driver.initialize()
+        self.switch_mock.device_name = 'foo'
+        self.switch_mock.PLUG_SWITCH_TO_NETWORK = ['mock', 'commands']
+        self.switch_mock.get_state_snapshot.return_value = (
+            device_utils.SwitchStateSnapshot(vlan_vnis={100: [5000]}))
+
+        driver.update_port_postcommit(self._l2vni_port_context())
+
+        self.switch_mock.get_state_snapshot.assert_called_once_with()
+        self.switch_mock.vlan_has_vni.assert_not_called()
+        self.switch_mock.plug_switch_to_network.assert_not_called()
+        # The snapshot answers queries for other VLANs until the switch is
+        # changed.
+        self.assertFalse(driver._vlan_has_ports(self.switch_mock, 200))
+        self.switch_mock.get_state_snapshot.assert_called_once_with()
+        self.switch_mock.vlan_has_ports.assert_not_called()
+        driver._port_removed(self.switch_mock, 300)
+        self.assertFalse(driver._vlan_has_ports(self.switch_mock, 300))
+        self.assertEqual(2, self.switch_mock.get_state_snapshot.call_count)
+
+    @mock.patch.object(provisioning_blocks, 'provisioning_complete',
+                       autospec=True)
+    def test_update_port_postcommit_l2vni_plug_snapshot_fallback(
+            self, m_pc, m_list):
+        self._set_switch_state_cache_time(60)
+        driver = gsm.GenericSwitchDriver()
+        driver.initialize()
+        self.switch_mock.device_name = 'foo'
+        self.switch_mock.PLUG_SWITCH_TO_NETWORK = ['mock', 'commands']
+        self.switch_mock.get_state_snapshot.side_effect = Exception('boom')
+        self.switch_mock.vlan_has_vni.return_value = False
+
+        driver.update_port_postcommit(self._l2vni_port_context())
+
+        self.switch_mock.vlan_has_vni.assert_called_once_with(100, 5000)
+        self.switch_mock.plug_switch_to_network.assert_called_once_with(
+            5000, 100, physnet='physnet1')
+
     @mock.patch('networking_generic_switch.generic_switch_mech.segments_db',
                 autospec=True)
     def test_delete_port_postcommit_l2vni_with_remaining_ports(
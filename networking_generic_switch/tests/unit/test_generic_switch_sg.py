@@ -22,6 +22,7 @@ from neutron_lib.callbacks import resources
 from oslo_config import fixture as config_fixture
 
 from networking_generic_switch import devices
+from networking_generic_switch.devices import utils as device_utils
 from networking_generic_switch import exceptions as exc
 from networking_generic_switch import generic_switch_sg as sg
 from networking_generic_switch import utils as ngs_utils
@@ -38,12 +39,15 @@ class TestGenericSwitchSecurityGroupHandler(fixtures.TestWithFixtures):
             self.switch1 = mock.Mock(ngs_config={
                 'ngs_security_groups_enabled': True,
             })
+            self.switch1.get_physical_networks.return_value = []
             self.switch2 = mock.Mock(ngs_config={
                 'ngs_security_groups_enabled': True,
             })
+            self.switch2.get_physical_networks.return_value = []
             self.switch3 = mock.Mock(ngs_config={
                 'ngs_security_groups_enabled': False,
             })
+            self.switch3.get_physical_networks.return_value = []
             mock_gd.return_value = {
                 'switch1': self.switch1,
                 'switch2': self.switch2,
@@ -75,23 +79,17 @@ class TestGenericSwitchSecurityGroupHandler(fixtures.TestWithFixtures):
 
     @mock.patch.object(sg_obj.SecurityGroup, 'get_object', autospec=True)
     def test_create_security_group(self, m_get_object):
-        sg = mock.Mock()
-        sg.id = 'sg_id'
-        sg.rules([])
-        sg_data = {'id': sg.id, 'rules': []}
-        m_get_object.return_value = sg
-
+        sg_data = {'id': 'sg_id', 'rules': []}
         payload = mock.Mock()
         payload.latest_state = sg_data
-        payload.resource_id = sg.id
+        payload.resource_id = 'sg_id'
 
         self.handler.create_security_group(
             None, events.AFTER_CREATE, None, payload)
-        m_get_object.assert_called_once_with(payload.context, id='sg_id')
-        self.switch1.add_security_group.assert_called_once_with(
-            sg)
-        self.switch2.add_security_group.assert_called_once_with(
-            sg)
+        # Created on first bind.
+        m_get_object.assert_not_called()
+        self.switch1.add_security_group.assert_not_called()
+        self.switch2.add_security_group.assert_not_called()
         self.switch3.add_security_group.assert_not_called()
 
     def test_delete_security_group(self):
@@ -104,8 +102,23 @@ class TestGenericSwitchSecurityGroupHandler(fixtures.TestWithFixtures):
         self.switch2.del_security_group.assert_called_once_with('sg_id')
         self.switch3.del_security_group.assert_not_called()
 
+    def test_delete_security_group_fanout(self):
+        self.cfg.config(security_group_fanout_width=2, group='ngs')
+        self.switch1.del_security_group.side_effect = ValueError
+        payload = mock.Mock()
+        payload.resource_id = 'sg_id'
+
+        self.assertRaises(ValueError,
+                          self.handler.delete_security_group,
+                          None, events.AFTER_DELETE, None, payload)
+        self.switch1.del_security_group.assert_called_once_with('sg_id')
+        self.switch2.del_security_group.assert_called_once_with('sg_id')
+
     @mock.patch.object(sg_obj.SecurityGroup, 'get_object', autospec=True)
-    def test_change_security_group_rule(self, m_get_object):
+    @mock.patch.object(sg.GenericSwitchSecurityGroupHandler,
+                       '_security_group_switches', autospec=True)
+    def test_change_security_group_rule(self, m_sgs, m_get_object):
+        m_sgs.return_value = [('switch2', self.switch2)]
         rule = mock.Mock()
         rule.id = 'rule1'
         sg = mock.Mock()
@@ -120,10 +133,68 @@ class TestGenericSwitchSecurityGroupHandler(fixtures.TestWithFixtures):
         self.handler.update_security_group_rules(
             None, events.AFTER_CREATE, None, payload)
         m_get_object.assert_called_once_with(payload.context, id='sg_id')
-        self.switch1.update_security_group.assert_called_once_with(sg)
+        m_sgs.assert_called_once_with(self.handler, payload.context, 'sg_id')
+        self.switch1.update_security_group.assert_not_called()
         self.switch2.update_security_group.assert_called_once_with(sg)
         self.switch3.update_security_group.assert_not_called()
 
+    @mock.patch.object(sg_obj.SecurityGroup, 'get_object', autospec=True)
+    @mock.patch.object(sg.GenericSwitchSecurityGroupHandler,
+                       '_security_group_switches', autospec=True)
+    def test_change_security_group_rule_error(self, m_sgs, m_get_object):
+        m_sgs.return_value = [('switch1', self.switch1),
+                              ('switch2', self.switch2)]
+        self.switch1.update_security_group.side_effect = ValueError
+        payload = mock.Mock()
+        payload.latest_state = {'security_group_id': 'sg_id', 'id': 'rule1'}
+
+        self.assertRaises(ValueError,
+                          self.handler.update_security_group_rules,
+                          None, events.AFTER_CREATE, None, payload)
+        self.switch2.update_security_group.assert_not_called()
+
+    def test__devices_reloaded(self):
+        self.assertIn(self.handler._devices_reloaded,
+                      devices._RELOAD_CALLBACKS)
+        self.handler._devices_reloaded({'switch2': self.switch2,
+                                        'switch3': self.switch3})
+        self.assertIsInstance(self.handler.switches,
+                              device_utils.DeviceRegistry)
+        self.assertEqual(['switch2'], list(self.handler.switches))
+
+    @mock.patch.object(ports_obj.Port, 'get_ports_by_vnic_type_and_host',
+                       autospec=True)
+    def test__security_group_switches(self, m_get_ports):
+        self.switch2.ngs_config['ngs_mac_address'] = 'aa:bb:cc:dd:ee:ff'
+        self.handler.switches = device_utils.DeviceRegistry({
+            'switch1': self.switch1, 'switch2': self.switch2})
+        m_get_ports.return_value = [
+            mock.Mock(
+                security_group_ids=['sg1', 'sg2'],
+                bindings=[mock.Mock(profile={'local_link_information': [
+                    {'port_id': 'p1', 'switch_info': 'switch1'}]})]),
+            mock.Mock(
+                security_group_ids=['sg1'],
+                bindings=[mock.Mock(profile={'local_link_information': [
+                    {'port_id': 'p2', 'switch_info': 'unknown',
+                     'switch_id': 'AA:BB:CC:DD:EE:FF'}]})]),
+            mock.Mock(
+                security_group_ids=['sg1'],
+                bindings=[mock.Mock(profile={'local_link_information': [
+                    {'port_id': 'p3', 'switch_info': 'switch3'}]})]),
+            mock.Mock(security_group_ids=['sg1'], bindings=None),
+        ]
+        context = mock.Mock()
+
+        self.assertEqual(
+            [('switch1', self.switch1), ('switch2', self.switch2)],
+            self.handler._security_group_switches(context, 'sg1'))
+        self.assertEqual(
+            [('switch1', self.switch1)],
+            self.handler._security_group_switches(context, 'sg2'))
+        self.assertEqual(
+            [], self.handler._security_group_switches(context, 'sg3'))
+
     def test__valid_baremetal_port(self):
         with mock.patch.object(ngs_utils, 'is_port_bound',
                                autospec=True) as mock_ipb:
@@ -255,6 +326,39 @@ class TestGenericSwitchSecurityGroupHandler(fixtures.TestWithFixtures):
             }, self.handler._all_security_group_ports(
                 context, '192.168.2.100', '3c:e1:a1:4e:c6:a3'))
 
+    @mock.patch.object(ports_obj.Port, 'get_ports_by_vnic_type_and_host',
+                       autospec=True)
+    def test__all_security_group_ports_index(self, m_get_ports):
+        self.cfg.config(security_group_ports_cache_time=60, group='ngs')
+        with mock.patch.object(devices, 'get_devices', autospec=True,
+                               return_value={}), \
+                mock.patch.object(registry, 'subscribe', autospec=True):
+            handler = sg.GenericSwitchSecurityGroupHandler()
+        m_get_ports.return_value = [
+            mock.Mock(
+                id='port1',
+                security_group_ids=['sg1'],
+                bindings=[
+                    mock.Mock(
+                        profile={
+                            'local_link_information': [{
+                                'port_id': 'p1',
+                                'switch_info': '192.168.2.100'
+                            }]
+                        }
+                    )
+                ]
+            ),
+        ]
+        context = mock.Mock()
+
+        for _ in range(2):
+            self.assertEqual(
+                {'sg1': {'p1'}},
+                handler._all_security_group_ports(
+                    context, '192.168.2.100', None))
+        m_get_ports.assert_called_once_with(context, 'baremetal')
+
     @mock.patch.object(sg_obj.SecurityGroup, 'get_object', autospec=True)
     @mock.patch.object(sg.GenericSwitchSecurityGroupHandler,
                        '_all_security_group_ports', autospec=True)
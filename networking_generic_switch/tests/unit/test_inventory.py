@@ -0,0 +1,101 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+from unittest import mock
+
+import fixtures
+from oslo_config import fixture as config_fixture
+
+from networking_generic_switch import inventory
+
+
+@mock.patch.object(inventory.devices, 'reload_devices', autospec=True)
+class TestInventory(fixtures.TestWithFixtures):
+
+    def setUp(self):
+        super(TestInventory, self).setUp()
+        self.cfg = self.useFixture(config_fixture.Config())
+        patcher = mock.patch.object(inventory, '_WATCHER', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reload(self, mock_reload):
+        inventory.reload()
+        mock_reload.assert_called_once_with()
+
+    def test_reload_failure(self, mock_reload):
+        mock_reload.side_effect = ValueError('boom')
+        with mock.patch.object(inventory, 'LOG', autospec=True) as mock_log:
+            inventory.reload()
+        self.assertEqual(1, mock_log.exception.call_count)
+
+    @mock.patch.object(inventory.InventoryWatcher, 'start', autospec=True)
+    def test_setup_disabled(self, mock_start, mock_reload):
+        with mock.patch.object(inventory.gsw_conf.CONF,
+                               'register_mutate_hook',
+                               autospec=True) as mock_hook:
+            inventory.setup()
+        mock_hook.assert_not_called()
+        mock_start.assert_not_called()
+        self.assertIsNone(inventory._WATCHER)
+
+    def test_setup_sighup(self, mock_reload):
+        self.cfg.config(inventory_reload_on_sighup=True, group='ngs')
+        with mock.patch.object(inventory.gsw_conf.CONF,
+                               'register_mutate_hook',
+                               autospec=True) as mock_hook:
+            inventory.setup()
+        mock_hook.assert_called_once_with(inventory._mutate_hook)
+
+        inventory._mutate_hook(inventory.gsw_conf.CONF, {})
+        mock_reload.assert_called_once_with()
+
+    @mock.patch.object(inventory.atexit, 'register', autospec=True)
+    @mock.patch.object(inventory.InventoryWatcher, 'start', autospec=True)
+    def test_setup_interval(self, mock_start, mock_atexit, mock_reload):
+        self.cfg.config(inventory_reload_interval=30, group='ngs')
+
+        inventory.setup()
+        inventory.setup()
+
+        watcher = inventory._WATCHER
+        self.assertEqual(30, watcher.interval)
+        mock_start.assert_called_once_with(watcher)
+        mock_atexit.assert_called_once_with(watcher.stop)
+
+        inventory._restart_after_fork()
+        self.assertEqual(2, mock_start.call_count)
+
+
+@mock.patch.object(inventory, 'reload', autospec=True)
+class TestInventoryWatcher(unittest.TestCase):
+
+    def test_run(self, mock_reload):
+        watcher = inventory.InventoryWatcher(30)
+        with mock.patch.object(watcher, '_stopped', autospec=True) as m_stop:
+            m_stop.wait.side_effect = [False, False, True]
+            watcher._run()
+        m_stop.wait.assert_called_with(30)
+        self.assertEqual(2, mock_reload.call_count)
+
+    def test_start_stop(self, mock_reload):
+        watcher = inventory.InventoryWatcher(3600)
+        watcher.start()
+        self.assertTrue(watcher._thread.is_alive())
+
+        watcher.stop()
+
+        self.assertFalse(watcher._thread.is_alive())
+        mock_reload.assert_not_called()
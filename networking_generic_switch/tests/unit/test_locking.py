@@ -84,3 +84,156 @@ class PoolLockTest(fixtures.TestWithFixtures):
         log_mock.assert_called_once_with(mock.ANY, exc_info=True)
         lock_mock.release.assert_not_called()
         stop_mock.assert_called_once_with(1)
+
+    def test_lock_fair_default(self):
+        self.assertFalse(ngs_lock.PoolLock(None).fair)
+        self.cfg.config(fair_locking=True, group='ngs_coordination')
+        self.assertTrue(ngs_lock.PoolLock(None).fair)
+        self.assertFalse(ngs_lock.PoolLock(None, fair=False).fair)
+
+    def test_lock_fair_free_lock(self):
+        coord = mock.Mock()
+        locks = [mock.Mock(), mock.Mock()]
+        locks[0].acquire.return_value = False
+        locks[1].acquire.return_value = True
+        coord.get_lock.side_effect = locks
+
+        with ngs_lock.PoolLock(coord, locks_pool_size=2, locks_prefix='fair1',
+                               timeout=1, fair=True) as lk:
+            self.assertEqual(locks[1], lk.lock)
+
+        coord.get_lock.assert_has_calls([mock.call(b'fair10'),
+                                         mock.call(b'fair11')])
+        locks[0].acquire.assert_called_once_with(blocking=False)
+        locks[1].acquire.assert_called_once_with(blocking=False)
+        locks[1].release.assert_called_once_with()
+
+    def test_lock_fair_blocks_on_slots(self):
+        coord = mock.Mock()
+        lock_mock = mock.Mock()
+        coord.get_lock.return_value = lock_mock
+        lock_mock.acquire.side_effect = [False, False, False, True]
+
+        with ngs_lock.PoolLock(coord, locks_pool_size=2, locks_prefix='fair2',
+                               fair=True) as lk:
+            self.assertEqual(lock_mock, lk.lock)
+
+        lock_mock.acquire.assert_has_calls([
+            mock.call(blocking=False), mock.call(blocking=False),
+            mock.call(blocking=ngs_lock.SLOT_WAIT),
+            mock.call(blocking=ngs_lock.SLOT_WAIT)])
+
+    def test_lock_fair_single_slot(self):
+        coord = mock.Mock()
+        lock_mock = mock.Mock()
+        coord.get_lock.return_value = lock_mock
+        lock_mock.acquire.side_effect = [False, True]
+
+        with ngs_lock.PoolLock(coord, locks_prefix='fair3', fair=True):
+            pass
+
+        lock_mock.acquire.assert_has_calls([
+            mock.call(blocking=False), mock.call(blocking=True)])
+
+    @mock.patch.object(ngs_lock.LOG, 'error', autospec=True)
+    def test_lock_fair_timeout(self, log_mock):
+        coord = mock.Mock()
+        coord.get_lock.return_value.acquire.return_value = False
+
+        def test_call():
+            with ngs_lock.PoolLock(coord, locks_pool_size=2,
+                                   locks_prefix='fair4', timeout=0.05,
+                                   fair=True):
+                pass
+
+        self.assertRaises(coordination.LockAcquireFailed, test_call)
+        log_mock.assert_called_once_with(mock.ANY, exc_info=True)
+
+    def test_ticket_queue_order(self):
+        queue = ngs_lock._TicketQueue()
+        order = []
+
+        def waiter(name):
+            with queue.turn():
+                order.append(name)
+
+        with queue.turn():
+            threads = []
+            for name in ('first', 'second', 'third'):
+                thread = ngs_lock.threading.Thread(target=waiter,
+                                                   args=(name,))
+                thread.start()
+                threads.append(thread)
+                # Let the thread take its ticket.
+                while len(queue._waiters) < len(threads) + 1:
+                    ngs_lock.time.sleep(0.001)
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(['first', 'second', 'third'], order)
+        self.assertEqual(0, len(queue._waiters))
+
+    def test_ticket_queue_timeout(self):
+        queue = ngs_lock._TicketQueue()
+
+        with queue.turn():
+            self.assertRaises(coordination.LockAcquireFailed,
+                              queue.turn(ngs_lock.time.monotonic()).__enter__)
+
+        self.assertEqual(0, len(queue._waiters))
+
+    @mock.patch.object(ngs_lock.metrics, 'observe', autospec=True)
+    def test_lock_metrics(self, observe_mock):
+        coord = mock.Mock()
+        coord.get_lock.return_value.acquire.return_value = True
+
+        with ngs_lock.PoolLock(coord, locks_prefix='sw1', fair=True):
+            observe_mock.assert_called_once_with('lock_wait_time', 'sw1',
+                                                 mock.ANY)
+
+        observe_mock.assert_called_with('lock_hold_time', 'sw1', mock.ANY)
+
+
+@mock.patch.object(coordination, 'get_coordinator', autospec=True)
+class SharedCoordinatorTest(fixtures.TestWithFixtures):
+
+    def test_shared(self, mock_get):
+        coord1 = ngs_lock.get_coordinator('redis://host', b'ngs-host1')
+        coord2 = ngs_lock.get_coordinator('redis://host', b'ngs-host1')
+        other = ngs_lock.get_coordinator('redis://host', b'ngs-batch-host1',
+                                         start_heart=True)
+        self.addCleanup(other.release)
+
+        self.assertIs(coord1, coord2)
+        self.assertIsNot(coord1, other)
+        self.assertEqual(2, coord1.refs)
+        mock_get.assert_not_called()
+
+        coord1.release()
+        coord2.release()
+
+        self.assertIsNot(
+            coord1, ngs_lock.get_coordinator('redis://host', b'ngs-host1'))
+        self.addCleanup(ngs_lock._COORDINATORS.clear)
+
+    def test_lazy_start(self, mock_get):
+        shared = ngs_lock.get_coordinator('redis://host', b'ngs-host1',
+                                          start_heart=True)
+        tooz_coordinator = mock_get.return_value
+
+        lock1 = shared.get_lock(b'lock1')
+        shared.get_lock(b'lock2')
+
+        mock_get.assert_called_once_with('redis://host', b'ngs-host1')
+        tooz_coordinator.start.assert_called_once_with(start_heart=True)
+        self.assertEqual(tooz_coordinator.get_lock.return_value, lock1)
+        tooz_coordinator.get_lock.assert_called_with(b'lock2')
+
+        shared.release()
+
+        tooz_coordinator.stop.assert_called_once_with()
+
+    def test_release_not_started(self, mock_get):
+        shared = ngs_lock.get_coordinator('redis://host', b'ngs-host1')
+        shared.release()
+        mock_get.assert_not_called()
@@ -0,0 +1,102 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+import fixtures
+from oslo_config import fixture as config_fixture
+
+from networking_generic_switch import metrics
+
+
+class MetricsTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(MetricsTest, self).setUp()
+        self.cfg = self.useFixture(config_fixture.Config())
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_set_gauge(self):
+        metrics.set_gauge("window", "switch1", 0.1)
+        metrics.set_gauge("window", "switch1", 0.2)
+        metrics.set_gauge("window", "switch2", 0.3)
+
+        self.assertEqual(
+            {"window": {"switch1": 0.2, "switch2": 0.3}},
+            metrics.get_metrics()["gauges"])
+
+    def test_observe(self):
+        for value in (1, 3, 7):
+            metrics.observe("size", "switch1", value, buckets=(2, 5))
+
+        self.assertEqual(
+            {"size": {"switch1": {
+                "count": 3, "sum": 11, "max": 7,
+                "buckets": {"2": 1, "5": 1, "+Inf": 1}}}},
+            metrics.get_metrics()["histograms"])
+
+    def test_reset(self):
+        metrics.set_gauge("window", "switch1", 0.1)
+        metrics.observe("size", "switch1", 1)
+
+        metrics.reset()
+
+        self.assertEqual({"gauges": {}, "histograms": {}},
+                         metrics.get_metrics())
+
+    @mock.patch.object(metrics.threading, "Thread", autospec=True)
+    def test_logging_disabled(self, mock_thread):
+        metrics.set_gauge("window", "switch1", 0.1)
+
+        self.assertFalse(mock_thread.called)
+
+    @mock.patch.object(metrics, "_LOGGER_THREAD", None)
+    @mock.patch.object(metrics.threading, "Thread", autospec=True)
+    def test_logging_enabled(self, mock_thread):
+        self.cfg.config(metrics_log_interval=60, group='ngs')
+
+        metrics.set_gauge("window", "switch1", 0.1)
+        metrics.observe("size", "switch1", 1)
+
+        mock_thread.assert_called_once_with(
+            target=metrics._log_metrics, args=(60,), daemon=True,
+            name="ngs-metrics")
+        mock_thread.return_value.start.assert_called_once_with()
+
+    @mock.patch.object(metrics, "_LOGGER_THREAD", None)
+    @mock.patch.object(metrics.threading, "Thread", autospec=True)
+    def test_restart_after_fork(self, mock_thread):
+        self.cfg.config(metrics_log_interval=60, group='ngs')
+        metrics.set_gauge("window", "switch1", 0.1)
+        parent_thread = metrics._LOGGER_THREAD
+        mock_thread.reset_mock()
+        mock_thread.return_value = mock.Mock()
+
+        metrics._restart_after_fork()
+
+        self.assertIsNot(parent_thread, metrics._LOGGER_THREAD)
+        mock_thread.assert_called_once_with(
+            target=metrics._log_metrics, args=(60,), daemon=True,
+            name="ngs-metrics")
+        metrics._LOGGER_THREAD.start.assert_called_once_with()
+
+    @mock.patch.object(metrics, "_LOGGER_THREAD", None)
+    @mock.patch.object(metrics.threading, "Thread", autospec=True)
+    def test_restart_after_fork_not_started(self, mock_thread):
+        self.cfg.config(metrics_log_interval=60, group='ngs')
+
+        metrics._restart_after_fork()
+
+        self.assertIsNone(metrics._LOGGER_THREAD)
+        self.assertFalse(mock_thread.called)
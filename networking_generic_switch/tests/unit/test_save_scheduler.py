@@ -0,0 +1,115 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+from unittest import mock
+
+import fixtures
+
+from networking_generic_switch import metrics
+from networking_generic_switch import save_scheduler
+
+
+class SaveSchedulerTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(SaveSchedulerTest, self).setUp()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.save = mock.Mock()
+
+    def _make_scheduler(self, delay=60, max_changes=0):
+        scheduler = save_scheduler.SaveScheduler(
+            "switch1", self.save, delay, max_changes=max_changes)
+        self.addCleanup(scheduler.stop)
+        return scheduler
+
+    def test_record_change_coalesces(self):
+        scheduler = self._make_scheduler()
+
+        scheduler.record_change()
+        scheduler.record_change(2)
+
+        self.assertEqual(3, scheduler.pending)
+        self.assertEqual({"switch1": 3}, save_scheduler.get_pending_saves())
+        self.assertEqual(
+            3, metrics.get_metrics()['gauges']['pending_saves']['switch1'])
+        self.save.assert_not_called()
+
+        scheduler.flush()
+
+        self.save.assert_called_once_with()
+        self.assertEqual(0, scheduler.pending)
+
+    def test_flush_nothing_pending(self):
+        scheduler = self._make_scheduler()
+        scheduler.flush()
+        self.save.assert_not_called()
+
+    def test_save_after_delay(self):
+        saved = threading.Event()
+        self.save.side_effect = saved.set
+        scheduler = self._make_scheduler(delay=0.01)
+
+        scheduler.record_change()
+
+        self.assertTrue(saved.wait(5))
+        self.save.assert_called_once_with()
+
+    def test_save_after_max_changes(self):
+        saved = threading.Event()
+        self.save.side_effect = saved.set
+        scheduler = self._make_scheduler(max_changes=2)
+
+        scheduler.record_change()
+        self.assertFalse(saved.wait(0.05))
+        scheduler.record_change()
+
+        self.assertTrue(saved.wait(5))
+        self.save.assert_called_once_with()
+
+    def test_save_failure_keeps_changes_pending(self):
+        scheduler = self._make_scheduler(max_changes=1)
+        self.save.side_effect = [Exception("Bang"), None]
+
+        with mock.patch.object(scheduler, '_ensure_thread', autospec=True):
+            scheduler.record_change()
+            scheduler.flush()
+
+            self.assertEqual(1, scheduler.pending)
+            # Do not retry before the delay, even with max_changes pending.
+            with scheduler._cond:
+                self.assertFalse(scheduler._is_due())
+
+            scheduler.flush()
+
+        self.assertEqual(2, self.save.call_count)
+        self.assertEqual(0, scheduler.pending)
+
+    def test_stop_flushes(self):
+        scheduler = self._make_scheduler()
+        scheduler.record_change()
+
+        scheduler.stop()
+
+        self.save.assert_called_once_with()
+        self.assertNotIn(scheduler, save_scheduler.SCHEDULERS)
+
+    def test_record_change_after_stop(self):
+        scheduler = self._make_scheduler()
+        scheduler.stop()
+
+        scheduler.record_change()
+
+        self.save.assert_called_once_with()
+        self.assertEqual(0, scheduler.pending)
@@ -0,0 +1,180 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+import fixtures
+from neutron.objects import ports as ports_obj
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import resources
+
+from networking_generic_switch import sg_port_index
+
+
+def _db_port(port_id, sg_ids, *links):
+    return mock.Mock(
+        id=port_id, security_group_ids=sg_ids,
+        bindings=[mock.Mock(profile={'local_link_information': [link]})
+                  for link in links])
+
+
+def _port(port_id, sg_ids, *links, vnic_type='baremetal'):
+    return {
+        'id': port_id,
+        'security_groups': sg_ids,
+        'binding:vnic_type': vnic_type,
+        'binding:profile': {'local_link_information': list(links)},
+    }
+
+
+class SecurityGroupPortIndexTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(SecurityGroupPortIndexTest, self).setUp()
+        self.ctxt = mock.Mock()
+        patcher = mock.patch.object(
+            ports_obj.Port, 'get_ports_by_vnic_type_and_host', autospec=True)
+        self.get_ports = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.get_ports.return_value = [
+            _db_port('1', ['sg1', 'sg2'],
+                     {'port_id': 'p1a', 'switch_info': 'sw1'},
+                     {'port_id': 'p1b', 'switch_info': 'sw1'}),
+            _db_port('2', ['sg1'],
+                     {'port_id': 'p2', 'switch_id': 'aa:bb'}),
+            _db_port('3', ['sg1'], {'port_id': 'p3', 'switch_info': 'sw2'}),
+            _db_port('4', None, {'port_id': 'p4', 'switch_info': 'sw1'}),
+            mock.Mock(id='5', security_group_ids=['sg1'], bindings=None),
+        ]
+        self.index = sg_port_index.SecurityGroupPortIndex(60)
+
+    def test_get_security_group_ports(self):
+        self.assertEqual(
+            {'sg1': {'p1a', 'p1b', 'p2'}, 'sg2': {'p1a', 'p1b'}},
+            self.index.get_security_group_ports(self.ctxt, 'sw1', 'aa:bb'))
+        self.assertEqual(
+            {'sg1': {'p3'}},
+            self.index.get_security_group_ports(self.ctxt, 'sw2', None))
+        self.assertEqual(
+            {}, self.index.get_security_group_ports(self.ctxt, 'sw3', None))
+
+        self.get_ports.assert_called_once_with(self.ctxt, 'baremetal')
+
+    def test_get_security_group_links(self):
+        self.assertEqual(
+            {('sw1', None), (None, 'aa:bb'), ('sw2', None)},
+            self.index.get_security_group_links(self.ctxt, 'sg1'))
+        self.assertEqual(
+            {('sw1', None)},
+            self.index.get_security_group_links(self.ctxt, 'sg2'))
+        self.assertEqual(
+            set(), self.index.get_security_group_links(self.ctxt, 'sg3'))
+
+        self.get_ports.assert_called_once_with(self.ctxt, 'baremetal')
+
+    @mock.patch.object(sg_port_index.time, 'monotonic', autospec=True)
+    def test_get_security_group_ports_rebuild(self, mock_time):
+        mock_time.side_effect = [0, 30, 61, 61]
+
+        for _ in range(3):
+            self.index.get_security_group_ports(self.ctxt, 'sw1', None)
+
+        self.assertEqual(2, self.get_ports.call_count)
+
+    def test_update_port(self):
+        # Ignored until the index is built.
+        self.index.update_port(
+            _port('6', ['sg3'], {'port_id': 'p6', 'switch_info': 'sw1'}))
+        self.index.get_security_group_ports(self.ctxt, 'sw1', None)
+
+        # New port.
+        self.index.update_port(
+            _port('6', ['sg3'], {'port_id': 'p6', 'switch_info': 'sw1'}))
+        # Security group replaced.
+        self.index.update_port(
+            _port('3', ['sg2'], {'port_id': 'p3', 'switch_info': 'sw2'}))
+        # Link removed.
+        self.index.update_port(_port('2', ['sg1']))
+        # No longer a baremetal port.
+        self.index.update_port(
+            _port('1', ['sg1', 'sg2'],
+                  {'port_id': 'p1a', 'switch_info': 'sw1'},
+                  vnic_type='normal'))
+
+        self.assertEqual(
+            {'sg3': {'p6'}},
+            self.index.get_security_group_ports(self.ctxt, 'sw1', 'aa:bb'))
+        self.assertEqual(
+            {'sg2': {'p3'}},
+            self.index.get_security_group_ports(self.ctxt, 'sw2', None))
+        self.get_ports.assert_called_once_with(self.ctxt, 'baremetal')
+
+    def test_shared_port_name(self):
+        self.index.get_security_group_ports(self.ctxt, 'sw1', None)
+        self.index.update_port(
+            _port('6', ['sg1'], {'port_id': 'p1a', 'switch_info': 'sw1'}))
+
+        self.index.remove_port('1')
+
+        self.assertEqual(
+            {'sg1': {'p1a'}},
+            self.index.get_security_group_ports(self.ctxt, 'sw1', None))
+
+    def test_remove_port(self):
+        self.index.get_security_group_ports(self.ctxt, 'sw1', None)
+
+        self.index.remove_port('1')
+        self.index.remove_port('unknown')
+
+        self.assertEqual(
+            {'sg1': {'p2'}},
+            self.index.get_security_group_ports(self.ctxt, 'sw1', 'aa:bb'))
+
+    def test_invalidate(self):
+        self.index.get_security_group_ports(self.ctxt, 'sw1', None)
+        self.index.invalidate()
+        self.index.get_security_group_ports(self.ctxt, 'sw1', None)
+
+        self.assertEqual(2, self.get_ports.call_count)
+
+    @mock.patch.object(sg_port_index.registry, 'subscribe', autospec=True)
+    def test_subscribe(self, mock_subscribe):
+        self.index.subscribe()
+
+        mock_subscribe.assert_has_calls([
+            mock.call(self.index._port_updated, resources.PORT,
+                      events.AFTER_CREATE, priority=sg_port_index.PRIORITY),
+            mock.call(self.index._port_updated, resources.PORT,
+                      events.AFTER_UPDATE, priority=sg_port_index.PRIORITY),
+            mock.call(self.index._port_deleted, resources.PORT,
+                      events.AFTER_DELETE, priority=sg_port_index.PRIORITY),
+        ])
+
+    def test_port_events(self):
+        self.index.get_security_group_ports(self.ctxt, 'sw1', None)
+        port = _port('6', ['sg3'], {'port_id': 'p6', 'switch_info': 'sw1'})
+
+        self.index._port_updated(
+            resources.PORT, events.AFTER_UPDATE, None,
+            events.DBEventPayload(self.ctxt, states=({}, port)))
+        self.assertEqual(
+            {'p6'},
+            self.index.get_security_group_ports(
+                self.ctxt, 'sw1', None)['sg3'])
+
+        self.index._port_deleted(
+            resources.PORT, events.AFTER_DELETE, None,
+            events.DBEventPayload(self.ctxt, states=(port,)))
+        self.assertNotIn(
+            'sg3',
+            self.index.get_security_group_ports(self.ctxt, 'sw1', None))
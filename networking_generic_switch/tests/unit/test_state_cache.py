@@ -0,0 +1,192 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+from unittest import mock
+
+import fixtures
+
+from networking_generic_switch import state_cache
+
+
+class SwitchStateCacheTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(SwitchStateCacheTest, self).setUp()
+        self.cache = state_cache.SwitchStateCache(60)
+        self.query = mock.Mock(return_value=True)
+
+    def test_get(self):
+        self.assertTrue(self.cache.get('sw1', ('ports', 10), self.query))
+        self.assertTrue(self.cache.get('sw1', ('ports', 10), self.query))
+        self.query.assert_called_once_with()
+
+        self.query.return_value = False
+        self.assertFalse(self.cache.get('sw1', ('ports', 11), self.query))
+        self.assertFalse(self.cache.get('sw2', ('ports', 10), self.query))
+        self.assertEqual(3, self.query.call_count)
+
+    @mock.patch.object(state_cache.time, 'monotonic', autospec=True)
+    def test_get_expired(self, mock_time):
+        mock_time.side_effect = [0, 30, 61, 61]
+
+        self.cache.get('sw1', ('ports', 10), self.query)
+        self.cache.get('sw1', ('ports', 10), self.query)
+        self.cache.get('sw1', ('ports', 10), self.query)
+
+        self.assertEqual(2, self.query.call_count)
+
+    def test_get_error(self):
+        self.query.side_effect = [ValueError('boom'), True]
+
+        self.assertRaises(ValueError, self.cache.get, 'sw1', ('ports', 10),
+                          self.query)
+        self.assertTrue(self.cache.get('sw1', ('ports', 10), self.query))
+        self.assertEqual(2, self.query.call_count)
+
+    def test_get_concurrent(self):
+        waiting = threading.Semaphore(0)
+        release = threading.Event()
+
+        class Event(threading.Event):
+            def wait(self, timeout=None):
+                waiting.release()
+                return super(Event, self).wait(timeout)
+
+        class Query(state_cache._Query):
+            def __init__(self):
+                super(Query, self).__init__()
+                self.done = Event()
+
+        def query():
+            release.wait()
+            return True
+
+        query_mock = mock.Mock(side_effect=query)
+        results = []
+
+        def get():
+            results.append(self.cache.get('sw1', ('ports', 10), query_mock))
+
+        with mock.patch.object(state_cache, '_Query', Query):
+            threads = [threading.Thread(target=get) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            # Wait for all but the thread making the query to wait for it.
+            for _ in range(3):
+                waiting.acquire()
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual([True] * 4, results)
+        query_mock.assert_called_once_with()
+
+    def test_set(self):
+        self.cache.set('sw1', ('vni', 10, 5000), True)
+        self.assertTrue(self.cache.get('sw1', ('vni', 10, 5000), self.query))
+        self.cache.set('sw1', ('vni', 10, 5000), False)
+        self.assertFalse(self.cache.get('sw1', ('vni', 10, 5000), self.query))
+        self.query.assert_not_called()
+
+    def test_set_during_query(self):
+        def query():
+            # The switch is changed while it is being queried.
+            self.cache.set('sw1', ('vni', 10, 5000), True)
+            return False
+
+        self.assertFalse(self.cache.get('sw1', ('vni', 10, 5000), query))
+        self.assertTrue(self.cache.get('sw1', ('vni', 10, 5000), self.query))
+        self.query.assert_not_called()
+
+    def test_invalidate_during_query(self):
+        def query():
+            self.cache.invalidate('sw1')
+            return False
+
+        self.assertFalse(self.cache.get('sw1', ('ports', 10), query))
+        self.assertTrue(self.cache.get('sw1', ('ports', 10), self.query))
+        self.query.assert_called_once_with()
+
+    def test_cancel(self):
+        self.cache.set('sw1', ('ports', 11), False)
+
+        def query():
+            self.cache.cancel('sw1', ('ports', 10))
+            return False
+
+        self.assertFalse(self.cache.get('sw1', ('ports', 10), query))
+        self.assertTrue(self.cache.get('sw1', ('ports', 10), self.query))
+        self.cache.cancel('sw1')
+        self.assertFalse(self.cache.get('sw1', ('ports', 11), self.query))
+        self.query.assert_called_once_with()
+
+    def test_invalidate(self):
+        self.cache.set('sw1', ('ports', 10), True)
+        self.cache.set('sw1', ('ports', 11), True)
+        self.cache.set('sw2', ('ports', 10), True)
+
+        self.cache.invalidate('sw1', ('ports', 10))
+        self.cache.get('sw1', ('ports', 10), self.query)
+        self.cache.get('sw1', ('ports', 11), self.query)
+        self.assertEqual(1, self.query.call_count)
+
+        self.cache.invalidate('sw1')
+        self.cache.get('sw1', ('ports', 11), self.query)
+        self.cache.get('sw2', ('ports', 10), self.query)
+        self.assertEqual(2, self.query.call_count)
+
+        self.cache.invalidate()
+        self.cache.get('sw2', ('ports', 10), self.query)
+        self.assertEqual(3, self.query.call_count)
+
+    def test_invalidate_value(self):
+        self.cache.set('sw1', ('ports', 10), True)
+        self.cache.set('sw1', ('ports', 11), False)
+
+        self.cache.invalidate('sw1', ('ports', 10), value=True)
+        self.cache.invalidate('sw1', ('ports', 11), value=True)
+        self.cache.invalidate('sw1', ('ports', 12), value=True)
+
+        self.assertTrue(self.cache.get('sw1', ('ports', 10), self.query))
+        self.assertFalse(self.cache.get('sw1', ('ports', 11), self.query))
+        self.query.assert_called_once_with()
+
+    @mock.patch.object(state_cache.time, 'monotonic', autospec=True)
+    def test_prune(self, mock_time):
+        mock_time.side_effect = [0, 30, 70, 200]
+
+        self.cache.set('sw1', ('ports', 10), True)
+        self.cache.set('sw1', ('ports', 11), True)
+        self.cache.set('sw2', ('ports', 10), True)
+
+        self.assertEqual({'sw1': {('ports', 11): (True, 90)},
+                          'sw2': {('ports', 10): (True, 130)}},
+                         self.cache._results)
+
+        self.cache.set('sw2', ('ports', 12), False)
+
+        self.assertEqual({'sw2': {('ports', 12): (False, 260)}},
+                         self.cache._results)
+
+    def test_no_state_kept_for_queries(self):
+        def query():
+            self.cache.invalidate('sw1')
+            return False
+
+        self.cache.get('sw1', ('ports', 10), query)
+        self.cache.set('sw1', ('ports', 11), True)
+        self.cache.invalidate('sw1', ('ports', 11))
+
+        self.assertEqual({}, self.cache._queries)
+        self.assertEqual({'sw1': {}}, self.cache._results)
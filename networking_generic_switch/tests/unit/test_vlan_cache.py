@@ -0,0 +1,122 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+import fixtures
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import resources
+
+from networking_generic_switch import vlan_cache
+
+
+class PhysnetVlanCacheTest(fixtures.TestWithFixtures):
+    def setUp(self):
+        super(PhysnetVlanCacheTest, self).setUp()
+        self.ctxt = mock.Mock()
+        patcher = mock.patch.object(vlan_cache.network_obj, 'NetworkSegment',
+                                    autospec=True)
+        self.segment_obj = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.segment_obj.get_objects.return_value = [
+            mock.Mock(physical_network='physnet1', segmentation_id=10),
+            mock.Mock(physical_network='physnet1', segmentation_id=11),
+            mock.Mock(physical_network='physnet2', segmentation_id=20),
+        ]
+        self.cache = vlan_cache.PhysnetVlanCache(60)
+
+    def test_get_vlans(self):
+        self.assertEqual({10, 11},
+                         self.cache.get_vlans(self.ctxt, ['physnet1']))
+        self.assertEqual({10, 11, 20},
+                         self.cache.get_vlans(self.ctxt, []))
+        self.assertEqual({20},
+                         self.cache.get_vlans(self.ctxt,
+                                              ['physnet2', 'physnet3']))
+
+        self.segment_obj.get_objects.assert_called_once_with(
+            self.ctxt, network_type='vlan')
+
+    @mock.patch.object(vlan_cache.time, 'monotonic', autospec=True)
+    def test_get_vlans_refresh(self, mock_time):
+        mock_time.side_effect = [0, 30, 61, 61]
+
+        self.cache.get_vlans(self.ctxt, ['physnet1'])
+        self.cache.get_vlans(self.ctxt, ['physnet1'])
+        self.cache.get_vlans(self.ctxt, ['physnet1'])
+
+        self.assertEqual(2, self.segment_obj.get_objects.call_count)
+
+    def test_get_vlans_force_refresh(self):
+        self.cache.get_vlans(self.ctxt, ['physnet1'])
+        self.segment_obj.get_objects.return_value = [
+            mock.Mock(physical_network='physnet1', segmentation_id=12),
+        ]
+
+        self.assertEqual({12}, self.cache.get_vlans(self.ctxt, ['physnet1'],
+                                                    refresh=True))
+        self.assertEqual({12}, self.cache.get_vlans(self.ctxt, ['physnet1']))
+        self.assertEqual(2, self.segment_obj.get_objects.call_count)
+
+    def test_add_remove(self):
+        # Ignored until the cache is loaded.
+        self.cache.add('physnet1', 12)
+        self.cache.get_vlans(self.ctxt, [])
+
+        self.cache.add('physnet1', 12)
+        self.cache.add('physnet3', 30)
+        self.cache.remove('physnet1', 10)
+        self.cache.remove('physnet4', 40)
+
+        self.assertEqual({11, 12, 20, 30},
+                         self.cache.get_vlans(self.ctxt, []))
+        self.segment_obj.get_objects.assert_called_once_with(
+            self.ctxt, network_type='vlan')
+
+    def test_invalidate(self):
+        self.cache.get_vlans(self.ctxt, [])
+        self.cache.invalidate()
+        self.cache.get_vlans(self.ctxt, [])
+
+        self.assertEqual(2, self.segment_obj.get_objects.call_count)
+
+    @mock.patch.object(vlan_cache.registry, 'subscribe', autospec=True)
+    def test_subscribe(self, mock_subscribe):
+        self.cache.subscribe()
+
+        mock_subscribe.assert_has_calls([
+            mock.call(self.cache._segment_created, resources.SEGMENT,
+                      events.AFTER_CREATE),
+            mock.call(self.cache._segment_deleted, resources.SEGMENT,
+                      events.AFTER_DELETE),
+        ])
+
+    def test_segment_events(self):
+        self.cache.get_vlans(self.ctxt, [])
+        created = mock.Mock(network_type='vlan', physical_network='physnet2',
+                            segmentation_id=21)
+        vxlan = mock.Mock(network_type='vxlan', physical_network=None,
+                          segmentation_id=5000)
+        deleted = {'network_type': 'vlan', 'physical_network': 'physnet1',
+                   'segmentation_id': 10}
+
+        for segment in (created, vxlan):
+            self.cache._segment_created(
+                resources.SEGMENT, events.AFTER_CREATE, None,
+                events.DBEventPayload(self.ctxt, states=(segment,)))
+        self.cache._segment_deleted(
+            resources.SEGMENT, events.AFTER_DELETE, None,
+            events.DBEventPayload(self.ctxt, states=(deleted,)))
+
+        self.assertEqual({11, 20, 21}, self.cache.get_vlans(self.ctxt, []))
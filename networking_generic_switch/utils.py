@@ -12,6 +12,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import atexit
+from concurrent import futures
+import threading
+
 from neutron_lib.api.definitions import portbindings
 
 
@@ -55,3 +59,70 @@ def is_port_bound(port):
 
     vif_type = port[portbindings.VIF_TYPE]
     return vif_type == portbindings.VIF_TYPE_OTHER
+
+
+def call_on_switches(calls, width, stop_on_error=False):
+    """Make a call for each of a number of switches.
+
+    :param calls: A list of 2-tuples containing the name of a switch and
+        a function to call.
+    :param width: Maximum number of calls to make concurrently.
+    :param stop_on_error: Whether to skip calls which have not started
+        once a call has failed.
+    :returns: A list of 2-tuples containing the name of the switch and
+        the exception raised by the call, or None, for each call made,
+        in the order of calls.
+    """
+    width = min(width, len(calls))
+    results = []
+    if width <= 1:
+        for switch_name, call in calls:
+            try:
+                call()
+            except Exception as e:
+                results.append((switch_name, e))
+                if stop_on_error:
+                    break
+            else:
+                results.append((switch_name, None))
+        return results
+
+    failed = threading.Event()
+
+    def run(call):
+        if stop_on_error and failed.is_set():
+            return False
+        try:
+            call()
+        except Exception:
+            failed.set()
+            raise
+        return True
+
+    with futures.ThreadPoolExecutor(max_workers=width) as executor:
+        submitted = [(switch_name, executor.submit(run, call))
+                     for switch_name, call in calls]
+    for switch_name, future in submitted:
+        error = future.exception()
+        if error is not None or future.result():
+            results.append((switch_name, error))
+    return results
+
+
+def release_at_exit(release):
+    """Call a function releasing a resource at exit, unless called earlier.
+
+    :param release: The function releasing the resource.
+    :returns: A function that releases the resource now rather than at exit.
+        The resource is released at most once.
+    """
+    released = threading.Lock()
+
+    def release_once():
+        if not released.acquire(blocking=False):
+            return
+        atexit.unregister(release_once)
+        release()
+
+    atexit.register(release_once)
+    return release_once
@@ -0,0 +1,122 @@
+# Copyright 2026 StackHPC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import threading
+import time
+
+from neutron.objects import network as network_obj
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
+from neutron_lib.callbacks import resources
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+def _segment_field(segment, name):
+    if isinstance(segment, dict):
+        return segment.get(name)
+    return getattr(segment, name, None)
+
+
+class PhysnetVlanCache(object):
+    """Cache of the VLAN segmentation IDs in use on each physical network.
+
+    The VLAN segments of all physical networks are read from the database
+    with a single query, which is repeated once the cache is older than
+    refresh_interval seconds. In between, the cache is updated as networks
+    and segments are created and deleted in this process. Changes made by
+    other processes, such as other neutron-server workers, are only seen
+    after the next refresh, so refresh_interval only bounds the staleness of
+    changes made by this process. Callers which prune VLANs from switches
+    must request a refresh.
+
+    :param refresh_interval: Maximum age of the cache in seconds.
+    """
+
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._vlans = {}
+        self._expires = None
+
+    def subscribe(self):
+        """Update the cache when segments are created or deleted."""
+        registry.subscribe(self._segment_created, resources.SEGMENT,
+                           events.AFTER_CREATE)
+        registry.subscribe(self._segment_deleted, resources.SEGMENT,
+                           events.AFTER_DELETE)
+
+    def get_vlans(self, plugin_context, physnets, refresh=False):
+        """Return the VLAN segmentation IDs in use on physical networks.
+
+        :param plugin_context: Neutron admin context for DB access.
+        :param physnets: List of physical network names, or empty list
+            for all physnets.
+        :param refresh: Whether to read the database even if the cache has
+            not expired.
+        :returns: Set of segmentation IDs.
+        """
+        with self._lock:
+            if (refresh or self._expires is None
+                    or time.monotonic() >= self._expires):
+                self._refresh(plugin_context)
+            if physnets:
+                selected = [self._vlans.get(physnet, ())
+                            for physnet in physnets]
+            else:
+                selected = self._vlans.values()
+            return set().union(*selected)
+
+    def _refresh(self, plugin_context):
+        segments = network_obj.NetworkSegment.get_objects(
+            plugin_context, network_type='vlan')
+        vlans = collections.defaultdict(set)
+        for segment in segments:
+            vlans[segment.physical_network].add(segment.segmentation_id)
+        self._vlans = dict(vlans)
+        self._expires = time.monotonic() + self.refresh_interval
+        LOG.debug("Refreshed VLANs of %d physical networks", len(vlans))
+
+    def add(self, physnet, segmentation_id):
+        """Record a VLAN segment which has been created."""
+        with self._lock:
+            if self._expires is not None:
+                self._vlans.setdefault(physnet, set()).add(segmentation_id)
+
+    def remove(self, physnet, segmentation_id):
+        """Record a VLAN segment which has been deleted."""
+        with self._lock:
+            if self._expires is not None:
+                self._vlans.get(physnet, set()).discard(segmentation_id)
+
+    def invalidate(self):
+        """Query the database on the next lookup."""
+        with self._lock:
+            self._expires = None
+
+    def _segment_created(self, resource, event, trigger, payload):
+        segment = payload.latest_state
+        if (_segment_field(segment, 'network_type') == 'vlan'
+                and _segment_field(segment, 'segmentation_id')):
+            self.add(_segment_field(segment, 'physical_network'),
+                     _segment_field(segment, 'segmentation_id'))
+
+    def _segment_deleted(self, resource, event, trigger, payload):
+        segment = payload.latest_state
+        if (_segment_field(segment, 'network_type') == 'vlan'
+                and _segment_field(segment, 'segmentation_id')):
+            self.remove(_segment_field(segment, 'physical_network'),
+                        _segment_field(segment, 'segmentation_id'))